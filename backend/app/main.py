@@ -3,7 +3,7 @@ Main FastAPI application module.
 """
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 import os
 import logging
 from pathlib import Path
@@ -11,6 +11,10 @@ import traceback
 
 from app.routers import generate
 from app.utils.helpers import get_video_path, generate_uuid, is_audio_processing
+from app.services.job_queue import get_job_queue, start_job_workers, stop_job_workers, JOB_QUEUED, JOB_WORKERS
+from app.services.metrics import render_metrics
+from app.services.events import stop_event_bus
+from app.services.supervisor import start_worker_processes, stop_worker_processes, WORKER_MODE, WORKER_MODES
 
 # Configure logging
 logging.basicConfig(
@@ -34,6 +38,34 @@ app.add_middleware(
 # Include routers
 app.include_router(generate.router)
 
+@app.on_event("startup")
+async def start_workers():
+    """
+    Start running jobs according to EDUTUTOR_WORKER_MODE: in this process
+    ("inline"), in supervised worker processes ("process"), or not at all
+    ("external", or EDUTUTOR_JOB_WORKERS=0), leaving the jobs to workers
+    started separately (app.worker). Jobs whose worker stopped without
+    finishing them are requeued once their lease expires.
+    """
+    if WORKER_MODE not in WORKER_MODES:
+        raise ValueError(f"Unknown EDUTUTOR_WORKER_MODE {WORKER_MODE}, expected one of {', '.join(WORKER_MODES)}")
+    
+    if WORKER_MODE == "external" or JOB_WORKERS <= 0:
+        app.logger.info("No local job workers, jobs are run by external workers")
+    elif WORKER_MODE == "process":
+        start_worker_processes()
+    else:
+        start_job_workers(generate.generate_video_task)
+
+@app.on_event("shutdown")
+async def stop_workers():
+    """
+    Stop the job workers and the progress event poller.
+    """
+    await stop_job_workers()
+    await stop_worker_processes()
+    await stop_event_bus()
+
 @app.get("/")
 async def root():
     """
@@ -48,6 +80,13 @@ async def health_check():
     """
     return {"status": "healthy"}
 
+@app.get("/api/metrics")
+async def metrics():
+    """
+    Pipeline metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/video/{video_id}")
 async def get_video(video_id: str):
     """
@@ -72,6 +111,20 @@ async def get_video(video_id: str):
         video_path = get_video_path(video_id)
         
         if not video_path:
+            # Check if the job is still waiting in the queue
+            job = get_job_queue().get(video_id)
+            if job and job["state"] == JOB_QUEUED:
+                app.logger.info(f"Video {video_id} is waiting in the job queue")
+                return JSONResponse(
+                    content={
+                        "video_id": video_id,
+                        "status": "processing",
+                        "job_state": JOB_QUEUED,
+                        "message": "Waiting in queue"
+                    },
+                    status_code=202  # Accepted but still processing
+                )
+            
             # Check if there's an error file
             error_path = Path(f"videos/{video_id}/error.txt")
             if error_path.exists():
@@ -1,20 +1,53 @@
 """
 Router for video generation endpoints.
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import logging
 import traceback
 import os
 import json
+import math
 import asyncio
+import time
+import shutil
+from typing import Optional, Dict, Any, List, Tuple
 
 from app.services.gemini import generate_manim_code
+from app.services.code_edit import edit_manim_code
 from app.services.manim import execute_manim_code, execute_manim_code_without_audio
 from app.services.text_extraction import extract_narration_from_manim
-from app.services.tts import generate_audio_for_script
+from app.services.tts import generate_audio_for_script, AUDIO_DIR
 from app.services.media_processing import merge_audio_segments_with_video
-from app.utils.helpers import generate_uuid, clean_code, get_video_status
+from app.services.job_queue import (
+    get_job_queue, notify_job_workers, cancel_job, stage_slot, DEDUPLICATED, REJECTED,
+    QueueFullError, RateLimitedError, MAX_QUEUE_DEPTH, CLIENT_RATE_LIMIT,
+    PRIORITY_WEIGHTS, DEFAULT_PRIORITY, DEFAULT_CLIENT,
+    JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+)
+from app.services.events import publish, stream_events
+from app.services.video_cache import get_video_cache, cache_key, VIDEO_CACHE_ENABLED
+from app.services.metrics import time_stage, STAGE_LATENCY, STAGE_FAILURES
+from app.services.budget import (
+    Budget, cap_segments, generic_script, expected_stage_seconds, TTS_SEGMENT_SECONDS,
+    DEGRADE_FAST_MODEL, DEGRADE_SHORTER_VIDEO, DEGRADE_DRAFT_RENDER,
+    DEGRADE_FEWER_SEGMENTS, DEGRADE_GENERIC_NARRATION
+)
+from app.services.gemini import GEMINI_FAST_MODEL
+from app.services.code_stream import NarrationPrefetcher
+from app.services.llm_cache import get_llm_cache, LLM_CACHE_ENABLED
+from app.services.retrieval import get_example_index, RETRIEVAL_ENABLED
+from app.services.resilience import set_deadline
+from app.services.templates import template_name, TEMPLATE_RENDER_FAILURES
+from app.services.checkpoints import (
+    record_checkpoint, load_valid_checkpoints, clear_checkpoints,
+    STAGE_GENERATE, STAGE_RENDER, STAGE_NARRATION, STAGE_MERGE
+)
+from app.utils.helpers import (
+    generate_uuid, get_video_status, update_metadata, request_fingerprint, edit_fingerprint,
+    remove_audio_processing_marker
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +55,10 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api", tags=["generate"])
 
+# Start narration extraction and TTS as soon as the code exists instead of
+# waiting for the render to finish
+PIPELINED_NARRATION = os.environ.get("EDUTUTOR_PIPELINED_NARRATION", "true").lower() in ("1", "true", "yes")
+
 class GenerateRequest(BaseModel):
     """
     Request model for generating a video.
@@ -30,6 +67,9 @@ class GenerateRequest(BaseModel):
     topic: str = None
     grade_level: str = None
     duration_minutes: float = 3.0
+    use_cache: bool = True
+    priority: str = DEFAULT_PRIORITY
+    deadline_seconds: Optional[float] = None
 
 class GenerateResponse(BaseModel):
     """
@@ -37,6 +77,44 @@ class GenerateResponse(BaseModel):
     """
     video_id: str
     status: str
+    deduplicated: bool = False
+    cached: bool = False
+
+class EditRequest(BaseModel):
+    """
+    Request model for editing a video.
+    """
+    instruction: str
+    priority: str = DEFAULT_PRIORITY
+
+class BatchGenerateRequest(BaseModel):
+    """
+    Request model for generating a set of videos.
+    """
+    items: List[GenerateRequest]
+    priority: str = "bulk"
+
+class BatchGenerateResponse(BaseModel):
+    """
+    Response model for the batch generate endpoint.
+    """
+    batch_id: str
+    items: List[GenerateResponse]
+
+# Shortest video requested when a deadline is tight (in minutes)
+DEADLINE_DURATION_MINUTES = 1.0
+
+# Maximum number of videos in one batch
+MAX_BATCH_SIZE = int(os.environ.get("EDUTUTOR_MAX_BATCH_SIZE", "100"))
+
+# Response status reported for each job state
+JOB_RESPONSE_STATUS = {
+    JOB_QUEUED: "queued",
+    JOB_RUNNING: "processing",
+    JOB_DONE: "completed",
+    JOB_FAILED: "failed",
+    JOB_CANCELLED: "cancelled"
+}
 
 def handle_manim_generation_error(video_id: str, error: Exception, prompt: str = "", topic: str = None):
     """
@@ -83,9 +161,141 @@ def handle_manim_generation_error(video_id: str, error: Exception, prompt: str =
     
     logger.error(f"Generation failed for video {video_id}. Error saved to {error_file}")
 
-async def generate_video_task(video_id: str, prompt: str, topic: str = None, grade_level: str = None, duration_minutes: float = 3.0):
+def publish_stage(video_id: str, stage: str, state: str) -> None:
     """
-    Background task for generating a video.
+    Publish a pipeline stage transition to the video's progress stream.
+    
+    Args:
+        video_id: The ID of the video
+        stage: The pipeline stage
+        state: started, completed, skipped or failed
+    """
+    publish(video_id, "stage", {"stage": stage, "state": state})
+
+async def prepare_narration(
+    video_id: str,
+    manim_code: str,
+    timings: Optional[Dict[str, float]] = None,
+    budget: Optional[Budget] = None,
+    available: Optional[float] = None,
+    prompt: str = "",
+    topic: str = None,
+    prefetcher: Optional[NarrationPrefetcher] = None
+) -> Dict[str, Any]:
+    """
+    Extract the narration script from Manim code and generate its audio.
+    
+    With a deadline, a script that cannot be synthesized in the available
+    time is merged into fewer segments, or replaced by a generic narration.
+    Segments synthesized while the code was streaming are not counted and
+    are not merged, as their audio is already cached.
+    
+    Args:
+        video_id: The ID of the video
+        manim_code: The generated Manim code
+        timings: Optional dictionary that receives the stage timings
+        budget: The latency budget of the job
+        available: Seconds the narration may take to meet the deadline
+        prompt: The prompt of the video, for the generic narration
+        topic: The topic of the video, for the generic narration
+        prefetcher: The prefetcher that synthesized narration while the code was streaming
+        
+    Returns:
+        The audio manifest
+    """
+    video_dir = os.path.join("videos", video_id)
+    
+    publish_stage(video_id, STAGE_NARRATION, "started")
+    
+    # STEP 3: Extract narration from NARRATION comments in the Manim code
+    logger.info("Extracting narration from NARRATION comments...")
+    try:
+        with time_stage("extract", timings):
+            script = extract_narration_from_manim(manim_code)
+        logger.info(f"Extracted {len(script)} narration segments")
+        
+        # Save the script
+        script_path = os.path.join(video_dir, "script.json")
+        with open(script_path, "w") as f:
+            json.dump(script, f, indent=2)
+    except Exception as e:
+        logger.error(f"Error extracting narration: {str(e)}")
+        logger.error(traceback.format_exc())
+        
+        # Create a generic script if narration extraction fails
+        script = [{
+            "text": "Welcome to this educational video created with Manim.",
+            "timing": {
+                "start": 0.0,
+                "duration": 3.0
+            },
+            "type": "generic"
+        }]
+        logger.info("Using generic script due to extraction failure")
+    
+    if prefetcher is not None:
+        await prefetcher.wait()
+    
+    if budget is not None and budget.limited and available is not None:
+        max_segments = int(available // TTS_SEGMENT_SECONDS)
+        missing = prefetcher.missing(script) if prefetcher is not None else script
+        ready = {segment["text"] for segment in script} - {segment["text"] for segment in missing}
+        if max_segments < 2 and len(missing) > 1 and not ready:
+            script = generic_script(prompt, topic)
+            budget.degrade(DEGRADE_GENERIC_NARRATION)
+        elif len(missing) > max_segments:
+            capped = cap_segments(script, max_segments, keep=ready)
+            budget.degrade(DEGRADE_FEWER_SEGMENTS, f"{len(script)} segments merged into {len(capped)}")
+            script = capped
+    
+    # STEP 4: Generate audio for the script
+    logger.info("Generating audio for the script...")
+    async with stage_slot("tts"):
+        with time_stage("tts", timings):
+            audio_manifest = await generate_audio_for_script(script, video_id)
+    
+    # Save the manifest
+    manifest_path = os.path.join(video_dir, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(audio_manifest, f, indent=2)
+    
+    if audio_manifest.get("segments"):
+        record_checkpoint(video_id, STAGE_NARRATION, {"manifest_path": manifest_path})
+    publish_stage(video_id, STAGE_NARRATION, "completed")
+    
+    return audio_manifest
+
+async def generate_video_task(
+    video_id: str,
+    prompt: str,
+    topic: str = None,
+    grade_level: str = None,
+    duration_minutes: float = 3.0,
+    deadline_at: Optional[float] = None,
+    use_cache: bool = True,
+    edit_of: Optional[str] = None,
+    instruction: Optional[str] = None,
+    use_templates: bool = True
+):
+    """
+    Job handler for generating a video.
+    
+    With edit_of, the video is an edited version of that video: its code is
+    changed as the instruction asks instead of generated, and its render
+    reuses the animations of that video that did not change.
+    
+    The time spent in each stage is recorded in the stage latency metrics and
+    written to the "stage_timings" field of the video's metadata.json.
+    
+    Completed stages are checkpointed. When the job runs again after an
+    interruption, stages with valid checkpoints are skipped.
+    
+    With a deadline, stages that are not expected to fit in the time left
+    run in a faster, lower quality variant. The choices are written to the
+    "budget" field of the metadata.
+    
+    Code served from a template that fails to render is generated with
+    Gemini instead, and the job starts over from the code generation.
     
     Args:
         video_id: The ID for the video
@@ -93,7 +303,24 @@ async def generate_video_task(video_id: str, prompt: str, topic: str = None, gra
         topic: The educational topic
         grade_level: The target grade level
         duration_minutes: The desired duration in minutes
+        deadline_at: Time by which the video should be ready (seconds since the epoch)
+        use_cache: Reuse code generated earlier for the same prompt
+        edit_of: ID of the video this one is an edited version of
+        instruction: The change to make to that video
+        use_templates: Serve the code from a template if one matches
+        
+    Returns:
+        True if the video was generated, False if generation failed
     """
+    timings = {}
+    job_start = time.perf_counter()
+    narration_task = None
+    prefetcher = None
+    budget = Budget(deadline_at)
+    set_deadline(deadline_at)
+    # An edited video is described by the request of the earlier video and the change
+    request_prompt = f"{prompt}\n\n{instruction}" if edit_of else prompt
+    
     try:
         logger.info(f"Starting video generation for ID: {video_id}")
         
@@ -101,108 +328,240 @@ async def generate_video_task(video_id: str, prompt: str, topic: str = None, gra
         video_dir = os.path.join("videos", video_id)
         os.makedirs(video_dir, exist_ok=True)
         
-        # STEP 1: Generate Manim code using Gemini (first LLM call)
-        try:
-            logger.info("Generating Manim code with NARRATION comments...")
-            manim_code = await generate_manim_code(
-                prompt=prompt, 
-                topic=topic, 
-                grade_level=grade_level, 
-                duration_minutes=duration_minutes,
-                max_retries=3,
-                timeout=180.0  # 3 minutes timeout
-            )
-        except Exception as e:
-            handle_manim_generation_error(video_id, e, prompt, topic)
-            return
-        
-        # Clean the code to remove any Markdown formatting
-        if "```" in manim_code:
-            logger.warning("Detected Markdown code blocks in the code, cleaning...")
-            manim_code = clean_code(manim_code)
+        # Load the stages completed by an earlier, interrupted run
+        checkpoints = load_valid_checkpoints(video_id)
+        if checkpoints:
+            logger.info(f"Resuming video {video_id} after stages: {', '.join(checkpoints)}")
+            update_metadata(video_id, {"resumed_stages": list(checkpoints)})
         
-        # Save the generated code
+        # STEP 1: Generate Manim code using Gemini (first LLM call)
         code_file = os.path.join(video_dir, f"{video_id}.py")
-        with open(code_file, "w") as f:
-            f.write(manim_code)
+        if STAGE_GENERATE in checkpoints:
+            with open(checkpoints[STAGE_GENERATE]["code_path"], "r", encoding="utf-8") as f:
+                manim_code = f.read()
+            publish_stage(video_id, STAGE_GENERATE, "skipped")
+        else:
+            publish_stage(video_id, STAGE_GENERATE, "started")
+            pipelined = STAGE_MERGE not in checkpoints and STAGE_NARRATION not in checkpoints and PIPELINED_NARRATION
+            # Synthesize the narration of each method as soon as it has streamed in,
+            # but no more segments than the narration may use to meet the deadline
+            if pipelined:
+                max_prefetch = None
+                if budget.limited:
+                    max_prefetch = max(0, int((budget.remaining() - expected_stage_seconds("merge")) // TTS_SEGMENT_SECONDS))
+                prefetcher = NarrationPrefetcher(video_id, max_segments=max_prefetch)
+            # The model router picks the model unless the deadline requires the fast one.
+            # Pipelined narration runs alongside the render.
+            model_name = None
+            later_stages = [("render", "tts")] if pipelined else ["render", "tts"]
+            if budget.limited and not budget.fits("generate", *later_stages, "merge"):
+                model_name = GEMINI_FAST_MODEL
+                budget.degrade(DEGRADE_FAST_MODEL, GEMINI_FAST_MODEL)
+                if duration_minutes > DEADLINE_DURATION_MINUTES:
+                    budget.degrade(DEGRADE_SHORTER_VIDEO, f"{duration_minutes} minutes shortened to {DEADLINE_DURATION_MINUTES}")
+                    duration_minutes = DEADLINE_DURATION_MINUTES
+            try:
+                logger.info("Generating Manim code with NARRATION comments...")
+                async with stage_slot("generate"):
+                    with time_stage("generate", timings):
+                        if edit_of:
+                            source_file = os.path.join("videos", edit_of, f"{edit_of}.py")
+                            with open(source_file, "r", encoding="utf-8") as f:
+                                source_code = f.read()
+                            manim_code = await edit_manim_code(
+                                source_code,
+                                instruction,
+                                prompt,
+                                topic=topic,
+                                duration_minutes=duration_minutes,
+                                timeout=budget.call_timeout(180.0, "render", "merge"),
+                                on_section=prefetcher.add_section if prefetcher is not None else None
+                            )
+                        else:
+                            manim_code = await generate_manim_code(
+                                prompt=prompt, 
+                                topic=topic, 
+                                grade_level=grade_level, 
+                                duration_minutes=duration_minutes,
+                                max_retries=2 if budget.limited else 3,
+                                timeout=budget.call_timeout(180.0, "render", "merge"),  # 3 minutes timeout
+                                model_name=model_name,
+                                on_section=prefetcher.add_section if prefetcher is not None else None,
+                                use_cache=use_cache,
+                                use_templates=use_templates
+                            )
+            except Exception as e:
+                if prefetcher is not None:
+                    prefetcher.cancel()
+                handle_manim_generation_error(video_id, e, prompt, topic)
+                return False
+            
+            # Save the generated code
+            with open(code_file, "w") as f:
+                f.write(manim_code)
+            record_checkpoint(video_id, STAGE_GENERATE, {"code_path": code_file})
+            publish_stage(video_id, STAGE_GENERATE, "completed")
+        
+        # STEPS 3-4: Extract narration and generate audio. In pipelined mode this
+        # only needs the code, so it runs alongside the render.
+        if STAGE_MERGE not in checkpoints and STAGE_NARRATION not in checkpoints and PIPELINED_NARRATION:
+            # The narration may take as long as the render
+            available = budget.remaining() - expected_stage_seconds("merge")
+            narration_task = asyncio.create_task(
+                prepare_narration(video_id, manim_code, timings, budget, available, prompt, topic, prefetcher)
+            )
         
         # STEP 2: Generate video from Manim code
-        logger.info("Generating video from Manim code...")
-        try:
-            video_path = await execute_manim_code_without_audio(video_id, manim_code)
-        except Exception as e:
-            logger.error(f"Error executing Manim code: {str(e)}")
-            error_file = os.path.join(video_dir, "error.txt")
-            with open(error_file, "a") as f:
-                f.write(f"\nError executing Manim code: {str(e)}")
-            return
+        if STAGE_RENDER in checkpoints or STAGE_MERGE in checkpoints:
+            video_path = checkpoints.get(STAGE_RENDER, {}).get("video_path")
+            publish_stage(video_id, STAGE_RENDER, "skipped")
+        else:
+            logger.info("Generating video from Manim code...")
+            try:
+                async with stage_slot("render"):
+                    publish_stage(video_id, STAGE_RENDER, "started")
+                    draft = budget.limited and not budget.fits("render", "merge")
+                    if draft:
+                        budget.degrade(DEGRADE_DRAFT_RENDER)
+                    with time_stage("render", timings):
+                        video_path = await execute_manim_code_without_audio(
+                            video_id,
+                            manim_code,
+                            progress_callback=lambda percent: publish(
+                                video_id, "progress", {"stage": STAGE_RENDER, "percent": percent}
+                            ),
+                            draft=draft,
+                            reuse_from=edit_of
+                        )
+            except Exception as e:
+                logger.error(f"Error executing Manim code: {str(e)}")
+                error_file = os.path.join(video_dir, "error.txt")
+                with open(error_file, "a") as f:
+                    f.write(f"\nError executing Manim code: {str(e)}")
+                # Code that does not render must not be served to the next request
+                if LLM_CACHE_ENABLED:
+                    try:
+                        await asyncio.to_thread(get_llm_cache().invalidate_response, manim_code)
+                    except Exception as cache_error:
+                        logger.error(f"Failed to invalidate cached code: {str(cache_error)}")
+                if RETRIEVAL_ENABLED:
+                    try:
+                        await asyncio.to_thread(get_example_index().remove_code, manim_code)
+                    except Exception as index_error:
+                        logger.error(f"Failed to remove code from the example index: {str(index_error)}")
+                if narration_task is not None:
+                    narration_task.cancel()
+                    await asyncio.gather(narration_task, return_exceptions=True)
+                if prefetcher is not None:
+                    prefetcher.cancel()
+                # A template that does not render must not fail the request
+                failed_template = template_name(manim_code)
+                if failed_template and not edit_of:
+                    logger.warning(f"Template {failed_template} did not render, generating the code of video {video_id} instead")
+                    TEMPLATE_RENDER_FAILURES.inc(template=failed_template)
+                    clear_checkpoints(video_id)
+                    return await generate_video_task(
+                        video_id, prompt, topic, grade_level, duration_minutes, deadline_at,
+                        use_cache=use_cache, use_templates=False
+                    )
+                return False
+            record_checkpoint(video_id, STAGE_RENDER, {"video_path": str(video_path)})
+            publish_stage(video_id, STAGE_RENDER, "completed")
             
-        # STEP 3: Extract narration from NARRATION comments in the Manim code
-        logger.info("Extracting narration from NARRATION comments...")
-        try:
-            script = extract_narration_from_manim(manim_code)
-            logger.info(f"Extracted {len(script)} narration segments")
-            
-            # Save the script
-            script_path = os.path.join(video_dir, "script.json")
-            with open(script_path, "w") as f:
-                json.dump(script, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error extracting narration: {str(e)}")
-            logger.error(traceback.format_exc())
-            
-            # Create a generic script if narration extraction fails
-            script = [{
-                "text": "Welcome to this educational video created with Manim.",
-                "timing": {
-                    "start": 0.0,
-                    "duration": 3.0
-                },
-                "type": "generic"
-            }]
-            logger.info("Using generic script due to extraction failure")
-        
-        # STEP 4: Generate audio for the script
-        logger.info("Generating audio for the script...")
-        try:
-            audio_manifest = await generate_audio_for_script(script, video_id)
-            
-            # Save the manifest
-            manifest_path = os.path.join(video_dir, "manifest.json")
-            with open(manifest_path, "w") as f:
-                json.dump(audio_manifest, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error generating audio: {str(e)}")
-            logger.error(traceback.format_exc())
-            return
+            # The program rendered, so later requests can reuse it or learn from it
+            if RETRIEVAL_ENABLED:
+                try:
+                    await asyncio.to_thread(get_example_index().add, video_id, request_prompt, topic, duration_minutes, code_file)
+                except Exception as e:
+                    logger.error(f"Failed to add the program to the example index: {str(e)}")
         
-        # STEP 5: Merge audio and video
-        logger.info("Merging audio and video...")
-        try:
-            output_path = await merge_audio_segments_with_video(
-                video_path=video_path,
-                audio_manifest=audio_manifest,
-                output_path=os.path.join(video_dir, f"{video_id}_final.mp4")
-            )
-        except Exception as e:
-            logger.error(f"Error merging audio and video: {str(e)}")
-            logger.error(traceback.format_exc())
-            return
+        output_path = os.path.join(video_dir, f"{video_id}_final.mp4")
+        if STAGE_MERGE in checkpoints:
+            output_path = checkpoints[STAGE_MERGE]["output_path"]
+            publish_stage(video_id, STAGE_MERGE, "skipped")
+        else:
+            try:
+                if STAGE_NARRATION in checkpoints:
+                    with open(checkpoints[STAGE_NARRATION]["manifest_path"], "r") as f:
+                        audio_manifest = json.load(f)
+                elif narration_task is not None:
+                    audio_manifest = await narration_task
+                else:
+                    available = budget.remaining() - expected_stage_seconds("merge")
+                    audio_manifest = await prepare_narration(
+                        video_id, manim_code, timings, budget, available, prompt, topic
+                    )
+            except Exception as e:
+                logger.error(f"Error generating audio: {str(e)}")
+                logger.error(traceback.format_exc())
+                return False
+            
+            # STEP 5: Merge audio and video
+            logger.info("Merging audio and video...")
+            publish_stage(video_id, STAGE_MERGE, "started")
+            try:
+                async with stage_slot("merge"):
+                    with time_stage("merge", timings):
+                        output_path = await merge_audio_segments_with_video(
+                            video_path=video_path,
+                            audio_manifest=audio_manifest,
+                            output_path=output_path
+                        )
+            except Exception as e:
+                logger.error(f"Error merging audio and video: {str(e)}")
+                logger.error(traceback.format_exc())
+                publish_stage(video_id, STAGE_MERGE, "failed")
+                return False
+            if output_path is None:
+                # No video to serve, so the job fails and may be retried
+                logger.error(f"Merging audio and video failed for video {video_id}")
+                STAGE_FAILURES.inc(stage="merge")
+                error_file = os.path.join(video_dir, "error.txt")
+                with open(error_file, "a") as f:
+                    f.write("\nError merging audio and video: no output video was produced")
+                publish_stage(video_id, STAGE_MERGE, "failed")
+                return False
+            record_checkpoint(video_id, STAGE_MERGE, {"output_path": str(output_path)})
+            publish_stage(video_id, STAGE_MERGE, "completed")
         
         # Update metadata
-        metadata_file = os.path.join(video_dir, "metadata.json")
-        with open(metadata_file, "w") as f:
-            metadata = {
-                "status": "completed",
-                "prompt": prompt,
-                "topic": topic,
-                "original_video": str(video_path),
-                "final_video": str(output_path),
-                "script_source": "narration_extraction"
-            }
-            json.dump(metadata, f, indent=2)
+        fields = {
+            "status": "completed",
+            "prompt": request_prompt,
+            "topic": topic,
+            "grade_level": grade_level,
+            "duration_minutes": duration_minutes,
+            "original_video": str(video_path) if video_path else None,
+            "final_video": str(output_path) if output_path else None,
+            "script_source": "narration_extraction"
+        }
+        if edit_of:
+            fields.update({"edit_of": edit_of, "instruction": instruction})
+        update_metadata(video_id, fields)
+        
+        # Serve repeats of this request from the completed video, unless its
+        # quality was lowered to meet a deadline. Edited videos do not answer
+        # the request of the video they were made from.
+        if VIDEO_CACHE_ENABLED and output_path and not budget.degradations and not edit_of:
+            try:
+                fingerprint = request_fingerprint(prompt, topic, grade_level, duration_minutes)
+                get_video_cache().put(cache_key(fingerprint), video_id, str(output_path))
+            except Exception as e:
+                logger.error(f"Failed to cache video {video_id}: {str(e)}")
         
         logger.info(f"Video generation completed for ID: {video_id}")
+        return True
+    
+    except asyncio.CancelledError:
+        # The render and merge stop their own subprocesses; stop the narration
+        # so no more TTS requests are made
+        logger.info(f"Video generation cancelled for ID: {video_id}")
+        if prefetcher is not None:
+            prefetcher.cancel()
+        if narration_task is not None and not narration_task.done():
+            narration_task.cancel()
+            await asyncio.gather(narration_task, return_exceptions=True)
+        raise
     
     except Exception as e:
         logger.error(f"Error generating video {video_id}: {str(e)}")
@@ -216,43 +575,603 @@ async def generate_video_task(video_id: str, prompt: str, topic: str = None, gra
         error_file = os.path.join(video_dir, "error.txt")
         with open(error_file, "w") as f:
             f.write(f"Error: {str(e)}\n\n{traceback.format_exc()}")
+        
+        return False
+    
+    finally:
+        # Record how long the job spent in each stage
+        timings["total"] = round(time.perf_counter() - job_start, 3)
+        STAGE_LATENCY.observe(timings["total"], stage="total")
+        fields = {"stage_timings": timings}
+        if budget.limited:
+            budget.record_outcome()
+            fields["budget"] = budget.summary()
+        try:
+            update_metadata(video_id, fields)
+        except Exception as e:
+            logger.error(f"Failed to write stage timings for video {video_id}: {str(e)}")
+
+def cleanup_cancelled_video(video_id: str) -> None:
+    """
+    Remove the scratch files of a cancelled generation and record the
+    cancellation in the video's metadata. Checkpoints of finished stages are
+    kept, so a resumed job does not repeat them.
+    
+    Args:
+        video_id: The ID of the video
+    """
+    shutil.rmtree(AUDIO_DIR / video_id, ignore_errors=True)
+    
+    # Jobs cancelled while queued have not created their directory yet
+    if os.path.isdir(os.path.join("videos", video_id)):
+        remove_audio_processing_marker(video_id)
+        update_metadata(video_id, {"status": "cancelled"})
+
+def resolve_client_id(http_request: Request, client_id: Optional[str]) -> str:
+    """
+    Identify the client of a request for fair scheduling.
+    
+    Args:
+        http_request: The incoming HTTP request
+        client_id: The value of the X-Client-Id header, if any
+        
+    Returns:
+        The client ID, or the client address if the header is missing
+    """
+    if client_id:
+        return client_id
+    return http_request.client.host if http_request.client else DEFAULT_CLIENT
+
+def validate_priority(priority: str) -> None:
+    """
+    Reject unknown priority classes with 400 Bad Request.
+    
+    Args:
+        priority: The requested priority class
+    """
+    if priority not in PRIORITY_WEIGHTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid priority '{priority}'. Choose one of: {', '.join(PRIORITY_WEIGHTS)}"
+        )
+
+def validate_deadline(request: GenerateRequest) -> None:
+    """
+    Reject deadlines that are not positive with 400 Bad Request.
+    
+    Args:
+        request: The generation request
+    """
+    if request.deadline_seconds is not None and request.deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds must be positive")
+
+def cached_generation(request: GenerateRequest) -> Optional[GenerateResponse]:
+    """
+    Look up a finished video for a generation request in the video cache.
+    
+    Args:
+        request: The request containing the prompt and other parameters
+        
+    Returns:
+        Response with the cached video, or None if the request needs a job
+    """
+    if not VIDEO_CACHE_ENABLED or not request.use_cache:
+        return None
+    fingerprint = request_fingerprint(request.prompt, request.topic, request.grade_level, request.duration_minutes)
+    entry = get_video_cache().get(cache_key(fingerprint))
+    if not entry:
+        return None
+    logger.info(f"Serving cached video {entry['video_id']}")
+    return GenerateResponse(
+        video_id=entry["video_id"],
+        status="completed",
+        cached=True
+    )
+
+def generation_job(request: GenerateRequest) -> Tuple[Dict[str, Any], str]:
+    """
+    Build the job handler arguments and the deduplication key of a generation request.
+    
+    Args:
+        request: The request containing the prompt and other parameters
+        
+    Returns:
+        Tuple of (job handler arguments, deduplication key)
+    """
+    params = {
+        "prompt": request.prompt,
+        "topic": request.topic,
+        "grade_level": request.grade_level,
+        "duration_minutes": request.duration_minutes,
+        "use_cache": request.use_cache
+    }
+    dedup_key = request_fingerprint(request.prompt, request.topic, request.grade_level, request.duration_minutes)
+    if request.deadline_seconds is not None:
+        # The budget includes the time spent in the queue. Requests with a
+        # deadline may get a degraded video, so they only share jobs with each other.
+        params["deadline_at"] = time.time() + request.deadline_seconds
+        dedup_key = f"{dedup_key}:deadline"
+    return params, dedup_key
+
+def job_response(job: Dict[str, Any], created: bool, idempotency_key: Optional[str] = None) -> GenerateResponse:
+    """
+    Build the response for a submitted job.
+    
+    Args:
+        job: The new job, or the existing job the request was attached to
+        created: Whether the job was created for this request
+        idempotency_key: Optional client key that identifies retries of one request
+        
+    Returns:
+        Response with the video ID and status
+    """
+    if not created:
+        reason = "idempotency_key" if idempotency_key and job["idempotency_key"] == idempotency_key else "in_flight"
+        DEDUPLICATED.inc(reason=reason)
+        logger.info(f"Request attached to existing job {job['id']} ({reason})")
+        return GenerateResponse(
+            video_id=job["id"],
+            status=JOB_RESPONSE_STATUS.get(job["state"], "processing"),
+            deduplicated=True
+        )
+    
+    return GenerateResponse(
+        video_id=job["id"],
+        status="queued"
+    )
+
+def submit_generation(
+    request: GenerateRequest,
+    client_id: str,
+    priority: str,
+    idempotency_key: Optional[str] = None
+) -> GenerateResponse:
+    """
+    Serve a generation request from the video cache, attach it to an identical
+    in-flight job, or queue a new job.
+    
+    Args:
+        request: The request containing the prompt and other parameters
+        client_id: Identity of the client for fair scheduling
+        priority: The priority class of the job
+        idempotency_key: Optional client key that identifies retries of one request
+        
+    Returns:
+        Response with the video ID and status
+        
+    Raises:
+        QueueFullError: If the queue is full
+        RateLimitedError: If the client exceeded its rate limit
+    """
+    # Return a finished video for the same request if there is one
+    cached = cached_generation(request)
+    if cached is not None:
+        return cached
+    
+    # Queue the video generation for the worker pool
+    params, dedup_key = generation_job(request)
+    job, created = get_job_queue().submit(
+        generate_uuid(),
+        params,
+        dedup_key=dedup_key,
+        idempotency_key=idempotency_key,
+        max_depth=MAX_QUEUE_DEPTH,
+        client_id=client_id,
+        priority=priority,
+        rate_limit=CLIENT_RATE_LIMIT
+    )
+    return job_response(job, created, idempotency_key)
+
+def queue_full_response(error: QueueFullError) -> HTTPException:
+    """
+    Build the 429 Too Many Requests error for a full queue.
+    
+    Args:
+        error: The queue error
+        
+    Returns:
+        HTTP exception with a Retry-After header
+    """
+    REJECTED.inc(reason="queue_full")
+    retry_after = max(1, math.ceil(get_job_queue().estimate_wait(0)))
+    logger.warning(f"Rejected video generation request: {str(error)}")
+    return HTTPException(
+        status_code=429,
+        detail=f"{str(error)}. Please retry in {retry_after} seconds.",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def rate_limited_response(error: RateLimitedError) -> HTTPException:
+    """
+    Build the 429 Too Many Requests error for a client over its rate limit.
+    
+    Args:
+        error: The rate limit error
+        
+    Returns:
+        HTTP exception with a Retry-After header
+    """
+    REJECTED.inc(reason="rate_limited")
+    retry_after = max(1, math.ceil(error.retry_after))
+    logger.warning(f"Rejected video generation request: {str(error)}")
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many requests from this client. Please retry in {retry_after} seconds.",
+        headers={"Retry-After": str(retry_after)}
+    )
 
 @router.post("/generate", response_model=GenerateResponse)
-async def generate_video(request: GenerateRequest, background_tasks: BackgroundTasks):
+async def generate_video(
+    request: GenerateRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
     """
     Generate an educational video using Manim based on the provided prompt.
     
+    The request is stored in the job queue and picked up by the worker pool.
+    A request that repeats the Idempotency-Key of an earlier request, or that
+    matches a queued or running job with the same normalized parameters, is
+    attached to the existing job instead of starting a new one. A request that
+    matches a video in the completed-video cache returns that video right away,
+    unless the request sets use_cache to false.
+    
+    New jobs are rejected with 429 Too Many Requests while the queue holds
+    MAX_QUEUE_DEPTH jobs; Retry-After is the estimated time until one starts.
+    
+    Jobs are scheduled fairly between clients, identified by the X-Client-Id
+    header or else the client address, and weighted by their priority class.
+    A client that submits more than CLIENT_RATE_LIMIT jobs per minute also
+    gets 429 Too Many Requests.
+    
     Args:
         request: The request containing the prompt and other parameters
-        background_tasks: FastAPI background tasks
+        http_request: The incoming HTTP request
+        idempotency_key: Optional client key that identifies retries of one request
+        client_id: Optional identity of the client for fair scheduling
         
     Returns:
         Response with the video ID and status
     """
+    validate_priority(request.priority)
+    validate_deadline(request)
+    client_id = resolve_client_id(http_request, client_id)
+    
     try:
-        # Generate a unique ID for the video
-        video_id = generate_uuid()
-        
-        # Start the video generation in the background
-        background_tasks.add_task(
-            generate_video_task,
-            video_id=video_id,
-            prompt=request.prompt,
-            topic=request.topic,
-            grade_level=request.grade_level,
-            duration_minutes=request.duration_minutes
-        )
-        
-        return GenerateResponse(
-            video_id=video_id,
-            status="processing"
-        )
+        response = submit_generation(request, client_id, request.priority, idempotency_key=idempotency_key)
+        if response.status == "queued":
+            notify_job_workers()
+        return response
+    
+    except RateLimitedError as e:
+        raise rate_limited_response(e)
+    
+    except QueueFullError as e:
+        raise queue_full_response(e)
     
     except Exception as e:
         logger.error(f"Error initiating video generation: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to initiate video generation: {str(e)}")
 
+@router.post("/generate/batch", response_model=BatchGenerateResponse)
+async def generate_video_batch(
+    request: BatchGenerateRequest,
+    http_request: Request,
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
+    """
+    Generate a set of videos in one call.
+    
+    The batch is admitted as a whole: it is rejected with 429 Too Many Requests
+    if the queue of its priority class is full, and otherwise every item is
+    queued, in one transaction with the batch record. Jobs of batches do not
+    count against the client's per-minute rate limit, neither now nor for
+    later requests. Items go through the video cache and in-flight
+    deduplication like single requests, and are scheduled with the batch's
+    priority class (bulk by default) so they fill idle workers without
+    delaying interactive requests.
+    
+    Args:
+        request: The batch with the requests for each video
+        http_request: The incoming HTTP request
+        client_id: Optional identity of the client for fair scheduling
+        
+    Returns:
+        Response with the batch ID and the video ID and status of each item
+    """
+    validate_priority(request.priority)
+    client_id = resolve_client_id(http_request, client_id)
+    
+    if not request.items:
+        raise HTTPException(status_code=400, detail="A batch needs at least one item")
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can contain at most {MAX_BATCH_SIZE} items, got {len(request.items)}"
+        )
+    for item in request.items:
+        validate_deadline(item)
+    
+    try:
+        batch_id = generate_uuid()
+        cached = [cached_generation(item) for item in request.items]
+        jobs = []
+        for item, response in zip(request.items, cached):
+            if response is not None:
+                jobs.append((response.video_id, None, None))
+            else:
+                params, dedup_key = generation_job(item)
+                jobs.append((generate_uuid(), params, dedup_key))
+        results = get_job_queue().submit_batch(
+            batch_id,
+            jobs,
+            max_depth=MAX_QUEUE_DEPTH,
+            client_id=client_id,
+            priority=request.priority
+        )
+        items = [
+            response if response is not None else job_response(job, created)
+            for response, (job, created) in zip(cached, results)
+        ]
+        notify_job_workers()
+        
+        logger.info(f"Queued batch {batch_id} with {len(items)} items for client {client_id}")
+        return BatchGenerateResponse(batch_id=batch_id, items=items)
+    
+    except QueueFullError as e:
+        raise queue_full_response(e)
+    
+    except Exception as e:
+        logger.error(f"Error initiating batch generation: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to initiate batch generation: {str(e)}")
+
+@router.get("/batch/{batch_id}/status")
+async def get_batch_status(batch_id: str):
+    """
+    Get the aggregated progress of a batch.
+    
+    Args:
+        batch_id: The ID of the batch
+        
+    Returns:
+        Dictionary with the number of items in each status, the fraction of
+        finished items and the status of every item
+    """
+    items = get_job_queue().get_batch(batch_id)
+    if not items:
+        raise HTTPException(status_code=404, detail=f"Batch with ID {batch_id} not found")
+    
+    counts = {"queued": 0, "processing": 0, "completed": 0, "failed": 0}
+    results = []
+    for item in items:
+        if item["job_state"] is not None:
+            status = JOB_RESPONSE_STATUS.get(item["job_state"], "processing")
+        else:
+            status = item["status"]
+        counts[status] = counts.get(status, 0) + 1
+        
+        result = {"video_id": item["video_id"], "status": status}
+        if status == "failed" and item["error"]:
+            result["error"] = item["error"]
+        results.append(result)
+    
+    finished = counts["completed"] + counts["failed"] + counts.get("cancelled", 0)
+    return {
+        "batch_id": batch_id,
+        "status": "completed" if finished == len(items) else "processing",
+        "total": len(items),
+        "counts": counts,
+        "progress": round(finished / len(items), 3),
+        "items": results
+    }
+
+@router.get("/video/{video_id}/events")
+async def video_events(
+    video_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """
+    Stream the progress of a video generation as server-sent events.
+    
+    Events are "status" (the current status when the stream opens), "state"
+    (job state changes, with the video URL once the job is done), "stage"
+    (pipeline stage transitions) and "progress" (render progress percentage).
+    The stream ends when the job is done, has failed or was cancelled.
+    
+    Args:
+        video_id: The ID of the video
+        last_event_id: ID of the last event received, sent by reconnecting clients
+        
+    Returns:
+        Streaming response with the events
+    """
+    if get_job_queue().get(video_id) is None and not os.path.isdir(os.path.join("videos", video_id)):
+        raise HTTPException(status_code=404, detail=f"Video with ID {video_id} not found")
+    
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    
+    return StreamingResponse(
+        stream_events(video_id, after_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering
+        }
+    )
+
+@router.delete("/video/{video_id}")
+async def cancel_video(video_id: str):
+    """
+    Cancel a queued or running video generation.
+    
+    A running job's Manim render (with the processes it started) and FFmpeg
+    merge are terminated, pending narration audio is not generated and the
+    job's scratch files are removed. A cancelled job can be resumed.
+    
+    Args:
+        video_id: The ID of the video
+        
+    Returns:
+        Dictionary with the video ID, its status and the state it was cancelled in
+    """
+    previous = await cancel_job(video_id)
+    
+    if previous is None:
+        raise HTTPException(status_code=404, detail=f"Video with ID {video_id} not found")
+    if previous not in (JOB_QUEUED, JOB_RUNNING):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Video {video_id} is already {JOB_RESPONSE_STATUS.get(previous, previous)}"
+        )
+    
+    await asyncio.to_thread(cleanup_cancelled_video, video_id)
+    
+    # The cancelled job frees a worker slot
+    notify_job_workers()
+    
+    logger.info(f"Cancelled video generation for ID: {video_id}")
+    return {"video_id": video_id, "status": "cancelled", "previous_state": previous}
+
+@router.post("/video/{video_id}/resume", response_model=GenerateResponse)
+async def resume_video(video_id: str):
+    """
+    Resume a failed, cancelled or interrupted video generation from its last checkpoint.
+    
+    Args:
+        video_id: The ID of the video
+        
+    Returns:
+        Response with the video ID and status
+    """
+    queue = get_job_queue()
+    job = queue.get(video_id)
+    
+    if job is not None and job["state"] in (JOB_QUEUED, JOB_RUNNING):
+        raise HTTPException(status_code=409, detail=f"Video {video_id} is already {job['state']}")
+    
+    if job is None:
+        # Videos generated before the job queue existed only have metadata
+        metadata_path = os.path.join("videos", video_id, "metadata.json")
+        if not os.path.exists(metadata_path):
+            raise HTTPException(status_code=404, detail=f"Video with ID {video_id} not found")
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+        if not metadata.get("prompt"):
+            raise HTTPException(status_code=400, detail=f"Video {video_id} has no stored prompt to resume from")
+    
+    # Clear the error from the previous attempt so the status endpoints
+    # report the resumed job as processing
+    error_file = os.path.join("videos", video_id, "error.txt")
+    if os.path.exists(error_file):
+        os.remove(error_file)
+    
+    if job is None:
+        queue.enqueue(video_id, {
+            "prompt": metadata["prompt"],
+            "topic": metadata.get("topic"),
+            "grade_level": metadata.get("grade_level"),
+            "duration_minutes": metadata.get("duration_minutes", 3.0)
+        })
+    else:
+        queue.requeue(video_id)
+    notify_job_workers()
+    
+    logger.info(f"Resuming video generation for ID: {video_id}")
+    return GenerateResponse(video_id=video_id, status="queued")
+
+@router.post("/video/{video_id}/edit", response_model=GenerateResponse)
+async def edit_video(
+    video_id: str,
+    request: EditRequest,
+    http_request: Request,
+    client_id: Optional[str] = Header(None, alias="X-Client-Id")
+):
+    """
+    Make an edited version of a video, such as "same as before but slower".
+    
+    The edited video gets a new video ID. Gemini is asked only for the lines
+    of the video's code that the instruction changes, the render reuses the
+    animations that did not change, and unchanged narration is served from
+    the narration cache. A repeated edit of the same video is attached to the
+    queued or running job for it. Edits are queued and rate limited like new
+    videos.
+    
+    Args:
+        video_id: The ID of the video to edit
+        request: The request containing the instruction and priority
+        http_request: The incoming HTTP request
+        client_id: Optional identity of the client for fair scheduling
+        
+    Returns:
+        Response with the ID and status of the edited video
+    """
+    validate_priority(request.priority)
+    instruction = request.instruction.strip()
+    if not instruction:
+        raise HTTPException(status_code=400, detail="instruction must not be empty")
+    client_id = resolve_client_id(http_request, client_id)
+    
+    queue = get_job_queue()
+    source = queue.get(video_id)
+    if source is not None and source["state"] in (JOB_QUEUED, JOB_RUNNING):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Video {video_id} is still {JOB_RESPONSE_STATUS[source['state']]}"
+        )
+    if not os.path.exists(os.path.join("videos", video_id, f"{video_id}.py")):
+        raise HTTPException(status_code=404, detail=f"Video with ID {video_id} has no code to edit")
+    
+    # The metadata describes edited videos with their edits, the job only with its original request
+    source_params = source["params"] if source is not None else {}
+    metadata = {}
+    metadata_path = os.path.join("videos", video_id, "metadata.json")
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+    prompt = metadata.get("prompt") or source_params.get("prompt")
+    if not prompt:
+        raise HTTPException(status_code=400, detail=f"Video {video_id} has no stored prompt to edit")
+    
+    params = {
+        "prompt": prompt,
+        "topic": metadata.get("topic") or source_params.get("topic"),
+        "grade_level": source_params.get("grade_level"),
+        "duration_minutes": source_params.get("duration_minutes", 3.0),
+        "edit_of": video_id,
+        "instruction": instruction
+    }
+    
+    try:
+        job, created = queue.submit(
+            generate_uuid(),
+            params,
+            dedup_key=edit_fingerprint(video_id, instruction),
+            max_depth=MAX_QUEUE_DEPTH,
+            client_id=client_id,
+            priority=request.priority,
+            rate_limit=CLIENT_RATE_LIMIT
+        )
+    except RateLimitedError as e:
+        raise rate_limited_response(e)
+    except QueueFullError as e:
+        raise queue_full_response(e)
+    
+    if not created:
+        DEDUPLICATED.inc(reason="in_flight")
+        logger.info(f"Edit of video {video_id} attached to existing job {job['id']}")
+        return GenerateResponse(
+            video_id=job["id"],
+            status=JOB_RESPONSE_STATUS.get(job["state"], "processing"),
+            deduplicated=True
+        )
+    
+    notify_job_workers()
+    logger.info(f"Queued edit {job['id']} of video {video_id}: {instruction}")
+    return GenerateResponse(video_id=job["id"], status="queued")
+
 @router.get("/video/{video_id}/status", response_model=dict)
 async def get_video_status_endpoint(video_id: str):
     """
@@ -0,0 +1,242 @@
+"""
+Latency budgets for video generation.
+
+A request may carry a deadline. The pipeline asks its budget before each stage
+whether the remaining stages still fit in the time left, based on how long
+those stages recently took, and picks cheaper variants of the stages that do
+not fit: a faster Gemini model, a shorter video, a draft render, fewer
+narration segments or a generic narration. The chosen degradations are
+recorded in the video's metadata.
+"""
+import time
+import logging
+from typing import Optional, Dict, Any, List, Set, Tuple, Union
+
+from app.services import metrics
+from app.services.metrics import STAGE_LATENCY
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Assumed stage durations before the stage has run in this process (in seconds)
+DEFAULT_STAGE_SECONDS = {
+    "generate": 45.0,
+    "render": 90.0,
+    "tts": 30.0,
+    "merge": 10.0,
+}
+
+# Assumed time to synthesize one narration segment (in seconds)
+TTS_SEGMENT_SECONDS = 3.0
+
+# Shortest timeout given to a call, however little time is left (in seconds)
+MIN_CALL_TIMEOUT = 10.0
+
+# Degradations
+DEGRADE_FAST_MODEL = "fast_model"
+DEGRADE_SHORTER_VIDEO = "shorter_video"
+DEGRADE_DRAFT_RENDER = "draft_render"
+DEGRADE_FEWER_SEGMENTS = "fewer_narration_segments"
+DEGRADE_GENERIC_NARRATION = "generic_narration"
+
+DEGRADATIONS = metrics.counter("edututor_budget_degradations_total", "Quality degradations applied to meet request deadlines", ("degradation",))
+DEADLINES = metrics.counter("edututor_budget_deadlines_total", "Jobs with a deadline by whether they met it", ("outcome",))
+
+def expected_stage_seconds(stage: str) -> float:
+    """
+    Estimate how long a stage takes from its recent latency.
+
+    Args:
+        stage: The stage name
+
+    Returns:
+        The average duration in seconds, or the default if the stage has not run yet
+    """
+    mean = STAGE_LATENCY.mean(stage=stage)
+    return mean if mean is not None else DEFAULT_STAGE_SECONDS.get(stage, 0.0)
+
+def _expected_seconds(stage: Union[str, Tuple[str, ...]]) -> float:
+    if isinstance(stage, tuple):
+        return max((expected_stage_seconds(name) for name in stage), default=0.0)
+    return expected_stage_seconds(stage)
+
+class Budget:
+    """
+    Time left until the deadline of a job. A budget without a deadline never
+    runs out and never degrades anything.
+    """
+
+    def __init__(self, deadline_at: Optional[float] = None):
+        self.deadline_at = deadline_at
+        self.started_at = time.time()
+        self.degradations: List[Dict[str, Any]] = []
+
+    @property
+    def limited(self) -> bool:
+        return self.deadline_at is not None
+
+    def remaining(self) -> float:
+        """
+        Get the seconds left until the deadline.
+
+        Returns:
+            The remaining seconds (negative once the deadline has passed), or infinity without a deadline
+        """
+        if self.deadline_at is None:
+            return float("inf")
+        return self.deadline_at - time.time()
+
+    def fits(self, *stages: Union[str, Tuple[str, ...]]) -> bool:
+        """
+        Check whether the given stages are expected to finish before the deadline.
+
+        Args:
+            *stages: The stage names in the order they run; a tuple of names
+                stands for stages that run at the same time and takes as
+                long as the slowest of them
+
+        Returns:
+            True if the stages fit in the remaining time
+        """
+        return self.remaining() >= sum(_expected_seconds(stage) for stage in stages)
+
+    def call_timeout(self, timeout: float, *later_stages: str) -> float:
+        """
+        Shorten a call timeout so the stages after the call still fit.
+
+        Args:
+            timeout: The normal timeout in seconds
+            *later_stages: Stages that run after the call
+
+        Returns:
+            The timeout to use
+        """
+        if not self.limited:
+            return timeout
+        available = self.remaining() - sum(expected_stage_seconds(stage) for stage in later_stages)
+        return max(MIN_CALL_TIMEOUT, min(timeout, available))
+
+    def degrade(self, degradation: str, detail: Optional[str] = None) -> None:
+        """
+        Record a degradation chosen to meet the deadline.
+
+        Args:
+            degradation: The degradation name
+            detail: Optional description of what was changed
+        """
+        entry = {"degradation": degradation, "remaining_seconds": round(self.remaining(), 1)}
+        if detail:
+            entry["detail"] = detail
+        self.degradations.append(entry)
+        DEGRADATIONS.inc(degradation=degradation)
+        logger.info(f"Applying {degradation} with {entry['remaining_seconds']} seconds left" + (f": {detail}" if detail else ""))
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Describe the budget for the video's metadata.
+
+        Returns:
+            Dictionary with the deadline, whether it was met and the degradations
+        """
+        met = self.remaining() >= 0
+        return {
+            "deadline_seconds": round(self.deadline_at - self.started_at, 1) if self.limited else None,
+            "met": met,
+            "overrun_seconds": 0.0 if met else round(-self.remaining(), 1),
+            "degradations": self.degradations
+        }
+
+    def record_outcome(self) -> None:
+        """
+        Count whether the deadline was met.
+        """
+        if self.limited:
+            DEADLINES.inc(outcome="met" if self.remaining() >= 0 else "missed")
+
+def cap_segments(
+    script: List[Dict[str, Any]],
+    max_segments: int,
+    keep: Optional[Set[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Merge neighbouring narration segments so that at most max_segments
+    segments need a text-to-speech call. The narration text is kept; only the
+    number of text-to-speech calls goes down.
+
+    Segments whose text is in keep already have their speech, for example
+    from the narration prefetcher, and are left as they are; only the
+    segments between them are merged. If there are more runs of other
+    segments than max_segments, the whole script is merged.
+
+    Args:
+        script: The narration script
+        max_segments: Maximum number of segments that need a text-to-speech call
+        keep: Texts of segments whose speech is already synthesized
+
+    Returns:
+        The merged script
+    """
+    max_segments = max(1, max_segments)
+    keep = keep or set()
+
+    # Split the script into kept segments and runs of segments that need speech
+    parts: List[Tuple[bool, List[Dict[str, Any]]]] = []
+    for segment in script:
+        kept = segment["text"] in keep
+        if parts and not kept and not parts[-1][0]:
+            parts[-1][1].append(segment)
+        else:
+            parts.append((kept, [segment]))
+    runs = [run for kept, run in parts if not kept]
+    if sum(len(run) for run in runs) <= max_segments:
+        return script
+    if len(runs) > max_segments:
+        return _merge_segments(script, max_segments)
+
+    # Every run gets one segment, and the rest go to the runs merged the most
+    shares = {id(run): 1 for run in runs}
+    for _ in range(max_segments - len(runs)):
+        run = max((run for run in runs if shares[id(run)] < len(run)), key=lambda run: len(run) / shares[id(run)])
+        shares[id(run)] += 1
+
+    merged = []
+    for kept, run in parts:
+        merged += run if kept else _merge_segments(run, shares[id(run)])
+    return merged
+
+def _merge_segments(script: List[Dict[str, Any]], max_segments: int) -> List[Dict[str, Any]]:
+    if len(script) <= max_segments:
+        return script
+
+    merged = []
+    group_size = -(-len(script) // max_segments)
+    for i in range(0, len(script), group_size):
+        group = script[i:i + group_size]
+        start = group[0].get("timing", {}).get("start", 0.0)
+        last_timing = group[-1].get("timing", {})
+        end = last_timing.get("start", start) + last_timing.get("duration", 0.0)
+        merged.append({
+            "text": " ".join(segment["text"].strip() for segment in group if segment["text"].strip()),
+            "timing": {"start": start, "duration": max(0.0, end - start)},
+            "type": group[0].get("type", "narration")
+        })
+    return merged
+
+def generic_script(prompt: str, topic: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Build a one-segment narration that introduces the video.
+
+    Args:
+        prompt: The prompt of the video
+        topic: The educational topic
+
+    Returns:
+        The narration script
+    """
+    subject = (topic or prompt).strip().rstrip(".")
+    return [{
+        "text": f"In this video, we explore {subject}.",
+        "timing": {"start": 0.0, "duration": 4.0},
+        "type": "generic"
+    }]
@@ -0,0 +1,310 @@
+"""
+Record and replay of Gemini and Eleven Labs calls.
+
+In record mode, every successful call to Gemini (through the shared client, so
+both code and narration script generation) and to Eleven Labs speech synthesis
+is stored in a cassette: the request, the response and how long it took,
+including when each streamed chunk arrived. In replay mode the recordings are
+served back without keys or network access, optionally with their recorded
+latencies or latencies sampled from the recorded distribution, so render,
+merge and scheduling can be measured reproducibly on an offline machine.
+
+Requests are matched by a hash of the service and the request. When the same
+request was recorded several times, the recordings are served in turn.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Callable, Union
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Modes
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# Latencies applied in replay mode
+LATENCY_NONE = "none"
+LATENCY_RECORDED = "recorded"
+LATENCY_SAMPLED = "sampled"
+
+# Whether external calls are recorded, replayed or neither
+CASSETTE_MODE = os.environ.get("EDUTUTOR_CASSETTE_MODE", MODE_OFF).lower()
+
+# Location of the cassette
+CASSETTE_PATH = Path(os.environ.get("EDUTUTOR_CASSETTE_PATH", "./cassettes/default.db"))
+
+# Latency of replayed calls: none, the recorded latency of the call, or one sampled from the recorded calls of the service
+CASSETTE_LATENCY = os.environ.get("EDUTUTOR_CASSETTE_LATENCY", LATENCY_NONE).lower()
+
+CASSETTE_CALLS = metrics.counter("edututor_cassette_calls_total", "Recorded and replayed external calls by service and result", ("service", "result"))
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode when a request was never recorded.
+    """
+
+    def __init__(self, service: str, request: Dict[str, Any]):
+        super().__init__(f"No recording of this {service} request in the cassette")
+        self.service = service
+        self.request = request
+
+def request_key(service: str, request: Dict[str, Any]) -> str:
+    """
+    Build the key that matches a request with its recordings.
+
+    Args:
+        service: The service name
+        request: The request parameters
+
+    Returns:
+        The key
+    """
+    return hashlib.sha256(f"{service}:{json.dumps(request, sort_keys=True, default=str)}".encode("utf-8")).hexdigest()
+
+class Cassette:
+    """
+    SQLite store of recorded calls.
+    """
+
+    def __init__(self, path: Path = CASSETTE_PATH, mode: str = CASSETTE_MODE, latency: str = CASSETTE_LATENCY):
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._plays: Dict[str, int] = {}
+        self._latencies: Dict[str, List[float]] = {}
+        self._init_schema()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == MODE_RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the cassette.
+
+        Returns:
+            A SQLite connection in autocommit mode
+        """
+        conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self) -> None:
+        """
+        Create the recordings table if it does not exist yet.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS recordings (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        service TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        request TEXT NOT NULL,
+                        response BLOB NOT NULL,
+                        chunks TEXT,
+                        latency_seconds REAL NOT NULL,
+                        recorded_at REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_recordings_key ON recordings (key, id)")
+            finally:
+                conn.close()
+
+    def record(
+        self,
+        service: str,
+        request: Dict[str, Any],
+        response: Union[str, bytes],
+        latency_seconds: float,
+        chunks: Optional[List[Tuple[float, str]]] = None
+    ) -> None:
+        """
+        Store a successful call.
+
+        Args:
+            service: The service name
+            request: The request parameters
+            response: The response text or audio
+            latency_seconds: How long the call took
+            chunks: For streamed text, each chunk with its arrival time after the start of the call
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    """
+                    INSERT INTO recordings (service, key, request, response, chunks, latency_seconds, recorded_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        service,
+                        request_key(service, request),
+                        json.dumps(request, sort_keys=True, default=str),
+                        response,
+                        json.dumps(chunks) if chunks is not None else None,
+                        latency_seconds,
+                        time.time()
+                    )
+                )
+            finally:
+                conn.close()
+        CASSETTE_CALLS.inc(service=service, result="recorded")
+
+    def _next_recording(self, service: str, request: Dict[str, Any]) -> Optional[sqlite3.Row]:
+        """
+        Get the recording to serve for a request, taking repeated recordings in turn.
+        """
+        key = request_key(service, request)
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT * FROM recordings WHERE key = ? ORDER BY id", (key,)).fetchall()
+            finally:
+                conn.close()
+            if not rows:
+                return None
+            play = self._plays.get(key, 0)
+            self._plays[key] = play + 1
+            return rows[play % len(rows)]
+
+    def _service_latencies(self, service: str) -> List[float]:
+        """
+        Get the recorded latencies of a service.
+        """
+        with self._lock:
+            latencies = self._latencies.get(service)
+            if latencies is None:
+                conn = self._connect()
+                try:
+                    latencies = [row[0] for row in conn.execute("SELECT latency_seconds FROM recordings WHERE service = ?", (service,))]
+                finally:
+                    conn.close()
+                self._latencies[service] = latencies
+            return latencies
+
+    def _replay_latency(self, service: str, recorded: float) -> float:
+        if self.latency == LATENCY_RECORDED:
+            return recorded
+        if self.latency == LATENCY_SAMPLED:
+            latencies = self._service_latencies(service)
+            return random.choice(latencies) if latencies else recorded
+        return 0.0
+
+    async def replay(
+        self,
+        service: str,
+        request: Dict[str, Any],
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> Union[str, bytes]:
+        """
+        Serve a recorded call.
+
+        Streamed text is passed to on_chunk chunk by chunk, at the recorded
+        arrival times scaled to the replay latency.
+
+        Args:
+            service: The service name
+            request: The request parameters
+            on_chunk: Optional callback for streamed text
+
+        Returns:
+            The recorded response
+
+        Raises:
+            CassetteMissError: If the request was never recorded
+        """
+        row = await asyncio.to_thread(self._next_recording, service, request)
+        if row is None:
+            CASSETTE_CALLS.inc(service=service, result="miss")
+            raise CassetteMissError(service, request)
+        CASSETTE_CALLS.inc(service=service, result="replayed")
+
+        recorded = row["latency_seconds"]
+        latency = self._replay_latency(service, recorded)
+        chunks = json.loads(row["chunks"]) if row["chunks"] else None
+        if on_chunk is None or not chunks:
+            if latency > 0:
+                await asyncio.sleep(latency)
+            response = row["response"]
+            if on_chunk is not None:
+                on_chunk(response)
+            return response
+
+        scale = latency / recorded if recorded > 0 else 0.0
+        elapsed = 0.0
+        for offset, text in chunks:
+            wait = offset * scale - elapsed
+            if wait > 0:
+                await asyncio.sleep(wait)
+                elapsed += wait
+            on_chunk(text)
+        if latency > elapsed:
+            await asyncio.sleep(latency - elapsed)
+        return "".join(text for _, text in chunks)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Count the recordings by service.
+
+        Returns:
+            Recordings and distinct requests by service
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT service, COUNT(*) AS recordings, COUNT(DISTINCT key) AS requests FROM recordings GROUP BY service"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row["service"]: {"recordings": row["recordings"], "requests": row["requests"]} for row in rows}
+
+_cassette: Optional[Cassette] = None
+
+def get_cassette() -> Optional[Cassette]:
+    """
+    Get the shared cassette.
+
+    Returns:
+        The cassette, or None when calls are neither recorded nor replayed
+    """
+    global _cassette
+    if CASSETTE_MODE not in (MODE_RECORD, MODE_REPLAY):
+        return None
+    if _cassette is None:
+        _cassette = Cassette()
+        logger.info(f"External calls are {'recorded to' if _cassette.recording else 'replayed from'} {_cassette.path}")
+    return _cassette
+
+def replaying() -> bool:
+    """
+    Check whether external calls are served from the cassette.
+
+    Returns:
+        True in replay mode
+    """
+    cassette = get_cassette()
+    return cassette is not None and cassette.replaying
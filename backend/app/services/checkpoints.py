@@ -0,0 +1,171 @@
+"""
+Pipeline checkpoints for resuming interrupted video generation jobs.
+
+Each completed stage records the artifacts it produced in
+videos/<id>/checkpoints.json. When a job runs again, the artifacts are
+validated and every stage whose artifacts are still usable is skipped.
+"""
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Any
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Define the directory for storing generated videos
+VIDEOS_DIR = Path("./videos")
+
+CHECKPOINT_FILE = "checkpoints.json"
+
+# Pipeline stages in the order they complete
+STAGE_GENERATE = "generate"
+STAGE_RENDER = "render"
+STAGE_NARRATION = "narration"
+STAGE_MERGE = "merge"
+
+CHECKPOINT_STAGES = (STAGE_GENERATE, STAGE_RENDER, STAGE_NARRATION, STAGE_MERGE)
+
+def _checkpoint_path(video_id: str) -> Path:
+    return VIDEOS_DIR / video_id / CHECKPOINT_FILE
+
+def _read_checkpoints(video_id: str) -> Dict[str, Any]:
+    """
+    Read the raw checkpoint records of a video.
+
+    Args:
+        video_id: The ID of the video
+
+    Returns:
+        Checkpoint records by stage name
+    """
+    path = _checkpoint_path(video_id)
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint file for video {video_id}: {str(e)}")
+        return {}
+
+def record_checkpoint(video_id: str, stage: str, artifacts: Dict[str, Any]) -> None:
+    """
+    Record that a pipeline stage completed.
+
+    Args:
+        video_id: The ID of the video
+        stage: The completed stage
+        artifacts: Paths (and other values) needed to resume after this stage
+    """
+    if stage not in CHECKPOINT_STAGES:
+        raise ValueError(f"Unknown pipeline stage: {stage}")
+
+    checkpoints = _read_checkpoints(video_id)
+    checkpoints[stage] = {
+        "completed_at": time.time(),
+        "artifacts": artifacts
+    }
+
+    path = _checkpoint_path(video_id)
+    os.makedirs(path.parent, exist_ok=True)
+
+    # Write to a temporary file first so a crash never leaves a partial file
+    temp_path = path.with_suffix(".json.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(temp_path, path)
+
+    logger.info(f"Recorded checkpoint '{stage}' for video {video_id}")
+
+def clear_checkpoints(video_id: str) -> None:
+    """
+    Remove all checkpoint records of a video.
+
+    Args:
+        video_id: The ID of the video
+    """
+    path = _checkpoint_path(video_id)
+    if path.exists():
+        path.unlink()
+
+def _is_nonempty_file(path: Any) -> bool:
+    return bool(path) and Path(path).is_file() and Path(path).stat().st_size > 0
+
+def _validate_stage(stage: str, artifacts: Dict[str, Any]) -> bool:
+    """
+    Check that the artifacts of a stage are still present and usable.
+
+    Args:
+        stage: The stage name
+        artifacts: The recorded artifacts
+
+    Returns:
+        True if the stage can be skipped
+    """
+    if stage == STAGE_GENERATE:
+        code_path = artifacts.get("code_path")
+        if not _is_nonempty_file(code_path):
+            return False
+        try:
+            with open(code_path, "r", encoding="utf-8") as f:
+                compile(f.read(), str(code_path), "exec")
+        except (OSError, SyntaxError, ValueError):
+            return False
+        return True
+
+    if stage == STAGE_RENDER:
+        return _is_nonempty_file(artifacts.get("video_path"))
+
+    if stage == STAGE_NARRATION:
+        manifest_path = artifacts.get("manifest_path")
+        if not _is_nonempty_file(manifest_path):
+            return False
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        segments = manifest.get("segments", [])
+        return bool(segments) and all(_is_nonempty_file(s.get("audio_path")) for s in segments)
+
+    if stage == STAGE_MERGE:
+        return _is_nonempty_file(artifacts.get("output_path"))
+
+    return False
+
+def load_valid_checkpoints(video_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the checkpoints of a video whose artifacts are still valid.
+
+    Every later stage depends on the generated code, so nothing is returned
+    when the generate checkpoint is missing or invalid.
+
+    Args:
+        video_id: The ID of the video
+
+    Returns:
+        Artifacts of the valid stages, by stage name
+    """
+    checkpoints = _read_checkpoints(video_id)
+    valid = {}
+
+    for stage in CHECKPOINT_STAGES:
+        record = checkpoints.get(stage)
+        if not record:
+            continue
+        artifacts = record.get("artifacts", {})
+        if _validate_stage(stage, artifacts):
+            valid[stage] = artifacts
+        else:
+            logger.warning(f"Checkpoint '{stage}' for video {video_id} is no longer valid")
+
+    if STAGE_GENERATE not in valid:
+        return {}
+
+    logger.info(f"Video {video_id} can resume after stages: {', '.join(valid)}")
+    return valid
@@ -0,0 +1,314 @@
+"""
+Edits of generated Manim code.
+
+A small change to a video ("slower", "add an example") does not need a new
+program. Gemini is shown the program of the earlier video and the requested
+change, and answers with search and replace blocks for the lines to change,
+which takes far fewer output tokens than writing the whole program again. The
+blocks are applied to the program and the result is checked like generated
+code. If the edit cannot be applied after the retries, the program is
+generated again for the request with the change appended.
+"""
+import os
+import re
+import ast
+import time
+import difflib
+import asyncio
+import logging
+from typing import Optional, Callable, List, Tuple
+
+from app.services import metrics
+from app.services.resilience import CircuitOpenError, allow_retry, backoff_delay, SERVICE_GEMINI
+from app.services.cassette import replaying
+from app.services.llm_client import get_llm_client, GEMINI_FAST_MODEL
+from app.services.gemini import generate_manim_code, replay_sections, score_candidate, GEMINI_API_KEY
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Gemini model used for edits; the answer is short, so the fast model is the default
+GEMINI_EDIT_MODEL = os.environ.get("EDUTUTOR_GEMINI_EDIT_MODEL", GEMINI_FAST_MODEL)
+
+# Output token limit of an edit
+EDIT_OUTPUT_TOKENS = 4096
+
+# Outcomes of an edit
+OUTCOME_PATCHED = "patched"
+OUTCOME_REGENERATED = "regenerated"
+OUTCOME_FAILED = "failed"
+
+CODE_EDITS = metrics.counter("edututor_code_edits_total", "Code edits by outcome", ("outcome",))
+CODE_EDIT_CHANGED_LINES = metrics.histogram(
+    "edututor_code_edit_changed_lines", "Lines of the program changed by an applied edit",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+
+EDIT_BLOCK = re.compile(
+    r"^<{7} ?SEARCH[^\n]*\n(.*?)^={7}[ \t]*\n(.*?)^>{7} ?REPLACE[^\n]*$",
+    re.MULTILINE | re.DOTALL
+)
+
+class EditApplyError(ValueError):
+    """
+    Raised when the answer to an edit request cannot be applied to the program.
+    """
+
+def build_edit_prompt(manim_code: str, instruction: str, prompt: str, duration_minutes: float) -> str:
+    """
+    Build the prompt that asks Gemini for the changes to a program.
+
+    Args:
+        manim_code: The program of the earlier video
+        instruction: The requested change
+        prompt: The request the program was generated for
+        duration_minutes: The duration of the video in minutes
+
+    Returns:
+        The prompt
+    """
+    return f"""You are editing a Manim Community Edition program that renders an educational video.
+
+The video was made for this request:
+{prompt}
+
+Change it as follows:
+{instruction}
+
+Here is the current program:
+```python
+{manim_code}
+```
+
+Reply only with the changes, as one or more blocks in this format:
+
+<<<<<<< SEARCH
+lines copied exactly from the current program
+=======
+the lines that replace them
+>>>>>>> REPLACE
+
+Rules:
+- The SEARCH part must match the current program exactly, including indentation, and occur in it only once; include unchanged neighbouring lines if needed to make it unique
+- Keep the class CreateScene(Scene) and the structure of the program; change only what the request needs
+- Every animation keeps a # NARRATION: comment before it; update narration that no longer matches its animation
+- The video must still last about {duration_minutes} minutes; adjust self.wait() calls to change the pacing
+- Do not repeat unchanged parts of the program
+"""
+
+def parse_edit_blocks(response_text: str) -> List[Tuple[str, str]]:
+    """
+    Extract the search and replace blocks from Gemini's answer.
+
+    Args:
+        response_text: The answer
+
+    Returns:
+        List of (search, replace) pairs
+
+    Raises:
+        EditApplyError: If the answer contains no blocks
+    """
+    blocks = EDIT_BLOCK.findall(response_text.replace("\r\n", "\n"))
+    if not blocks:
+        raise EditApplyError("The answer contains no SEARCH/REPLACE blocks")
+    return blocks
+
+def _find_lines(code_lines: List[str], search_lines: List[str]) -> List[int]:
+    # Positions where the search lines match, ignoring trailing whitespace
+    target = [line.rstrip() for line in search_lines]
+    stripped = [line.rstrip() for line in code_lines]
+    return [
+        i for i in range(len(stripped) - len(target) + 1)
+        if stripped[i:i + len(target)] == target
+    ]
+
+def apply_edit_blocks(manim_code: str, blocks: List[Tuple[str, str]]) -> str:
+    """
+    Apply search and replace blocks to a program, in order.
+
+    A search text must occur exactly once. If it does not occur verbatim, it
+    is matched line by line with trailing whitespace ignored.
+
+    Args:
+        manim_code: The program
+        blocks: List of (search, replace) pairs
+
+    Returns:
+        The changed program
+
+    Raises:
+        EditApplyError: If a search text is empty, missing or ambiguous
+    """
+    code = manim_code if manim_code.endswith("\n") else manim_code + "\n"
+    for number, (search, replace) in enumerate(blocks, start=1):
+        if not search.strip():
+            raise EditApplyError(f"Block {number} has an empty SEARCH part")
+        count = code.count(search)
+        if count == 1:
+            code = code.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise EditApplyError(f"The SEARCH part of block {number} occurs {count} times in the program")
+
+        code_lines = code.splitlines(keepends=True)
+        search_lines = search.splitlines()
+        matches = _find_lines(code_lines, search_lines)
+        if len(matches) != 1:
+            problem = "does not occur" if not matches else f"occurs {len(matches)} times"
+            raise EditApplyError(f"The SEARCH part of block {number} {problem} in the program")
+        start = matches[0]
+        code = "".join(code_lines[:start]) + replace + "".join(code_lines[start + len(search_lines):])
+    return code
+
+def check_edited_code(manim_code: str) -> None:
+    """
+    Check that an edited program can be rendered.
+
+    Args:
+        manim_code: The edited program
+
+    Raises:
+        EditApplyError: If the program has a syntax error, a known Manim error or no CreateScene class
+    """
+    syntax_ok, no_errors, has_scene, _ = score_candidate(manim_code)
+    if not syntax_ok:
+        try:
+            ast.parse(manim_code)
+        except SyntaxError as e:
+            raise EditApplyError(f"The edited program has a syntax error on line {e.lineno}: {e.msg}")
+    if not no_errors:
+        raise EditApplyError("The edited program uses Manim features that are not supported")
+    if not has_scene:
+        raise EditApplyError("The edited program has no CreateScene(Scene) class")
+
+def changed_line_count(old_code: str, new_code: str) -> int:
+    """
+    Count the lines removed or added by an edit.
+
+    Args:
+        old_code: The program before the edit
+        new_code: The program after the edit
+
+    Returns:
+        The number of changed lines
+    """
+    diff = difflib.unified_diff(old_code.splitlines(), new_code.splitlines(), lineterm="", n=0)
+    return sum(
+        1 for line in diff
+        if line[:1] in ("+", "-") and not line.startswith(("+++", "---"))
+    )
+
+async def edit_manim_code(
+    manim_code: str,
+    instruction: str,
+    prompt: str,
+    topic: Optional[str] = None,
+    duration_minutes: float = 3.0,
+    max_retries: int = 3,
+    retry_delay: float = 2.0,
+    timeout: float = 120.0,
+    model_name: str = GEMINI_EDIT_MODEL,
+    on_section: Optional[Callable[[str], None]] = None,
+    regenerate_on_failure: bool = True
+) -> str:
+    """
+    Change a program as requested by asking Gemini only for the changed lines.
+
+    An answer that cannot be applied, or that produces a program with a
+    syntax error, is retried with the problem added to the prompt. When the
+    attempts are used up, the program is generated again for the prompt with
+    the instruction appended, unless regenerate_on_failure is false. The
+    sections of the result are passed to on_section.
+
+    Args:
+        manim_code: The program of the earlier video
+        instruction: The requested change
+        prompt: The request the program was generated for
+        topic: The educational topic (optional)
+        duration_minutes: The duration of the video in minutes
+        max_retries: Maximum number of edit attempts (default: 3)
+        retry_delay: Delay between retries in seconds (default: 2.0)
+        timeout: Timeout for each API call in seconds (default: 120.0)
+        model_name: The Gemini model to use (default: GEMINI_EDIT_MODEL)
+        on_section: Optional callback for each section of the resulting code
+        regenerate_on_failure: Generate the whole program if the edit fails (default: True)
+
+    Returns:
+        The changed Manim code
+    """
+    logger.info(f"Editing Manim code: {instruction}")
+    duration_minutes = max(0.67, min(duration_minutes, 3.0))
+    edit_prompt = build_edit_prompt(manim_code, instruction, prompt, duration_minutes)
+
+    # Check if API key is configured (recorded calls are replayed without one)
+    if not GEMINI_API_KEY and not replaying():
+        raise ValueError("GEMINI_API_KEY not set. Please run 'python setup_env.py' to configure.")
+
+    attempts = 0
+    last_exception = None
+    feedback = ""
+
+    while attempts < max_retries:
+        try:
+            logger.info(f"Edit attempt {attempts + 1}/{max_retries}")
+            start = time.perf_counter()
+            response_text = await get_llm_client().generate(
+                edit_prompt + feedback,
+                model_name=model_name,
+                timeout=timeout,
+                generation_config={"max_output_tokens": EDIT_OUTPUT_TOKENS}
+            )
+            edited_code = apply_edit_blocks(manim_code, parse_edit_blocks(response_text))
+            check_edited_code(edited_code)
+
+            changed = changed_line_count(manim_code, edited_code)
+            CODE_EDITS.inc(outcome=OUTCOME_PATCHED)
+            CODE_EDIT_CHANGED_LINES.observe(changed)
+            logger.info(
+                f"Applied an edit changing {changed} lines in {time.perf_counter() - start:.1f} seconds "
+                f"({len(response_text)} characters generated instead of {len(edited_code)})"
+            )
+            replay_sections(edited_code, on_section)
+            return edited_code
+
+        except CircuitOpenError:
+            # Gemini keeps failing for every job, so retrying would only add load
+            CODE_EDITS.inc(outcome=OUTCOME_FAILED)
+            raise
+        except EditApplyError as e:
+            last_exception = e
+            logger.warning(f"Edit could not be applied: {str(e)} (attempt {attempts + 1}/{max_retries})")
+            feedback = f"\nYour previous answer could not be used: {str(e)}. Answer again following the format and rules above.\n"
+        except Exception as e:
+            last_exception = e
+            logger.warning(f"Edit call failed with error: {str(e)} (attempt {attempts + 1}/{max_retries})")
+
+        # Wait before retrying, if the deadline and the retry budget allow it
+        attempts += 1
+        if attempts < max_retries:
+            delay = backoff_delay(attempts, retry_delay, multiplier=1.5)
+            if not allow_retry(SERVICE_GEMINI, delay):
+                break
+            await asyncio.sleep(delay)
+
+    if not regenerate_on_failure:
+        CODE_EDITS.inc(outcome=OUTCOME_FAILED)
+        raise last_exception or EditApplyError("The edit failed")
+
+    logger.warning(f"Editing failed ({str(last_exception)}), generating the program again")
+    try:
+        edited_code = await generate_manim_code(
+            f"{prompt}\n\n{instruction}",
+            topic=topic,
+            duration_minutes=duration_minutes,
+            retry_delay=retry_delay,
+            timeout=timeout,
+            on_section=on_section
+        )
+    except Exception:
+        CODE_EDITS.inc(outcome=OUTCOME_FAILED)
+        raise
+    CODE_EDITS.inc(outcome=OUTCOME_REGENERATED)
+    return edited_code
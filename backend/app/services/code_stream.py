@@ -0,0 +1,236 @@
+"""
+Incremental processing of streamed Manim code.
+
+Gemini streams the generated code. The splitter cuts the stream into sections
+as soon as they are finished: a section is a method (or function) together
+with the comments and decorators in front of it, and it is finished once the
+next method at the same or an outer level starts. Finished sections are
+checked for syntax errors and their NARRATION comments are synthesized while
+the rest of the code is still being generated.
+"""
+import re
+import ast
+import asyncio
+import logging
+from typing import Optional, List, Set, Dict, Any
+
+from app.services import metrics
+from app.services.text_extraction import ManimTextExtractor
+from app.services.tts import verify_api_access, prefetch_speech
+from app.services.job_queue import stage_slot
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lines that start a method, function or class
+DEF_PATTERN = re.compile(r'^(\s*)(?:async\s+)?def\s')
+CLASS_PATTERN = re.compile(r'^(\s*)class\s')
+
+# Lines that belong to the section that follows them
+LEADING_PATTERN = re.compile(r'^\s*(#.*|@.*)?$')
+
+FIRST_SECTION_LATENCY = metrics.histogram(
+    "edututor_generate_first_section_seconds",
+    "Time from the start of a code generation call to its first finished method"
+)
+SECTIONS = metrics.counter("edututor_generate_sections_total", "Streamed code sections by syntax check result", ("result",))
+PREFETCHED_SEGMENTS = metrics.counter("edututor_narration_prefetched_total", "Narration segments synthesized while the code was streaming", ("outcome",))
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+class CodeSectionSplitter:
+    """
+    Splits streamed code into finished sections.
+    """
+
+    def __init__(self):
+        self._partial = ""
+        self._lines: List[str] = []
+        self._start = 0
+        self._def_indent: Optional[int] = None
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text.
+
+        Args:
+            text: The next piece of the code
+
+        Returns:
+            The sections finished by this text
+        """
+        self._partial += text
+        *complete, self._partial = self._partial.split("\n")
+
+        sections = []
+        for line in complete:
+            # Markdown fences are removed from the code later on
+            if line.lstrip().startswith("```"):
+                continue
+            section = self._add_line(line)
+            if section is not None:
+                sections.append(section)
+        return sections
+
+    def finish(self) -> List[str]:
+        """
+        End the stream.
+
+        Returns:
+            The remaining section, if it has any code
+        """
+        if self._partial and not self._partial.lstrip().startswith("```"):
+            self._lines.append(self._partial)
+        self._partial = ""
+        rest = "\n".join(self._lines[self._start:])
+        self._start = len(self._lines)
+        return [rest] if rest.strip() else []
+
+    def _add_line(self, line: str) -> Optional[str]:
+        """
+        Add a complete line and return the section it finishes, if any.
+        """
+        self._lines.append(line)
+        def_match = DEF_PATTERN.match(line)
+        class_match = CLASS_PATTERN.match(line)
+        if class_match:
+            # Methods of a new class start a new level
+            self._def_indent = None
+            return None
+        if not def_match:
+            return None
+
+        indent = len(def_match.group(1))
+        if self._def_indent is not None and indent > self._def_indent:
+            # A nested function is part of the current section
+            return None
+
+        # Comments and decorators right before the new method belong to it
+        boundary = len(self._lines) - 1
+        while boundary > self._start and LEADING_PATTERN.match(self._lines[boundary - 1]):
+            boundary -= 1
+
+        section = "\n".join(self._lines[self._start:boundary])
+        self._start = boundary
+        self._def_indent = indent
+        return section if section.strip() else None
+
+def is_method_section(section: str) -> bool:
+    """
+    Check whether a section holds a method or function.
+
+    Args:
+        section: The section code
+
+    Returns:
+        True if the first code line of the section defines a method or function
+    """
+    for line in section.split("\n"):
+        if not LEADING_PATTERN.match(line):
+            return bool(DEF_PATTERN.match(line))
+    return False
+
+def check_section_syntax(section: str) -> Optional[str]:
+    """
+    Check a method section for syntax errors.
+
+    Args:
+        section: The section code
+
+    Returns:
+        The syntax error, or None if the section is valid or is not a method
+    """
+    if not is_method_section(section):
+        return None
+
+    lines = section.split("\n")
+    code_lines = [line for line in lines if not LEADING_PATTERN.match(line)]
+    # Methods are indented inside their class, so wrap them in one to parse them
+    source = section if _indent(code_lines[0]) == 0 else "class _Section:\n" + section
+    try:
+        ast.parse(source)
+    except SyntaxError as e:
+        SECTIONS.inc(result="invalid")
+        return f"{e.msg} in section starting with {code_lines[0].strip()!r}"
+    SECTIONS.inc(result="valid")
+    return None
+
+class NarrationPrefetcher:
+    """
+    Synthesizes the narration of finished sections in the background.
+
+    The audio goes to the shared speech cache, so the narration stage finds
+    it there once the whole code is available. With max_segments, no more
+    segments are synthesized than the narration may use to meet a deadline.
+    """
+
+    def __init__(self, video_id: str, max_segments: Optional[int] = None):
+        self.video_id = video_id
+        self.max_segments = max_segments
+        self._extractor = ManimTextExtractor()
+        self._texts: Set[str] = set()
+        self._ready: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._api_check: Optional[asyncio.Task] = None
+
+    def add_section(self, section: str) -> None:
+        """
+        Start synthesizing the narration of a finished section.
+
+        Args:
+            section: The section code
+        """
+        for text in self._extractor.find_narration_blocks(section):
+            if self.max_segments is not None and len(self._texts) >= self.max_segments:
+                return
+            if text and text not in self._texts:
+                self._texts.add(text)
+                self._tasks.append(asyncio.create_task(self._synthesize(text)))
+
+    async def _synthesize(self, text: str) -> None:
+        """
+        Synthesize one narration segment into the speech cache.
+        """
+        if self._api_check is None:
+            self._api_check = asyncio.create_task(verify_api_access())
+        api_success, _ = await asyncio.shield(self._api_check)
+        if not api_success:
+            PREFETCHED_SEGMENTS.inc(outcome="skipped")
+            return
+
+        async with stage_slot("tts"):
+            ok = await prefetch_speech(text)
+        if ok:
+            self._ready.add(text)
+        PREFETCHED_SEGMENTS.inc(outcome="ok" if ok else "failed")
+
+    def missing(self, script: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Get the segments of a script whose speech was not prefetched.
+
+        Args:
+            script: The narration script
+
+        Returns:
+            The segments that still need to be synthesized
+        """
+        return [segment for segment in script if segment["text"] not in self._ready]
+
+    async def wait(self) -> None:
+        """
+        Wait for the started segments to finish.
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            logger.info(f"Prefetched {len(self._ready)}/{len(self._texts)} narration segments for video {self.video_id}")
+
+    def cancel(self) -> None:
+        """
+        Stop synthesizing.
+        """
+        for task in self._tasks:
+            task.cancel()
+        if self._api_check is not None:
+            self._api_check.cancel()
@@ -0,0 +1,232 @@
+"""
+Context caching of the static part of the code generation prompt.
+
+The code generation prompt starts with a long block that is the same for every
+request of a content type: the Manim requirements and the content type's
+template. Only the topic, content, duration and examples that follow it
+change. The static prefix is stored once per model as cached context with
+Gemini's context caching, and calls send only the variable suffix, which cuts
+the input tokens billed and the time to the first token.
+
+Context caching needs a google-generativeai release with the caching module
+(0.8 or later, as pinned in requirements.txt). With an older release the full
+prompt is sent as before. A local backend that keeps the
+prefix in memory and prepends it to each call stands in for the provider in
+tests.
+"""
+import os
+import time
+import hashlib
+import datetime
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple, Callable
+
+import google.generativeai as genai
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to false to always send the full prompt
+CONTEXT_CACHE_ENABLED = os.environ.get("EDUTUTOR_CONTEXT_CACHE", "true").lower() in ("1", "true", "yes")
+
+# How long cached context is kept by the provider (in seconds)
+CONTEXT_CACHE_TTL = float(os.environ.get("EDUTUTOR_CONTEXT_CACHE_TTL", "3600"))
+
+# Shortest prefix worth caching (in characters); the provider rejects contexts below its token minimum
+CONTEXT_CACHE_MIN_CHARS = int(os.environ.get("EDUTUTOR_CONTEXT_CACHE_MIN_CHARS", "2000"))
+
+# Cached context is replaced this long before it expires (in seconds)
+EXPIRY_MARGIN = 60.0
+
+# How long to send full prompts after the provider refused to cache a prefix (in seconds)
+FAILURE_BACKOFF = 600.0
+
+CONTEXT_CACHE_LOOKUPS = metrics.counter("edututor_context_cache_lookups_total", "Cached prompt context lookups by result", ("result",))
+CONTEXT_CACHE_SAVED_CHARS = metrics.counter("edututor_context_cache_saved_chars_total", "Prompt characters not sent because they were cached context")
+
+def provider_supported() -> bool:
+    """
+    Check whether the installed Gemini SDK supports context caching.
+
+    Returns:
+        True if cached contents can be created
+    """
+    try:
+        from google.generativeai import caching
+    except ImportError:
+        return False
+    return hasattr(caching, "CachedContent") and hasattr(genai.GenerativeModel, "from_cached_content")
+
+class ProviderContextBackend:
+    """
+    Stores prefixes with Gemini's context caching.
+    """
+
+    def create(self, model_name: str, prefix: str, ttl: float) -> Any:
+        """
+        Create cached content for a prefix. Blocks, so it is called in a thread.
+
+        Returns:
+            The cached content
+        """
+        from google.generativeai import caching
+
+        name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        return caching.CachedContent.create(
+            model=name,
+            display_name=f"edututor-{hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]}",
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    def model(self, base_model: Any, handle: Any) -> Any:
+        """
+        Get a model that answers with the cached content in front of each prompt.
+        """
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+class _LocalCachedModel:
+    """
+    Model that prepends a locally stored prefix to each prompt.
+    """
+
+    def __init__(self, base_model: Any, prefix: str):
+        self._base_model = base_model
+        self._prefix = prefix
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self._base_model.generate_content_async(self._prefix + prompt, **kwargs)
+
+class LocalContextBackend:
+    """
+    Keeps prefixes in memory, standing in for the provider in tests.
+    """
+
+    def __init__(self):
+        self.created = 0
+
+    def create(self, model_name: str, prefix: str, ttl: float) -> Any:
+        self.created += 1
+        return prefix
+
+    def model(self, base_model: Any, handle: Any) -> Any:
+        return _LocalCachedModel(base_model, handle)
+
+class ContextCache:
+    """
+    Cached context per model and prompt prefix.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        ttl: float = CONTEXT_CACHE_TTL,
+        min_chars: int = CONTEXT_CACHE_MIN_CHARS
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self._entries: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._failed_until: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def needs_creation(self, model_name: str, prefix: str) -> bool:
+        """
+        Check whether a lookup of a prefix would create cached context, which
+        is a call to the provider.
+
+        Args:
+            model_name: The model the context is for
+            prefix: The static prompt prefix
+
+        Returns:
+            True if the prefix is worth caching and has no fresh context
+        """
+        if len(prefix) < self.min_chars:
+            return False
+        key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - EXPIRY_MARGIN > now:
+                return False
+            return self._failed_until.get(key, 0.0) <= now
+
+    def lookup(
+        self,
+        model_name: str,
+        prefix: str,
+        on_create: Optional[Callable[[bool], None]] = None
+    ) -> Optional[Tuple[str, Any]]:
+        """
+        Get the cached context for a prefix, creating it if needed. Creating
+        context blocks, so this is called in a thread.
+
+        Args:
+            model_name: The model the context is for
+            prefix: The static prompt prefix
+            on_create: Optional callback told whether creating context succeeded, if it was created
+
+        Returns:
+            A key identifying the model and prefix, which stays the same when the
+            context is refreshed, and the backend's handle, or None to send the full prompt
+        """
+        if len(prefix) < self.min_chars:
+            CONTEXT_CACHE_LOOKUPS.inc(result="skipped")
+            return None
+
+        key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        # Creation is serialized, so concurrent requests share one cached context
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - EXPIRY_MARGIN > now:
+                CONTEXT_CACHE_LOOKUPS.inc(result="hit")
+                CONTEXT_CACHE_SAVED_CHARS.inc(len(prefix))
+                return f"{model_name}@{key[1][:16]}", entry[0]
+            if self._failed_until.get(key, 0.0) > now:
+                CONTEXT_CACHE_LOOKUPS.inc(result="unavailable")
+                return None
+
+            try:
+                handle = self.backend.create(model_name, prefix, self.ttl)
+            except Exception as e:
+                logger.warning(f"Could not cache the prompt prefix for {model_name}, sending full prompts: {str(e)}")
+                self._failed_until[key] = now + FAILURE_BACKOFF
+                CONTEXT_CACHE_LOOKUPS.inc(result="error")
+                if on_create is not None:
+                    on_create(False)
+                return None
+            if on_create is not None:
+                on_create(True)
+
+            expires_at = now + self.ttl
+            self._entries[key] = (handle, expires_at)
+            CONTEXT_CACHE_LOOKUPS.inc(result="created")
+            CONTEXT_CACHE_SAVED_CHARS.inc(len(prefix))
+            logger.info(f"Cached a prompt prefix of {len(prefix)} characters for {model_name}")
+            return f"{model_name}@{key[1][:16]}", handle
+
+_context_cache: Optional[ContextCache] = None
+_checked = False
+
+def get_context_cache() -> Optional[ContextCache]:
+    """
+    Get the shared context cache.
+
+    Returns:
+        The context cache, or None if context caching is disabled or not supported by the SDK
+    """
+    global _context_cache, _checked
+    if not _checked:
+        _checked = True
+        if CONTEXT_CACHE_ENABLED:
+            if provider_supported():
+                _context_cache = ContextCache(ProviderContextBackend())
+            else:
+                logger.info("The installed google-generativeai does not support context caching, sending full prompts")
+    return _context_cache
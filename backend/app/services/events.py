@@ -0,0 +1,283 @@
+"""
+Progress events for video generation, streamed to clients as server-sent events.
+
+The pipeline appends events (job state changes, stage transitions and render
+progress) to the job database. A single poller per process tails the events
+table and fans new events out to the subscribers of each video, so the cost
+of serving progress does not grow with the number of viewers.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Set, AsyncIterator
+
+from app.services import metrics
+from app.services.job_queue import get_job_queue, JobQueue, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How often the poller checks for new events (in seconds)
+EVENT_POLL_INTERVAL = float(os.environ.get("EDUTUTOR_EVENT_POLL_INTERVAL", "0.5"))
+
+# How long events are kept (in seconds)
+EVENT_RETENTION = float(os.environ.get("EDUTUTOR_EVENT_RETENTION", str(24 * 3600)))
+
+# Seconds between keepalive comments on idle streams
+KEEPALIVE_INTERVAL = 15.0
+
+# Job states after which a stream ends
+TERMINAL_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+SUBSCRIBERS = metrics.gauge("edututor_event_subscribers", "Number of open progress event streams")
+
+class EventBus:
+    """
+    Fans events from the job database out to in-process subscribers.
+    """
+
+    def __init__(self, queue: JobQueue, poll_interval: float = EVENT_POLL_INTERVAL):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def subscribe(self, video_id: str) -> asyncio.Queue:
+        """
+        Receive the events of a video that are added from now on.
+
+        Args:
+            video_id: The ID of the video
+
+        Returns:
+            Queue that receives the events
+        """
+        self._ensure_running()
+        subscriber = asyncio.Queue()
+        self._subscribers.setdefault(video_id, set()).add(subscriber)
+        SUBSCRIBERS.set(self.subscriber_count())
+        return subscriber
+
+    def unsubscribe(self, video_id: str, subscriber: asyncio.Queue) -> None:
+        """
+        Stop receiving the events of a video.
+
+        Args:
+            video_id: The ID of the video
+            subscriber: The queue returned by subscribe
+        """
+        subscribers = self._subscribers.get(video_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[video_id]
+        SUBSCRIBERS.set(self.subscriber_count())
+
+    def subscriber_count(self) -> int:
+        """
+        Count the open subscriptions.
+
+        Returns:
+            Number of subscribers
+        """
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def wake(self) -> None:
+        """
+        Check for new events right away instead of at the next poll. Safe to
+        call from any thread.
+        """
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _ensure_running(self) -> None:
+        """
+        Start the poller on the running event loop if it is not running yet.
+        """
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        """
+        Stop the poller.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _poll_loop(self) -> None:
+        """
+        Tail the events table and deliver new events until cancelled.
+        """
+        last_id = await asyncio.to_thread(self.queue.last_event_id)
+        polls = 0
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                events = await asyncio.to_thread(self.queue.events_after, last_id)
+                for event in events:
+                    last_id = event["id"]
+                    for subscriber in list(self._subscribers.get(event["video_id"], ())):
+                        subscriber.put_nowait(event)
+
+                # Prune old events about once an hour
+                polls += 1
+                if polls * self.poll_interval >= 3600:
+                    polls = 0
+                    removed = await asyncio.to_thread(self.queue.prune_events, EVENT_RETENTION)
+                    if removed:
+                        logger.info(f"Pruned {removed} old progress events")
+            except Exception as e:
+                logger.error(f"Failed to read progress events: {str(e)}")
+
+_event_bus: Optional[EventBus] = None
+
+def get_event_bus() -> EventBus:
+    """
+    Get the shared event bus.
+
+    Returns:
+        The event bus
+    """
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = EventBus(get_job_queue())
+    return _event_bus
+
+async def stop_event_bus() -> None:
+    """
+    Write the queued events and stop the poller of the shared event bus if it
+    is running.
+    """
+    await asyncio.to_thread(get_job_queue().flush_events)
+    if _event_bus is not None:
+        await _event_bus.stop()
+
+def _wake_event_bus() -> None:
+    if _event_bus is not None:
+        _event_bus.wake()
+
+def publish(video_id: str, event_type: str, data: Dict[str, Any]) -> None:
+    """
+    Record a progress event for a video. The event is written by the job
+    queue's writer thread, so publishing never blocks the event loop on
+    SQLite. Failures are logged and ignored so progress reporting never
+    breaks the pipeline.
+
+    Args:
+        video_id: The ID of the video
+        event_type: The event type (stage or progress)
+        data: The event payload
+    """
+    try:
+        get_job_queue().queue_event(video_id, event_type, data, on_written=_wake_event_bus)
+    except Exception as e:
+        logger.warning(f"Failed to publish {event_type} event for video {video_id}: {str(e)}")
+
+def format_event(event_type: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """
+    Format an event in the server-sent events wire format.
+
+    Args:
+        event_type: The event name
+        data: The event payload
+        event_id: The event ID clients send back in Last-Event-ID when reconnecting
+
+    Returns:
+        The formatted event
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+def _format_stored_event(event: Dict[str, Any]) -> str:
+    """
+    Format an event from the job database, adding the video URL to the
+    event that completes a job.
+
+    Args:
+        event: The stored event
+
+    Returns:
+        The formatted event
+    """
+    data = dict(event["data"])
+    if event["type"] == "state" and data.get("state") == JOB_DONE:
+        data["video_url"] = f"/api/video/{event['video_id']}"
+    return format_event(event["type"], data, event["id"])
+
+def _is_terminal(event: Dict[str, Any]) -> bool:
+    return event["type"] == "state" and event["data"].get("state") in TERMINAL_STATES
+
+async def stream_events(video_id: str, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Stream the progress of a video as server-sent events.
+
+    A new stream starts with a "status" event holding the current status of
+    the video. A reconnecting client that sends the ID of the last event it
+    received gets the events it missed instead. The stream ends after the job
+    is done, has failed or was cancelled.
+
+    Args:
+        video_id: The ID of the video
+        last_event_id: ID of the last event the client received, if reconnecting
+
+    Yields:
+        Formatted server-sent events
+    """
+    from app.utils.helpers import get_video_status
+
+    bus = get_event_bus()
+    subscriber = bus.subscribe(video_id)
+
+    try:
+        if last_event_id is None:
+            # Events added while the status is read are replayed below
+            sent_id = await asyncio.to_thread(bus.queue.last_event_id)
+            status = await asyncio.to_thread(get_video_status, video_id)
+            yield format_event("status", status)
+            if status.get("status") in ("completed", "failed", "not_found") and status.get("job_state") not in ("queued", "running"):
+                return
+        else:
+            sent_id = last_event_id
+
+        # Replay the events the poller may not deliver: those the client missed
+        # while disconnected, or that were added before the poller started
+        for event in await asyncio.to_thread(bus.queue.events_after, sent_id, video_id):
+            sent_id = event["id"]
+            yield _format_stored_event(event)
+            if _is_terminal(event):
+                return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), timeout=KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if event["id"] <= sent_id:
+                continue
+            sent_id = event["id"]
+            yield _format_stored_event(event)
+            if _is_terminal(event):
+                return
+
+    finally:
+        bus.unsubscribe(video_id, subscriber)
@@ -2,14 +2,30 @@
 Gemini API integration for generating Manim code.
 """
 import os
+import ast
 import logging
 import traceback
 import google.generativeai as genai
-from typing import Optional
+from typing import Optional, Callable, List, Tuple, Dict, Any
 import asyncio
 import time
 from dotenv import load_dotenv
 
+from app.services import metrics
+from app.services.resilience import CircuitOpenError, allow_retry, backoff_delay, SERVICE_GEMINI
+from app.services.cassette import replaying
+from app.services.model_router import route, record_outcome, generation_config
+from app.services.llm_client import get_llm_client, LLMClient, LLMTimeoutError, LLM_LATENCY, GEMINI_MODEL, GEMINI_FAST_MODEL
+from app.services.code_stream import CodeSectionSplitter, check_section_syntax, is_method_section, FIRST_SECTION_LATENCY
+from app.services.llm_cache import get_llm_cache, llm_cache_key, LLM_CACHE_ENABLED, KIND_CODE
+from app.services.text_extraction import ManimTextExtractor
+from app.services.retrieval import (
+    get_example_index, find_reusable_code, select_examples, RETRIEVAL_ENABLED, RETRIEVALS
+)
+from app.services.templates import find_template_code, TEMPLATES_ENABLED
+from app.services.manim import check_for_common_errors
+from app.utils.helpers import clean_code
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -45,10 +61,41 @@ class ManimEducationalAgent:
             'interactive_exploration': ['explore', 'investigate', 'experiment', 'what if', 'interactive']
         }
         
-    def classify_and_generate(self, topic, prompt, duration_minutes=3):
-        """Classifies content and generates optimized Manim code"""
+    def classify_and_generate(self, topic, prompt, duration_minutes=3, examples=None):
+        """Classifies content and generates optimized Manim code, with earlier successful programs as examples"""
+        prefix, suffix = self.build_prompt(topic, prompt, duration_minutes, examples)
+        return prefix + suffix
+    
+    def build_prompt(self, topic, prompt, duration_minutes=3, examples=None):
+        """Splits the prompt into the static prefix of the content type, which can be cached, and the request details"""
         content_type = self._classify_content(prompt)
-        return self._generate_specialized_code(content_type, topic, prompt, duration_minutes)
+        prefix = self._generate_specialized_code(content_type)
+        suffix = self._request_details(topic, prompt, duration_minutes)
+        if examples:
+            suffix += self._format_examples(examples)
+        return prefix, suffix
+    
+    def _request_details(self, topic, prompt, duration_minutes):
+        """The part of the prompt that changes with each request"""
+        return f"""
+TOPIC: {topic or 'Mathematics'}
+CONTENT: {prompt}
+DURATION: {duration_minutes} minutes
+"""
+    
+    def _format_examples(self, examples):
+        """Format programs that rendered successfully for similar prompts"""
+        parts = ["""
+REFERENCE EXAMPLES:
+The following programs rendered successfully for similar requests. Reuse their structure and the Manim
+APIs they use, but write a new program for the CONTENT above.
+"""]
+        for i, example in enumerate(examples, 1):
+            parts.append(f"""
+EXAMPLE {i} (TOPIC: {example.get('topic') or 'Mathematics'}; CONTENT: {example['prompt']}):
+{example['code']}
+""")
+        return "".join(parts)
     
     def _classify_content(self, prompt):
         """Efficient content classification using keyword matching"""
@@ -60,10 +107,10 @@ class ManimEducationalAgent:
         
         return max(scores, key=scores.get) if max(scores.values()) > 0 else 'conceptual_explanation'
     
-    def _generate_specialized_code(self, content_type, topic, prompt, duration_minutes):
+    def _generate_specialized_code(self, content_type):
         """Generate highly optimized Manim code based on content type"""
         
-        base_requirements = f"""
+        base_requirements = """
 GENERATE PURE PYTHON CODE ONLY - NO MARKDOWN, NO EXPLANATIONS OUTSIDE CODE
 
 CRITICAL MANIM REQUIREMENTS:
@@ -103,10 +150,6 @@ COMPATIBILITY WARNINGS:
 -Use only standard colors (RED, BLUE, GREEN, YELLOW, WHITE, BLACK, etc.)
 -Always call methods returning points or vectors with parentheses (e.g., get_center(), get_corner()), never use method references without parentheses in arithmetic expressions.
 
-TOPIC: {topic or 'Mathematics'}
-CONTENT: {prompt}
-DURATION: {duration_minutes} minutes
-
 """
         
         if content_type == 'step_by_step_problem':
@@ -287,6 +330,278 @@ Exploration Themes:
 Encourage mathematical discovery through guided visual exploration.
 """
 
+# Send a second, hedged code generation request when the first one takes longer
+# than the recent 90th percentile latency, and keep whichever finishes first
+GEMINI_HEDGE = os.environ.get("EDUTUTOR_GEMINI_HEDGE", "false").lower() in ("1", "true", "yes")
+
+# Hedge delay used until enough calls have been observed (in seconds)
+GEMINI_HEDGE_DELAY = float(os.environ.get("EDUTUTOR_GEMINI_HEDGE_DELAY", "60"))
+
+# Calls of a model that must be observed before its latency sets the hedge delay
+HEDGE_MIN_SAMPLES = 20
+HEDGE_QUANTILE = 0.9
+
+# Number of code candidates generated in parallel; the best one that passes the
+# static checks is rendered
+GEMINI_CANDIDATES = int(os.environ.get("EDUTUTOR_GEMINI_CANDIDATES", "1"))
+
+HEDGED_REQUESTS = metrics.counter("edututor_gemini_hedged_requests_total", "Code generation calls in hedged mode by which request won", ("winner",))
+CANDIDATES = metrics.counter("edututor_gemini_candidates_total", "Generated code candidates by static check result", ("result",))
+
+# Shared agent, reused by every request instead of rebuilt per video
+_agent = None
+
+def get_agent() -> ManimEducationalAgent:
+    """
+    Get the shared ManimEducationalAgent.
+    
+    Returns:
+        The agent
+    """
+    global _agent
+    if _agent is None:
+        _agent = ManimEducationalAgent()
+    return _agent
+
+def replay_sections(manim_code: str, on_section: Optional[Callable[[str], None]]) -> None:
+    """
+    Pass the sections of complete code to a section callback.
+    
+    Args:
+        manim_code: The code
+        on_section: The callback, or None
+    """
+    if on_section is not None:
+        splitter = CodeSectionSplitter()
+        for section in splitter.feed(manim_code) + splitter.finish():
+            on_section(section)
+
+def score_candidate(manim_code: str) -> Tuple[int, int, int, int]:
+    """
+    Rank generated code by static checks.
+    
+    Args:
+        manim_code: The code
+        
+    Returns:
+        Tuple that sorts higher for better code: valid syntax, no known Manim
+        errors, the expected scene class, and narration comments
+    """
+    try:
+        ast.parse(manim_code)
+        syntax_ok = 1
+    except SyntaxError:
+        syntax_ok = 0
+    has_errors, _ = check_for_common_errors(manim_code)
+    has_scene = int("class CreateScene(Scene)" in manim_code)
+    has_narration = int(bool(ManimTextExtractor().find_narration_blocks(manim_code)))
+    return (syntax_ok, int(not has_errors), has_scene, has_narration)
+
+def hedge_delay(model_name: str) -> float:
+    """
+    Get how long to wait for a code generation call before hedging it.
+    
+    Args:
+        model_name: The Gemini model
+        
+    Returns:
+        The recent 90th percentile call latency, or GEMINI_HEDGE_DELAY if too few calls were observed
+    """
+    if LLM_LATENCY.count(model=model_name) < HEDGE_MIN_SAMPLES:
+        return GEMINI_HEDGE_DELAY
+    return LLM_LATENCY.quantile(HEDGE_QUANTILE, model=model_name) or GEMINI_HEDGE_DELAY
+
+async def generate_candidate(
+    client: LLMClient,
+    specialized_prompt: str,
+    model_name: str,
+    timeout: float,
+    on_section: Optional[Callable[[str], None]] = None,
+    check_syntax: bool = True,
+    generation_config: Optional[Dict[str, Any]] = None,
+    cached_prefix: Optional[str] = None
+) -> str:
+    """
+    Stream one piece of code from Gemini.
+    
+    Args:
+        client: The Gemini client
+        specialized_prompt: The code generation prompt
+        model_name: The Gemini model
+        timeout: Timeout for the API call in seconds
+        on_section: Optional callback for each finished section of the code
+        check_syntax: Stop as soon as a finished method has a syntax error
+        generation_config: Optional generation settings such as the output token limit
+        cached_prefix: Optional static start of the prompt, sent as cached context; specialized_prompt is the rest
+        
+    Returns:
+        The generated code without Markdown formatting
+        
+    Raises:
+        SyntaxError: If check_syntax is set and a method has a syntax error
+    """
+    splitter = CodeSectionSplitter()
+    start = time.perf_counter()
+    first_section = True
+    
+    def handle_sections(sections):
+        nonlocal first_section
+        for section in sections:
+            if first_section and is_method_section(section):
+                FIRST_SECTION_LATENCY.observe(time.perf_counter() - start)
+                first_section = False
+            error = check_section_syntax(section)
+            if error:
+                logger.warning(f"Streamed code has a syntax error: {error}")
+                if check_syntax:
+                    raise SyntaxError(f"Generated code has a syntax error: {error}")
+            if on_section is not None:
+                on_section(section)
+    
+    response_text = await client.generate(
+        specialized_prompt,
+        model_name=model_name,
+        timeout=timeout,
+        generation_config=generation_config,
+        on_chunk=lambda text: handle_sections(splitter.feed(text)),
+        cached_prefix=cached_prefix
+    )
+    handle_sections(splitter.finish())
+    
+    manim_code = response_text.strip()
+    
+    # Clean the code to remove any Markdown formatting
+    if "```" in manim_code:
+        logger.warning("Detected Markdown code blocks in the code, cleaning...")
+        manim_code = clean_code(manim_code)
+    
+    return manim_code
+
+async def generate_hedged(
+    client: LLMClient,
+    specialized_prompt: str,
+    model_name: str,
+    timeout: float,
+    check_syntax: bool = True,
+    generation_config: Optional[Dict[str, Any]] = None,
+    cached_prefix: Optional[str] = None
+) -> str:
+    """
+    Generate code, sending a second request if the first one is slow, and
+    keep the first request that succeeds.
+    
+    Args:
+        client: The Gemini client
+        specialized_prompt: The code generation prompt
+        model_name: The Gemini model
+        timeout: Timeout for each API call in seconds
+        check_syntax: Fail a request as soon as a finished method has a syntax error
+        generation_config: Optional generation settings such as the output token limit
+        cached_prefix: Optional static start of the prompt, sent as cached context; specialized_prompt is the rest
+        
+    Returns:
+        The generated code
+    """
+    primary = asyncio.create_task(generate_candidate(
+        client, specialized_prompt, model_name, timeout, check_syntax=check_syntax,
+        generation_config=generation_config, cached_prefix=cached_prefix
+    ))
+    pending = {primary}
+    hedge = None
+    may_hedge = True
+    delay = hedge_delay(model_name)
+    last_exception = None
+    
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if may_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_REQUESTS.inc(winner="not_hedged" if hedge is None else "hedge" if task is hedge else "primary")
+                    return task.result()
+                last_exception = task.exception()
+            
+            # Hedge when the first request is slow or failed before the delay;
+            # a hedge adds load on Gemini, so it is paid for from the retry budget
+            if may_hedge:
+                may_hedge = False
+                if isinstance(last_exception, CircuitOpenError) or not allow_retry("gemini_hedge", 0.0):
+                    continue
+                logger.info(f"Sending a hedged code generation request after {delay:.1f} seconds")
+                hedge = asyncio.create_task(generate_candidate(
+                    client, specialized_prompt, model_name, timeout, check_syntax=check_syntax,
+                    generation_config=generation_config, cached_prefix=cached_prefix
+                ))
+                pending.add(hedge)
+        
+        HEDGED_REQUESTS.inc(winner="none")
+        raise last_exception
+    finally:
+        for task in (primary, hedge):
+            if task is not None and not task.done():
+                task.cancel()
+
+async def generate_best_candidate(
+    client: LLMClient,
+    specialized_prompt: str,
+    model_name: str,
+    timeout: float,
+    candidates: int,
+    check_syntax: bool = True,
+    generation_config: Optional[Dict[str, Any]] = None,
+    cached_prefix: Optional[str] = None
+) -> str:
+    """
+    Generate several pieces of code in parallel and keep the best one.
+    
+    Args:
+        client: The Gemini client
+        specialized_prompt: The code generation prompt
+        model_name: The Gemini model
+        timeout: Timeout for each API call in seconds
+        candidates: Number of candidates
+        check_syntax: Drop a candidate as soon as a finished method has a syntax error
+        generation_config: Optional generation settings such as the output token limit
+        cached_prefix: Optional static start of the prompt, sent as cached context; specialized_prompt is the rest
+        
+    Returns:
+        The candidate with the best static checks, the first one to finish on ties
+    """
+    tasks = [
+        asyncio.create_task(generate_candidate(
+            client, specialized_prompt, model_name, timeout, check_syntax=check_syntax,
+            generation_config=generation_config, cached_prefix=cached_prefix
+        ))
+        for _ in range(candidates)
+    ]
+    finished: List[str] = []
+    last_exception = None
+    
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                finished.append(await next_done)
+            except Exception as e:
+                CANDIDATES.inc(result="failed")
+                last_exception = e
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    if not finished:
+        raise last_exception
+    
+    scores = [score_candidate(code) for code in finished]
+    for score in scores:
+        CANDIDATES.inc(result="valid" if all(score[:3]) else "invalid")
+    best = max(range(len(finished)), key=lambda i: (scores[i], -i))
+    logger.info(f"Picked code candidate {best + 1} of {len(finished)} with static checks {scores[best]}")
+    return finished[best]
+
 async def generate_manim_code(
     prompt: str, 
     topic: Optional[str] = None, 
@@ -294,11 +609,46 @@ async def generate_manim_code(
     duration_minutes: float = 3.0,
     max_retries: int = 3,
     retry_delay: float = 2.0,
-    timeout: float = 120.0
+    timeout: float = 120.0,
+    model_name: Optional[str] = None,
+    on_section: Optional[Callable[[str], None]] = None,
+    use_cache: bool = True,
+    hedge: bool = GEMINI_HEDGE,
+    candidates: int = GEMINI_CANDIDATES,
+    use_templates: bool = True
 ) -> str:
     """
     Generate Manim code using the Gemini API with retry logic and timeout handling.
     
+    The code is streamed. Each method is checked for syntax errors as soon as
+    it is finished, and an attempt whose code has a syntax error is retried
+    without waiting for the rest of it (except on the last attempt, where the
+    render reports the error). Finished sections are passed to on_section so
+    their narration can be processed while the code is still being generated.
+    
+    Prompts that a template in app/services/templates.py serves with high
+    confidence, such as solving a linear equation or plotting a function, are
+    filled into the template without calling Gemini, unless use_templates is
+    false. Code generated for the same prompt and model earlier is served
+    from the response cache, unless use_cache is false; the examples added
+    to the prompt are not part of the cache key. With retrieval
+    enabled, a program that rendered for the same request (after normalizing
+    case and spacing) and duration is reused (unless use_cache is false), and
+    programs that rendered for similar requests are added to the prompt as
+    examples.
+    
+    With candidates above one, that many requests run in parallel and the
+    candidate that passes the most static checks is returned. With hedge, a
+    second request is sent when the first one is slower than the recent 90th
+    percentile, and the first to succeed is returned. In both modes the
+    sections are passed to on_section once the code is chosen.
+    
+    Without a model_name, the model is chosen from the content type, the
+    duration and the recently observed latency and success rate of the models.
+    The output token limit grows with the duration, and after a failed attempt
+    in case the code was cut off. The static start of the prompt is sent as
+    cached context when context caching is available.
+    
     Args:
         prompt: The prompt for generating the video
         topic: The educational topic (optional)
@@ -307,6 +657,12 @@ async def generate_manim_code(
         max_retries: Maximum number of retry attempts for API calls (default: 3)
         retry_delay: Delay between retries in seconds (default: 2.0)
         timeout: Timeout for the API call in seconds (default: 120.0)
+        model_name: The Gemini model to use (default: chosen by the model router)
+        on_section: Optional callback for each finished section of the code
+        use_cache: Serve the code from the response cache if it is there (default: True)
+        hedge: Send a hedged request when the first one is slow (default: GEMINI_HEDGE)
+        candidates: Number of candidates to generate in parallel (default: GEMINI_CANDIDATES)
+        use_templates: Serve the code from a template if one matches (default: True)
         
     Returns:
         Generated Manim Python code
@@ -314,24 +670,68 @@ async def generate_manim_code(
     try:
         logger.info(f"Generating Manim code for prompt: {prompt}")
         
-        # Check if API key is configured
-        if not GEMINI_API_KEY:
-            raise ValueError("GEMINI_API_KEY not set. Please run 'python setup_env.py' to configure.")
-        
         # Ensure duration is within bounds (40 seconds to 3 minutes)
         duration_minutes = max(0.67, min(duration_minutes, 3.0))
         
+        # Common request shapes are filled into a template without calling Gemini
+        if TEMPLATES_ENABLED and use_templates:
+            template_code = find_template_code(prompt, get_agent()._classify_content(prompt), duration_minutes)
+            if template_code:
+                replay_sections(template_code, on_section)
+                return template_code
+        
+        # Reuse the program of the same request
+        index = None
+        if RETRIEVAL_ENABLED:
+            try:
+                index = get_example_index()
+                if use_cache:
+                    reused_code = await asyncio.to_thread(find_reusable_code, index, prompt, topic, duration_minutes)
+                    if reused_code:
+                        RETRIEVALS.inc(outcome="reused")
+                        replay_sections(reused_code, on_section)
+                        return reused_code
+            except Exception as e:
+                logger.error(f"Example retrieval failed: {str(e)}")
+        
         # Use the ManimEducationalAgent to generate specialized prompt
-        agent = ManimEducationalAgent()
-        specialized_prompt = agent.classify_and_generate(topic, prompt, duration_minutes)
+        agent = get_agent()
+        prompt_prefix, prompt_suffix = agent.build_prompt(topic, prompt, duration_minutes)
+        if model_name is None:
+            model_name = route(agent._classify_content(prompt), duration_minutes)
         
         # Simplify prompt if it's too complex (for "neural network from scratch" type prompts)
         if "neural network" in prompt.lower() and "from scratch" in prompt.lower():
             logger.info("Detected complex 'neural network from scratch' prompt, simplifying...")
-            specialized_prompt += "\n\nIMPORTANT: Focus on a simple, high-level explanation of neural networks with basic visuals. Avoid complex code and detailed implementations."
+            prompt_suffix += "\n\nIMPORTANT: Focus on a simple, high-level explanation of neural networks with basic visuals. Avoid complex code and detailed implementations."
+        
+        # The key is built from the request without the retrieved examples, which
+        # change as the example index grows, so repeated requests reuse earlier code
+        cache_key = llm_cache_key(KIND_CODE, model_name, prompt_prefix + prompt_suffix)
+        if LLM_CACHE_ENABLED and use_cache:
+            cached_code = await asyncio.to_thread(get_llm_cache().get, cache_key, KIND_CODE)
+            if cached_code is not None:
+                logger.info("Using cached Manim code for this prompt")
+                replay_sections(cached_code, on_section)
+                return cached_code
+        
+        # Add the programs of similar requests to the prompt as examples
+        if index is not None:
+            try:
+                matches = await asyncio.to_thread(index.search, prompt, topic)
+                examples = select_examples(index, matches)
+                RETRIEVALS.inc(outcome="examples" if examples else "none")
+                if examples:
+                    prompt_suffix += agent._format_examples(examples)
+            except Exception as e:
+                logger.error(f"Example retrieval failed: {str(e)}")
         
-        # Generate the code using Gemini with retry logic
-        model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
+        # Check if API key is configured (recorded calls are replayed without one)
+        if not GEMINI_API_KEY and not replaying():
+            raise ValueError("GEMINI_API_KEY not set. Please run 'python setup_env.py' to configure.")
+        
+        # Generate the code using the shared Gemini client with retry logic
+        client = get_llm_client()
         
         # Initialize variables for retry loop
         attempts = 0
@@ -341,39 +741,56 @@ async def generate_manim_code(
             try:
                 logger.info(f"API call attempt {attempts + 1}/{max_retries}")
                 
-                # Create a timeout for the API call
-                async def api_call():
-                    return model.generate_content(specialized_prompt)
-                
-                # Execute with timeout
-                response = await asyncio.wait_for(api_call(), timeout=timeout)
+                check_syntax = attempts < max_retries - 1
+                config = generation_config(duration_minutes, attempts)
+                if candidates > 1:
+                    manim_code = await generate_best_candidate(
+                        client, prompt_suffix, model_name, timeout, candidates, check_syntax, config, prompt_prefix
+                    )
+                    replay_sections(manim_code, on_section)
+                elif hedge:
+                    manim_code = await generate_hedged(
+                        client, prompt_suffix, model_name, timeout, check_syntax, config, prompt_prefix
+                    )
+                    replay_sections(manim_code, on_section)
+                else:
+                    manim_code = await generate_candidate(
+                        client, prompt_suffix, model_name, timeout, on_section, check_syntax, config, prompt_prefix
+                    )
+                record_outcome(model_name, True)
                 
-                # If we get here, the call was successful
-                if not response.text:
-                    logger.error("Gemini API returned empty response")
-                    raise ValueError("Failed to generate code: Empty response from Gemini API")
-                
-                manim_code = response.text.strip()
                 logger.info(f"Generated Manim code preview: {manim_code[:500]}...")
+                
+                if LLM_CACHE_ENABLED:
+                    try:
+                        await asyncio.to_thread(get_llm_cache().put, cache_key, KIND_CODE, model_name, manim_code)
+                    except Exception as e:
+                        logger.error(f"Failed to cache generated code: {str(e)}")
                 return manim_code
                 
-            except asyncio.TimeoutError:
-                last_exception = asyncio.TimeoutError("API call timed out")
+            except CircuitOpenError:
+                # Gemini keeps failing for every job, so retrying would only add load
+                raise
+            except LLMTimeoutError as e:
+                last_exception = e
+                record_outcome(model_name, False)
                 logger.warning(f"API call timed out (attempt {attempts + 1}/{max_retries})")
             except Exception as e:
                 last_exception = e
+                record_outcome(model_name, False)
                 logger.warning(f"API call failed with error: {str(e)} (attempt {attempts + 1}/{max_retries})")
             
-            # Increment attempt counter and wait before retrying
+            # Increment attempt counter and wait before retrying, if the deadline and the retry budget allow it
             attempts += 1
             if attempts < max_retries:
-                logger.info(f"Waiting {retry_delay} seconds before retry...")
-                await asyncio.sleep(retry_delay)
-                # Increase retry delay for subsequent attempts (exponential backoff)
-                retry_delay *= 1.5
+                delay = backoff_delay(attempts, retry_delay, multiplier=1.5)
+                if not allow_retry(SERVICE_GEMINI, delay):
+                    break
+                logger.info(f"Waiting {delay:.1f} seconds before retry...")
+                await asyncio.sleep(delay)
         
         # If we've exhausted all retries, raise the last exception
-        logger.error(f"All {max_retries} API call attempts failed")
+        logger.error(f"All {attempts} API call attempts failed")
         raise last_exception or ValueError("API call failed after multiple attempts")
         
     except Exception as e:
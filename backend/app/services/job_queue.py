@@ -0,0 +1,1584 @@
+"""
+Durable job queue and worker pool for video generation.
+
+Jobs are persisted in a SQLite database so queued and in-flight work survives
+an API restart. A fixed pool of asyncio workers claims jobs from the queue, and
+per-stage semaphores bound how many Gemini calls, Manim renders, TTS runs and
+FFmpeg merges execute at the same time.
+
+Jobs are claimed in weighted fair queuing order. Every job gets a virtual
+finish tag from its client's previous tag and the weight of its priority
+class, so a client with a large backlog cannot starve other clients and
+interactive requests overtake bulk ones. Clients are also limited in how many
+jobs they may run at once and how many they may submit per minute.
+
+Workers hold a lease on the jobs they run and renew it with heartbeats. Jobs
+whose lease expires, because their worker crashed or lost contact with the
+database, go back to the queue. This lets worker pools in several processes,
+on one or more hosts, share a job database (see app/worker.py).
+"""
+import os
+import json
+import time
+import heapq
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+import traceback
+from queue import Queue
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Set, Tuple, Callable, Awaitable
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Location of the job database
+JOBS_DB_PATH = Path(os.environ.get("EDUTUTOR_JOBS_DB", "./jobs/jobs.db"))
+
+# Number of jobs that may run through the pipeline at once
+JOB_WORKERS = int(os.environ.get("EDUTUTOR_JOB_WORKERS", "4"))
+
+# Scheduling weight of each priority class; a higher weight gets a larger share of the workers
+PRIORITY_WEIGHTS = {
+    "interactive": 8.0,
+    "standard": 2.0,
+    "bulk": 1.0,
+}
+DEFAULT_PRIORITY = "standard"
+
+# Client used for requests that do not identify themselves
+DEFAULT_CLIENT = "anonymous"
+
+# Maximum number of jobs a single client may run at once (0 for no limit)
+CLIENT_MAX_RUNNING = int(os.environ.get("EDUTUTOR_CLIENT_MAX_RUNNING", "2"))
+
+# Maximum number of jobs a single client may submit per minute (0 for no limit)
+CLIENT_RATE_LIMIT = int(os.environ.get("EDUTUTOR_CLIENT_RATE_LIMIT", "30"))
+
+# Maximum number of queued jobs before new requests are rejected (0 for no limit)
+MAX_QUEUE_DEPTH = int(os.environ.get("EDUTUTOR_MAX_QUEUE_DEPTH", "20"))
+
+# Assumed job duration for start time estimates before any job has finished (in seconds)
+DEFAULT_JOB_DURATION = float(os.environ.get("EDUTUTOR_DEFAULT_JOB_DURATION", "180"))
+
+# Number of recently finished jobs used to estimate the job duration
+DURATION_SAMPLE_SIZE = 20
+
+# How long a worker's claim on a job lasts without a heartbeat (in seconds)
+JOB_LEASE_DURATION = float(os.environ.get("EDUTUTOR_JOB_LEASE", "60"))
+
+# How often workers renew the leases of their running jobs (in seconds)
+JOB_HEARTBEAT_INTERVAL = JOB_LEASE_DURATION / 3
+
+# How often idle workers look for new jobs (in seconds)
+JOB_POLL_INTERVAL = float(os.environ.get("EDUTUTOR_JOB_POLL_INTERVAL", "1.0"))
+
+# Environment variables that set the concurrency limit of each pipeline stage
+STAGE_CONCURRENCY_VARS = {
+    "generate": "EDUTUTOR_GENERATE_WORKERS",
+    "render": "EDUTUTOR_RENDER_WORKERS",
+    "tts": "EDUTUTOR_TTS_WORKERS",
+    "merge": "EDUTUTOR_MERGE_WORKERS",
+}
+
+# Maximum number of concurrent operations for each pipeline stage in this
+# process (supervised worker processes get a share of the limits)
+STAGE_CONCURRENCY = {
+    "generate": int(os.environ.get(STAGE_CONCURRENCY_VARS["generate"], "4")),
+    "render": int(os.environ.get(STAGE_CONCURRENCY_VARS["render"], str(max(1, (os.cpu_count() or 2) // 2)))),
+    "tts": int(os.environ.get(STAGE_CONCURRENCY_VARS["tts"], "4")),
+    "merge": int(os.environ.get(STAGE_CONCURRENCY_VARS["merge"], "2")),
+}
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# Job metrics
+JOBS_BY_STATE = metrics.gauge("edututor_jobs", "Number of jobs in the job queue by state", ("state",))
+JOBS_FINISHED = metrics.counter("edututor_jobs_finished_total", "Number of finished jobs by outcome", ("outcome",))
+DEDUPLICATED = metrics.counter("edututor_deduplicated_requests_total", "Requests attached to an existing job", ("reason",))
+REJECTED = metrics.counter("edututor_rejected_requests_total", "Requests rejected by admission control", ("reason",))
+LEASES_EXPIRED = metrics.counter("edututor_job_leases_expired_total", "Running jobs requeued after their worker's lease expired")
+LIVE_WORKERS = metrics.gauge("edututor_job_workers_live", "Number of job worker pools with a recent heartbeat")
+QUEUE_WAIT = metrics.histogram("edututor_job_queue_wait_seconds", "Time jobs spend in the queue before a worker picks them up")
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is at its maximum depth.
+    """
+
+    def __init__(self, depth: int):
+        super().__init__(f"The job queue is full ({depth} jobs waiting)")
+        self.depth = depth
+
+class RateLimitedError(Exception):
+    """
+    Raised when a client submits more jobs per minute than its quota allows.
+    """
+
+    def __init__(self, client_id: str, retry_after: float):
+        super().__init__(f"Client {client_id} exceeded its rate limit")
+        self.client_id = client_id
+        self.retry_after = retry_after
+
+class JobQueue:
+    """
+    SQLite-backed queue of video generation jobs.
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB_PATH):
+        self.db_path = Path(db_path)
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending_events: Queue = Queue()
+        self._event_writer: Optional[threading.Thread] = None
+        self._event_writer_lock = threading.Lock()
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the job database.
+
+        Returns:
+            A SQLite connection in autocommit mode
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self) -> None:
+        """
+        Create the jobs table if it does not exist yet.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        state TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        error TEXT
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)")
+                self._ensure_columns(conn, {
+                    "dedup_key": "TEXT",
+                    "idempotency_key": "TEXT",
+                    "client_id": "TEXT",
+                    "priority": "TEXT",
+                    "vfinish": "REAL",
+                    "worker_id": "TEXT",
+                    "lease_expires_at": "REAL",
+                    "batch_id": "TEXT"
+                })
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup_key ON jobs (dedup_key, state)")
+                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency_key ON jobs (idempotency_key)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs (client_id, state, created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_vfinish ON jobs (state, vfinish)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (state, lease_expires_at)")
+
+                # Fair queuing state: the last finish tag of each client and the
+                # system virtual time (the tag of the most recently claimed job)
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS clients (
+                        client_id TEXT PRIMARY KEY,
+                        last_finish REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS job_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        video_id TEXT NOT NULL,
+                        type TEXT NOT NULL,
+                        data TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_video ON job_events (video_id, id)")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS batch_items (
+                        batch_id TEXT NOT NULL,
+                        position INTEGER NOT NULL,
+                        video_id TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (batch_id, position)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS scheduler (
+                        name TEXT PRIMARY KEY,
+                        value REAL NOT NULL
+                    )
+                    """
+                )
+
+                # Worker pools and their capacity, kept up to date by heartbeats
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS workers (
+                        worker_id TEXT PRIMARY KEY,
+                        concurrency INTEGER NOT NULL,
+                        started_at REAL NOT NULL,
+                        heartbeat_at REAL NOT NULL
+                    )
+                    """
+                )
+            finally:
+                conn.close()
+
+    @staticmethod
+    def _ensure_columns(conn: sqlite3.Connection, columns: Dict[str, str]) -> None:
+        """
+        Add columns that are missing from a jobs table created by an older version.
+
+        Args:
+            conn: Open connection to the job database
+            columns: Column types by column name
+        """
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)").fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+                except sqlite3.OperationalError as e:
+                    # Another process opening the database added it first
+                    if "duplicate column name" not in str(e):
+                        raise
+
+    @staticmethod
+    def _add_event(conn: sqlite3.Connection, video_id: str, event_type: str, data: Dict[str, Any]) -> int:
+        """
+        Append a progress event inside the caller's transaction.
+
+        Args:
+            conn: Open connection to the job database
+            video_id: The ID of the video
+            event_type: The event type
+            data: The event payload
+
+        Returns:
+            The ID of the event
+        """
+        cursor = conn.execute(
+            "INSERT INTO job_events (video_id, type, data, created_at) VALUES (?, ?, ?, ?)",
+            (video_id, event_type, json.dumps(data), time.time())
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _finish_tag(conn: sqlite3.Connection, client_id: Optional[str], priority: Optional[str]) -> float:
+        """
+        Compute the virtual finish tag of a job entering the queue and record
+        it as the client's last finish inside the caller's transaction.
+
+        Weighted fair queuing: the job starts when the client's previous job
+        finishes, or at the current virtual time if the client is idle.
+
+        Args:
+            conn: Connection with an open transaction
+            client_id: Identity of the submitting client
+            priority: Priority class (a key of PRIORITY_WEIGHTS)
+
+        Returns:
+            The finish tag of the job
+        """
+        client_id = client_id or DEFAULT_CLIENT
+        weight = PRIORITY_WEIGHTS.get(priority or DEFAULT_PRIORITY, PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+        virtual_time = conn.execute("SELECT value FROM scheduler WHERE name = 'virtual_time'").fetchone()
+        last_finish = conn.execute("SELECT last_finish FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+        start = max(virtual_time["value"] if virtual_time else 0.0, last_finish["last_finish"] if last_finish else 0.0)
+        vfinish = start + 1.0 / weight
+        conn.execute(
+            "INSERT OR REPLACE INTO clients (client_id, last_finish) VALUES (?, ?)",
+            (client_id, vfinish)
+        )
+        return vfinish
+
+    @staticmethod
+    def _row_to_job(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        """
+        Convert a database row to a job dictionary.
+
+        Args:
+            row: The row to convert
+
+        Returns:
+            Job dictionary, or None if the row is None
+        """
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def enqueue(self, job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add a new job to the queue.
+
+        Args:
+            job_id: The ID of the job (the video ID)
+            params: Keyword arguments for the job handler
+
+        Returns:
+            The stored job
+        """
+        job, _ = self.submit(job_id, params)
+        return job
+
+    def submit(
+        self,
+        job_id: str,
+        params: Dict[str, Any],
+        dedup_key: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        max_depth: int = 0,
+        client_id: str = DEFAULT_CLIENT,
+        priority: str = DEFAULT_PRIORITY,
+        rate_limit: int = 0
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Add a job unless an equivalent one already exists.
+
+        A job submitted earlier with the same idempotency key is returned as is.
+        Otherwise a queued or running job with the same deduplication key is
+        returned, so identical concurrent requests share one pipeline run.
+        New jobs are only accepted while fewer than max_depth jobs of the same
+        priority class are queued, so a bulk backlog does not shed interactive
+        requests, and the client submitted fewer than rate_limit jobs outside
+        batches in the last minute.
+
+        Args:
+            job_id: The ID for a new job
+            params: Keyword arguments for the job handler
+            dedup_key: Fingerprint of the normalized request parameters
+            idempotency_key: Client-supplied key identifying a retried request
+            max_depth: Maximum number of queued jobs, or 0 for no limit
+            client_id: Identity of the submitting client
+            priority: Priority class (a key of PRIORITY_WEIGHTS)
+            rate_limit: Maximum number of jobs the client may submit per minute, or 0 for no limit
+
+        Returns:
+            Tuple of (job, created) where created is False if an existing job was returned
+
+        Raises:
+            ValueError: If the priority class is unknown
+            RateLimitedError: If the client exceeded its rate limit
+            QueueFullError: If the queue already holds max_depth jobs of the priority class
+        """
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+
+                existing = self._find_existing(conn, dedup_key, idempotency_key)
+                if existing is not None:
+                    conn.execute("COMMIT")
+                    logger.info(f"Request attached to existing job {existing['id']}")
+                    return self._row_to_job(existing), False
+
+                now = time.time()
+                if rate_limit > 0:
+                    # Jobs of batches are admitted with their batch and do not count
+                    recent = conn.execute(
+                        """
+                        SELECT created_at FROM jobs
+                        WHERE client_id = ? AND created_at > ? AND batch_id IS NULL
+                        ORDER BY created_at
+                        """,
+                        (client_id, now - 60.0)
+                    ).fetchall()
+                    if len(recent) >= rate_limit:
+                        # The oldest submission in the window has to age out first
+                        raise RateLimitedError(client_id, recent[len(recent) - rate_limit]["created_at"] + 60.0 - now)
+
+                self._check_depth(conn, priority, max_depth)
+                row = self._insert_job(conn, job_id, params, dedup_key, idempotency_key, client_id, priority, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        logger.info(f"Enqueued job {job_id}")
+        return self._row_to_job(row), True
+
+    def submit_batch(
+        self,
+        batch_id: str,
+        items: List[Tuple[str, Optional[Dict[str, Any]], Optional[str]]],
+        max_depth: int = 0,
+        client_id: str = DEFAULT_CLIENT,
+        priority: str = DEFAULT_PRIORITY
+    ) -> List[Tuple[Optional[Dict[str, Any]], bool]]:
+        """
+        Add the jobs of a batch and record the batch in one transaction.
+
+        The batch is admitted as a whole: it is rejected if max_depth jobs of
+        its priority class are queued, and otherwise every item is added.
+        Items are attached to equivalent queued or running jobs like single
+        submissions. Jobs of a batch do not count against the client's rate
+        limit. If any item fails, no job of the batch is added.
+
+        Args:
+            batch_id: The ID of the batch
+            items: Tuples of (video ID, job handler arguments, deduplication key)
+                in request order; arguments of None mark an existing video
+                that is only recorded in the batch
+            max_depth: Maximum number of queued jobs, or 0 for no limit
+            client_id: Identity of the submitting client
+            priority: Priority class (a key of PRIORITY_WEIGHTS)
+
+        Returns:
+            Tuple of (job, created) for each item, with a job of None for existing videos
+
+        Raises:
+            ValueError: If the priority class is unknown
+            QueueFullError: If the queue already holds max_depth jobs of the priority class
+        """
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        results = []
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                self._check_depth(conn, priority, max_depth)
+
+                now = time.time()
+                for position, (video_id, params, dedup_key) in enumerate(items):
+                    if params is None:
+                        results.append((None, False))
+                        status = "completed"
+                    else:
+                        existing = self._find_existing(conn, dedup_key)
+                        if existing is not None:
+                            results.append((self._row_to_job(existing), False))
+                            video_id = existing["id"]
+                        else:
+                            row = self._insert_job(conn, video_id, params, dedup_key, None, client_id, priority, now, batch_id)
+                            results.append((self._row_to_job(row), True))
+                        status = "queued"
+                    conn.execute(
+                        "INSERT INTO batch_items (batch_id, position, video_id, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (batch_id, position, video_id, status, now)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        logger.info(f"Enqueued batch {batch_id} with {sum(1 for _, created in results if created)} new jobs")
+        return results
+
+    @staticmethod
+    def _find_existing(
+        conn: sqlite3.Connection,
+        dedup_key: Optional[str],
+        idempotency_key: Optional[str] = None
+    ) -> Optional[sqlite3.Row]:
+        """
+        Find the job a submission is attached to instead of adding a new one.
+
+        Args:
+            conn: Connection with an open transaction
+            dedup_key: Fingerprint of the normalized request parameters
+            idempotency_key: Client-supplied key identifying a retried request
+
+        Returns:
+            The job submitted with the same idempotency key, else the oldest
+            queued or running job with the same deduplication key, else None
+        """
+        existing = None
+        if idempotency_key:
+            existing = conn.execute(
+                "SELECT * FROM jobs WHERE idempotency_key = ?",
+                (idempotency_key,)
+            ).fetchone()
+        if existing is None and dedup_key:
+            existing = conn.execute(
+                "SELECT * FROM jobs WHERE dedup_key = ? AND state IN (?, ?) ORDER BY created_at LIMIT 1",
+                (dedup_key, JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+        return existing
+
+    @staticmethod
+    def _check_depth(conn: sqlite3.Connection, priority: str, max_depth: int) -> None:
+        """
+        Reject new jobs while the queue of a priority class is full.
+
+        Args:
+            conn: Connection with an open transaction
+            priority: Priority class of the new jobs
+            max_depth: Maximum number of queued jobs, or 0 for no limit
+
+        Raises:
+            QueueFullError: If the queue already holds max_depth jobs of the priority class
+        """
+        if max_depth > 0:
+            depth = conn.execute(
+                "SELECT COUNT(*) AS n FROM jobs WHERE state = ? AND priority = ?",
+                (JOB_QUEUED, priority)
+            ).fetchone()["n"]
+            if depth >= max_depth:
+                raise QueueFullError(depth)
+
+    def _insert_job(
+        self,
+        conn: sqlite3.Connection,
+        job_id: str,
+        params: Dict[str, Any],
+        dedup_key: Optional[str],
+        idempotency_key: Optional[str],
+        client_id: str,
+        priority: str,
+        now: float,
+        batch_id: Optional[str] = None
+    ) -> sqlite3.Row:
+        """
+        Insert a queued job inside the caller's transaction.
+
+        Args:
+            conn: Connection with an open transaction
+            job_id: The ID for the job
+            params: Keyword arguments for the job handler
+            dedup_key: Fingerprint of the normalized request parameters
+            idempotency_key: Client-supplied key identifying a retried request
+            client_id: Identity of the submitting client
+            priority: Priority class (a key of PRIORITY_WEIGHTS)
+            now: Submission time
+            batch_id: The ID of the batch the job belongs to, if any
+
+        Returns:
+            The inserted job row
+        """
+        vfinish = self._finish_tag(conn, client_id, priority)
+        conn.execute(
+            """
+            INSERT INTO jobs (id, state, params, created_at, dedup_key, idempotency_key, client_id, priority, vfinish, batch_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, JOB_QUEUED, json.dumps(params), now, dedup_key, idempotency_key, client_id, priority, vfinish, batch_id)
+        )
+        self._add_event(conn, job_id, "state", {"state": JOB_QUEUED})
+        return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def claim_next(
+        self,
+        client_max_running: int = CLIENT_MAX_RUNNING,
+        worker_id: Optional[str] = None,
+        lease_duration: float = JOB_LEASE_DURATION
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Atomically move the queued job with the smallest virtual finish tag to
+        the running state, skipping clients that already run their maximum
+        number of jobs. Running jobs whose lease has expired are requeued first.
+
+        Args:
+            client_max_running: Maximum number of running jobs per client, or 0 for no limit
+            worker_id: The worker that takes the lease on the job; jobs claimed
+                without a worker ID have no lease
+            lease_duration: Seconds the lease lasts without a heartbeat
+
+        Returns:
+            The claimed job, or None if no job can be claimed
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                self._requeue_expired(conn, now)
+                row = conn.execute(
+                    """
+                    SELECT id, vfinish FROM jobs AS j
+                    WHERE state = ? AND (
+                        ? <= 0 OR (
+                            SELECT COUNT(*) FROM jobs AS r
+                            WHERE r.state = ? AND r.client_id IS j.client_id
+                        ) < ?
+                    )
+                    ORDER BY vfinish, created_at LIMIT 1
+                    """,
+                    (JOB_QUEUED, client_max_running, JOB_RUNNING, client_max_running)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                conn.execute(
+                    """
+                    UPDATE jobs SET state = ?, started_at = ?, attempts = attempts + 1,
+                        worker_id = ?, lease_expires_at = ?
+                    WHERE id = ?
+                    """,
+                    (JOB_RUNNING, now, worker_id, now + lease_duration if worker_id is not None else None, row["id"])
+                )
+                self._add_event(conn, row["id"], "state", {"state": JOB_RUNNING})
+                if row["vfinish"] is not None:
+                    conn.execute(
+                        """
+                        INSERT INTO scheduler (name, value) VALUES ('virtual_time', ?)
+                        ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+                        """,
+                        (row["vfinish"],)
+                    )
+                job_row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        return self._row_to_job(job_row)
+
+    def _finish(self, job_id: str, state: str, error: Optional[str] = None, worker_id: Optional[str] = None) -> None:
+        """
+        Record the final state of a job. A job that was cancelled while it ran
+        stays cancelled, and a worker whose lease was taken over by another
+        worker does not change the job.
+
+        Args:
+            job_id: The ID of the job
+            state: The final state (done or failed)
+            error: Error message for failed jobs
+            worker_id: The worker that ran the job, if it ran under a lease
+        """
+        # Streams end with the final state, so the job's queued events are written before it
+        self.flush_events()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                updated = conn.execute(
+                    """
+                    UPDATE jobs SET state = ?, finished_at = ?, error = ?, lease_expires_at = NULL
+                    WHERE id = ? AND state != ? AND (? IS NULL OR worker_id = ?)
+                    """,
+                    (state, time.time(), error, job_id, JOB_CANCELLED, worker_id, worker_id)
+                ).rowcount
+                if not updated:
+                    conn.execute("COMMIT")
+                    return
+                data = {"state": state}
+                if error:
+                    data["error"] = error
+                self._add_event(conn, job_id, "state", data)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+    def complete(self, job_id: str, worker_id: Optional[str] = None) -> None:
+        """
+        Mark a job as done.
+
+        Args:
+            job_id: The ID of the job
+            worker_id: The worker that ran the job
+        """
+        self._finish(job_id, JOB_DONE, worker_id=worker_id)
+
+    def fail(self, job_id: str, error: str, worker_id: Optional[str] = None) -> None:
+        """
+        Mark a job as failed.
+
+        Args:
+            job_id: The ID of the job
+            error: Description of the failure
+            worker_id: The worker that ran the job
+        """
+        self._finish(job_id, JOB_FAILED, error, worker_id)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Mark a queued or running job as cancelled. Workers never claim a
+        cancelled job; stopping a running one is up to the worker pool.
+
+        Args:
+            job_id: The ID of the job
+
+        Returns:
+            The state of the job before it was cancelled, or None if there is no such job
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is not None and row["state"] in (JOB_QUEUED, JOB_RUNNING):
+                    conn.execute(
+                        "UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE id = ?",
+                        (JOB_CANCELLED, time.time(), "Cancelled", job_id)
+                    )
+                    self._add_event(conn, job_id, "state", {"state": JOB_CANCELLED})
+                    conn.execute("UPDATE jobs SET lease_expires_at = NULL WHERE id = ?", (job_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        if row is None:
+            return None
+        if row["state"] in (JOB_QUEUED, JOB_RUNNING):
+            logger.info(f"Cancelled {row['state']} job {job_id}")
+        return row["state"]
+
+    def requeue(self, job_id: str) -> None:
+        """
+        Put a finished job back in the queue so it runs again.
+
+        The job gets a new finish tag from the current virtual time, so it
+        queues behind the jobs submitted while it was finished.
+
+        Args:
+            job_id: The ID of the job
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT client_id, priority FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return
+                conn.execute(
+                    """
+                    UPDATE jobs SET state = ?, started_at = NULL, finished_at = NULL, error = NULL,
+                        worker_id = NULL, lease_expires_at = NULL, vfinish = ?
+                    WHERE id = ?
+                    """,
+                    (JOB_QUEUED, self._finish_tag(conn, row["client_id"], row["priority"]), job_id)
+                )
+                self._add_event(conn, job_id, "state", {"state": JOB_QUEUED})
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        logger.info(f"Requeued job {job_id}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a job by ID.
+
+        Args:
+            job_id: The ID of the job
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_job(row)
+
+    def count(self, state: str, priority: Optional[str] = None) -> int:
+        """
+        Count the jobs in a given state.
+
+        Args:
+            state: The state to count
+            priority: Only count jobs of this priority class
+
+        Returns:
+            Number of jobs in that state
+        """
+        conn = self._connect()
+        try:
+            if priority is None:
+                row = conn.execute("SELECT COUNT(*) AS n FROM jobs WHERE state = ?", (state,)).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT COUNT(*) AS n FROM jobs WHERE state = ? AND priority = ?",
+                    (state, priority)
+                ).fetchone()
+        finally:
+            conn.close()
+        return row["n"]
+
+    def queue_event(
+        self,
+        video_id: str,
+        event_type: str,
+        data: Dict[str, Any],
+        on_written: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Append a progress event for a video from a background writer thread,
+        so callers on the event loop do not wait for the database. Events are
+        written in the order they are queued.
+
+        Args:
+            video_id: The ID of the video
+            event_type: The event type (stage or progress)
+            data: The event payload
+            on_written: Optional function called after the event is written
+        """
+        with self._event_writer_lock:
+            if self._event_writer is None or not self._event_writer.is_alive():
+                self._event_writer = threading.Thread(target=self._write_events, name="event-writer", daemon=True)
+                self._event_writer.start()
+        self._pending_events.put((video_id, event_type, data, on_written))
+
+    def _write_events(self) -> None:
+        """
+        Write queued events until the process exits.
+        """
+        while True:
+            video_id, event_type, data, on_written = self._pending_events.get()
+            try:
+                self.add_event(video_id, event_type, data)
+                if on_written is not None:
+                    on_written()
+            except Exception as e:
+                logger.warning(f"Failed to write {event_type} event for video {video_id}: {str(e)}")
+            finally:
+                self._pending_events.task_done()
+
+    def flush_events(self) -> None:
+        """
+        Wait until the queued events are written. Blocks, so callers on the
+        event loop run it in a thread.
+        """
+        self._pending_events.join()
+
+    def add_event(self, video_id: str, event_type: str, data: Dict[str, Any]) -> int:
+        """
+        Append a progress event for a video.
+
+        Args:
+            video_id: The ID of the video
+            event_type: The event type (state, stage or progress)
+            data: The event payload
+
+        Returns:
+            The ID of the event
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                return self._add_event(conn, video_id, event_type, data)
+            finally:
+                conn.close()
+
+    def events_after(self, after_id: int, video_id: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Get the events added after a given event.
+
+        Args:
+            after_id: Only return events with a larger ID
+            video_id: Only return events of this video
+            limit: Maximum number of events to return
+
+        Returns:
+            Events in the order they were added
+        """
+        conn = self._connect()
+        try:
+            if video_id is None:
+                rows = conn.execute(
+                    "SELECT * FROM job_events WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM job_events WHERE video_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (video_id, after_id, limit)
+                ).fetchall()
+        finally:
+            conn.close()
+
+        events = []
+        for row in rows:
+            event = dict(row)
+            event["data"] = json.loads(event["data"])
+            events.append(event)
+        return events
+
+    def last_event_id(self) -> int:
+        """
+        Get the ID of the most recent event.
+
+        Returns:
+            The event ID, or 0 if there are no events
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT COALESCE(MAX(id), 0) AS id FROM job_events").fetchone()
+        finally:
+            conn.close()
+        return row["id"]
+
+    def prune_events(self, max_age: float) -> int:
+        """
+        Delete events older than a given age.
+
+        Args:
+            max_age: Maximum age in seconds
+
+        Returns:
+            Number of deleted events
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                removed = conn.execute(
+                    "DELETE FROM job_events WHERE created_at < ?",
+                    (time.time() - max_age,)
+                ).rowcount
+            finally:
+                conn.close()
+        return removed
+
+    def get_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        """
+        Get the videos of a batch with the current state of their jobs.
+
+        Args:
+            batch_id: The ID of the batch
+
+        Returns:
+            Batch items in request order, each with the video ID, the status at
+            submission and the job state (None if the video has no job)
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT b.position, b.video_id, b.status, j.state AS job_state, j.error
+                FROM batch_items AS b LEFT JOIN jobs AS j ON j.id = b.video_id
+                WHERE b.batch_id = ?
+                ORDER BY b.position
+                """,
+                (batch_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def recent_job_duration(self, sample_size: int = DURATION_SAMPLE_SIZE) -> float:
+        """
+        Get the average run time of the most recently completed jobs.
+
+        Args:
+            sample_size: Number of completed jobs to average
+
+        Returns:
+            Average duration in seconds, or DEFAULT_JOB_DURATION if no job has completed
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT AVG(finished_at - started_at) AS duration FROM (
+                    SELECT started_at, finished_at FROM jobs
+                    WHERE state = ? AND started_at IS NOT NULL AND finished_at IS NOT NULL
+                    ORDER BY finished_at DESC LIMIT ?
+                )
+                """,
+                (JOB_DONE, sample_size)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row["duration"] if row["duration"] is not None else DEFAULT_JOB_DURATION
+
+    def estimate_wait(self, ahead: int, workers: Optional[int] = None) -> float:
+        """
+        Estimate how long a job waits before a worker picks it up.
+
+        Running jobs are assumed to take the recent average duration, so the
+        estimate replays the queue over the workers as they become free.
+
+        Args:
+            ahead: Number of queued jobs that will be claimed first
+            workers: Number of jobs that run at once, by default the capacity
+                of the live workers
+
+        Returns:
+            Estimated wait in seconds
+        """
+        if workers is None:
+            workers = self.worker_capacity()[1] or JOB_WORKERS
+        workers = max(1, workers)
+        duration = self.recent_job_duration()
+        now = time.time()
+
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT started_at FROM jobs WHERE state = ?", (JOB_RUNNING,)).fetchall()
+        finally:
+            conn.close()
+
+        # Seconds until each worker becomes free
+        free_at = [max(0.0, duration - (now - (row["started_at"] or now))) for row in rows][:workers]
+        free_at.extend([0.0] * (workers - len(free_at)))
+        heapq.heapify(free_at)
+
+        for _ in range(ahead):
+            heapq.heappush(free_at, heapq.heappop(free_at) + duration)
+        return free_at[0]
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """
+        Get the position of a queued job, starting at 1 for the next job to run.
+
+        Args:
+            job_id: The ID of the job
+
+        Returns:
+            The position, or None if the job is not queued
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT COUNT(*) AS n FROM jobs
+                WHERE state = ? AND (vfinish, created_at) <= (
+                    SELECT vfinish, created_at FROM jobs WHERE id = ? AND state = ?
+                )
+                """,
+                (JOB_QUEUED, job_id, JOB_QUEUED)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row["n"] or None
+
+    def requeue_running(self, worker_id: Optional[str] = None) -> List[str]:
+        """
+        Put running jobs back in the queue, either all of them or those of one
+        worker that is shutting down.
+
+        Args:
+            worker_id: Only requeue the jobs leased by this worker
+
+        Returns:
+            IDs of the requeued jobs
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    "SELECT id FROM jobs WHERE state = ? AND (? IS NULL OR worker_id = ?)",
+                    (JOB_RUNNING, worker_id, worker_id)
+                ).fetchall()
+                self._requeue(conn, [row["id"] for row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        job_ids = [row["id"] for row in rows]
+        if job_ids:
+            logger.info(f"Requeued {len(job_ids)} interrupted jobs: {', '.join(job_ids)}")
+        return job_ids
+
+    def requeue_expired(self) -> List[str]:
+        """
+        Put running jobs whose lease has expired back in the queue.
+
+        Returns:
+            IDs of the requeued jobs
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                job_ids = self._requeue_expired(conn, time.time())
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        return job_ids
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> List[str]:
+        """
+        Requeue the running jobs whose lease has expired, inside the caller's
+        transaction. Jobs started without a lease never expire.
+
+        Args:
+            conn: Connection with an open transaction
+            now: The current time
+
+        Returns:
+            IDs of the requeued jobs
+        """
+        rows = conn.execute(
+            "SELECT id, worker_id FROM jobs WHERE state = ? AND lease_expires_at < ?",
+            (JOB_RUNNING, now)
+        ).fetchall()
+        job_ids = [row["id"] for row in rows]
+        self._requeue(conn, job_ids)
+
+        for row in rows:
+            LEASES_EXPIRED.inc()
+            logger.warning(f"Lease of worker {row['worker_id']} on job {row['id']} expired, requeued the job")
+        return job_ids
+
+    def _requeue(self, conn: sqlite3.Connection, job_ids: List[str]) -> None:
+        """
+        Move running jobs back to the queued state inside the caller's
+        transaction. They get new finish tags from the current virtual time,
+        so a requeued job does not overtake the jobs queued since it started.
+
+        Args:
+            conn: Connection with an open transaction
+            job_ids: IDs of the jobs
+        """
+        for job_id in job_ids:
+            row = conn.execute(
+                "SELECT client_id, priority FROM jobs WHERE id = ? AND state = ?",
+                (job_id, JOB_RUNNING)
+            ).fetchone()
+            if row is None:
+                continue
+            conn.execute(
+                """
+                UPDATE jobs SET state = ?, started_at = NULL, worker_id = NULL, lease_expires_at = NULL, vfinish = ?
+                WHERE id = ? AND state = ?
+                """,
+                (JOB_QUEUED, self._finish_tag(conn, row["client_id"], row["priority"]), job_id, JOB_RUNNING)
+            )
+            self._add_event(conn, job_id, "state", {"state": JOB_QUEUED})
+
+    def heartbeat(
+        self,
+        worker_id: str,
+        job_ids: List[str],
+        concurrency: int,
+        lease_duration: float = JOB_LEASE_DURATION
+    ) -> List[str]:
+        """
+        Record that a worker is alive and renew the leases on its running jobs.
+
+        Args:
+            worker_id: The ID of the worker
+            job_ids: IDs of the jobs the worker is running
+            concurrency: Number of jobs the worker runs at once
+            lease_duration: Seconds the renewed leases last
+
+        Returns:
+            IDs of the jobs the worker no longer holds, because they were
+            cancelled or their lease expired and another worker took them over
+        """
+        now = time.time()
+        lost = []
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    """
+                    INSERT INTO workers (worker_id, concurrency, started_at, heartbeat_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (worker_id) DO UPDATE SET
+                        concurrency = excluded.concurrency, heartbeat_at = excluded.heartbeat_at
+                    """,
+                    (worker_id, concurrency, now, now)
+                )
+                for job_id in job_ids:
+                    renewed = conn.execute(
+                        "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND state = ? AND worker_id = ?",
+                        (now + lease_duration, job_id, JOB_RUNNING, worker_id)
+                    ).rowcount
+                    if not renewed:
+                        lost.append(job_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        return lost
+
+    def remove_worker(self, worker_id: str) -> List[str]:
+        """
+        Unregister a worker that is shutting down and requeue its running jobs.
+
+        Args:
+            worker_id: The ID of the worker
+
+        Returns:
+            IDs of the requeued jobs
+        """
+        job_ids = self.requeue_running(worker_id)
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            finally:
+                conn.close()
+        return job_ids
+
+    def worker_capacity(self, max_age: float = JOB_LEASE_DURATION) -> Tuple[int, int]:
+        """
+        Count the worker pools that sent a heartbeat recently and the jobs
+        they can run at once.
+
+        Args:
+            max_age: Seconds since the last heartbeat for a worker to count as live
+
+        Returns:
+            Tuple of (number of live workers, their total concurrency)
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n, SUM(concurrency) AS capacity FROM workers WHERE heartbeat_at >= ?",
+                (time.time() - max_age,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row["n"], row["capacity"] or 0
+
+def default_worker_id() -> str:
+    """
+    Build an ID for the worker pool of this process that is unique across hosts.
+
+    Returns:
+        The worker ID
+    """
+    return os.environ.get("EDUTUTOR_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+class JobWorkerPool:
+    """
+    Pool of asyncio workers that run queued jobs through a handler.
+
+    The handler is called as ``handler(job_id, **params)``. A return value of
+    False or an exception marks the job as failed; anything else marks it done.
+
+    The pool leases the jobs it claims and renews the leases with a heartbeat.
+    A job the pool loses its lease on, because it was cancelled or requeued
+    after the lease expired, is stopped.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[..., Awaitable[Any]],
+        concurrency: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        worker_id: Optional[str] = None,
+        lease_duration: float = JOB_LEASE_DURATION,
+        heartbeat_interval: Optional[float] = None
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_duration = lease_duration
+        self.heartbeat_interval = heartbeat_interval or lease_duration / 3
+        self._tasks: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    def start(self) -> None:
+        """
+        Start the worker tasks.
+        """
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._worker_loop(f"worker-{i}")))
+        logger.info(f"Started {self.concurrency} job workers as {self.worker_id}")
+
+    async def stop(self) -> None:
+        """
+        Cancel the worker tasks and put the jobs that were running back in the
+        queue, where this or another worker picks them up again.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+        try:
+            await asyncio.to_thread(self.queue.remove_worker, self.worker_id)
+        except Exception as e:
+            logger.error(f"Failed to release the jobs of worker {self.worker_id}: {str(e)}")
+        logger.info("Stopped job workers")
+
+    def notify(self) -> None:
+        """
+        Wake up idle workers after a job has been enqueued.
+        """
+        self._wakeup.set()
+
+    async def cancel(self, job_id: str, timeout: float = 30.0) -> bool:
+        """
+        Stop a job this pool is running and wait for its handler to clean up.
+
+        Args:
+            job_id: The ID of the job
+            timeout: Seconds to wait for the handler to finish
+
+        Returns:
+            True if the job was running in this pool
+        """
+        task = self._running.get(job_id)
+        if task is None:
+            return False
+
+        self._cancelled.add(job_id)
+        task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Job {job_id} did not stop within {timeout} seconds of being cancelled")
+        return True
+
+    async def _heartbeat_loop(self) -> None:
+        """
+        Renew the leases of the running jobs until cancelled, stopping the
+        jobs whose lease was lost.
+        """
+        while True:
+            try:
+                lost = await asyncio.to_thread(
+                    self.queue.heartbeat, self.worker_id, list(self._running), self.concurrency, self.lease_duration
+                )
+                for job_id in lost:
+                    task = self._running.get(job_id)
+                    if task is not None:
+                        logger.warning(f"Worker {self.worker_id} lost its lease on job {job_id}, stopping it")
+                        self._cancelled.add(job_id)
+                        task.cancel()
+            except Exception as e:
+                logger.error(f"Heartbeat of worker {self.worker_id} failed: {str(e)}")
+
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _worker_loop(self, worker_name: str) -> None:
+        """
+        Claim and run jobs until cancelled.
+
+        Args:
+            worker_name: Name used in log messages
+        """
+        while True:
+            try:
+                job = await asyncio.to_thread(
+                    self.queue.claim_next, worker_id=self.worker_id, lease_duration=self.lease_duration
+                )
+            except Exception as e:
+                logger.error(f"{worker_name} failed to claim a job: {str(e)}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            logger.info(f"{worker_name} picked up job {job['id']}")
+            await self._run_job(job)
+
+            # A finished job may lift a client's concurrency limit for idle workers
+            self.notify()
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        """
+        Run a single job and record its outcome.
+
+        Args:
+            job: The claimed job
+        """
+        job_id = job["id"]
+        QUEUE_WAIT.observe(max(0.0, job["started_at"] - job["created_at"]))
+
+        # The handler runs in its own task so a single job can be cancelled
+        task = asyncio.create_task(self.handler(job_id, **job["params"]))
+        self._running[job_id] = task
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if job_id not in self._cancelled:
+                # The pool is stopping
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            JOBS_FINISHED.inc(outcome=JOB_CANCELLED)
+            logger.info(f"Job {job_id} was stopped")
+            return
+        except Exception as e:
+            logger.error(f"Job {job_id} raised an exception: {str(e)}")
+            logger.error(traceback.format_exc())
+            JOBS_FINISHED.inc(outcome=JOB_FAILED)
+            await asyncio.to_thread(self.queue.fail, job_id, str(e), self.worker_id)
+            return
+        finally:
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+
+        if result is False:
+            JOBS_FINISHED.inc(outcome=JOB_FAILED)
+            await asyncio.to_thread(self.queue.fail, job_id, "Video generation failed", self.worker_id)
+        else:
+            JOBS_FINISHED.inc(outcome=JOB_DONE)
+            await asyncio.to_thread(self.queue.complete, job_id, self.worker_id)
+        logger.info(f"Job {job_id} finished")
+
+# Shared queue, worker pool and stage semaphores
+_job_queue = None
+_worker_pool = None
+_stage_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def get_job_queue() -> JobQueue:
+    """
+    Get the shared job queue, creating it on first use.
+
+    Returns:
+        The job queue
+    """
+    global _job_queue
+
+    if _job_queue is None:
+        _job_queue = JobQueue(JOBS_DB_PATH)
+
+    return _job_queue
+
+def _collect_job_metrics() -> None:
+    """
+    Refresh the job state gauges from the job database.
+    """
+    queue = get_job_queue()
+    for state in JOB_STATES:
+        JOBS_BY_STATE.set(queue.count(state), state=state)
+    LIVE_WORKERS.set(queue.worker_capacity()[0])
+
+metrics.register_collector(_collect_job_metrics)
+
+def start_job_workers(
+    handler: Callable[..., Awaitable[Any]],
+    concurrency: int = JOB_WORKERS,
+    worker_id: Optional[str] = None
+) -> JobWorkerPool:
+    """
+    Recover jobs of workers whose lease has expired and start the shared
+    worker pool.
+
+    Args:
+        handler: Coroutine function that runs a job
+        concurrency: Number of jobs to run at once
+        worker_id: ID the pool leases jobs under, by default host name and process ID
+
+    Returns:
+        The started worker pool
+    """
+    global _worker_pool
+
+    queue = get_job_queue()
+    queue.requeue_expired()
+
+    if _worker_pool is None:
+        _worker_pool = JobWorkerPool(queue, handler, concurrency=concurrency, worker_id=worker_id)
+        _worker_pool.start()
+
+    return _worker_pool
+
+async def stop_job_workers() -> None:
+    """
+    Stop the shared worker pool if it is running.
+    """
+    global _worker_pool
+
+    if _worker_pool is not None:
+        await _worker_pool.stop()
+        _worker_pool = None
+
+async def cancel_job(job_id: str) -> Optional[str]:
+    """
+    Cancel a queued or running job, stopping its handler if it runs in the
+    shared worker pool.
+
+    Args:
+        job_id: The ID of the job
+
+    Returns:
+        The state of the job before it was cancelled, or None if there is no such job
+    """
+    previous = await asyncio.to_thread(get_job_queue().cancel, job_id)
+    if previous == JOB_RUNNING and _worker_pool is not None:
+        await _worker_pool.cancel(job_id)
+    return previous
+
+def notify_job_workers() -> None:
+    """
+    Wake up idle workers of the shared pool.
+    """
+    if _worker_pool is not None:
+        _worker_pool.notify()
+
+@asynccontextmanager
+async def stage_slot(stage: str):
+    """
+    Hold one of the limited slots for a pipeline stage.
+
+    Args:
+        stage: The stage name (generate, render, tts or merge)
+    """
+    semaphore = _stage_semaphores.get(stage)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(STAGE_CONCURRENCY.get(stage, 1))
+        _stage_semaphores[stage] = semaphore
+
+    async with semaphore:
+        yield
@@ -0,0 +1,283 @@
+"""
+Persistent cache of Gemini responses.
+
+The code generation prompt is built deterministically from the topic, prompt
+and duration, and the narration script prompt from the generated code, so
+repeated requests send Gemini the same prompts again. Responses are stored in
+SQLite by a hash of the kind of call, the model name and the prompt. Entries
+expire after a TTL and the least recently used entries are evicted when the
+stored responses exceed the size limit. Code that fails to render is removed,
+so the next request asks Gemini again.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Location of the cache database
+LLM_CACHE_DB_PATH = Path(os.environ.get("EDUTUTOR_LLM_CACHE_DB", "./cache/llm.db"))
+
+# Set to false to always call Gemini
+LLM_CACHE_ENABLED = os.environ.get("EDUTUTOR_LLM_CACHE", "true").lower() in ("1", "true", "yes")
+
+# How long a cached response is served (in seconds, default 30 days)
+LLM_CACHE_TTL = float(os.environ.get("EDUTUTOR_LLM_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Total size of the cached responses before the least recently used are evicted (in MB)
+LLM_CACHE_MAX_MB = float(os.environ.get("EDUTUTOR_LLM_CACHE_MAX_MB", "256"))
+
+# Kinds of cached calls
+KIND_CODE = "code"
+KIND_SCRIPT = "script"
+
+# Cache metrics
+LLM_CACHE_LOOKUPS = metrics.counter("edututor_llm_cache_lookups_total", "Gemini response cache lookups by kind and result", ("kind", "result"))
+LLM_CACHE_EVICTIONS = metrics.counter("edututor_llm_cache_evictions_total", "Gemini response cache evictions by reason", ("reason",))
+LLM_CACHE_ENTRIES = metrics.gauge("edututor_llm_cache_entries", "Number of responses in the Gemini response cache")
+LLM_CACHE_BYTES = metrics.gauge("edututor_llm_cache_bytes", "Total size of the responses in the Gemini response cache")
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def llm_cache_key(kind: str, model_name: str, prompt: str) -> str:
+    """
+    Build the cache key for a Gemini call.
+
+    Args:
+        kind: The kind of call (code or script)
+        model_name: The name of the model
+        prompt: The prompt sent to the model
+
+    Returns:
+        The cache key
+    """
+    return _hash(f"{kind}:{model_name}:{_hash(prompt)}")
+
+class LLMCache:
+    """
+    SQLite store that maps Gemini calls to their responses.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = LLM_CACHE_DB_PATH,
+        ttl: float = LLM_CACHE_TTL,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024)
+    ):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the cache database.
+
+        Returns:
+            A SQLite connection in autocommit mode
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self) -> None:
+        """
+        Create the cache table if it does not exist yet.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        response_hash TEXT NOT NULL,
+                        size_bytes INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_hash ON responses (response_hash)")
+            finally:
+                conn.close()
+
+    def get(self, key: str, kind: str = KIND_CODE) -> Optional[str]:
+        """
+        Look up a cached response. Expired entries count as misses and are removed.
+
+        Args:
+            key: The cache key
+            kind: The kind of call, for the metrics
+
+        Returns:
+            The response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row["created_at"] > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    LLM_CACHE_EVICTIONS.inc(reason="expired")
+                    row = None
+                elif row is not None:
+                    conn.execute(
+                        "UPDATE responses SET last_used_at = ?, hits = hits + 1 WHERE key = ?",
+                        (now, key)
+                    )
+            finally:
+                conn.close()
+
+        LLM_CACHE_LOOKUPS.inc(kind=kind, result="hit" if row is not None else "miss")
+        return row["response"] if row is not None else None
+
+    def put(self, key: str, kind: str, model_name: str, response: str) -> None:
+        """
+        Store a response and evict entries over the size limit.
+
+        Args:
+            key: The cache key
+            kind: The kind of call
+            model_name: The name of the model
+            response: The response text
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO responses (key, kind, model, response, response_hash, size_bytes, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, kind, model_name, response, _hash(response), len(response.encode("utf-8")), now, now)
+                )
+            finally:
+                conn.close()
+
+        self.evict()
+
+    def invalidate_response(self, response: str) -> int:
+        """
+        Remove every entry that returned the given response, for example code
+        that failed to render.
+
+        Args:
+            response: The response text
+
+        Returns:
+            Number of removed entries
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                removed = conn.execute("DELETE FROM responses WHERE response_hash = ?", (_hash(response),)).rowcount
+            finally:
+                conn.close()
+
+        if removed:
+            LLM_CACHE_EVICTIONS.inc(removed, reason="invalidated")
+            logger.info(f"Removed {removed} cached responses that failed downstream")
+        return removed
+
+    def evict(self) -> List[str]:
+        """
+        Remove expired entries, then the least recently used entries until the
+        cached responses fit within the size limit.
+
+        Returns:
+            Keys of the evicted entries
+        """
+        evicted = []
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                expired = conn.execute(
+                    "SELECT key FROM responses WHERE created_at < ?",
+                    (time.time() - self.ttl,)
+                ).fetchall()
+                for row in expired:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+                    evicted.append(row["key"])
+                if expired:
+                    LLM_CACHE_EVICTIONS.inc(len(expired), reason="expired")
+
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    rows = conn.execute("SELECT key, size_bytes FROM responses ORDER BY last_used_at").fetchall()
+                    for row in rows:
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM responses WHERE key = ?", (row["key"],))
+                        evicted.append(row["key"])
+                        total -= row["size_bytes"]
+                        LLM_CACHE_EVICTIONS.inc(reason="size")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the size of the cache.
+
+        Returns:
+            Dictionary with the number of entries and their total size in bytes
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()
+        finally:
+            conn.close()
+        return {"entries": row[0], "bytes": row[1]}
+
+_llm_cache: Optional[LLMCache] = None
+
+def get_llm_cache() -> LLMCache:
+    """
+    Get the shared Gemini response cache.
+
+    Returns:
+        The response cache
+    """
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+def _collect_cache_metrics() -> None:
+    """
+    Refresh the cache size gauges.
+    """
+    if _llm_cache is None:
+        return
+    stats = _llm_cache.stats()
+    LLM_CACHE_ENTRIES.set(stats["entries"])
+    LLM_CACHE_BYTES.set(stats["bytes"])
+
+metrics.register_collector(_collect_cache_metrics)
@@ -0,0 +1,333 @@
+"""
+Shared asynchronous Gemini client.
+
+Every Gemini call in the pipeline goes through one client. It keeps one
+configured model per model name, so the SDK's async channel is opened once and
+reused, awaits the SDK's native async API so a timeout really cancels the
+call, and caps the number of calls in flight so a burst of jobs queues for the
+API instead of piling up slow requests. Calls also pass through the Gemini
+upstream of the resilience module, which limits their rate and fails fast while
+Gemini keeps failing, and are recorded to or replayed from the cassette when
+one is enabled.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable, Tuple
+
+import google.generativeai as genai
+
+from app.services import metrics
+from app.services.resilience import Upstream, get_upstream, attempt_timeout, SERVICE_GEMINI
+from app.services.cassette import get_cassette
+from app.services.context_cache import get_context_cache
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Gemini models for code generation; the fast model is used when a request's deadline is tight
+GEMINI_MODEL = os.environ.get("EDUTUTOR_GEMINI_MODEL", "gemini-2.5-flash-preview-05-20")
+GEMINI_FAST_MODEL = os.environ.get("EDUTUTOR_GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+
+# Maximum number of Gemini calls in flight per process
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("EDUTUTOR_GEMINI_CONCURRENCY", "8"))
+
+LLM_CALLS = metrics.counter("edututor_llm_calls_total", "Gemini calls by model and outcome", ("model", "outcome"))
+LLM_LATENCY = metrics.histogram("edututor_llm_call_duration_seconds", "Duration of Gemini calls", ("model",))
+LLM_IN_FLIGHT = metrics.gauge("edututor_llm_calls_in_flight", "Number of Gemini calls in flight")
+LLM_WAITING = metrics.gauge("edututor_llm_calls_waiting", "Number of Gemini calls waiting for a free slot")
+
+class LLMTimeoutError(TimeoutError):
+    """
+    Raised when a Gemini call does not finish within its timeout.
+    """
+
+    def __init__(self, model_name: str, timeout: float):
+        super().__init__(f"Gemini call to {model_name} timed out after {timeout} seconds")
+        self.model_name = model_name
+        self.timeout = timeout
+
+class _CallbackError(Exception):
+    """
+    Carries an exception raised by a stream callback, which is not a failure of Gemini.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
+
+class LLMClient:
+    """
+    Gemini client shared by all requests of a process.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        upstream: Optional[Upstream] = None
+    ):
+        self.api_key = api_key
+        self.max_concurrency = max(1, max_concurrency)
+        self.upstream = upstream or get_upstream(SERVICE_GEMINI)
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._context_models: Dict[str, Tuple[Any, Any]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight = 0
+        self._waiting = 0
+        if api_key:
+            genai.configure(api_key=api_key)
+
+    def _bind_loop(self) -> None:
+        """
+        Bind the semaphore and the models' async channels to the running
+        event loop, replacing those of an earlier loop.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._models = {}
+            self._context_models = {}
+
+    def model(self, model_name: str = GEMINI_MODEL) -> genai.GenerativeModel:
+        """
+        Get the shared model for a model name.
+
+        Args:
+            model_name: The name of the model
+
+        Returns:
+            The Gemini model
+        """
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            self._models[model_name] = model
+        return model
+
+    async def generate(
+        self,
+        prompt: str,
+        model_name: str = GEMINI_MODEL,
+        timeout: float = 120.0,
+        generation_config: Optional[Dict[str, Any]] = None,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        cached_prefix: Optional[str] = None
+    ) -> str:
+        """
+        Generate text with Gemini.
+
+        The timeout covers the call itself, not the time spent waiting for a
+        free slot, and is shortened to end by the current job's deadline.
+        With on_chunk, the response is streamed and on_chunk is called with
+        each piece of text as it arrives; an exception raised by on_chunk
+        stops the stream and is raised to the caller. Timeouts and API errors
+        count as failures of Gemini for the circuit breaker; exceptions raised
+        by on_chunk do not. In replay mode the recorded response is served and
+        no API key is needed.
+
+        With cached_prefix, the prompt is the part that follows the prefix.
+        The prefix is sent as cached context when context caching is
+        available, and in front of the prompt otherwise.
+
+        Args:
+            prompt: The prompt
+            model_name: The name of the model
+            timeout: Seconds the call may take before it is cancelled
+            generation_config: Optional generation settings such as the temperature
+            on_chunk: Optional callback for streamed text
+            cached_prefix: Optional static start of the prompt to send as cached context
+
+        Returns:
+            The generated text
+
+        Raises:
+            LLMTimeoutError: If the call timed out
+            CircuitOpenError: If Gemini failed repeatedly and calls are rejected for now
+            ValueError: If the API key is missing or the response is empty
+        """
+        cassette = get_cassette()
+        replay = cassette is not None and cassette.replaying
+        if not self.api_key and not replay:
+            raise ValueError("GEMINI_API_KEY not set. Please run 'python setup_env.py' to configure.")
+
+        self._bind_loop()
+        model = self.model(model_name)
+        full_prompt = prompt if cached_prefix is None else cached_prefix + prompt
+        if cached_prefix is not None and not replay:
+            context = await self._cached_context_model(model_name, cached_prefix)
+            if context is not None:
+                model = context
+            else:
+                prompt = full_prompt
+        if not replay:
+            await self.upstream.acquire()
+        timeout = attempt_timeout(timeout)
+        request = {"model": model_name, "prompt": full_prompt, "generation_config": generation_config}
+
+        self._waiting += 1
+        LLM_WAITING.set(self._waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+            LLM_WAITING.set(self._waiting)
+
+        self._in_flight += 1
+        LLM_IN_FLIGHT.set(self._in_flight)
+        start = time.perf_counter()
+        outcome = "error"
+        chunks = []
+
+        def handle_chunk(text: str) -> None:
+            chunks.append((time.perf_counter() - start, text))
+            if on_chunk is not None:
+                try:
+                    on_chunk(text)
+                except Exception as e:
+                    raise _CallbackError(e)
+
+        try:
+            if replay:
+                text = await asyncio.wait_for(
+                    cassette.replay(SERVICE_GEMINI, request, on_chunk=handle_chunk if on_chunk else None),
+                    timeout=timeout
+                )
+            elif on_chunk is None:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, generation_config=generation_config),
+                    timeout=timeout
+                )
+                text = response.text
+            else:
+                text = await asyncio.wait_for(
+                    self._stream(model, prompt, generation_config, handle_chunk),
+                    timeout=timeout
+                )
+            if not text:
+                raise ValueError("Empty response from Gemini API")
+            outcome = "ok"
+            if not replay:
+                self.upstream.record_success()
+                if cassette is not None and cassette.recording:
+                    try:
+                        await asyncio.to_thread(
+                            cassette.record, SERVICE_GEMINI, request, text, time.perf_counter() - start, chunks or None
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to record Gemini call: {str(e)}")
+            return text
+        except _CallbackError as e:
+            outcome = "aborted"
+            if not replay:
+                self.upstream.record_success()
+            raise e.error
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            if not replay:
+                self.upstream.record_failure()
+            raise LLMTimeoutError(model_name, timeout)
+        except Exception:
+            if not replay:
+                self.upstream.record_failure()
+            raise
+        finally:
+            self._semaphore.release()
+            self._in_flight -= 1
+            LLM_IN_FLIGHT.set(self._in_flight)
+            LLM_CALLS.inc(model=model_name, outcome=outcome)
+            LLM_LATENCY.observe(time.perf_counter() - start, model=model_name)
+
+    async def _cached_context_model(self, model_name: str, prefix: str) -> Optional[Any]:
+        """
+        Get a model that answers with a prefix as cached context.
+
+        Creating the context is a call to Gemini, so it waits for the rate
+        limit and a free slot like other calls, and its outcome counts for
+        the circuit breaker.
+
+        Args:
+            model_name: The name of the model
+            prefix: The static start of the prompt
+
+        Returns:
+            The model, or None if the prefix is not cached
+
+        Raises:
+            CircuitOpenError: If Gemini failed repeatedly and calls are rejected for now
+        """
+        context_cache = get_context_cache()
+        if context_cache is None:
+            return None
+
+        creating = context_cache.needs_creation(model_name, prefix)
+        if creating:
+            await self.upstream.acquire()
+            await self._semaphore.acquire()
+        outcomes = []
+        try:
+            found = await asyncio.to_thread(context_cache.lookup, model_name, prefix, outcomes.append)
+        finally:
+            if creating:
+                self._semaphore.release()
+                if not outcomes:
+                    # Created by a concurrent call in the meantime
+                    self.upstream.record_ignored()
+                elif outcomes[0]:
+                    self.upstream.record_success()
+                else:
+                    self.upstream.record_failure()
+        if found is None:
+            return None
+        key, handle = found
+        # One model per model and prefix, replaced when the context is refreshed
+        entry = self._context_models.get(key)
+        if entry is None or entry[0] is not handle:
+            entry = (handle, context_cache.backend.model(self.model(model_name), handle))
+            self._context_models[key] = entry
+        return entry[1]
+
+    async def _stream(
+        self,
+        model: genai.GenerativeModel,
+        prompt: str,
+        generation_config: Optional[Dict[str, Any]],
+        on_chunk: Callable[[str], None]
+    ) -> str:
+        """
+        Stream a response, passing each piece of text to on_chunk.
+
+        Returns:
+            The complete text
+        """
+        response = await model.generate_content_async(prompt, generation_config=generation_config, stream=True)
+        parts = []
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text, such as the one carrying only the finish reason
+                continue
+            parts.append(text)
+            on_chunk(text)
+        return "".join(parts)
+
+_llm_client: Optional[LLMClient] = None
+
+def get_llm_client() -> LLMClient:
+    """
+    Get the shared Gemini client, creating it on first use.
+
+    Returns:
+        The client
+    """
+    global _llm_client
+
+    if _llm_client is None:
+        _llm_client = LLMClient(os.environ.get("GEMINI_API_KEY"))
+
+    return _llm_client
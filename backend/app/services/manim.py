@@ -2,6 +2,7 @@
 Manim code generation and execution service.
 """
 import os
+import signal
 import tempfile
 import subprocess
 import asyncio
@@ -10,10 +11,12 @@ import sys
 import traceback
 import re
 import glob
+import uuid
 import shutil
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Callable
 
+from app.services import metrics
 from app.utils.helpers import find_video_files, create_audio_processing_marker, remove_audio_processing_marker
 
 # Set up logging
@@ -24,6 +27,161 @@ logger = logging.getLogger(__name__)
 VIDEOS_DIR = Path("./videos")
 os.makedirs(VIDEOS_DIR, exist_ok=True)
 
+# Tex and text glyph caches shared by all renders, so formulas and labels that
+# appear in many videos are compiled once instead of in every temp media dir
+MANIM_CACHE_DIR = Path(os.environ.get("EDUTUTOR_MANIM_CACHE_DIR", "./cache/manim"))
+
+# Subdirectories of the shared cache, by the Manim setting that points at them
+MANIM_CACHE_SUBDIRS = {"tex_dir": "Tex", "text_dir": "texts"}
+
+# Size limit of the shared Tex and text caches (in megabytes); the files
+# written longest ago are removed first
+MANIM_CACHE_MAX_MB = float(os.environ.get("EDUTUTOR_MANIM_CACHE_MAX_MB", "200"))
+
+# Extra Manim arguments for draft renders
+DRAFT_RENDER_ARGS = ["--frame_rate", "10", "--resolution", "640,360"]
+
+# Keep the partial movie files of each render, so the render of an edited
+# version of the video reuses the animations that did not change
+RENDER_CACHE_ENABLED = os.environ.get("EDUTUTOR_RENDER_CACHE", "true").lower() in ("1", "true", "yes")
+
+# Directory inside a video's directory that holds its partial movie files, per quality
+PARTIAL_MOVIES_DIR = "partial_movie_files"
+
+RENDER_CACHE_ANIMATIONS = metrics.counter(
+    "edututor_render_cache_animations_total", "Animations of renders of edited videos by whether they were reused", ("result",)
+)
+MANIM_CACHE_EVICTIONS = metrics.counter("edututor_manim_cache_evictions_total", "Files removed from the shared Manim caches")
+
+def prepare_render_cache(temp_dir: str) -> Path:
+    """
+    Give a render its own Tex and text cache directories, filled from the
+    shared cache.
+    
+    Manim writes .tex, .dvi and .svg files into these directories while it
+    compiles formulas and labels. With a directory per render, no render reads
+    a file that another one is still writing; the files of a finished render
+    are added to the shared cache by publish_render_cache. The shared files
+    are hard linked, which takes no space and little time because the shared
+    cache is kept under MANIM_CACHE_MAX_MB.
+    
+    Args:
+        temp_dir: The temporary directory of the render
+        
+    Returns:
+        Path to the Manim config file of the render
+    """
+    shared_dir = MANIM_CACHE_DIR.resolve()
+    render_dir = Path(temp_dir).resolve() / "manim_cache"
+    config = "[CLI]\n"
+    for setting, name in MANIM_CACHE_SUBDIRS.items():
+        os.makedirs(render_dir / name, exist_ok=True)
+        config += f"{setting} = {render_dir / name}\n"
+        if not (shared_dir / name).is_dir():
+            continue
+        for path in (shared_dir / name).iterdir():
+            # Files still being published have a temporary name starting with a dot
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            # Hard links save the copy when the temp dir is on the same file system;
+            # Manim only creates cache files, so it never writes to the shared ones through them
+            try:
+                os.link(path, render_dir / name / path.name)
+            except FileNotFoundError:
+                # Evicted by another render in the meantime
+                continue
+            except OSError:
+                try:
+                    shutil.copy2(path, render_dir / name / path.name)
+                except FileNotFoundError:
+                    continue
+    
+    config_path = render_dir / "manim.cfg"
+    config_path.write_text(config)
+    return config_path
+
+def publish_render_cache(temp_dir: str) -> int:
+    """
+    Add the Tex and text files compiled by a successful render to the shared cache.
+    
+    Each file is copied under a temporary name and renamed into place, so
+    other renders see either the complete file or none. The shared cache is
+    then trimmed to MANIM_CACHE_MAX_MB.
+    
+    Args:
+        temp_dir: The temporary directory of the render
+        
+    Returns:
+        The number of files added
+    """
+    shared_dir = MANIM_CACHE_DIR.resolve()
+    render_dir = Path(temp_dir).resolve() / "manim_cache"
+    published = 0
+    for name in MANIM_CACHE_SUBDIRS.values():
+        if not (render_dir / name).is_dir():
+            continue
+        os.makedirs(shared_dir / name, exist_ok=True)
+        for path in (render_dir / name).iterdir():
+            dest = shared_dir / name / path.name
+            if not path.is_file() or dest.exists():
+                continue
+            temp_path = dest.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                shutil.copy2(path, temp_path)
+                os.replace(temp_path, dest)
+                published += 1
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+    if published:
+        evict_render_cache()
+    return published
+
+def evict_render_cache(max_mb: Optional[float] = None) -> int:
+    """
+    Remove the files written longest ago from the shared Tex and text caches
+    until they fit the size limit.
+    
+    Renders that linked a removed file keep their link, and a file that is
+    needed again is compiled and published again.
+    
+    Args:
+        max_mb: The size limit in megabytes (default: MANIM_CACHE_MAX_MB)
+        
+    Returns:
+        The number of files removed
+    """
+    max_bytes = (MANIM_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    shared_dir = MANIM_CACHE_DIR.resolve()
+    files = []
+    for name in MANIM_CACHE_SUBDIRS.values():
+        if not (shared_dir / name).is_dir():
+            continue
+        for path in (shared_dir / name).iterdir():
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    if removed:
+        MANIM_CACHE_EVICTIONS.inc(removed)
+        logger.info(f"Removed {removed} files from the shared Manim caches")
+    return removed
+
 # Common Manim errors to check for
 COMMON_MANIM_ERRORS = [
     (r"TypeError: .*__init__\(\) got an unexpected keyword argument 'display_frame'", 
@@ -157,6 +315,114 @@ def find_and_copy_video(temp_dir: str, output_dir: Path, video_id: str) -> Optio
     
     return None
 
+def estimate_animation_count(manim_code: str) -> int:
+    """
+    Estimate how many partial movie files Manim writes for a scene.
+    
+    Manim renders every play() and wait() call to its own partial movie file,
+    so counting the calls gives the number of steps in the render.
+    
+    Args:
+        manim_code: The Manim Python code
+        
+    Returns:
+        Estimated number of animations (at least 1)
+    """
+    return max(1, len(re.findall(r"\.(?:play|wait)\(", manim_code)))
+
+async def watch_render_progress(
+    media_dir: Path,
+    total: int,
+    progress_callback: Callable[[int], None],
+    interval: float = 1.0
+):
+    """
+    Report render progress from the partial movie files Manim has written.
+    
+    Runs until cancelled. Progress stays below 100 until the render finishes,
+    because loops in the scene can produce more animations than estimated.
+    
+    Args:
+        media_dir: The media directory of the render
+        total: Estimated number of animations
+        progress_callback: Called with the progress percentage when it changes
+        interval: Seconds between checks
+    """
+    last_percent = -1
+    while True:
+        await asyncio.sleep(interval)
+        done = len(glob.glob(str(media_dir / "videos" / "**" / "partial_movie_files" / "**" / "*.mp4"), recursive=True))
+        percent = min(99, int(100 * done / total))
+        if percent != last_percent:
+            last_percent = percent
+            try:
+                progress_callback(percent)
+            except Exception as e:
+                logger.warning(f"Render progress callback failed: {str(e)}")
+
+def save_partial_movies(media_dir: Path, video_id: str) -> int:
+    """
+    Keep the partial movie files of a finished render in the video's directory.
+    
+    Manim names each partial movie file after a hash of the animation and the
+    scene before it, and skips animations whose file already exists, so the
+    files let a later render of similar code reuse the unchanged animations.
+    
+    Args:
+        media_dir: The media directory of the render
+        video_id: The ID of the video
+        
+    Returns:
+        The number of files kept
+    """
+    kept = 0
+    for scene_dir in (media_dir / "videos").glob(f"*/*/{PARTIAL_MOVIES_DIR}/CreateScene"):
+        quality = scene_dir.parent.parent.name
+        dest_dir = VIDEOS_DIR / video_id / PARTIAL_MOVIES_DIR / quality
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.makedirs(dest_dir, exist_ok=True)
+        for path in scene_dir.glob("*.mp4"):
+            shutil.move(str(path), str(dest_dir / path.name))
+            kept += 1
+    return kept
+
+def seed_partial_movies(media_dir: Path, video_id: str, source_video_id: str) -> int:
+    """
+    Put the partial movie files of an earlier video where a render looks for them.
+    
+    Args:
+        media_dir: The media directory of the render
+        video_id: The ID of the video being rendered
+        source_video_id: The ID of the earlier video
+        
+    Returns:
+        The number of files available to the render
+    """
+    seeded = 0
+    for quality_dir in (VIDEOS_DIR / source_video_id / PARTIAL_MOVIES_DIR).glob("*"):
+        dest_dir = media_dir / "videos" / video_id / quality_dir.name / PARTIAL_MOVIES_DIR / "CreateScene"
+        os.makedirs(dest_dir, exist_ok=True)
+        for path in quality_dir.glob("*.mp4"):
+            # Hard links save the copy when the temp dir is on the same file system
+            try:
+                os.link(path, dest_dir / path.name)
+            except OSError:
+                shutil.copy2(path, dest_dir / path.name)
+            seeded += 1
+    return seeded
+
+def count_reused_animations(output_text: str) -> int:
+    """
+    Count the animations Manim took from existing partial movie files.
+    
+    Args:
+        output_text: The output of the Manim process
+        
+    Returns:
+        The number of reused animations
+    """
+    return len(re.findall(r"Using cached\s+data", output_text))
+
 def create_error_files(video_id: str, error_message: str):
     """Create error files in the video directory"""
     output_dir = Path("videos") / video_id
@@ -172,14 +438,74 @@ def create_error_files(video_id: str, error_message: str):
             f.write(f"{error_message}\n\n")
             f.write("[Some characters were replaced due to encoding issues]")
 
-async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> str:
+def terminate_process_group(process: subprocess.Popen, grace_period: float = 5.0) -> None:
+    """
+    Stop a render and every process it started (LaTeX, FFmpeg). The render
+    must have been started in its own session.
+    
+    Args:
+        process: The Manim process
+        grace_period: Seconds to wait after SIGTERM before sending SIGKILL
+    """
+    if process.poll() is not None:
+        return
+    
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+async def wait_for_render(process: subprocess.Popen, timeout: float = 600) -> Tuple[bytes, bytes]:
+    """
+    Wait for a Manim process without blocking the event loop. If the waiting
+    task is cancelled, the render's process group is terminated.
+    
+    Args:
+        process: The Manim process
+        timeout: Seconds to wait before raising subprocess.TimeoutExpired
+        
+    Returns:
+        Tuple of (stdout, stderr)
+    """
+    try:
+        return await asyncio.to_thread(process.communicate, timeout=timeout)
+    except asyncio.CancelledError:
+        logger.info(f"Terminating Manim process {process.pid} of a cancelled job")
+        await asyncio.to_thread(terminate_process_group, process)
+        raise
+
+async def execute_manim_code_without_audio(
+    video_id: str,
+    manim_code: str,
+    progress_callback: Optional[Callable[[int], None]] = None,
+    draft: bool = False,
+    reuse_from: Optional[str] = None
+) -> str:
     """
     Execute Manim code to generate a video without audio processing.
     This is a modified version of execute_manim_code that skips the audio generation step.
     
+    With the render cache enabled, the partial movie files of the render are
+    kept in the video's directory. With reuse_from, the partial movie files of
+    that video are made available, so animations that are the same in both
+    programs are not rendered again.
+    
     Args:
         video_id: Unique identifier for the video
         manim_code: The Manim Python code to execute
+        progress_callback: Optional function called with the render progress percentage
+        draft: Render below the low quality preset, to finish sooner
+        reuse_from: ID of an earlier video whose unchanged animations may be reused
         
     Returns:
         Path to the generated video file
@@ -227,6 +553,13 @@ async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> st
             temp_media_dir = Path(temp_dir) / "media"
             os.makedirs(temp_media_dir, exist_ok=True)
             
+            seeded = 0
+            if RENDER_CACHE_ENABLED and reuse_from:
+                seeded = seed_partial_movies(temp_media_dir, video_id, reuse_from)
+                logger.info(f"Made {seeded} animations of video {reuse_from} available to the render")
+            
+            config_path = await asyncio.to_thread(prepare_render_cache, temp_dir)
+            
             # Execute Manim using the Python module approach instead of the command
             cmd = [
                 python_executable,
@@ -234,9 +567,13 @@ async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> st
                 "-ql",  # Low quality for faster rendering
                 "--output_file", f"{video_id}",
                 "--media_dir", str(temp_media_dir),
+                "--config_file", str(config_path),
                 str(script_path),
                 "CreateScene"  # Assumes the main scene class is named CreateScene
             ]
+            if draft:
+                # Fewer frames and pixels than -ql, for requests with a tight deadline
+                cmd[4:4] = DRAFT_RENDER_ARGS
             
             logger.info(f"Executing Manim command: {' '.join(cmd)}")
             
@@ -244,11 +581,23 @@ async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> st
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                stderr=subprocess.PIPE,
+                start_new_session=True  # Own process group, so a cancel stops LaTeX and FFmpeg too
             )
             
+            progress_task = None
+            if progress_callback is not None:
+                progress_task = asyncio.create_task(
+                    watch_render_progress(temp_media_dir, estimate_animation_count(manim_code), progress_callback)
+                )
+            
             try:
-                stdout, stderr = process.communicate(timeout=600)  # 10-minute timeout
+                # Wait in a thread so the event loop keeps serving other work
+                try:
+                    stdout, stderr = await wait_for_render(process, timeout=600)  # 10-minute timeout
+                finally:
+                    if progress_task is not None:
+                        progress_task.cancel()
                 
                 # Log the output for debugging
                 try:
@@ -281,6 +630,23 @@ async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> st
                     create_error_files(video_id, f"Manim execution failed: {error_message}")
                     raise RuntimeError(f"Manim execution failed: {error_message}")
                 
+                try:
+                    await asyncio.to_thread(publish_render_cache, temp_dir)
+                except Exception as e:
+                    logger.error(f"Failed to add the Tex and text files of video {video_id} to the shared cache: {str(e)}")
+                
+                if reuse_from and seeded:
+                    reused = count_reused_animations(stdout_text + stderr_text)
+                    rendered = max(0, estimate_animation_count(manim_code) - reused)
+                    RENDER_CACHE_ANIMATIONS.inc(reused, result="reused")
+                    RENDER_CACHE_ANIMATIONS.inc(rendered, result="rendered")
+                    logger.info(f"Reused {reused} animations of video {reuse_from}, rendered about {rendered}")
+                if RENDER_CACHE_ENABLED:
+                    try:
+                        save_partial_movies(temp_media_dir, video_id)
+                    except Exception as e:
+                        logger.error(f"Failed to keep the partial movie files of video {video_id}: {str(e)}")
+                
                 # Extract the output path from stdout if possible
                 output_path = None
                 for line in stdout_text.splitlines():
@@ -314,9 +680,9 @@ async def execute_manim_code_without_audio(video_id: str, manim_code: str) -> st
                 create_error_files(video_id, "No video files were found after Manim execution")
                 raise RuntimeError("No video files were found after Manim execution")
                 
-            except asyncio.TimeoutError:
+            except subprocess.TimeoutExpired:
                 # Kill the process if it times out
-                process.kill()
+                terminate_process_group(process)
                 logger.error("Manim execution timed out after 10 minutes")
                 create_error_files(video_id, "Manim execution timed out after 10 minutes")
                 raise TimeoutError("Manim execution timed out after 10 minutes")
@@ -412,6 +778,8 @@ async def execute_manim_code(video_id: str, manim_code: str) -> str:
             temp_media_dir = Path(temp_dir) / "media"
             os.makedirs(temp_media_dir, exist_ok=True)
             
+            config_path = await asyncio.to_thread(prepare_render_cache, temp_dir)
+            
             # Execute Manim using the Python module approach instead of the command
             cmd = [
                 python_executable,
@@ -419,6 +787,7 @@ async def execute_manim_code(video_id: str, manim_code: str) -> str:
                 "-ql",  # Low quality for faster rendering
                 "--output_file", f"{video_id}",
                 "--media_dir", str(temp_media_dir),
+                "--config_file", str(config_path),
                 str(script_path),
                 "CreateScene"  # Assumes the main scene class is named CreateScene
             ]
@@ -429,11 +798,13 @@ async def execute_manim_code(video_id: str, manim_code: str) -> str:
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                stderr=subprocess.PIPE,
+                start_new_session=True  # Own process group, so a cancel stops LaTeX and FFmpeg too
             )
             
             try:
-                stdout, stderr = process.communicate(timeout=600)  # 10-minute timeout
+                # Wait in a thread so the event loop keeps serving other work
+                stdout, stderr = await wait_for_render(process, timeout=600)  # 10-minute timeout
                 
                 # Log the output for debugging
                 try:
@@ -476,6 +847,11 @@ async def execute_manim_code(video_id: str, manim_code: str) -> str:
                             f.write(f"\nReturn code: {process.returncode}")
                     raise RuntimeError(f"Manim execution failed: {error_message}")
                 
+                try:
+                    await asyncio.to_thread(publish_render_cache, temp_dir)
+                except Exception as e:
+                    logger.error(f"Failed to add the Tex and text files of video {video_id} to the shared cache: {str(e)}")
+                
                 # Extract the output path from stdout if possible
                 output_path = None
                 for line in stdout_text.splitlines():
@@ -690,7 +1066,7 @@ async def execute_manim_code(video_id: str, manim_code: str) -> str:
                 raise FileNotFoundError("No video file was generated, but Manim reported success.")
             
             except subprocess.TimeoutExpired:
-                process.kill()
+                terminate_process_group(process)
                 logger.error("Manim execution timed out after 10 minutes")
                 error_path = output_dir / "error.txt"
                 with open(error_path, "w") as f:
@@ -20,6 +20,25 @@ logger = logging.getLogger(__name__)
 TEMP_DIR = Path("./temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+async def communicate_or_kill(process: asyncio.subprocess.Process):
+    """
+    Wait for an FFmpeg process to finish, killing it if the waiting task is cancelled.
+    
+    Args:
+        process: The running process
+        
+    Returns:
+        Tuple of (stdout, stderr)
+    """
+    try:
+        return await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            logger.info(f"Killing FFmpeg process {process.pid} of a cancelled job")
+            process.kill()
+            await process.wait()
+        raise
+
 async def merge_audio_video(
     video_path: Union[str, Path],
     audio_path: Union[str, Path],
@@ -82,7 +101,7 @@ async def merge_audio_video(
             stderr=asyncio.subprocess.PIPE
         )
         
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await communicate_or_kill(process)
         
         if process.returncode != 0:
             logger.error(f"FFmpeg error: {stderr.decode()}")
@@ -195,7 +214,7 @@ async def merge_audio_segments_with_video(
                     stderr=asyncio.subprocess.PIPE
                 )
                 
-                stdout, stderr = await process.communicate()
+                stdout, stderr = await communicate_or_kill(process)
                 
                 if process.returncode != 0:
                     logger.error(f"FFmpeg concat error: {stderr.decode()}")
@@ -228,7 +247,7 @@ async def merge_audio_segments_with_video(
                     stderr=asyncio.subprocess.PIPE
                 )
                 
-                stdout, stderr = await process.communicate()
+                stdout, stderr = await communicate_or_kill(process)
                 
                 if process.returncode != 0:
                     logger.error(f"FFmpeg merge error: {stderr.decode()}")
@@ -0,0 +1,570 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are kept in a module-level registry and
+rendered in the Prometheus text format by the /api/metrics endpoint.
+
+Worker processes write snapshots of their counters and histograms to a shared
+directory, and the API process adds them to its own values when rendering, so
+the pipeline metrics stay complete when jobs run outside the API process.
+"""
+import os
+import re
+import glob
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, sized for pipeline stages that take
+# anywhere from milliseconds (extraction) to minutes (rendering)
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0, 300.0, 600.0, math.inf)
+
+# Directory where worker processes write their metrics snapshots
+METRICS_SNAPSHOT_DIR = Path(os.environ.get("EDUTUTOR_METRICS_DIR", "./metrics"))
+
+_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+_collectors: List[Callable[[], None]] = []
+
+def _format_value(value: float) -> str:
+    """
+    Format a sample value for the text exposition format.
+
+    Args:
+        value: The value to format
+
+    Returns:
+        The formatted value
+    """
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+    """
+    Format a label set for the text exposition format.
+
+    Args:
+        names: The label names
+        values: The label values, in the same order as the names
+        extra: Additional labels (such as the histogram bucket bound)
+
+    Returns:
+        The formatted label set, or an empty string if there are no labels
+    """
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class _Metric:
+    """
+    Base class for metrics with a fixed set of label names.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        """
+        Build the storage key for a label set.
+
+        Args:
+            labels: The label values by name
+
+        Returns:
+            Tuple of label values in label-name order
+        """
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        """
+        Render the metric in the text exposition format.
+
+        Returns:
+            Lines of output
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """
+    Monotonically increasing counter.
+    """
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount: The amount to add
+            **labels: The label values
+        """
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        """
+        Get the current value of the counter.
+
+        Args:
+            **labels: The label values
+
+        Returns:
+            The current value
+        """
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+    def snapshot(self) -> List[List[Any]]:
+        """
+        Get the values of the counter in a form that can be written as JSON.
+
+        Returns:
+            List of [label values, value] pairs, one per label set
+        """
+        with _lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merged(self, snapshots: List[List[List[Any]]]) -> "Counter":
+        """
+        Build a copy of the counter with the values of snapshots added.
+
+        Args:
+            snapshots: Snapshots of the same counter from other processes
+
+        Returns:
+            The combined counter
+        """
+        combined = Counter(self.name, self.help_text, self.label_names)
+        with _lock:
+            combined._values = dict(self._values)
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                key = tuple(key)
+                combined._values[key] = combined._values.get(key, 0.0) + value
+        return combined
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Set the gauge.
+
+        Args:
+            value: The new value
+            **labels: The label values
+        """
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = float(value)
+
+    def get(self, **labels) -> float:
+        """
+        Get the current value of the gauge.
+
+        Args:
+            **labels: The label values
+
+        Returns:
+            The current value
+        """
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observation.
+
+        Args:
+            value: The observed value
+            **labels: The label values
+        """
+        key = self._key(labels)
+        with _lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels) -> int:
+        """
+        Get the number of observations.
+
+        Args:
+            **labels: The label values
+
+        Returns:
+            The number of observations
+        """
+        counts = self._counts.get(self._key(labels))
+        return counts[-1] if counts else 0
+
+    def mean(self, **labels) -> Optional[float]:
+        """
+        Get the average of the observations.
+
+        Args:
+            **labels: The label values
+
+        Returns:
+            The average, or None if nothing was observed
+        """
+        key = self._key(labels)
+        with _lock:
+            counts = self._counts.get(key)
+            if not counts or not counts[-1]:
+                return None
+            return self._sums[key] / counts[-1]
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimate a quantile of the observations by interpolating within the
+        bucket that contains it.
+
+        Args:
+            q: The quantile, between 0 and 1
+            **labels: The label values
+
+        Returns:
+            The estimated quantile, or None if nothing was observed
+        """
+        key = self._key(labels)
+        with _lock:
+            counts = self._counts.get(key)
+            if not counts or not counts[-1]:
+                return None
+            counts = list(counts)
+
+        rank = q * counts[-1]
+        lower_bound, lower_count = 0.0, 0
+        for bound, count in zip(self.buckets, counts):
+            if count >= rank:
+                if math.isinf(bound):
+                    return lower_bound
+                if count == lower_count:
+                    return bound
+                return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+            lower_bound, lower_count = bound, count
+        return lower_bound
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with _lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+    def snapshot(self) -> List[List[Any]]:
+        """
+        Get the observations of the histogram in a form that can be written as JSON.
+
+        Returns:
+            List of [label values, cumulative bucket counts, sum] entries, one per label set
+        """
+        with _lock:
+            return [[list(key), list(counts), self._sums[key]] for key, counts in self._counts.items()]
+
+    def merged(self, snapshots: List[List[List[Any]]]) -> "Histogram":
+        """
+        Build a copy of the histogram with the observations of snapshots added.
+
+        Args:
+            snapshots: Snapshots of the same histogram from other processes
+
+        Returns:
+            The combined histogram
+        """
+        combined = Histogram(self.name, self.help_text, self.label_names, self.buckets)
+        with _lock:
+            combined._counts = {key: list(counts) for key, counts in self._counts.items()}
+            combined._sums = dict(self._sums)
+        for snapshot in snapshots:
+            for key, counts, total in snapshot:
+                key = tuple(key)
+                if len(counts) != len(self.buckets):
+                    continue
+                current = combined._counts.setdefault(key, [0] * len(self.buckets))
+                combined._counts[key] = [a + b for a, b in zip(current, counts)]
+                combined._sums[key] = combined._sums.get(key, 0.0) + total
+        return combined
+
+def _register(metric_class, name: str, help_text: str, label_names: Tuple[str, ...], **kwargs) -> Any:
+    """
+    Get a metric from the registry, creating it if needed.
+
+    Args:
+        metric_class: The metric class
+        name: The metric name
+        help_text: Description of the metric
+        label_names: The label names
+
+    Returns:
+        The registered metric
+    """
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = metric_class(name, help_text, tuple(label_names), **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"Metric {name} is already registered as a {metric.metric_type}")
+    return metric
+
+def counter(name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+    """
+    Get or create a counter.
+    """
+    return _register(Counter, name, help_text, label_names)
+
+def gauge(name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+    """
+    Get or create a gauge.
+    """
+    return _register(Gauge, name, help_text, label_names)
+
+def histogram(
+    name: str,
+    help_text: str,
+    label_names: Tuple[str, ...] = (),
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+) -> Histogram:
+    """
+    Get or create a histogram.
+    """
+    return _register(Histogram, name, help_text, label_names, buckets=buckets)
+
+def register_collector(collector: Callable[[], None]) -> None:
+    """
+    Register a function that refreshes gauges right before metrics are rendered.
+
+    Args:
+        collector: Function without arguments
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+def write_snapshot(name: str, directory: Path = METRICS_SNAPSHOT_DIR) -> None:
+    """
+    Write the counters and histograms of this process to the snapshot
+    directory. Gauges describe the state of a single process and are left out.
+
+    Args:
+        name: Name of the snapshot, unique to the process
+        directory: The snapshot directory
+    """
+    with _lock:
+        metrics = list(_registry.values())
+    data = {metric.name: metric.snapshot() for metric in metrics if isinstance(metric, (Counter, Histogram))}
+
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so readers never see a partial snapshot
+    temp_path = directory / f".{name}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, directory / f"{name}.json")
+
+def snapshot_name(worker_id: str) -> str:
+    """
+    Build the snapshot name of a worker process.
+
+    Args:
+        worker_id: The ID of the worker
+
+    Returns:
+        The worker ID with characters that are not safe in file names replaced
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", worker_id)
+
+def remove_snapshots(prefix: str, directory: Path = METRICS_SNAPSHOT_DIR) -> int:
+    """
+    Remove the snapshots whose names start with a prefix, such as those of
+    the worker processes of an earlier run of a supervisor.
+
+    Args:
+        prefix: Start of the snapshot names
+        directory: The snapshot directory
+
+    Returns:
+        The number of snapshots removed
+    """
+    removed = 0
+    if not directory.is_dir():
+        return removed
+    for path in directory.glob(f"{glob.escape(prefix)}*.json"):
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def _read_snapshots(directory: Path) -> Dict[str, List[Any]]:
+    """
+    Read the snapshots written by other processes.
+
+    Args:
+        directory: The snapshot directory
+
+    Returns:
+        Snapshots of each metric by metric name
+    """
+    snapshots: Dict[str, List[Any]] = {}
+    if not directory.is_dir():
+        return snapshots
+
+    for path in directory.glob("*.json"):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics snapshot {path}: {str(e)}")
+            continue
+        for name, snapshot in data.items():
+            snapshots.setdefault(name, []).append(snapshot)
+    return snapshots
+
+def render_metrics(snapshot_dir: Optional[Path] = METRICS_SNAPSHOT_DIR) -> str:
+    """
+    Render all registered metrics in the Prometheus text format, including
+    the snapshots of worker processes.
+
+    Args:
+        snapshot_dir: Directory with the snapshots of worker processes, or None for this process only
+
+    Returns:
+        The metrics text
+    """
+    for collector in list(_collectors):
+        try:
+            collector()
+        except Exception as e:
+            logger.error(f"Metrics collector failed: {str(e)}")
+
+    with _lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+
+    snapshots = _read_snapshots(snapshot_dir) if snapshot_dir is not None else {}
+
+    lines = []
+    for metric in metrics:
+        if metric.name in snapshots and isinstance(metric, (Counter, Histogram)):
+            metric = metric.merged(snapshots[metric.name])
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Pipeline metrics shared by the services
+STAGE_LATENCY = histogram(
+    "edututor_stage_duration_seconds",
+    "Time spent in each stage of the video generation pipeline",
+    ("stage",)
+)
+STAGE_FAILURES = counter(
+    "edututor_stage_failures_total",
+    "Number of failed pipeline stage runs",
+    ("stage",)
+)
+RETRIES = counter(
+    "edututor_retries_total",
+    "Number of retried calls to external services",
+    ("service",)
+)
+
+@contextmanager
+def time_stage(stage: str, timings: Optional[Dict[str, float]] = None):
+    """
+    Time a pipeline stage and record its latency and failures.
+
+    Args:
+        stage: The stage name
+        timings: Optional dictionary that receives the elapsed seconds under the stage name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = round(elapsed, 3)
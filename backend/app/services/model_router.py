@@ -0,0 +1,201 @@
+"""
+Choice of the Gemini model and output budget for code generation.
+
+Short clips and content that needs little structure are generated with the
+fast model, step-by-step problems, derivations and explorations with the
+stronger one. The choice is revised with what the process has observed: a model
+whose recent code generation attempts mostly fail is avoided while the other
+does better, and the fast model is not used while it is no faster than the
+strong one. The output token limit grows with the requested duration, so short
+clips do not wait for long generations.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Tuple
+
+from app.services import metrics
+from app.services.llm_client import LLM_LATENCY, GEMINI_MODEL, GEMINI_FAST_MODEL
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to false to always generate code with EDUTUTOR_GEMINI_MODEL
+ROUTING_ENABLED = os.environ.get("EDUTUTOR_MODEL_ROUTING", "true").lower() in ("1", "true", "yes")
+
+# Videos up to this duration are generated with the fast model (in minutes)
+FAST_MAX_MINUTES = float(os.environ.get("EDUTUTOR_ROUTING_FAST_MAX_MINUTES", "1.0"))
+
+# Output tokens allowed per minute of video, on top of the base
+TOKENS_PER_MINUTE = int(os.environ.get("EDUTUTOR_GEMINI_TOKENS_PER_MINUTE", "4096"))
+
+# Output tokens allowed for any video, and the most allowed for one
+BASE_OUTPUT_TOKENS = 4096
+MAX_OUTPUT_TOKENS = 16384
+
+# Growth of the output limit after a failed attempt, in case the code was cut off
+RETRY_TOKEN_GROWTH = 1.5
+
+# Content types generated with the fast model when the video is longer than FAST_MAX_MINUTES
+FAST_CONTENT_TYPES = {"conceptual_explanation", "visual_demonstration", "comparison_analysis"}
+
+# Recent attempts per model used for the success rate
+OUTCOME_WINDOW = 50
+
+# Observations needed before a model's success rate or latency changes the choice
+MIN_SAMPLES = 10
+
+# Success rate below which a model is avoided if the other one does better
+MIN_SUCCESS_RATE = 0.7
+
+# Reasons for a choice
+REASON_SHORT = "short_video"
+REASON_CONTENT = "content_type"
+REASON_SUCCESS_RATE = "success_rate"
+REASON_LATENCY = "latency"
+
+ROUTING_DECISIONS = metrics.counter("edututor_model_routing_decisions_total", "Models chosen for code generation by reason", ("model", "reason"))
+ROUTING_SUCCESS_RATE = metrics.gauge("edututor_model_routing_success_rate", "Recent share of successful code generation attempts by model", ("model",))
+OUTPUT_TOKEN_LIMIT = metrics.histogram(
+    "edututor_gemini_max_output_tokens", "Output token limits of code generation calls",
+    buckets=(2048, 4096, 6144, 8192, 12288, 16384)
+)
+
+class ModelStats:
+    """
+    Recent code generation outcomes per model.
+    """
+
+    def __init__(self, window: int = OUTCOME_WINDOW):
+        self._outcomes: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, ok: bool) -> None:
+        """
+        Record whether a code generation attempt produced code.
+
+        Args:
+            model_name: The model that was used
+            ok: True if the attempt succeeded
+        """
+        with self._lock:
+            outcomes = self._outcomes.setdefault(model_name, deque(maxlen=self._window))
+            outcomes.append(ok)
+            rate = sum(outcomes) / len(outcomes)
+        ROUTING_SUCCESS_RATE.set(rate, model=model_name)
+
+    def success_rate(self, model_name: str) -> Optional[float]:
+        """
+        Get the recent success rate of a model.
+
+        Returns:
+            The share of successful attempts, or None with fewer than MIN_SAMPLES attempts
+        """
+        with self._lock:
+            outcomes = self._outcomes.get(model_name)
+            if not outcomes or len(outcomes) < MIN_SAMPLES:
+                return None
+            return sum(outcomes) / len(outcomes)
+
+_stats = ModelStats()
+
+def record_outcome(model_name: str, ok: bool) -> None:
+    """
+    Record whether a code generation attempt produced code.
+
+    Args:
+        model_name: The model that was used
+        ok: True if the attempt succeeded
+    """
+    _stats.record(model_name, ok)
+
+def _mean_latency(model_name: str) -> Optional[float]:
+    if LLM_LATENCY.count(model=model_name) < MIN_SAMPLES:
+        return None
+    return LLM_LATENCY.mean(model=model_name)
+
+def choose_model(content_type: str, duration_minutes: float) -> Tuple[str, str]:
+    """
+    Choose the model for a code generation request.
+
+    Args:
+        content_type: The content type of the prompt
+        duration_minutes: The requested duration
+
+    Returns:
+        The model name and the reason for the choice
+    """
+    if GEMINI_FAST_MODEL == GEMINI_MODEL:
+        return GEMINI_MODEL, REASON_CONTENT
+
+    if duration_minutes <= FAST_MAX_MINUTES:
+        model_name, reason = GEMINI_FAST_MODEL, REASON_SHORT
+    elif content_type in FAST_CONTENT_TYPES:
+        model_name, reason = GEMINI_FAST_MODEL, REASON_CONTENT
+    else:
+        model_name, reason = GEMINI_MODEL, REASON_CONTENT
+    other = GEMINI_MODEL if model_name == GEMINI_FAST_MODEL else GEMINI_FAST_MODEL
+
+    # Avoid a model that keeps failing while the other one does better
+    rate, other_rate = _stats.success_rate(model_name), _stats.success_rate(other)
+    if rate is not None and rate < MIN_SUCCESS_RATE and (other_rate is None or other_rate > rate):
+        return other, REASON_SUCCESS_RATE
+
+    # The fast model is only worth it while it is faster
+    if model_name == GEMINI_FAST_MODEL:
+        fast_latency, strong_latency = _mean_latency(GEMINI_FAST_MODEL), _mean_latency(GEMINI_MODEL)
+        if fast_latency is not None and strong_latency is not None and fast_latency >= strong_latency:
+            return GEMINI_MODEL, REASON_LATENCY
+
+    return model_name, reason
+
+def route(content_type: str, duration_minutes: float) -> str:
+    """
+    Choose the model for a code generation request and count the decision.
+
+    Args:
+        content_type: The content type of the prompt
+        duration_minutes: The requested duration
+
+    Returns:
+        The model name
+    """
+    if not ROUTING_ENABLED:
+        return GEMINI_MODEL
+    model_name, reason = choose_model(content_type, duration_minutes)
+    ROUTING_DECISIONS.inc(model=model_name, reason=reason)
+    logger.info(f"Generating {content_type} code for {duration_minutes} minutes with {model_name} ({reason})")
+    return model_name
+
+def output_token_limit(duration_minutes: float, attempt: int = 0) -> int:
+    """
+    Get the output token limit for code generation.
+
+    Args:
+        duration_minutes: The requested duration
+        attempt: The number of failed attempts so far
+
+    Returns:
+        The maximum number of output tokens
+    """
+    limit = (BASE_OUTPUT_TOKENS + TOKENS_PER_MINUTE * duration_minutes) * RETRY_TOKEN_GROWTH ** attempt
+    return int(min(MAX_OUTPUT_TOKENS, limit))
+
+def generation_config(duration_minutes: float, attempt: int = 0) -> Dict[str, Any]:
+    """
+    Build the generation settings for a code generation call.
+
+    Args:
+        duration_minutes: The requested duration
+        attempt: The number of failed attempts so far
+
+    Returns:
+        The generation settings
+    """
+    limit = output_token_limit(duration_minutes, attempt)
+    OUTPUT_TOKEN_LIMIT.observe(limit)
+    return {"max_output_tokens": limit}
@@ -0,0 +1,436 @@
+"""
+Shared protection for calls to external services.
+
+Every call to Gemini or Eleven Labs passes through the upstream of its
+service, which limits the request rate with a token bucket and fails fast with
+a circuit breaker while the service keeps failing. Retries of all services draw
+from one retry budget, so an outage cannot multiply the load on a struggling
+service, and are spaced by jittered exponential backoff. A job's deadline is
+propagated to the calls it makes, so no retry is started that could not finish
+in time.
+
+The state is kept per process.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Callable, Awaitable, TypeVar
+
+from app.services import metrics
+from app.services.metrics import RETRIES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Services
+SERVICE_GEMINI = "gemini"
+SERVICE_ELEVENLABS = "elevenlabs"
+
+# Requests per second and burst size allowed for each service
+GEMINI_RATE = float(os.environ.get("EDUTUTOR_GEMINI_RATE", "5"))
+GEMINI_BURST = int(os.environ.get("EDUTUTOR_GEMINI_BURST", "10"))
+ELEVENLABS_RATE = float(os.environ.get("EDUTUTOR_ELEVENLABS_RATE", "5"))
+ELEVENLABS_BURST = int(os.environ.get("EDUTUTOR_ELEVENLABS_BURST", "10"))
+
+# Consecutive failures that open a service's circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("EDUTUTOR_CIRCUIT_FAILURES", "5"))
+
+# Seconds an open circuit rejects calls before a probe call is let through
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("EDUTUTOR_CIRCUIT_RESET_SECONDS", "30"))
+
+# Retries allowed as a fraction of the requests made in the window, on top of the minimum
+RETRY_BUDGET_RATIO = float(os.environ.get("EDUTUTOR_RETRY_BUDGET_RATIO", "0.2"))
+
+# Retries allowed in the window however few requests were made
+RETRY_BUDGET_MIN = int(os.environ.get("EDUTUTOR_RETRY_BUDGET_MIN", "10"))
+
+# Length of the retry budget window (in seconds)
+RETRY_BUDGET_WINDOW = 60.0
+
+# Longest wait between two attempts (in seconds)
+MAX_BACKOFF = 30.0
+
+# Shortest time an attempt needs before the deadline to be worth starting (in seconds)
+MIN_ATTEMPT_SECONDS = 10.0
+
+# Circuit states
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = metrics.gauge("edututor_circuit_state", "Circuit state by service (0 closed, 1 half open, 2 open)", ("service",))
+CIRCUIT_REJECTIONS = metrics.counter("edututor_circuit_rejections_total", "Calls rejected by an open circuit", ("service",))
+CIRCUIT_TRANSITIONS = metrics.counter("edututor_circuit_transitions_total", "Circuit state changes", ("service", "state"))
+RATE_LIMIT_WAIT = metrics.histogram("edututor_rate_limit_wait_seconds", "Time calls waited for the rate limiter", ("service",))
+RETRIES_DENIED = metrics.counter("edututor_retries_denied_total", "Retries that were not made", ("service", "reason"))
+
+T = TypeVar("T")
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when a call is rejected because its service's circuit is open.
+    """
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} is unavailable after repeated failures, retry in {retry_after:.0f} seconds")
+        self.service = service
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Limits the rate of calls. A rate of zero or less disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until the next token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    async def acquire(self) -> float:
+        """
+        Wait for a token.
+
+        Returns:
+            The seconds waited
+        """
+        if self.rate <= 0:
+            return 0.0
+        start = time.monotonic()
+        while True:
+            wait = self._take()
+            if wait == 0.0:
+                return time.monotonic() - start
+            await asyncio.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Rejects calls to a service after consecutive failures. Once the reset
+    timeout has passed, one probe call is let through; its success closes the
+    circuit and its failure opens it again.
+    """
+
+    def __init__(self, service: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.service = service
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[CLOSED], service=service)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state], service=self.service)
+            CIRCUIT_TRANSITIONS.inc(service=self.service, state=state)
+            logger.warning(f"Circuit for {self.service} is now {state}")
+
+    def before_call(self) -> None:
+        """
+        Check whether a call may be made.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half open with a probe in flight
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    CIRCUIT_REJECTIONS.inc(service=self.service)
+                    raise CircuitOpenError(self.service, self.reset_timeout - (now - self._opened_at))
+                self._set_state(HALF_OPEN)
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # A probe that never reported back, for example because it was cancelled, is replaced
+                if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                    CIRCUIT_REJECTIONS.inc(service=self.service)
+                    raise CircuitOpenError(self.service, self.reset_timeout - (now - self._probe_started))
+                self._probe_started = now
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_started = None
+            self._set_state(CLOSED)
+
+    def record_ignored(self) -> None:
+        """
+        Record a call whose outcome says nothing about the health of the
+        service, such as rejected credentials. The state is left as it is; a
+        half-open circuit lets the next call probe.
+        """
+        with self._lock:
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                self._set_state(OPEN)
+
+class RetryBudget:
+    """
+    Allows retries up to a fraction of the recent requests, shared by all services.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, minimum: int = RETRY_BUDGET_MIN, window: float = RETRY_BUDGET_WINDOW):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        for times in (self._requests, self._retries):
+            while times and now - times[0] > self.window:
+                times.popleft()
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """
+        Take a retry from the budget.
+
+        Returns:
+            True if the retry may be made
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= self.minimum + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+RETRY_BUDGET = RetryBudget()
+
+class Upstream:
+    """
+    Rate limiter and circuit breaker of one external service.
+    """
+
+    def __init__(self, service: str, rate: float, burst: int):
+        self.service = service
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(service)
+
+    async def acquire(self) -> None:
+        """
+        Wait until a call may be made.
+
+        Raises:
+            CircuitOpenError: If the service's circuit is open
+        """
+        self.breaker.before_call()
+        waited = await self.bucket.acquire()
+        RATE_LIMIT_WAIT.observe(waited, service=self.service)
+        RETRY_BUDGET.record_request()
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self.breaker.record_failure()
+
+    def record_ignored(self) -> None:
+        self.breaker.record_ignored()
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+def get_upstream(service: str) -> Upstream:
+    """
+    Get the shared upstream of a service.
+
+    Args:
+        service: The service name
+
+    Returns:
+        The upstream
+    """
+    with _upstreams_lock:
+        upstream = _upstreams.get(service)
+        if upstream is None:
+            rate, burst = {
+                SERVICE_GEMINI: (GEMINI_RATE, GEMINI_BURST),
+                SERVICE_ELEVENLABS: (ELEVENLABS_RATE, ELEVENLABS_BURST),
+            }.get(service, (0.0, 1))
+            upstream = Upstream(service, rate, burst)
+            _upstreams[service] = upstream
+        return upstream
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("edututor_deadline", default=None)
+
+def set_deadline(deadline_at: Optional[float]) -> None:
+    """
+    Propagate a job's deadline to the external calls made by the current task
+    and the tasks and threads it starts. Each job runs in its own task, so the
+    deadline does not leak into other jobs.
+
+    Args:
+        deadline_at: Time by which the job should be done (seconds since the epoch), or None
+    """
+    _deadline.set(deadline_at)
+
+@contextmanager
+def deadline_scope(deadline_at: Optional[float]):
+    """
+    Propagate a job's deadline to the external calls made inside the block,
+    including those made by tasks and threads started in it.
+
+    Args:
+        deadline_at: Time by which the job should be done (seconds since the epoch), or None
+    """
+    token = _deadline.set(deadline_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_time() -> float:
+    """
+    Get the seconds left until the current job's deadline.
+
+    Returns:
+        The remaining seconds, or infinity without a deadline
+    """
+    deadline_at = _deadline.get()
+    return float("inf") if deadline_at is None else deadline_at - time.time()
+
+def attempt_timeout(timeout: float) -> float:
+    """
+    Shorten a call timeout so the call ends by the current job's deadline,
+    but never below MIN_ATTEMPT_SECONDS.
+
+    Args:
+        timeout: The normal timeout in seconds
+
+    Returns:
+        The timeout to use
+    """
+    return min(timeout, max(MIN_ATTEMPT_SECONDS, remaining_time()))
+
+def backoff_delay(attempt: int, base_delay: float, multiplier: float = 2.0) -> float:
+    """
+    Get the wait before a retry, with jitter so retries of many jobs spread out.
+
+    Args:
+        attempt: The number of attempts made so far (1 after the first failure)
+        base_delay: The wait after the first failure in seconds
+        multiplier: Growth of the wait per attempt
+
+    Returns:
+        A wait between half and all of the exponential backoff, in seconds
+    """
+    delay = min(MAX_BACKOFF, base_delay * multiplier ** max(0, attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+def allow_retry(service: str, delay: float) -> bool:
+    """
+    Decide whether a failed call may be retried after a wait.
+
+    A retry is denied when it could not start before the deadline with enough
+    time to finish, or when the shared retry budget is used up.
+
+    Args:
+        service: The service name used in metrics
+        delay: The wait before the retry in seconds
+
+    Returns:
+        True if the retry may be made; it is then counted against the budget
+    """
+    if remaining_time() - delay < MIN_ATTEMPT_SECONDS:
+        RETRIES_DENIED.inc(service=service, reason="deadline")
+        logger.warning(f"Not retrying {service}: the deadline would pass")
+        return False
+    if not RETRY_BUDGET.try_spend():
+        RETRIES_DENIED.inc(service=service, reason="budget")
+        logger.warning(f"Not retrying {service}: the retry budget is used up")
+        return False
+    RETRIES.inc(service=service)
+    return True
+
+async def call_with_retries(
+    service: str,
+    call: Callable[[], Awaitable[T]],
+    max_attempts: int = 3,
+    base_delay: float = 1.0,
+    is_retryable: Callable[[Exception], bool] = lambda e: True
+) -> T:
+    """
+    Make a call through a service's upstream, retrying failures.
+
+    Every attempt waits for the rate limiter and is recorded by the circuit
+    breaker. Failures that are not retryable, such as rejected credentials,
+    are raised right away and leave the circuit as it is: they neither count
+    against it nor close it.
+
+    Args:
+        service: The service name
+        call: Makes one attempt
+        max_attempts: Maximum number of attempts
+        base_delay: The wait after the first failure in seconds
+        is_retryable: Whether an exception is a transient failure of the service
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        CircuitOpenError: If the service's circuit is open
+        Exception: The exception of the last attempt
+    """
+    upstream = get_upstream(service)
+    attempt = 0
+    while True:
+        await upstream.acquire()
+        attempt += 1
+        try:
+            result = await call()
+        except Exception as e:
+            if not is_retryable(e):
+                upstream.record_ignored()
+                raise
+            upstream.record_failure()
+            delay = backoff_delay(attempt, base_delay)
+            if attempt >= max_attempts or not allow_retry(service, delay):
+                raise
+            logger.info(f"Retrying {service} in {delay:.1f} seconds after: {str(e)}")
+            await asyncio.sleep(delay)
+            continue
+        upstream.record_success()
+        return result
@@ -0,0 +1,416 @@
+"""
+Local retrieval of Manim programs that rendered successfully.
+
+Every program that rendered is recorded with the prompt and topic it was
+generated for. A request that is the same as an earlier one with the same
+duration, after normalizing case and spacing but keeping the math, operators
+and word order, reuses its program outright. Otherwise new requests are
+compared with the recorded prompts by TF-IDF cosine similarity, computed
+locally without any API, and the nearest programs are added to the code
+generation prompt as examples. Similarity alone never reuses a program, since
+"x^2 + 5x + 6" and "x^2 - 5x - 6" have the same words. Programs that later
+fail to render are removed.
+"""
+import os
+import re
+import math
+import time
+import json
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from collections import Counter
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Location of the example index
+EXAMPLES_DB_PATH = Path(os.environ.get("EDUTUTOR_EXAMPLES_DB", "./cache/examples.db"))
+
+# Set to false to neither reuse programs nor add examples to prompts
+RETRIEVAL_ENABLED = os.environ.get("EDUTUTOR_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+
+# Similarity from which an earlier program is added to the prompt as an example
+EXAMPLE_THRESHOLD = float(os.environ.get("EDUTUTOR_RETRIEVAL_EXAMPLE_THRESHOLD", "0.3"))
+
+# Number of examples added to the prompt
+MAX_EXAMPLES = int(os.environ.get("EDUTUTOR_RETRIEVAL_EXAMPLES", "2"))
+
+# Longest example program added to the prompt (in characters)
+MAX_EXAMPLE_CHARS = 6000
+
+# Largest duration difference for which a program is reused (in minutes)
+REUSE_DURATION_TOLERANCE = 0.25
+
+RETRIEVALS = metrics.counter("edututor_retrieval_lookups_total", "Example lookups by outcome", ("outcome",))
+EXAMPLES = metrics.gauge("edututor_retrieval_examples", "Number of programs in the example index")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SYMBOL_SPACING = re.compile(r"\s*([^\w\s])\s*")
+WHITESPACE = re.compile(r"\s+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase words.
+
+    Args:
+        text: The text
+
+    Returns:
+        The words
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _document(prompt: str, topic: Optional[str]) -> str:
+    return f"{topic or ''} {prompt}"
+
+def normalize_request(text: str) -> str:
+    """
+    Normalize a request for exact matching.
+
+    Case, spacing and closing punctuation are normalized; the math, operators
+    and word order are kept.
+
+    Args:
+        text: The text of the request
+
+    Returns:
+        The normalized text
+    """
+    text = SYMBOL_SPACING.sub(r"\1", text.lower())
+    return WHITESPACE.sub(" ", text).strip().rstrip(".!?")
+
+def request_key(prompt: str, topic: Optional[str]) -> str:
+    """
+    Get the key under which a request is matched exactly.
+
+    Args:
+        prompt: The prompt of the request
+        topic: The topic of the request
+
+    Returns:
+        A hash of the normalized topic and prompt
+    """
+    normalized = f"{normalize_request(topic or '')}\n{normalize_request(prompt)}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
+
+class ExampleIndex:
+    """
+    SQLite store of successful programs with an in-memory TF-IDF index over
+    their prompts.
+    """
+
+    def __init__(self, db_path: Path = EXAMPLES_DB_PATH, videos_dir: Path = Path("./videos")):
+        self.db_path = Path(db_path)
+        self.videos_dir = Path(videos_dir)
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._version = None
+        self._rows: List[Dict[str, Any]] = []
+        self._vectors: List[Dict[str, float]] = []
+        self._idf: Dict[str, float] = {}
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the index database.
+
+        Returns:
+            A SQLite connection in autocommit mode
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self) -> None:
+        """
+        Create the examples table, filling it from completed videos the first time.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS examples (
+                        code_hash TEXT PRIMARY KEY,
+                        video_id TEXT NOT NULL,
+                        prompt TEXT NOT NULL,
+                        topic TEXT,
+                        duration_minutes REAL,
+                        code_path TEXT NOT NULL,
+                        added_at REAL NOT NULL,
+                        request_key TEXT
+                    )
+                    """
+                )
+                # Indexes created before exact matching have no request keys yet
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(examples)")}
+                if "request_key" not in columns:
+                    conn.execute("ALTER TABLE examples ADD COLUMN request_key TEXT")
+                for row in conn.execute("SELECT code_hash, prompt, topic FROM examples WHERE request_key IS NULL").fetchall():
+                    conn.execute(
+                        "UPDATE examples SET request_key = ? WHERE code_hash = ?",
+                        (request_key(row["prompt"], row["topic"]), row["code_hash"])
+                    )
+                conn.execute("CREATE INDEX IF NOT EXISTS examples_request_key ON examples (request_key)")
+                empty = conn.execute("SELECT COUNT(*) FROM examples").fetchone()[0] == 0
+            finally:
+                conn.close()
+
+        if empty:
+            self._backfill()
+
+    def _backfill(self) -> None:
+        """
+        Add the programs of completed videos that were generated before the index existed.
+        """
+        added = 0
+        for metadata_path in self.videos_dir.glob("*/metadata.json"):
+            try:
+                with open(metadata_path, "r") as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            video_id = metadata_path.parent.name
+            code_path = metadata_path.parent / f"{video_id}.py"
+            if metadata.get("status") != "completed" or not metadata.get("prompt") or not code_path.is_file():
+                continue
+            if self.add(video_id, metadata["prompt"], metadata.get("topic"), None, code_path):
+                added += 1
+        if added:
+            logger.info(f"Added {added} programs of completed videos to the example index")
+
+    def add(
+        self,
+        video_id: str,
+        prompt: str,
+        topic: Optional[str],
+        duration_minutes: Optional[float],
+        code_path: Path
+    ) -> bool:
+        """
+        Record a program that rendered successfully.
+
+        Args:
+            video_id: The ID of the video
+            prompt: The prompt the program was generated for
+            topic: The topic the program was generated for
+            duration_minutes: The requested duration, if known
+            code_path: Path to the program
+
+        Returns:
+            True if the program was not in the index yet
+        """
+        try:
+            code = Path(code_path).read_text(encoding="utf-8")
+        except OSError:
+            return False
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                added = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO examples
+                        (code_hash, video_id, prompt, topic, duration_minutes, code_path, added_at, request_key)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (code_hash(code), video_id, prompt, topic, duration_minutes, str(code_path), time.time(),
+                     request_key(prompt, topic))
+                ).rowcount
+            finally:
+                conn.close()
+        return added > 0
+
+    def remove_code(self, code: str) -> bool:
+        """
+        Remove a program, for example because it failed to render.
+
+        Args:
+            code: The program
+
+        Returns:
+            True if the program was in the index
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                removed = conn.execute("DELETE FROM examples WHERE code_hash = ?", (code_hash(code),)).rowcount
+            finally:
+                conn.close()
+        if removed:
+            logger.info("Removed a program that failed to render from the example index")
+        return removed > 0
+
+    def _refresh(self) -> None:
+        """
+        Rebuild the TF-IDF vectors when other processes changed the index.
+        """
+        conn = self._connect()
+        try:
+            version = tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM examples").fetchone())
+            if version == self._version:
+                return
+            rows = [dict(row) for row in conn.execute("SELECT * FROM examples ORDER BY added_at")]
+        finally:
+            conn.close()
+
+        documents = [Counter(tokenize(_document(row["prompt"], row["topic"]))) for row in rows]
+        frequency = Counter(term for document in documents for term in document)
+        idf = {term: math.log((1 + len(documents)) / (1 + count)) + 1.0 for term, count in frequency.items()}
+
+        self._rows = rows
+        self._idf = idf
+        self._vectors = [self._vectorize(document) for document in documents]
+        self._version = version
+        EXAMPLES.set(len(rows))
+
+    def _vectorize(self, terms: Counter) -> Dict[str, float]:
+        """
+        Build a normalized TF-IDF vector. Terms that are not in the index are ignored.
+        """
+        vector = {term: count * self._idf[term] for term, count in terms.items() if term in self._idf}
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        return {term: value / norm for term, value in vector.items()} if norm else {}
+
+    def search(self, prompt: str, topic: Optional[str] = None, limit: int = MAX_EXAMPLES) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Find the programs generated for the most similar prompts.
+
+        Args:
+            prompt: The prompt of the new request
+            topic: The topic of the new request
+            limit: Maximum number of results
+
+        Returns:
+            (similarity, example) pairs, most similar first
+        """
+        with self._lock:
+            self._refresh()
+            query = self._vectorize(Counter(tokenize(_document(prompt, topic))))
+            scored = []
+            for row, vector in zip(self._rows, self._vectors):
+                similarity = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+                if similarity > 0:
+                    scored.append((similarity, row))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:limit]
+
+    def exact_matches(self, prompt: str, topic: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Find the programs generated for the same request.
+
+        Args:
+            prompt: The prompt of the new request
+            topic: The topic of the new request
+
+        Returns:
+            The examples with the same request key, newest first
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT * FROM examples WHERE request_key = ? ORDER BY added_at DESC",
+                    (request_key(prompt, topic),)
+                ).fetchall()
+            finally:
+                conn.close()
+        return [dict(row) for row in rows]
+
+    def load_code(self, example: Dict[str, Any]) -> Optional[str]:
+        """
+        Read the program of an example, removing the example if the file is gone.
+
+        Args:
+            example: The example
+
+        Returns:
+            The program, or None if it no longer exists
+        """
+        try:
+            return Path(example["code_path"]).read_text(encoding="utf-8")
+        except OSError:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute("DELETE FROM examples WHERE code_hash = ?", (example["code_hash"],))
+                finally:
+                    conn.close()
+            return None
+
+def find_reusable_code(
+    index: ExampleIndex,
+    prompt: str,
+    topic: Optional[str],
+    duration_minutes: float
+) -> Optional[str]:
+    """
+    Pick a program that can be reused for a request.
+
+    Only programs generated for the same normalized request and duration are
+    reused; similar requests only get examples.
+
+    Args:
+        index: The example index
+        prompt: The prompt of the request
+        topic: The topic of the request
+        duration_minutes: The requested duration
+
+    Returns:
+        The program, or None if no earlier request matches exactly
+    """
+    for example in index.exact_matches(prompt, topic):
+        duration = example.get("duration_minutes")
+        if duration is None or abs(duration - duration_minutes) > REUSE_DURATION_TOLERANCE:
+            continue
+        code = index.load_code(example)
+        if code:
+            logger.info(f"Reusing the program of video {example['video_id']} generated for the same request")
+            return code
+    return None
+
+def select_examples(index: ExampleIndex, matches: List[Tuple[float, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Pick the examples to add to a code generation prompt.
+
+    Args:
+        index: The example index
+        matches: Search results for the request
+
+    Returns:
+        Examples with their prompt, topic and code
+    """
+    examples = []
+    for similarity, example in matches:
+        if similarity < EXAMPLE_THRESHOLD:
+            break
+        code = index.load_code(example)
+        if code and len(code) <= MAX_EXAMPLE_CHARS:
+            examples.append({"prompt": example["prompt"], "topic": example["topic"], "code": code})
+    return examples
+
+_example_index: Optional[ExampleIndex] = None
+
+def get_example_index() -> ExampleIndex:
+    """
+    Get the shared example index.
+
+    Returns:
+        The example index
+    """
+    global _example_index
+    if _example_index is None:
+        _example_index = ExampleIndex()
+    return _example_index
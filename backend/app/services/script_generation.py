@@ -3,9 +3,12 @@ import logging
 import json
 import asyncio
 import time
-import google.generativeai as genai
 from typing import List, Dict, Any, Optional
 
+from app.services.resilience import CircuitOpenError, allow_retry, backoff_delay
+from app.services.llm_client import get_llm_client, LLMTimeoutError, GEMINI_MODEL
+from app.services.llm_cache import get_llm_cache, llm_cache_key, LLM_CACHE_ENABLED, KIND_SCRIPT
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -101,6 +104,29 @@ Each script segment contains:
 
 """
 
+async def generate_script_text(script_prompt: str, timeout: float) -> str:
+    """
+    Ask Gemini for a narration script.
+    
+    Args:
+        script_prompt: The script prompt
+        timeout: Timeout for the API call in seconds
+        
+    Returns:
+        The response text
+    """
+    # Generate the script with the shared Gemini client at a lower temperature for more precise output
+    try:
+        return await get_llm_client().generate(
+            script_prompt,
+            model_name=GEMINI_MODEL,
+            timeout=timeout,
+            generation_config={"temperature": 0.2}
+        )
+    except LLMTimeoutError:
+        logger.warning(f"API call timed out after {timeout} seconds")
+        raise
+
 async def generate_script_from_manim_code(
     video_id: str,
     manim_code: str,
@@ -108,11 +134,15 @@ async def generate_script_from_manim_code(
     topic: Optional[str] = None,
     max_retries: int = 3,
     retry_delay: float = 5.0,
-    timeout: float = 300.0  # 5 minutes timeout
+    timeout: float = 300.0,  # 5 minutes timeout
+    use_cache: bool = True
 ) -> List[Dict[str, Any]]:
     """
     Generate a synchronized script for a Manim video using Gemini.
     
+    The script prompt contains the code, so a script generated earlier for
+    the same code, prompt and topic is served from the response cache.
+    
     Args:
         video_id: The ID of the video
         manim_code: The Manim code for which to generate a script
@@ -121,6 +151,7 @@ async def generate_script_from_manim_code(
         max_retries: Maximum number of retries on failure
         retry_delay: Delay between retries in seconds
         timeout: Timeout for the API call in seconds
+        use_cache: Serve the script from the response cache if it is there
         
     Returns:
         List of script segments with text and timing information
@@ -128,49 +159,30 @@ async def generate_script_from_manim_code(
     retries = 0
     last_exception = None
     
+    # Use the hardcoded prompt template
+    script_prompt = SCRIPT_PROMPT_TEMPLATE.replace("[MANIM_CODE_HERE]", manim_code)
+    
+    # Add context about the original prompt and topic
+    script_prompt = script_prompt.replace(
+        "GENERATE SYNCHRONIZED SCRIPT FROM MANIM CODE", 
+        f"GENERATE SYNCHRONIZED SCRIPT FROM MANIM CODE\nORIGINAL PROMPT: {prompt}\nTOPIC: {topic or 'Educational content'}"
+    )
+    
+    cache_key = llm_cache_key(KIND_SCRIPT, GEMINI_MODEL, script_prompt)
+    cached_script = None
+    if LLM_CACHE_ENABLED and use_cache:
+        cached_script = await asyncio.to_thread(get_llm_cache().get, cache_key, KIND_SCRIPT)
+    
     while retries <= max_retries:
         try:
-            logger.info(f"Generating script for video ID: {video_id} (attempt {retries + 1}/{max_retries + 1})")
-            
-            # Use the hardcoded prompt template
-            script_prompt = SCRIPT_PROMPT_TEMPLATE.replace("[MANIM_CODE_HERE]", manim_code)
-            
-            # Add context about the original prompt and topic
-            script_prompt = script_prompt.replace(
-                "GENERATE SYNCHRONIZED SCRIPT FROM MANIM CODE", 
-                f"GENERATE SYNCHRONIZED SCRIPT FROM MANIM CODE\nORIGINAL PROMPT: {prompt}\nTOPIC: {topic or 'Educational content'}"
-            )
-            
-            # Configure Gemini API
-            GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-            if not GEMINI_API_KEY:
-                raise ValueError("GEMINI_API_KEY not set in environment variables")
-                
-            genai.configure(api_key=GEMINI_API_KEY)
-            
-            # Use a more capable model for script generation
-            model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-            
-            # Generate the script with timeout
-            try:
-                # Create a task with timeout
-                response_task = asyncio.create_task(
-                    asyncio.to_thread(
-                        model.generate_content,
-                        script_prompt,
-                        generation_config={"temperature": 0.2}  # Lower temperature for more precise output
-                    )
-                )
-                response = await asyncio.wait_for(response_task, timeout=timeout)
-            except asyncio.TimeoutError:
-                logger.warning(f"API call timed out after {timeout} seconds")
-                raise TimeoutError(f"API call timed out after {timeout} seconds")
-            
-            if not response.text:
-                raise ValueError("Empty response from Gemini API")
-            
-            # Extract the JSON script from the response
-            script_text = response.text
+            from_cache = cached_script is not None
+            if from_cache:
+                logger.info(f"Using cached script for video ID: {video_id}")
+                script_text = cached_script
+                cached_script = None
+            else:
+                logger.info(f"Generating script for video ID: {video_id} (attempt {retries + 1}/{max_retries + 1})")
+                script_text = await generate_script_text(script_prompt, timeout)
             
             # Clean up the response text to extract only the JSON part
             if "```json" in script_text:
@@ -181,6 +193,12 @@ async def generate_script_from_manim_code(
             # Parse the JSON script
             script = json.loads(script_text)
             
+            if LLM_CACHE_ENABLED and not from_cache:
+                try:
+                    await asyncio.to_thread(get_llm_cache().put, cache_key, KIND_SCRIPT, GEMINI_MODEL, script_text)
+                except Exception as e:
+                    logger.error(f"Failed to cache script: {str(e)}")
+            
             # Save the script to the video directory
             script_path = os.path.join("videos", video_id, "script.json")
             os.makedirs(os.path.dirname(script_path), exist_ok=True)
@@ -190,19 +208,23 @@ async def generate_script_from_manim_code(
             logger.info(f"Successfully generated script for video ID: {video_id}")
             return script
             
+        except CircuitOpenError as e:
+            # Gemini keeps failing for every job, so retrying would only add load
+            last_exception = e
+            logger.error(f"Not generating script: {str(e)}")
+            break
         except Exception as e:
             last_exception = e
             retries += 1
             logger.warning(f"Error generating script (attempt {retries}/{max_retries + 1}): {str(e)}")
             
-            if retries <= max_retries:
-                # Wait before retrying
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-                # Increase delay for next retry (exponential backoff)
-                retry_delay *= 1.5
+            # Wait before retrying, if the deadline and the retry budget allow it
+            delay = backoff_delay(retries, retry_delay, multiplier=1.5)
+            if retries <= max_retries and allow_retry("gemini_script", delay):
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
             else:
-                logger.error(f"Failed to generate script after {max_retries + 1} attempts: {str(e)}")
+                logger.error(f"Failed to generate script after {retries} attempts: {str(e)}")
                 break
     
     # If we've exhausted all retries, raise the last exception
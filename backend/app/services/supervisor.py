@@ -0,0 +1,235 @@
+"""
+Supervisor for job worker processes.
+
+In the "process" worker mode the API process does not run the pipeline
+itself. It only queues jobs and serves status and files, while a pool of
+worker processes (app.worker) started and restarted by the supervisor runs
+the jobs, so renders, LLM calls and TTS never hold up the API's event loop.
+"""
+import os
+import sys
+import time
+import uuid
+import signal
+import socket
+import asyncio
+import logging
+from pathlib import Path
+from typing import Optional, List
+
+from app.services import metrics
+from app.services.job_queue import JOB_WORKERS, STAGE_CONCURRENCY, STAGE_CONCURRENCY_VARS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where jobs run: "inline" (in the API process), "process" (in worker processes
+# supervised by the API) or "external" (in workers started separately)
+WORKER_MODES = ("inline", "process", "external")
+WORKER_MODE = os.environ.get("EDUTUTOR_WORKER_MODE", "inline").lower()
+
+# Number of worker processes in the process mode
+WORKER_PROCESSES = int(os.environ.get("EDUTUTOR_WORKER_PROCESSES", "2"))
+
+# Seconds a stopping worker gets to put its jobs back in the queue before it is killed
+WORKER_STOP_TIMEOUT = 30.0
+
+# Longest wait before restarting a worker that keeps crashing (in seconds)
+MAX_RESTART_DELAY = 60.0
+
+# A worker that ran at least this long resets the restart delay (in seconds)
+STABLE_RUN_TIME = 30.0
+
+# Directory that contains the app package, put on the workers' module path
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+# Part of the worker IDs of supervised processes, followed by the supervisor's
+# process ID, so the snapshots of a supervisor that exited can be told apart
+SUPERVISED_WORKER_TAG = "supervised"
+
+WORKER_RESTARTS = metrics.counter("edututor_worker_restarts_total", "Number of worker processes restarted after exiting")
+WORKER_PROCESSES_ALIVE = metrics.gauge("edututor_worker_processes", "Number of running supervised worker processes")
+
+class WorkerSupervisor:
+    """
+    Starts a fixed number of worker processes and restarts those that exit.
+
+    The stage concurrency limits of the API process are divided between the
+    worker processes, so the limits hold for the supervisor as a whole.
+    """
+
+    def __init__(self, processes: int = WORKER_PROCESSES, concurrency: int = 1):
+        self.processes = max(1, processes)
+        self.concurrency = max(1, concurrency)
+        self._procs: List[Optional[asyncio.subprocess.Process]] = [None] * self.processes
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        """
+        Start the worker processes.
+        """
+        # The counters of worker processes of an earlier run would be kept forever
+        removed = remove_stale_snapshots()
+        if removed:
+            logger.info(f"Removed {removed} metrics snapshots of earlier worker processes")
+
+        self._stopping = False
+        for slot in range(self.processes):
+            self._tasks.append(asyncio.create_task(self._run_slot(slot)))
+        logger.info(f"Supervising {self.processes} worker processes with {self.concurrency} jobs each")
+
+    def alive(self) -> int:
+        """
+        Count the running worker processes.
+
+        Returns:
+            Number of running worker processes
+        """
+        return sum(1 for proc in self._procs if proc is not None and proc.returncode is None)
+
+    async def _spawn(self, slot: int) -> asyncio.subprocess.Process:
+        """
+        Start one worker process.
+
+        Args:
+            slot: Index of the worker process
+
+        Returns:
+            The started process
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BACKEND_DIR), env.get("PYTHONPATH")]))
+        for stage, variable in STAGE_CONCURRENCY_VARS.items():
+            env[variable] = str(max(1, STAGE_CONCURRENCY[stage] // self.processes))
+        worker_id = f"{socket.gethostname()}:{SUPERVISED_WORKER_TAG}:{os.getpid()}:{slot}:{uuid.uuid4().hex[:8]}"
+        return await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app.worker",
+            "--concurrency", str(self.concurrency),
+            "--worker-id", worker_id,
+            env=env
+        )
+
+    async def _run_slot(self, slot: int) -> None:
+        """
+        Keep one worker process running until the supervisor stops.
+
+        Args:
+            slot: Index of the worker process
+        """
+        delay = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            try:
+                proc = await self._spawn(slot)
+            except Exception as e:
+                logger.error(f"Failed to start worker process {slot}: {str(e)}")
+                proc = None
+
+            if proc is not None:
+                self._procs[slot] = proc
+                WORKER_PROCESSES_ALIVE.set(self.alive())
+                returncode = await proc.wait()
+                WORKER_PROCESSES_ALIVE.set(self.alive())
+                if self._stopping:
+                    return
+                logger.warning(f"Worker process {slot} (pid {proc.pid}) exited with code {returncode}")
+
+            # Back off when a worker keeps crashing right after starting
+            if time.monotonic() - started >= STABLE_RUN_TIME:
+                delay = 1.0
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            WORKER_RESTARTS.inc()
+
+    async def stop(self) -> None:
+        """
+        Stop the worker processes. Workers put their running jobs back in the
+        queue before exiting; those that do not exit in time are killed.
+        """
+        self._stopping = True
+        running = [proc for proc in self._procs if proc is not None and proc.returncode is None]
+        for proc in running:
+            proc.send_signal(signal.SIGTERM)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(proc.wait() for proc in running)), timeout=WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for proc in running:
+                if proc.returncode is None:
+                    logger.warning(f"Killing worker process {proc.pid} that did not stop in time")
+                    proc.kill()
+            await asyncio.gather(*(proc.wait() for proc in running))
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        WORKER_PROCESSES_ALIVE.set(0)
+        logger.info("Stopped worker processes")
+
+def remove_stale_snapshots(directory: Optional[Path] = None) -> int:
+    """
+    Remove the metrics snapshots of worker processes supervised on this host
+    by supervisors that are no longer running. Snapshots of external workers
+    and of running supervisors are kept.
+
+    Args:
+        directory: The snapshot directory (default: METRICS_SNAPSHOT_DIR)
+
+    Returns:
+        The number of snapshots removed
+    """
+    directory = metrics.METRICS_SNAPSHOT_DIR if directory is None else directory
+    prefix = metrics.snapshot_name(f"{socket.gethostname()}:{SUPERVISED_WORKER_TAG}:")
+    supervisor_pids = {path.name[len(prefix):].split("_", 1)[0] for path in directory.glob(f"{prefix}*.json")}
+
+    removed = 0
+    for pid in supervisor_pids:
+        if not pid.isdigit() or _process_alive(int(pid)):
+            continue
+        removed += metrics.remove_snapshots(f"{prefix}{pid}_", directory)
+    return removed
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+_supervisor: Optional[WorkerSupervisor] = None
+
+def start_worker_processes(processes: int = WORKER_PROCESSES, total_concurrency: int = JOB_WORKERS) -> WorkerSupervisor:
+    """
+    Start the shared supervisor, spreading the job concurrency over the
+    worker processes.
+
+    Args:
+        processes: Number of worker processes
+        total_concurrency: Number of jobs that run at once across all processes
+
+    Returns:
+        The started supervisor
+    """
+    global _supervisor
+
+    if _supervisor is None:
+        processes = max(1, processes)
+        _supervisor = WorkerSupervisor(processes, max(1, -(-total_concurrency // processes)))
+        _supervisor.start()
+
+    return _supervisor
+
+async def stop_worker_processes() -> None:
+    """
+    Stop the shared supervisor if it is running.
+    """
+    global _supervisor
+
+    if _supervisor is not None:
+        await _supervisor.stop()
+        _supervisor = None
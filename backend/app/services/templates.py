@@ -0,0 +1,989 @@
+"""
+Manim templates for common requests.
+
+Requests such as "solve 3x - 5 = 2x + 7" or "plot f(x) = x^2 - 2x" make up a
+large share of the traffic and need no creativity: the steps of the video
+follow from the equation or function. They are served from parameterized
+templates with NARRATION comments instead of a Gemini call. A template is only
+used when the content type from ManimEducationalAgent matches it, its
+parameter extractor parses the math in the prompt, and the rest of the prompt
+asks for nothing the template does not show. Everything else is generated as
+before, and so is a template program that fails to render.
+"""
+import os
+import re
+import math
+import logging
+from fractions import Fraction
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to true to serve common requests from templates instead of Gemini. Off by
+# default until every template has been rendered with the installed Manim.
+TEMPLATES_ENABLED = os.environ.get("EDUTUTOR_TEMPLATES", "false").lower() in ("1", "true", "yes")
+
+# Share of the words outside the math that a template must account for
+TEMPLATE_MIN_CONFIDENCE = float(os.environ.get("EDUTUTOR_TEMPLATE_MIN_CONFIDENCE", "0.8"))
+
+# Lookup results
+RESULT_USED = "used"
+RESULT_LOW_CONFIDENCE = "low_confidence"
+RESULT_CONTENT_TYPE = "content_type_mismatch"
+RESULT_NO_MATCH = "no_match"
+
+TEMPLATE_LOOKUPS = metrics.counter("edututor_template_lookups_total", "Template lookups by template and result", ("template", "result"))
+TEMPLATE_RENDER_FAILURES = metrics.counter(
+    "edututor_template_render_failures_total", "Template programs that failed to render and were generated instead", ("template",)
+)
+
+# First line of template programs, followed by the template name
+TEMPLATE_HEADER = "# Template: "
+
+FUNCTIONS = {"sin", "cos", "tan", "exp", "log", "ln", "sqrt", "abs"}
+CONSTANTS = {"pi", "e"}
+
+# Words that do not change what a video shows
+FILLER_WORDS = {
+    "a", "an", "the", "this", "that", "these", "please", "can", "could", "would", "you", "me", "us", "we",
+    "i", "let", "lets", "let's", "how", "to", "do", "does", "of", "for", "and", "with", "in", "on", "it",
+    "its", "is", "are", "be", "video", "animation", "lesson", "make", "create", "generate", "simple",
+    "following", "given", "quick", "short", "using", "manim", "help", "understand", "explain", "show"
+}
+
+# Single letters that are also English words
+ENGLISH_LETTERS = {"a", "A", "I"}
+
+TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)?|[A-Za-z]+|[+\-*/^()=]|\S")
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+class TemplateParseError(ValueError):
+    """
+    Raised when the math in a prompt does not fit a template.
+    """
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """
+    Split text into number, word, operator and other tokens.
+
+    Args:
+        text: The text
+
+    Returns:
+        List of (token, start, end)
+    """
+    text = text.replace("−", "-").replace("×", "*").replace("·", "*")
+    return [(m.group(0), m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+
+def _is_number(token: str) -> bool:
+    return token[0].isdigit()
+
+class ExpressionParser:
+    """
+    Parser for the arithmetic expressions that appear in prompts.
+
+    Supports numbers, one variable, pi and e, + - * / ^, parentheses,
+    implicit multiplication ("2x", "3(x + 1)") and the functions in FUNCTIONS.
+    Expressions are parsed into nested tuples.
+    """
+
+    def __init__(self, tokens: List[str], variable: str = "x"):
+        self.tokens = [token if _is_number(token) or len(token) == 1 else token.lower() for token in tokens]
+        self.variable = variable
+        self.pos = 0
+
+    def parse(self) -> tuple:
+        """
+        Parse all tokens as one expression.
+
+        Returns:
+            The expression tree
+
+        Raises:
+            TemplateParseError: If the tokens are not a complete expression
+        """
+        if not self.tokens:
+            raise TemplateParseError("Empty expression")
+        node = self._expression()
+        if self.pos != len(self.tokens):
+            raise TemplateParseError(f"Unexpected {self.tokens[self.pos]!r}")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self, expected: Optional[str] = None) -> str:
+        token = self._peek()
+        if token is None or (expected is not None and token != expected):
+            raise TemplateParseError(f"Expected {expected or 'a term'}")
+        self.pos += 1
+        return token
+
+    def _starts_primary(self, token: Optional[str]) -> bool:
+        return token is not None and (
+            _is_number(token) or token == self.variable or token in CONSTANTS or token in FUNCTIONS or token == "("
+        )
+
+    def _expression(self) -> tuple:
+        node = self._term()
+        while self._peek() in ("+", "-"):
+            op = self._take()
+            node = ("bin", op, node, self._term())
+        return node
+
+    def _term(self) -> tuple:
+        node = self._factor()
+        while True:
+            if self._peek() in ("*", "/"):
+                op = self._take()
+                node = ("bin", op, node, self._factor())
+            elif self._starts_primary(self._peek()):
+                node = ("bin", "imp", node, self._power())
+            else:
+                return node
+
+    def _factor(self) -> tuple:
+        if self._peek() == "-":
+            self._take()
+            return ("neg", self._factor())
+        if self._peek() == "+":
+            self._take()
+            return self._factor()
+        return self._power()
+
+    def _power(self) -> tuple:
+        base = self._primary()
+        if self._peek() == "^":
+            self._take()
+            return ("pow", base, self._factor())
+        return base
+
+    def _primary(self) -> tuple:
+        token = self._take()
+        if _is_number(token):
+            return ("num", token)
+        if token == self.variable:
+            return ("var", token)
+        if token in CONSTANTS:
+            return ("const", token)
+        if token in FUNCTIONS:
+            self._take("(")
+            inner = self._expression()
+            self._take(")")
+            return ("call", token, inner)
+        if token == "(":
+            inner = self._expression()
+            self._take(")")
+            return ("paren", inner)
+        raise TemplateParseError(f"Unexpected {token!r}")
+
+def to_python(node: tuple, module: str = "np") -> str:
+    """
+    Write an expression as Python code in the variable x.
+
+    Args:
+        node: The expression tree
+        module: The module that provides the functions and constants (np or math)
+
+    Returns:
+        The Python expression
+    """
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "var":
+        return "x"
+    if kind == "const":
+        return f"{module}.{node[1]}"
+    if kind == "neg":
+        return f"-{to_python(node[1], module)}"
+    if kind == "paren":
+        return f"({to_python(node[1], module)})"
+    if kind == "pow":
+        return f"{to_python(node[1], module)}**{to_python(node[2], module)}"
+    if kind == "call":
+        name = {"ln": "log"}.get(node[1], node[1])
+        function = "abs" if name == "abs" and module == "math" else f"{module}.{name}"
+        return f"{function}({to_python(node[2], module)})"
+    op = "*" if node[1] == "imp" else node[1]
+    return f"{to_python(node[2], module)} {op} {to_python(node[3], module)}"
+
+def _strip_paren(node: tuple) -> tuple:
+    return node[1] if node[0] == "paren" else node
+
+def to_tex(node: tuple, value: Optional[str] = None) -> str:
+    """
+    Write an expression in LaTeX.
+
+    Args:
+        node: The expression tree
+        value: Optional LaTeX of a value to write in place of the variable
+
+    Returns:
+        The LaTeX
+    """
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "var":
+        return f"({value})" if value is not None else node[1]
+    if kind == "const":
+        return r"\pi" if node[1] == "pi" else "e"
+    if kind == "neg":
+        return f"-{to_tex(node[1], value)}"
+    if kind == "paren":
+        return rf"\left({to_tex(node[1], value)}\right)"
+    if kind == "pow":
+        return f"{to_tex(node[1], value)}^{{{to_tex(_strip_paren(node[2]), value)}}}"
+    if kind == "call":
+        inner = to_tex(node[2], value)
+        if node[1] == "sqrt":
+            return rf"\sqrt{{{inner}}}"
+        if node[1] == "abs":
+            return rf"\left|{inner}\right|"
+        return rf"\{node[1]}\left({inner}\right)"
+    op, left, right = node[1], to_tex(node[2], value), to_tex(node[3], value)
+    if op == "/":
+        return rf"\frac{{{to_tex(_strip_paren(node[2]), value)}}}{{{to_tex(_strip_paren(node[3]), value)}}}"
+    if op == "*" or (op == "imp" and (right[0].isdigit() or right[0] == "-")):
+        return rf"{left} \cdot {right}"
+    if op == "imp":
+        return f"{left}{right}"
+    return f"{left} {op} {right}"
+
+SPOKEN_FUNCTIONS = {
+    "sin": "sine of", "cos": "cosine of", "tan": "tangent of", "exp": "e to the power of",
+    "log": "the natural logarithm of", "ln": "the natural logarithm of",
+    "sqrt": "the square root of", "abs": "the absolute value of"
+}
+
+def to_speech(node: tuple) -> str:
+    """
+    Write an expression the way it is read aloud, for narration.
+
+    Args:
+        node: The expression tree
+
+    Returns:
+        The spoken expression
+    """
+    kind = node[0]
+    if kind in ("num", "var", "const"):
+        return node[1]
+    if kind == "neg":
+        return f"minus {to_speech(node[1])}"
+    if kind == "paren":
+        return to_speech(node[1])
+    if kind == "pow":
+        exponent = _strip_paren(node[2])
+        if exponent == ("num", "2"):
+            return f"{to_speech(node[1])} squared"
+        if exponent == ("num", "3"):
+            return f"{to_speech(node[1])} cubed"
+        return f"{to_speech(node[1])} to the power of {to_speech(exponent)}"
+    if kind == "call":
+        return f"{SPOKEN_FUNCTIONS[node[1]]} {to_speech(node[2])}"
+    words = {"+": "plus", "-": "minus", "*": "times", "/": "over", "imp": ""}[node[1]]
+    return " ".join(part for part in (to_speech(node[2]), words, to_speech(node[3])) if part)
+
+def linear_form(node: tuple) -> Tuple[Fraction, Fraction]:
+    """
+    Reduce an expression to a * variable + b.
+
+    Args:
+        node: The expression tree
+
+    Returns:
+        The coefficient a and the constant b
+
+    Raises:
+        TemplateParseError: If the expression is not linear with rational coefficients
+    """
+    kind = node[0]
+    if kind == "num":
+        return Fraction(0), Fraction(node[1])
+    if kind == "var":
+        return Fraction(1), Fraction(0)
+    if kind == "neg":
+        a, b = linear_form(node[1])
+        return -a, -b
+    if kind == "paren":
+        return linear_form(node[1])
+    if kind == "pow":
+        base, exponent = linear_form(node[1]), linear_form(node[2])
+        if exponent[0] != 0 or exponent[1].denominator != 1 or exponent[1] < 0:
+            raise TemplateParseError("Unsupported exponent")
+        if exponent[1] == 1:
+            return base
+        if base[0] == 0:
+            return Fraction(0), base[1] ** int(exponent[1])
+        raise TemplateParseError("The expression is not linear")
+    if kind == "bin":
+        left, right = linear_form(node[2]), linear_form(node[3])
+        op = node[1]
+        if op in ("+", "-"):
+            sign = 1 if op == "+" else -1
+            return left[0] + sign * right[0], left[1] + sign * right[1]
+        if op == "/":
+            if right[0] != 0 or right[1] == 0:
+                raise TemplateParseError("Division by the variable or by zero")
+            return left[0] / right[1], left[1] / right[1]
+        if left[0] == 0:
+            return left[1] * right[0], left[1] * right[1]
+        if right[0] == 0:
+            return left[0] * right[1], left[1] * right[1]
+    raise TemplateParseError("The expression is not linear")
+
+def format_number(value: Fraction) -> Tuple[str, str]:
+    """
+    Write a rational number in LaTeX and for narration.
+
+    Returns:
+        The LaTeX and the spoken number
+    """
+    if value.denominator == 1:
+        return str(value.numerator), str(value.numerator)
+    denominator = value.denominator
+    for factor in (2, 5):
+        while denominator % factor == 0:
+            denominator //= factor
+    if denominator == 1 and value.denominator <= 10000:
+        text = f"{float(value):g}"
+        return text, text
+    sign = "-" if value < 0 else ""
+    spoken_sign = "minus " if value < 0 else ""
+    return (
+        rf"{sign}\frac{{{abs(value.numerator)}}}{{{value.denominator}}}",
+        f"{spoken_sign}{abs(value.numerator)} over {value.denominator}"
+    )
+
+def plain_number(value: Fraction) -> str:
+    """
+    Write a rational number as plain text, for titles.
+    """
+    if value.denominator == 1:
+        return str(value.numerator)
+    tex, _ = format_number(value)
+    return tex if "frac" not in tex else f"{value.numerator}/{value.denominator}"
+
+def format_linear(a: Fraction, b: Fraction, variable: str) -> Tuple[str, str]:
+    """
+    Write a * variable + b in LaTeX and for narration.
+
+    Returns:
+        The LaTeX and the spoken expression
+    """
+    tex_parts, spoken_parts = [], []
+    if a != 0:
+        if abs(a) == 1:
+            tex_parts.append(f"{'-' if a < 0 else ''}{variable}")
+            spoken_parts.append(f"{'minus ' if a < 0 else ''}{variable}")
+        else:
+            tex, spoken = format_number(a)
+            tex_parts.append(f"{tex}{variable}")
+            spoken_parts.append(f"{spoken} {variable}")
+    if b != 0 or a == 0:
+        tex, spoken = format_number(abs(b) if a != 0 else b)
+        if a != 0:
+            tex_parts.append(f"{'-' if b < 0 else '+'} {tex}")
+            spoken_parts.append(f"{'minus' if b < 0 else 'plus'} {spoken}")
+        else:
+            tex_parts.append(tex)
+            spoken_parts.append(spoken)
+    return " ".join(tex_parts), " ".join(spoken_parts)
+
+def _is_math_token(token: str, letters: Optional[set]) -> bool:
+    if _is_number(token) or token in "+-*/^()":
+        return True
+    if token.lower() in FUNCTIONS or token.lower() in CONSTANTS:
+        return True
+    return len(token) == 1 and token.isalpha() and (letters is None or token in letters)
+
+def math_run(tokens: List[Tuple[str, int, int]], start: int, step: int, letters: Optional[set] = None) -> List[int]:
+    """
+    Get the indices of the math tokens next to a position.
+
+    Args:
+        tokens: The tokens of the prompt
+        start: The first index to look at
+        step: 1 to look forward, -1 to look backward
+        letters: Single letters that count as math, or None for any
+
+    Returns:
+        The indices of the run, in prompt order
+    """
+    indices = []
+    i = start
+    while 0 <= i < len(tokens) and _is_math_token(tokens[i][0], letters):
+        indices.append(i)
+        i += step
+    return sorted(indices)
+
+def word_confidence(prompt: str, spans: List[Tuple[int, int]], vocabulary: set) -> float:
+    """
+    Get the share of the words outside the math that a template accounts for.
+
+    Args:
+        prompt: The prompt
+        spans: Character ranges of the math the template uses
+        vocabulary: Words the template accounts for, besides FILLER_WORDS
+
+    Returns:
+        A value from 0 to 1
+    """
+    text = prompt.lower()
+    for start, end in sorted(spans, reverse=True):
+        text = text[:start] + " " + text[end:]
+    words = [word.strip("'") for word in WORD_PATTERN.findall(text)]
+    words = [word for word in words if word and len(word) > 1 or word in ("a", "i")]
+    if not words:
+        return 1.0
+    known = sum(1 for word in words if word in vocabulary or word in FILLER_WORDS)
+    return known / len(words)
+
+def _pause(duration_minutes: float, sections: int) -> float:
+    # Waits between animations stretch the video towards the requested duration
+    return round(min(3.0, max(1.0, duration_minutes * 60 / (sections * 3))), 1)
+
+def _method(name: str, narration: str, body: List[str]) -> List[str]:
+    lines = ["", f"    # NARRATION: {narration}", f"    def {name}(self):"]
+    return lines + [f"        {line}" for line in body]
+
+def _program(name: str, methods: List[Tuple[str, str, List[str]]]) -> str:
+    lines = [f"{TEMPLATE_HEADER}{name}", "from manim import *", "", "class CreateScene(Scene):", "    def construct(self):"]
+    lines += [f"        self.{name}()" for name, _, _ in methods]
+    for name, narration, body in methods:
+        lines += _method(name, narration, body)
+    return "\n".join(lines) + "\n"
+
+def _tex(tex: str) -> str:
+    return f'r"{tex}"'
+
+class Template:
+    """
+    A parameterized program for one shape of request.
+    """
+
+    name = ""
+    content_types: set = set()
+    vocabulary: set = set()
+
+    def extract(self, prompt: str) -> Optional[Tuple[Dict[str, Any], List[Tuple[int, int]]]]:
+        """
+        Extract the parameters of the template from a prompt.
+
+        Returns:
+            The parameters and the character ranges they were taken from, or None
+        """
+        raise NotImplementedError
+
+    def render(self, params: Dict[str, Any], duration_minutes: float) -> str:
+        """
+        Fill in the template.
+
+        Returns:
+            The Manim code
+        """
+        raise NotImplementedError
+
+class LinearEquationTemplate(Template):
+    """
+    Solves a linear equation in one variable step by step and checks the solution.
+    """
+
+    name = "linear_equation"
+    content_types = {"step_by_step_problem"}
+    vocabulary = {
+        "solve", "solving", "solution", "linear", "equation", "equations", "find", "value", "values",
+        "unknown", "variable", "step", "steps", "by", "each", "calculate", "compute", "determine", "work",
+        "out", "what", "isolate", "algebra", "algebraically", "check", "verify", "answer", "where"
+    }
+
+    def extract(self, prompt):
+        tokens = tokenize(prompt)
+        equals = [i for i, token in enumerate(tokens) if token[0] == "="]
+        if len(equals) != 1:
+            return None
+        eq = equals[0]
+        left_run = math_run(tokens, eq - 1, -1)
+        right_run = math_run(tokens, eq + 1, 1)
+
+        # The words "a" and "I" can border the equation, so try the longest sides that parse
+        # without them; nothing else is dropped, so "x + y = 3" is not read as "y = 3"
+        for left_start in range(len(left_run)):
+            if not all(tokens[i][0] in ENGLISH_LETTERS for i in left_run[:left_start]):
+                break
+            left = left_run[left_start:]
+            letters = {tokens[i][0] for i in left if len(tokens[i][0]) == 1 and tokens[i][0].isalpha()}
+            if len(letters) > 1:
+                continue
+            for right_end in range(len(right_run), 0, -1):
+                if not all(tokens[i][0] in ENGLISH_LETTERS for i in right_run[right_end:]):
+                    break
+                right = right_run[:right_end]
+                letters_right = {tokens[i][0] for i in right if len(tokens[i][0]) == 1 and tokens[i][0].isalpha()}
+                variables = letters | letters_right
+                if len(variables) != 1:
+                    continue
+                variable = variables.pop()
+                try:
+                    left_node = ExpressionParser([tokens[i][0] for i in left], variable).parse()
+                    right_node = ExpressionParser([tokens[i][0] for i in right], variable).parse()
+                    left_form, right_form = linear_form(left_node), linear_form(right_node)
+                except TemplateParseError:
+                    continue
+                if left_form[0] == right_form[0]:
+                    # No unique solution
+                    return None
+                params = {
+                    "variable": variable,
+                    "left": left_node,
+                    "right": right_node,
+                    "left_form": left_form,
+                    "right_form": right_form
+                }
+                return params, [(tokens[left[0]][1], tokens[right[-1]][2])]
+        return None
+
+    def render(self, params, duration_minutes):
+        v = params["variable"]
+        (a, b), (c, d) = params["left_form"], params["right_form"]
+        equation_tex = f"{to_tex(params['left'])} = {to_tex(params['right'])}"
+        equation_spoken = f"{to_speech(params['left'])} equals {to_speech(params['right'])}"
+        solution = (d - b) / (a - c)
+        solution_tex, solution_spoken = format_number(solution)
+
+        steps = []
+
+        def add_step(action: str, narration: str, a_now: Fraction, b_now: Fraction, c_now: Fraction, d_now: Fraction):
+            left_tex, left_spoken = format_linear(a_now, b_now, v)
+            right_tex, right_spoken = format_linear(c_now, d_now, v)
+            steps.append((action, f"{narration} This gives {left_spoken} equals {right_spoken}.", f"{left_tex} = {right_tex}"))
+
+        simplified = f"{format_linear(a, b, v)[0]} = {format_linear(c, d, v)[0]}"
+        if simplified != equation_tex:
+            add_step("Simplify both sides", "First, we simplify each side by combining like terms.", a, b, c, d)
+        if c != 0:
+            term = v if abs(c) == 1 else f"{plain_number(abs(c))}{v}"
+            _, term_spoken = format_linear(abs(c), Fraction(0), v)
+            verb, side = ("subtract", "from") if c > 0 else ("add", "to")
+            add_step(
+                f"{verb.capitalize()} {term} {side} both sides",
+                f"To collect the {v} terms on the left, we {verb} {term_spoken} {side} both sides.",
+                a - c, b, Fraction(0), d
+            )
+        coefficient = a - c
+        if b != 0:
+            _, constant_spoken = format_number(abs(b))
+            verb, side = ("subtract", "from") if b > 0 else ("add", "to")
+            add_step(
+                f"{verb.capitalize()} {plain_number(abs(b))} {side} both sides",
+                f"Next, we {verb} {constant_spoken} {side} both sides to move the constant to the right.",
+                coefficient, Fraction(0), Fraction(0), d - b
+            )
+        if coefficient != 1:
+            _, divisor_spoken = format_number(coefficient)
+            add_step(
+                f"Divide both sides by {plain_number(coefficient)}",
+                f"Finally, we divide both sides by {divisor_spoken} to get {v} by itself.",
+                Fraction(1), Fraction(0), Fraction(0), solution
+            )
+
+        pause = _pause(duration_minutes, 3 + len(steps))
+        left_value_tex, left_value_spoken = format_number(a * solution + b)
+        check_tex = f"{to_tex(params['left'], solution_tex)} = {to_tex(params['right'], solution_tex)}"
+
+        program = [(
+            "introduce_problem",
+            f"Let's solve the equation {equation_spoken}. Our goal is to find the value of {v} that makes both sides equal.",
+            [
+                'title = Text("Solving a Linear Equation", color=BLUE).to_edge(UP)',
+                f"equation = MathTex({_tex(equation_tex)}, color=YELLOW).scale(1.2)",
+                "self.play(Write(title))",
+                "self.wait(1)",
+                "self.play(Write(equation))",
+                f"self.wait({pause})",
+                "self.play(FadeOut(title, equation))"
+            ]
+        )]
+        for number, (action, narration, result_tex) in enumerate(steps, start=1):
+            program.append((
+                f"step_{number}",
+                narration,
+                [
+                    f"step_title = Text({f'Step {number}: {action}'!r}, color=BLUE).to_edge(UP)",
+                    f"step_math = MathTex({_tex(result_tex)}, color=YELLOW).scale(1.2)",
+                    "self.play(Write(step_title))",
+                    "self.wait(1)",
+                    "self.play(Write(step_math))",
+                    f"self.wait({pause})",
+                    "self.play(FadeOut(step_title, step_math))"
+                ]
+            ))
+        program.append((
+            "verify_solution",
+            f"Let's check the answer by putting {v} equals {solution_spoken} back into the original equation. "
+            f"Both sides come out as {left_value_spoken}, so the solution is correct.",
+            [
+                'check_title = Text("Check the answer", color=BLUE).to_edge(UP)',
+                f"substituted = MathTex({_tex(check_tex)}, color=WHITE)",
+                f"result = MathTex({_tex(f'{left_value_tex} = {left_value_tex}')}, color=GREEN).next_to(substituted, DOWN, buff=0.6)",
+                "self.play(Write(check_title))",
+                "self.wait(1)",
+                "self.play(Write(substituted))",
+                "self.wait(1)",
+                "self.play(Write(result))",
+                f"self.wait({pause})",
+                "self.play(FadeOut(check_title, substituted, result))"
+            ]
+        ))
+        program.append((
+            "conclude",
+            f"The solution of the equation {equation_spoken} is {v} equals {solution_spoken}.",
+            [
+                f"answer = MathTex({_tex(f'{v} = {solution_tex}')}, color=YELLOW).scale(1.5)",
+                "box = SurroundingRectangle(answer, color=GREEN, buff=0.3)",
+                "self.play(Write(answer))",
+                "self.play(Create(box))",
+                f"self.wait({pause})",
+                "self.play(FadeOut(*self.mobjects))"
+            ]
+        ))
+        return _program(self.name, program)
+
+class FunctionPlotTemplate(Template):
+    """
+    Plots a function of x on labelled axes and marks where it crosses the axes.
+    """
+
+    name = "function_plot"
+    content_types = {"visual_demonstration"}
+    vocabulary = {
+        "plot", "plotting", "graph", "graphing", "draw", "sketch", "visualize", "visualise", "animate",
+        "function", "curve", "axes", "axis", "coordinate", "plane", "from", "between", "over", "interval",
+        "range", "looks", "look", "like", "what", "its", "the", "where", "crosses", "roots", "intercepts"
+    }
+
+    # Default x range, when the prompt does not give one
+    X_RANGE = (-5.0, 5.0)
+    SAMPLES = 200
+
+    ASSIGNMENT = re.compile(r"\b(?:[fgh]\s*\(\s*x\s*\)|y)\s*=", re.IGNORECASE)
+    TRIGGER = re.compile(r"\b(?:plot|graph|sketch|draw)\b(?:\s+(?:of|the|function|graph))*\s+", re.IGNORECASE)
+    RANGE = re.compile(r"\b(?:from|between|for\s+x\s+(?:from|between))\s+(.+?)\s+(?:to|and)\s+(\S+(?:\s*[*/]?\s*pi)?)", re.IGNORECASE)
+
+    def extract(self, prompt):
+        tokens = tokenize(prompt)
+        match = self.ASSIGNMENT.search(prompt) or self.TRIGGER.search(prompt)
+        if match is None:
+            return None
+        start = next((i for i, token in enumerate(tokens) if token[1] >= match.end()), None)
+        if start is None:
+            return None
+        run = math_run(tokens, start, 1, letters={"x", "e"})
+        node = None
+        for end in range(len(run), 0, -1):
+            try:
+                node = ExpressionParser([tokens[i][0] for i in run[:end]], "x").parse()
+                run = run[:end]
+                break
+            except TemplateParseError:
+                continue
+        if node is None or not any(token[0].lower() == "x" for token in (tokens[i] for i in run)):
+            return None
+
+        spans = [(match.start(), tokens[run[-1]][2])]
+        x_range = self.X_RANGE
+        found = self.RANGE.search(prompt, tokens[run[-1]][2])
+        if found:
+            try:
+                low, high = (self._constant(bound.rstrip(".,;:!?")) for bound in found.groups())
+            except (ValueError, ZeroDivisionError, OverflowError):
+                return None
+            if not low < high or high - low > 100:
+                return None
+            x_range = (float(low), float(high))
+            spans.append(found.span())
+
+        samples = self._sample(node, x_range)
+        if samples is None:
+            return None
+        roots = self._roots(node, samples)
+        if roots is None:
+            return None
+        return {"function": node, "x_range": x_range, "samples": samples, "roots": roots}, spans
+
+    @staticmethod
+    def _constant(text: str) -> float:
+        # A bound of the x range, such as "-3" or "2pi"
+        node = ExpressionParser([token for token, _, _ in tokenize(text)], "x").parse()
+        if "x" in to_python(node, "math").replace("exp", ""):
+            raise TemplateParseError("The bound depends on x")
+        return float(eval(to_python(node, "math"), {"math": math, "__builtins__": {"abs": abs}}))
+
+    @staticmethod
+    def _evaluate(code, x: float) -> Optional[float]:
+        # The value of the function at x, or None where it is not defined or not finite
+        try:
+            y = float(eval(code, {"math": math, "__builtins__": {"abs": abs}}, {"x": x}))
+        except (ValueError, ZeroDivisionError, OverflowError, TypeError):
+            return None
+        return y if math.isfinite(y) and abs(y) <= 1e6 else None
+
+    def _sample(self, node: tuple, x_range: Tuple[float, float]) -> Optional[List[Tuple[float, float]]]:
+        # The function must be defined, finite and continuous over the whole range to plot it as one curve
+        code = compile(to_python(node, "math"), "<function>", "eval")
+        low, high = x_range
+        samples = []
+        for i in range(self.SAMPLES + 1):
+            x = low + (high - low) * i / self.SAMPLES
+            y = self._evaluate(code, x)
+            if y is None:
+                return None
+            samples.append((x, y))
+
+        ys = [y for _, y in samples]
+        threshold = max(max(ys) - min(ys), 1.0) * self.JUMP
+        for (x0, y0), (x1, y1) in zip(samples, samples[1:]):
+            if abs(y1 - y0) > threshold and not self._continuous(code, x0, y0, x1, y1, threshold):
+                return None
+        return samples
+
+    def _continuous(self, code, x0: float, y0: float, x1: float, y1: float, threshold: float) -> bool:
+        # Halve the interval, keeping the half with the larger change, until the change is small;
+        # across a pole or a step it does not shrink
+        for _ in range(self.BISECTIONS):
+            if abs(y1 - y0) <= threshold:
+                return True
+            xm = (x0 + x1) / 2
+            ym = self._evaluate(code, xm)
+            if ym is None:
+                return False
+            if abs(ym - y0) >= abs(y1 - ym):
+                x1, y1 = xm, ym
+            else:
+                x0, y0 = xm, ym
+        return False
+
+    def _roots(self, node: tuple, samples: List[Tuple[float, float]]) -> Optional[List[float]]:
+        # Where the curve crosses the x axis; every sign change is narrowed down by bisection and
+        # must converge to a zero of the function, or the template is not used
+        code = compile(to_python(node, "math"), "<function>", "eval")
+        x_low, x_high = samples[0][0], samples[-1][0]
+        scale = max(max(abs(y) for _, y in samples), 1.0)
+        roots = []
+        for i, (x0, y0) in enumerate(samples):
+            if abs(y0) < self.ZERO:
+                root = x0
+            elif i + 1 < len(samples) and abs(samples[i + 1][1]) >= self.ZERO and y0 * samples[i + 1][1] < 0:
+                x1, y1 = samples[i + 1]
+                for _ in range(self.BISECTIONS):
+                    xm = (x0 + x1) / 2
+                    ym = self._evaluate(code, xm)
+                    if ym is None:
+                        return None
+                    if y0 * ym <= 0:
+                        x1, y1 = xm, ym
+                    else:
+                        x0, y0 = xm, ym
+                root = (x0 + x1) / 2
+                value = self._evaluate(code, root)
+                if value is None or abs(value) > self.ROOT_TOLERANCE * scale:
+                    return None
+            else:
+                continue
+            if not roots or abs(root - roots[-1]) > (x_high - x_low) / 50:
+                roots.append(round(root, 2) + 0.0)
+        return roots[:3]
+
+    @staticmethod
+    def _nice_step(span: float) -> float:
+        raw = span / 8
+        magnitude = 10 ** math.floor(math.log10(raw))
+        for factor in (1, 2, 5, 10):
+            if factor * magnitude >= raw:
+                return factor * magnitude
+        return 10 * magnitude
+
+    # Function values this close to zero count as zero
+    ZERO = 1e-9
+
+    # Change between neighbouring samples, as a share of the value range, that is checked for a jump
+    JUMP = 0.05
+
+    # Halvings used to check for jumps and to narrow down roots
+    BISECTIONS = 60
+
+    # Largest value at a root found by bisection, relative to the largest value of the function
+    ROOT_TOLERANCE = 1e-6
+
+    @staticmethod
+    def _number(value: float) -> str:
+        return f"{round(value, 4) + 0.0:g}"
+
+    @classmethod
+    def _spoken(cls, value: float) -> str:
+        text = cls._number(value)
+        return f"minus {text[1:]}" if text.startswith("-") else text
+
+    def render(self, params, duration_minutes):
+        node, samples = params["function"], params["samples"]
+        x_low, x_high = params["x_range"]
+        ys = [y for _, y in samples]
+        y_low, y_high = min(ys), max(ys)
+        if y_high - y_low < 1e-9:
+            y_low, y_high = y_low - 1, y_high + 1
+        y_step = self._nice_step(y_high - y_low)
+        y_low, y_high = math.floor(y_low / y_step) * y_step, math.ceil(y_high / y_step) * y_step
+        # The axes end on ticks, so the tick labels are round numbers
+        x_step = self._nice_step(x_high - x_low)
+        axis_low, axis_high = math.floor(x_low / x_step) * x_step, math.ceil(x_high / x_step) * x_step
+
+        # Points where the curve meets the axes
+        roots = params["roots"]
+        points = [(root, 0.0) for root in roots]
+        intercept = None
+        if x_low <= 0 <= x_high:
+            intercept = float(eval(compile(to_python(node, "math"), "<function>", "eval"), {"math": math, "__builtins__": {"abs": abs}}, {"x": 0.0}))
+            if not any(abs(root) < 1e-9 for root in roots):
+                points.append((0.0, round(intercept, 2)))
+
+        function_tex = f"f(x) = {to_tex(node)}"
+        function_spoken = f"f of x equals {to_speech(node)}"
+        sections = 5 if points else 4
+        pause = _pause(duration_minutes, sections)
+
+        axes = (
+            f"self.axes = Axes(x_range=[{self._number(axis_low)}, {self._number(axis_high)}, {self._number(x_step)}], "
+            f"y_range=[{self._number(y_low)}, {self._number(y_high)}, {self._number(y_step)}], "
+            f"x_length=10, y_length=5.5, axis_config={{\"include_numbers\": True, \"font_size\": 24}}).shift(DOWN * 0.5)"
+        )
+        program = [
+            (
+                "introduce_function",
+                f"In this video we graph the function {function_spoken}, and see how its values change with x.",
+                [
+                    'title = Text("Graphing a Function", color=BLUE).to_edge(UP)',
+                    f"formula = MathTex({_tex(function_tex)}, color=YELLOW).scale(1.2)",
+                    "self.play(Write(title))",
+                    "self.wait(1)",
+                    "self.play(Write(formula))",
+                    f"self.wait({pause})",
+                    "self.play(FadeOut(title, formula))"
+                ]
+            ),
+            (
+                "draw_axes",
+                f"First we draw the coordinate axes, with x from {self._spoken(axis_low)} to {self._spoken(axis_high)} "
+                f"and y from {self._spoken(y_low)} to {self._spoken(y_high)}.",
+                [
+                    axes,
+                    'self.axis_labels = self.axes.get_axis_labels(x_label="x", y_label="y")',
+                    "self.play(Create(self.axes), Write(self.axis_labels), run_time=2)",
+                    f"self.wait({pause})"
+                ]
+            ),
+            (
+                "plot_graph",
+                "Now we plot the curve. For every value of x, the height of the curve is the value of the function.",
+                [
+                    f"self.graph = self.axes.plot(lambda x: {to_python(node)}, x_range=[{self._number(x_low)}, {self._number(x_high)}], color=YELLOW)",
+                    f"self.label = MathTex({_tex(function_tex)}, color=YELLOW).scale(0.8).to_edge(UP)",
+                    "self.play(Create(self.graph), run_time=2)",
+                    "self.play(Write(self.label))",
+                    f"self.wait({pause})"
+                ]
+            )
+        ]
+        if points:
+            parts = []
+            if roots:
+                listed = " and ".join(self._spoken(root) for root in roots)
+                parts.append(f"The curve crosses the x axis at x equals {listed}.")
+            if intercept is not None and not any(abs(root) < 1e-9 for root in roots):
+                parts.append(f"It meets the y axis at y equals {self._spoken(intercept)}.")
+            program.append((
+                "mark_points",
+                " ".join(parts),
+                [
+                    f"dots = VGroup(*[Dot(self.axes.c2p(x, y), color=RED) for x, y in {points!r}])",
+                    "self.play(FadeIn(dots))",
+                    f"self.wait({pause})"
+                ]
+            ))
+        program.append((
+            "conclude",
+            f"That is the graph of {function_spoken}. Its shape shows at a glance how the function behaves.",
+            [
+                'summary = Text("The graph shows the function at a glance", color=GREEN).scale(0.6).to_edge(UP)',
+                "self.play(FadeOut(self.label))",
+                "self.play(Write(summary))",
+                f"self.wait({pause})",
+                "self.play(FadeOut(*self.mobjects))"
+            ]
+        ))
+        return _program(self.name, program)
+
+TEMPLATES: List[Template] = [LinearEquationTemplate(), FunctionPlotTemplate()]
+
+def template_name(manim_code: str) -> Optional[str]:
+    """
+    Find the template a program was filled in from.
+
+    Args:
+        manim_code: The Manim code
+
+    Returns:
+        The template name, or None if the code was not served from a template
+    """
+    first_line = manim_code.split("\n", 1)[0]
+    if first_line.startswith(TEMPLATE_HEADER):
+        return first_line[len(TEMPLATE_HEADER):].strip()
+    return None
+
+def find_template_code(prompt: str, content_type: str, duration_minutes: float) -> Optional[str]:
+    """
+    Fill in the template that serves a prompt, if there is one.
+
+    Args:
+        prompt: The prompt for generating the video
+        content_type: The content type of the prompt from ManimEducationalAgent
+        duration_minutes: The desired duration in minutes
+
+    Returns:
+        The Manim code, or None if the prompt needs code generation
+    """
+    for template in TEMPLATES:
+        try:
+            extracted = template.extract(prompt)
+        except Exception as e:
+            logger.error(f"Template {template.name} failed to read the prompt: {str(e)}")
+            continue
+        if extracted is None:
+            continue
+        params, spans = extracted
+
+        if content_type not in template.content_types:
+            TEMPLATE_LOOKUPS.inc(template=template.name, result=RESULT_CONTENT_TYPE)
+            continue
+        confidence = word_confidence(prompt, spans, template.vocabulary)
+        if confidence < TEMPLATE_MIN_CONFIDENCE:
+            TEMPLATE_LOOKUPS.inc(template=template.name, result=RESULT_LOW_CONFIDENCE)
+            logger.info(f"Template {template.name} matched with confidence {confidence:.2f}, generating code instead")
+            continue
+
+        try:
+            manim_code = template.render(params, duration_minutes)
+        except Exception as e:
+            logger.error(f"Template {template.name} failed to render: {str(e)}")
+            continue
+        TEMPLATE_LOOKUPS.inc(template=template.name, result=RESULT_USED)
+        logger.info(f"Serving the prompt from template {template.name} (confidence {confidence:.2f})")
+        return manim_code
+
+    TEMPLATE_LOOKUPS.inc(template="none", result=RESULT_NO_MATCH)
+    return None
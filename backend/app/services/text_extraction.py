@@ -56,22 +56,16 @@ class ManimTextExtractor:
         
         return script
     
-    def _extract_narration_comments(self, manim_code: str) -> List[Dict[str, Any]]:
+    def find_narration_blocks(self, manim_code: str) -> List[str]:
         """
-        Extract script from NARRATION comments in the code.
-        
-        This method looks for comments starting with "# NARRATION:" and extracts
-        the continuous block of comments that follows.
+        Find the text of the NARRATION comment blocks in the code.
         
         Args:
-            manim_code: The Manim code to extract from
+            manim_code: The Manim code to search
             
         Returns:
-            List of script segments
+            The narration text of each block, in order
         """
-        script = []
-        current_time = 0.0
-        
         # Split the code into lines
         lines = manim_code.split('\n')
         
@@ -108,6 +102,26 @@ class ManimTextExtractor:
         if current_narration is not None:
             narration_blocks.append(current_narration.strip())
         
+        return narration_blocks
+    
+    def _extract_narration_comments(self, manim_code: str) -> List[Dict[str, Any]]:
+        """
+        Extract script from NARRATION comments in the code.
+        
+        This method looks for comments starting with "# NARRATION:" and extracts
+        the continuous block of comments that follows.
+        
+        Args:
+            manim_code: The Manim code to extract from
+            
+        Returns:
+            List of script segments
+        """
+        script = []
+        current_time = 0.0
+        
+        narration_blocks = self.find_narration_blocks(manim_code)
+        
         # If no NARRATION comments found, return empty script
         if not narration_blocks:
             logger.info("No NARRATION comments found in the code")
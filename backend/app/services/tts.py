@@ -2,6 +2,10 @@
 Text-to-speech service using Eleven Labs API.
 """
 import os
+import time
+import shutil
+import hashlib
+import uuid
 import logging
 import asyncio
 import json
@@ -11,6 +15,9 @@ from typing import Optional, Dict, Any, List, Tuple
 from elevenlabs import generate, save, set_api_key, Voice, voices
 from elevenlabs.api import Models
 
+from app.services.resilience import call_with_retries, CircuitOpenError, SERVICE_ELEVENLABS
+from app.services.cassette import get_cassette, replaying
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,29 +36,60 @@ os.makedirs(AUDIO_DIR, exist_ok=True)
 # Default voice ID for educational content
 DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"  # Adam voice (clear, professional)
 
+# Default TTS model
+DEFAULT_MODEL_ID = "eleven_monolingual_v1"
+
+# Synthesized segments shared between videos, keyed by voice, model and text
+TTS_CACHE_DIR = Path(os.environ.get("EDUTUTOR_TTS_CACHE_DIR", "./cache/tts"))
+
+# Attempts made to synthesize one text before giving up
+TTS_MAX_ATTEMPTS = 3
+
+# How long a successful API access check is reused (in seconds)
+API_CHECK_TTL = 300.0
+
 # Cache available voices
 _available_voices = None
 
+# Time of the last successful API access check and its message
+_api_verified_at = None
+_api_verified_message = None
+
 async def verify_api_access() -> Tuple[bool, str]:
     """
     Verify that the Eleven Labs API is accessible and the API key is valid.
     
+    A successful check is reused for API_CHECK_TTL seconds so that videos
+    generated back to back do not each make an extra request.
+    
     Returns:
         Tuple of (success, message)
     """
+    global _api_verified_at, _api_verified_message
+    
+    if replaying():
+        return True, "Replaying recorded Eleven Labs calls."
+    
     if not ELEVEN_LABS_API_KEY:
         return False, "ELEVEN_LABS_API_KEY not set"
     
+    if _api_verified_at is not None and time.monotonic() - _api_verified_at < API_CHECK_TTL:
+        return True, _api_verified_message
+    
     try:
         # Make a simple API request to check access
-        response = requests.get(
+        response = await asyncio.to_thread(
+            requests.get,
             "https://api.elevenlabs.io/v1/voices",
-            headers={"xi-api-key": ELEVEN_LABS_API_KEY}
+            headers={"xi-api-key": ELEVEN_LABS_API_KEY},
+            timeout=30
         )
         
         if response.status_code == 200:
             voice_count = len(response.json().get("voices", []))
-            return True, f"API access verified. {voice_count} voices available."
+            _api_verified_at = time.monotonic()
+            _api_verified_message = f"API access verified. {voice_count} voices available."
+            return True, _api_verified_message
         elif response.status_code == 401:
             return False, "Authentication failed. Invalid API key."
         elif response.status_code == 403:
@@ -73,7 +111,7 @@ async def get_available_voices() -> List[Voice]:
     
     if _available_voices is None:
         try:
-            _available_voices = voices()
+            _available_voices = await asyncio.to_thread(voices)
             logger.info(f"Retrieved {len(_available_voices)} voices from Eleven Labs API")
         except Exception as e:
             logger.error(f"Error retrieving voices from Eleven Labs API: {str(e)}")
@@ -81,11 +119,77 @@ async def get_available_voices() -> List[Voice]:
     
     return _available_voices
 
+def speech_cache_path(text: str, voice_id: str = DEFAULT_VOICE_ID, model_id: str = DEFAULT_MODEL_ID) -> Path:
+    """
+    Get the path of the cached speech for a text.
+    
+    Args:
+        text: The synthesized text
+        voice_id: The ID of the voice
+        model_id: The ID of the TTS model
+        
+    Returns:
+        Path in the speech cache
+    """
+    return TTS_CACHE_DIR / f"{hashlib.sha256(f'{voice_id}:{model_id}:{text}'.encode()).hexdigest()}.mp3"
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Check whether an Eleven Labs error may go away when the call is retried.
+    
+    Args:
+        error: The exception raised by the call
+        
+    Returns:
+        False for rejected credentials and unknown voices, True otherwise
+    """
+    error_msg = str(error)
+    return "401" not in error_msg and "403" not in error_msg and "voice" not in error_msg.lower()
+
+async def synthesize_speech(text: str, voice_id: str, model_id: str) -> bytes:
+    """
+    Synthesize text with Eleven Labs, or replay a recorded synthesis.
+    
+    Transient API errors are retried while the retry budget and the job's
+    deadline allow it. While Eleven Labs keeps failing, calls fail right away.
+    In record mode the audio is stored in the cassette.
+    
+    Args:
+        text: The text to synthesize
+        voice_id: The ID of the voice to use
+        model_id: The ID of the TTS model to use
+        
+    Returns:
+        The audio
+    """
+    request = {"text": text, "voice_id": voice_id, "model_id": model_id}
+    cassette = get_cassette()
+    if cassette is not None and cassette.replaying:
+        return await cassette.replay(SERVICE_ELEVENLABS, request)
+    
+    start = time.perf_counter()
+    # Run in a separate thread to avoid blocking, through the shared rate
+    # limiter, circuit breaker and retry budget
+    audio = await call_with_retries(
+        SERVICE_ELEVENLABS,
+        lambda: asyncio.to_thread(generate, text=text, voice=voice_id, model=model_id),
+        max_attempts=TTS_MAX_ATTEMPTS,
+        is_retryable=is_transient_error
+    )
+    
+    if cassette is not None and cassette.recording and isinstance(audio, bytes):
+        try:
+            await asyncio.to_thread(cassette.record, SERVICE_ELEVENLABS, request, audio, time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Failed to record Eleven Labs call: {str(e)}")
+    
+    return audio
+
 async def text_to_speech(
     text: str,
     voice_id: str = DEFAULT_VOICE_ID,
     output_path: Optional[Path] = None,
-    model_id: str = "eleven_monolingual_v1"
+    model_id: str = DEFAULT_MODEL_ID
 ) -> Optional[Path]:
     """
     Convert text to speech using Eleven Labs API.
@@ -99,35 +203,45 @@ async def text_to_speech(
     Returns:
         Path to the generated audio file or None if generation failed
     """
-    if not ELEVEN_LABS_API_KEY:
+    if not ELEVEN_LABS_API_KEY and not replaying():
         logger.error("Cannot generate audio: ELEVEN_LABS_API_KEY not set")
         return None
     
     # Generate output path if not provided
     if output_path is None:
         # Create a hash of the text to use as filename
-        import hashlib
         text_hash = hashlib.md5(text.encode()).hexdigest()[:16]
         output_path = AUDIO_DIR / f"{text_hash}.mp3"
     
     # Create parent directory if it doesn't exist
     os.makedirs(output_path.parent, exist_ok=True)
     
+    # Reuse audio synthesized earlier for the same text and voice
+    cache_path = speech_cache_path(text, voice_id, model_id)
+    if cache_path.is_file() and cache_path.stat().st_size > 0:
+        await asyncio.to_thread(shutil.copyfile, cache_path, output_path)
+        logger.info(f"Reused cached speech for text: '{text[:50]}...'")
+        return output_path
+    
     try:
         logger.info(f"Generating speech for text: '{text[:50]}...' with voice {voice_id}")
         
-        # Run in a separate thread to avoid blocking
-        audio = await asyncio.to_thread(
-            generate,
-            text=text,
-            voice=voice_id,
-            model=model_id
-        )
+        audio = await synthesize_speech(text, voice_id, model_id)
         
         # Save the audio to the output path
         await asyncio.to_thread(save, audio, str(output_path))
         
         logger.info(f"Speech generated and saved to {output_path}")
+        
+        # Keep a copy for later videos with the same narration
+        try:
+            os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+            temp_path = cache_path.with_name(f"{cache_path.stem}.{uuid.uuid4().hex}.tmp")
+            await asyncio.to_thread(shutil.copyfile, output_path, temp_path)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache speech: {str(e)}")
+        
         return output_path
     
     except Exception as e:
@@ -135,7 +249,9 @@ async def text_to_speech(
         error_type = type(e).__name__
         error_msg = str(e)
         
-        if "401" in error_msg:
+        if isinstance(e, CircuitOpenError):
+            logger.error(f"Error generating speech: {error_msg}")
+        elif "401" in error_msg:
             logger.error(f"Error generating speech: Authentication failed. Check your Eleven Labs API key. ({error_type}: {error_msg})")
         elif "403" in error_msg:
             logger.error(f"Error generating speech: Access forbidden. Your API key may not have permission. ({error_type}: {error_msg})")
@@ -148,6 +264,29 @@ async def text_to_speech(
         
         return None
 
+async def prefetch_speech(text: str, voice_id: str = DEFAULT_VOICE_ID) -> bool:
+    """
+    Synthesize text into the speech cache before the script it belongs to
+    is complete.
+    
+    Args:
+        text: The text to synthesize
+        voice_id: The ID of the voice to use
+        
+    Returns:
+        True if the speech is in the cache
+    """
+    cache_path = speech_cache_path(text, voice_id)
+    if cache_path.is_file() and cache_path.stat().st_size > 0:
+        return True
+    
+    # text_to_speech copies new speech into the cache
+    scratch_path = TTS_CACHE_DIR / "prefetch" / f"{uuid.uuid4().hex}.mp3"
+    try:
+        return await text_to_speech(text=text, voice_id=voice_id, output_path=scratch_path) is not None and cache_path.is_file()
+    finally:
+        scratch_path.unlink(missing_ok=True)
+
 async def generate_audio_for_script(
     script: List[Dict[str, Any]],
     video_id: str,
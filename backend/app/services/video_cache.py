@@ -0,0 +1,294 @@
+"""
+Content-addressed cache of completed videos.
+
+Finished videos are indexed by a hash of the normalized request parameters and
+the pipeline version, so a repeated request can be answered with the existing
+video instead of running the pipeline again. Entries expire after a TTL and the
+least recently used entries are evicted when the index holds more than the
+maximum number of entries. The cache does not own the video files: evicting an
+entry only removes it from the index, and the video itself stays available
+under its original ID, so the limit bounds the index and not disk usage.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from app.services import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Location of the cache index
+VIDEO_CACHE_DB_PATH = Path(os.environ.get("EDUTUTOR_VIDEO_CACHE_DB", "./cache/videos.db"))
+
+# Bump when a change to prompts, models or rendering makes earlier videos stale
+PIPELINE_VERSION = os.environ.get("EDUTUTOR_PIPELINE_VERSION", "1")
+
+# Set to false to disable the cache entirely
+VIDEO_CACHE_ENABLED = os.environ.get("EDUTUTOR_VIDEO_CACHE", "true").lower() in ("1", "true", "yes")
+
+# How long a cached video is served (in seconds, default 7 days)
+VIDEO_CACHE_TTL = float(os.environ.get("EDUTUTOR_VIDEO_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Number of index entries before the least recently used are evicted; the
+# video files are not deleted, so this does not limit disk usage
+VIDEO_CACHE_MAX_ENTRIES = int(os.environ.get("EDUTUTOR_VIDEO_CACHE_MAX_ENTRIES", "10000"))
+
+# Cache metrics
+CACHE_LOOKUPS = metrics.counter("edututor_video_cache_lookups_total", "Completed-video cache lookups by result", ("result",))
+CACHE_EVICTIONS = metrics.counter("edututor_video_cache_evictions_total", "Completed-video cache evictions by reason", ("reason",))
+CACHE_ENTRIES = metrics.gauge("edututor_video_cache_entries", "Number of videos in the completed-video cache")
+CACHE_BYTES = metrics.gauge("edututor_video_cache_bytes", "Total size of the videos in the completed-video cache")
+
+def cache_key(fingerprint: str, pipeline_version: str = PIPELINE_VERSION) -> str:
+    """
+    Build the cache key for a request fingerprint.
+
+    Args:
+        fingerprint: Hash of the normalized request parameters
+        pipeline_version: Version of the generation pipeline
+
+    Returns:
+        The cache key
+    """
+    return hashlib.sha256(f"{pipeline_version}:{fingerprint}".encode("utf-8")).hexdigest()
+
+class VideoCache:
+    """
+    SQLite index that maps request cache keys to completed videos.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = VIDEO_CACHE_DB_PATH,
+        ttl: float = VIDEO_CACHE_TTL,
+        max_entries: int = VIDEO_CACHE_MAX_ENTRIES
+    ):
+        self.db_path = Path(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the cache database.
+
+        Returns:
+            A SQLite connection in autocommit mode
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_schema(self) -> None:
+        """
+        Create the cache table if it does not exist yet.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS videos (
+                        key TEXT PRIMARY KEY,
+                        video_id TEXT NOT NULL,
+                        path TEXT NOT NULL,
+                        size_bytes INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_last_used ON videos (last_used_at)")
+            finally:
+                conn.close()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a completed video.
+
+        Expired entries and entries whose video file is gone count as misses
+        and are removed.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cache entry, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT * FROM videos WHERE key = ?", (key,)).fetchone()
+                reason = None
+                if row is not None:
+                    if now - row["created_at"] > self.ttl:
+                        reason = "expired"
+                    elif not Path(row["path"]).is_file():
+                        reason = "missing"
+
+                if reason:
+                    conn.execute("DELETE FROM videos WHERE key = ?", (key,))
+                    CACHE_EVICTIONS.inc(reason=reason)
+                    row = None
+                elif row is not None:
+                    conn.execute(
+                        "UPDATE videos SET last_used_at = ?, hits = hits + 1 WHERE key = ?",
+                        (now, key)
+                    )
+                    row = conn.execute("SELECT * FROM videos WHERE key = ?", (key,)).fetchone()
+            finally:
+                conn.close()
+
+        CACHE_LOOKUPS.inc(result="hit" if row is not None else "miss")
+        return dict(row) if row is not None else None
+
+    def put(self, key: str, video_id: str, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Add a completed video to the cache and evict entries over the entry limit.
+
+        Args:
+            key: The cache key
+            video_id: The ID of the completed video
+            path: Path to the final video file
+
+        Returns:
+            The stored entry, or None if the video file does not exist
+        """
+        video_path = Path(path)
+        if not video_path.is_file():
+            logger.warning(f"Not caching video {video_id}: {path} does not exist")
+            return None
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO videos (key, video_id, path, size_bytes, created_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, video_id, str(video_path), video_path.stat().st_size, now, now)
+                )
+                row = conn.execute("SELECT * FROM videos WHERE key = ?", (key,)).fetchone()
+            finally:
+                conn.close()
+
+        logger.info(f"Cached video {video_id}")
+        self.evict()
+        return dict(row)
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Remove an entry from the cache.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            True if an entry was removed
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                removed = conn.execute("DELETE FROM videos WHERE key = ?", (key,)).rowcount
+            finally:
+                conn.close()
+        return removed > 0
+
+    def evict(self) -> List[str]:
+        """
+        Remove expired entries, then the least recently used entries until the
+        index is within the entry limit.
+
+        Only index entries are removed; the video files stay where they are.
+
+        Returns:
+            Keys of the evicted entries
+        """
+        evicted = []
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                expired = conn.execute(
+                    "SELECT key FROM videos WHERE created_at < ?",
+                    (time.time() - self.ttl,)
+                ).fetchall()
+                for row in expired:
+                    conn.execute("DELETE FROM videos WHERE key = ?", (row["key"],))
+                    evicted.append(row["key"])
+                if expired:
+                    CACHE_EVICTIONS.inc(len(expired), reason="expired")
+
+                excess = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    rows = conn.execute(
+                        "SELECT key FROM videos ORDER BY last_used_at LIMIT ?", (excess,)
+                    ).fetchall()
+                    for row in rows:
+                        conn.execute("DELETE FROM videos WHERE key = ?", (row["key"],))
+                        evicted.append(row["key"])
+                    CACHE_EVICTIONS.inc(len(rows), reason="capacity")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} videos from the cache")
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the size of the cache.
+
+        Returns:
+            Dictionary with the number of entries and their total size in bytes
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM videos").fetchone()
+        finally:
+            conn.close()
+        return {"entries": row[0], "bytes": row[1]}
+
+_video_cache: Optional[VideoCache] = None
+
+def get_video_cache() -> VideoCache:
+    """
+    Get the shared completed-video cache.
+
+    Returns:
+        The video cache
+    """
+    global _video_cache
+    if _video_cache is None:
+        _video_cache = VideoCache()
+    return _video_cache
+
+def _collect_cache_metrics() -> None:
+    """
+    Refresh the cache size gauges.
+    """
+    if _video_cache is None:
+        return
+    stats = _video_cache.stats()
+    CACHE_ENTRIES.set(stats["entries"])
+    CACHE_BYTES.set(stats["bytes"])
+
+metrics.register_collector(_collect_cache_metrics)
@@ -3,8 +3,12 @@ Helper functions for the application.
 """
 import os
 import re
+import json
 import uuid
+import hashlib
 import glob
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Union
 
@@ -17,6 +21,53 @@ def generate_uuid() -> str:
     """
     return str(uuid.uuid4())
 
+def _normalize_text(value: Optional[str]) -> str:
+    return " ".join((value or "").lower().split())
+
+def request_fingerprint(
+    prompt: str,
+    topic: Optional[str] = None,
+    grade_level: Optional[str] = None,
+    duration_minutes: float = 3.0
+) -> str:
+    """
+    Compute a stable fingerprint of the parameters of a generation request.
+    
+    Text fields are compared case-insensitively with whitespace collapsed, so
+    trivially different submissions of the same prompt map to the same value.
+    
+    Args:
+        prompt: The prompt for generating the video
+        topic: The educational topic
+        grade_level: The target grade level
+        duration_minutes: The desired duration in minutes
+        
+    Returns:
+        Hex digest identifying the request
+    """
+    # Durations are clamped to the range the code generator supports
+    duration = round(max(0.67, min(float(duration_minutes), 3.0)), 2)
+    
+    key = "\n".join([_normalize_text(prompt), _normalize_text(topic), _normalize_text(grade_level), f"{duration:.2f}"])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def edit_fingerprint(video_id: str, instruction: str) -> str:
+    """
+    Compute a stable key for an edit of a video.
+    
+    The instruction is compared case-insensitively with whitespace collapsed,
+    so resubmitting the same edit of the same video maps to the same key.
+    
+    Args:
+        video_id: The ID of the video to edit
+        instruction: The edit instruction
+        
+    Returns:
+        Key identifying the edit
+    """
+    digest = hashlib.sha256(_normalize_text(instruction).encode("utf-8")).hexdigest()
+    return f"edit:{video_id}:{digest}"
+
 def clean_code(code_text: str) -> str:
     """
     Clean the code text by removing any Markdown formatting.
@@ -36,6 +87,39 @@ def clean_code(code_text: str) -> str:
     
     return code_text.strip()
 
+def update_metadata(video_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge fields into the metadata.json file of a video.
+    
+    Args:
+        video_id: The ID of the video
+        fields: The fields to add or replace
+        
+    Returns:
+        The updated metadata
+    """
+    video_dir = Path("./videos") / video_id
+    video_dir.mkdir(parents=True, exist_ok=True)
+    metadata_path = video_dir / "metadata.json"
+    
+    metadata = {}
+    if metadata_path.exists():
+        try:
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            metadata = {}
+    
+    metadata.update(fields)
+    
+    # Write to a temporary file first so readers never see a partial file
+    temp_path = metadata_path.with_suffix(".json.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(temp_path, metadata_path)
+    
+    return metadata
+
 def find_video_files(directory: Union[str, Path]) -> List[Path]:
     """
     Find all video files in a directory and its subdirectories.
@@ -213,6 +297,51 @@ def get_video_status(video_id: str) -> Dict[str, Any]:
     """
     Get the status of a video generation process.
     
+    Args:
+        video_id: The ID of the video
+        
+    Returns:
+        Dictionary with status information
+    """
+    status = _get_video_status_from_files(video_id)
+    
+    # Merge in the state of the job from the job queue, if there is one
+    from app.services.job_queue import get_job_queue, JOB_QUEUED, JOB_FAILED, JOB_CANCELLED
+    queue = get_job_queue()
+    job = queue.get(video_id)
+    if job is None:
+        return status
+    
+    status["job_state"] = job["state"]
+    
+    if job["state"] == JOB_QUEUED:
+        status["status"] = "processing"
+        status["message"] = "Waiting in queue"
+        
+        # Estimate when a worker will pick the job up
+        position = queue.queue_position(video_id)
+        if position is not None:
+            wait = queue.estimate_wait(position - 1)
+            status["queue_position"] = position
+            status["estimated_wait_seconds"] = round(wait)
+            status["estimated_start"] = datetime.fromtimestamp(time.time() + wait, tz=timezone.utc).isoformat()
+    elif job["state"] == JOB_CANCELLED:
+        status["status"] = "failed"
+        status["message"] = "Video generation was cancelled"
+    elif job["state"] == JOB_FAILED and status["status"] != "failed":
+        status["status"] = "failed"
+        status["message"] = job["error"] or "Video generation failed"
+    elif status["status"] == "not_found":
+        # The job exists but has not created its directory yet
+        status["status"] = "processing"
+        status["message"] = "Video generation in progress"
+    
+    return status
+
+def _get_video_status_from_files(video_id: str) -> Dict[str, Any]:
+    """
+    Get the status of a video generation process from the files in its directory.
+    
     Args:
         video_id: The ID of the video
         
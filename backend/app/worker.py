@@ -0,0 +1,104 @@
+"""
+Standalone job worker.
+
+Runs queued video generation jobs from the job database without serving the
+API, so rendering can be scaled out over more processes and hosts. Every
+worker leases the jobs it claims and renews the leases with heartbeats; when
+a worker dies, its jobs go back to the queue after the lease expires.
+
+Workers must share the job database (EDUTUTOR_JOBS_DB) and the videos/,
+audio/ and cache/ directories with the API, for example by running from the
+same working directory on a shared filesystem. Their counters and histograms
+are written to the metrics snapshot directory, where /api/metrics finds them.
+
+In the "process" worker mode the API starts and supervises these workers
+itself (see app/services/supervisor.py).
+
+Usage:
+    python -m app.worker [--concurrency N] [--worker-id ID]
+"""
+import os
+import signal
+import asyncio
+import logging
+import argparse
+from typing import Optional
+
+from app.routers.generate import generate_video_task
+from app.services.job_queue import start_job_workers, stop_job_workers, JOB_WORKERS, JOBS_DB_PATH
+from app.services.metrics import write_snapshot, snapshot_name
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# How often the worker writes its metrics snapshot (in seconds)
+SNAPSHOT_INTERVAL = 10.0
+
+async def write_snapshots(name: str) -> None:
+    """
+    Write the metrics snapshot of this worker periodically until cancelled.
+
+    Args:
+        name: Name of the snapshot
+    """
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(write_snapshot, name)
+        except Exception as e:
+            logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+async def run_worker(concurrency: int, worker_id: Optional[str] = None) -> None:
+    """
+    Run jobs until the process receives SIGINT or SIGTERM.
+
+    Args:
+        concurrency: Number of jobs to run at once
+        worker_id: ID the worker leases jobs under
+    """
+    for directory in ("videos", "audio", "temp"):
+        os.makedirs(directory, exist_ok=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows; Ctrl+C still stops the worker
+            pass
+
+    pool = start_job_workers(generate_video_task, concurrency=concurrency, worker_id=worker_id)
+    logger.info(f"Worker {pool.worker_id} is running jobs from {JOBS_DB_PATH}")
+
+    name = snapshot_name(pool.worker_id)
+    snapshots = asyncio.create_task(write_snapshots(name))
+
+    try:
+        await stop.wait()
+    finally:
+        # Running jobs are put back in the queue for other workers
+        await stop_job_workers()
+        snapshots.cancel()
+        write_snapshot(name)
+
+def main() -> None:
+    """
+    Parse the command line and run the worker.
+    """
+    parser = argparse.ArgumentParser(description="Run EduTutor video generation jobs")
+    parser.add_argument("--concurrency", type=int, default=max(1, JOB_WORKERS), help="Number of jobs to run at once")
+    parser.add_argument("--worker-id", default=None, help="Worker ID, by default the host name and process ID")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_worker(args.concurrency, args.worker_id))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
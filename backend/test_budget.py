@@ -0,0 +1,175 @@
+"""
+Test script to verify that the pipeline degrades quality to meet request deadlines.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import uuid
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.budget import Budget, cap_segments
+from app.routers import generate
+
+EXAMPLE_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    def construct(self):
+        # NARRATION: First we draw a circle.
+        self.play(Create(Circle()))
+        # NARRATION: Then we draw a square.
+        self.play(Create(Square()))
+        # NARRATION: Finally we draw a triangle.
+        self.play(Create(Triangle()))
+'''
+
+def test_cap_segments():
+    """Test that capping the narration merges segments without losing text."""
+    script = [
+        {"text": f"Segment {i}.", "timing": {"start": i * 2.0, "duration": 2.0}, "type": "narration"}
+        for i in range(5)
+    ]
+    capped = cap_segments(script, 2)
+
+    if len(capped) != 2 or " ".join(s["text"] for s in capped) != " ".join(s["text"] for s in script):
+        logger.error(f"❌ FAIL: Unexpected capped script {capped}")
+        return False
+    if capped[1]["timing"] != {"start": 6.0, "duration": 4.0}:
+        logger.error(f"❌ FAIL: Merged segment has timing {capped[1]['timing']}")
+        return False
+
+    logger.info("✅ PASS: Narration segments are merged to meet the cap")
+    return True
+
+def test_cap_around_prefetched():
+    """Test that capping the narration leaves prefetched segments as they are."""
+    script = [
+        {"text": f"Segment {i}.", "timing": {"start": i * 2.0, "duration": 2.0}, "type": "narration"}
+        for i in range(6)
+    ]
+    ready = {"Segment 0.", "Segment 1."}
+    capped = cap_segments(script, 2, keep=ready)
+
+    texts = [s["text"] for s in capped]
+    if texts[:2] != ["Segment 0.", "Segment 1."] or len(capped) != 4:
+        logger.error(f"❌ FAIL: Prefetched segments were merged: {texts}")
+        return False
+    if " ".join(texts) != " ".join(s["text"] for s in script):
+        logger.error(f"❌ FAIL: Narration text was lost: {texts}")
+        return False
+
+    logger.info("✅ PASS: Prefetched narration segments are kept when capping")
+    return True
+
+def test_concurrent_stages():
+    """Test that stages running at the same time are budgeted as the slowest of them."""
+    budget = Budget(deadline_at=time.time() + 150.0)
+    if budget.fits("generate", "render", "tts", "merge") or not budget.fits("generate", ("render", "tts"), "merge"):
+        logger.error("❌ FAIL: Concurrent render and narration were budgeted one after the other")
+        return False
+
+    logger.info("✅ PASS: Concurrent stages are budgeted as the slowest of them")
+    return True
+
+def test_budget_without_deadline():
+    """Test that a budget without a deadline never asks for degradations."""
+    budget = Budget()
+    if not budget.fits("generate", "render", "tts", "merge") or budget.call_timeout(180.0, "render") != 180.0:
+        logger.error("❌ FAIL: A budget without a deadline limited the pipeline")
+        return False
+
+    logger.info("✅ PASS: Jobs without a deadline are not degraded")
+    return True
+
+async def test_tight_deadline():
+    """Test that a job with a tight deadline picks the fast variants and records them."""
+    test_video_id = f"test_budget_{uuid.uuid4().hex[:8]}"
+    video_dir = Path(f"./videos/{test_video_id}")
+    calls = {}
+
+    async def fake_generate(prompt, topic=None, grade_level=None, duration_minutes=3.0, max_retries=3, timeout=120.0, model_name=None, on_section=None, use_cache=True, use_templates=True):
+        calls["model_name"] = model_name
+        calls["duration_minutes"] = duration_minutes
+        return EXAMPLE_CODE
+
+    async def fake_render(video_id, manim_code, progress_callback=None, draft=False, reuse_from=None):
+        calls["draft"] = draft
+        video_path = video_dir / f"{video_id}.mp4"
+        video_path.write_bytes(b"This is a dummy video file")
+        return str(video_path)
+
+    async def fake_tts(script, video_id):
+        calls["segments"] = len(script)
+        return {"video_id": video_id, "segments": []}
+
+    async def fake_merge(video_path, audio_manifest, output_path):
+        Path(output_path).write_bytes(b"This is a dummy merged video file")
+        return Path(output_path)
+
+    originals = (generate.generate_manim_code, generate.execute_manim_code_without_audio,
+                 generate.generate_audio_for_script, generate.merge_audio_segments_with_video)
+    generate.generate_manim_code = fake_generate
+    generate.execute_manim_code_without_audio = fake_render
+    generate.generate_audio_for_script = fake_tts
+    generate.merge_audio_segments_with_video = fake_merge
+
+    try:
+        result = await generate.generate_video_task(
+            test_video_id, prompt="Draw shapes", duration_minutes=3.0, deadline_at=time.time() + 5.0
+        )
+        with open(video_dir / "metadata.json", "r") as f:
+            metadata = json.load(f)
+
+        degradations = {d["degradation"] for d in metadata.get("budget", {}).get("degradations", [])}
+        expected = {"fast_model", "shorter_video", "draft_render"}
+        if not result or not expected <= degradations:
+            logger.error(f"❌ FAIL: Job returned {result} with degradations {degradations}")
+            return False
+        if calls["model_name"] != generate.GEMINI_FAST_MODEL or calls["duration_minutes"] != 1.0 or not calls["draft"]:
+            logger.error(f"❌ FAIL: Stages were not run in their fast variants: {calls}")
+            return False
+        if calls["segments"] >= 3:
+            logger.error(f"❌ FAIL: Narration was not reduced ({calls['segments']} segments)")
+            return False
+
+        logger.info("✅ PASS: A tight deadline selects the fast variants and records them")
+        return True
+
+    finally:
+        (generate.generate_manim_code, generate.execute_manim_code_without_audio,
+         generate.generate_audio_for_script, generate.merge_audio_segments_with_video) = originals
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing latency budgets...")
+
+    # Run the tests
+    test1 = test_cap_segments()
+    test2 = test_budget_without_deadline()
+    test3 = test_cap_around_prefetched()
+    # Before any stage has run, so the default stage durations are used
+    test4 = test_concurrent_stages()
+    test5 = await test_tight_deadline()
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5:
+        logger.info("✅ All tests passed! Jobs degrade to meet their deadlines.")
+    else:
+        logger.error("❌ Some tests failed. Jobs may not meet their deadlines.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
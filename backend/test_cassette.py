@@ -0,0 +1,152 @@
+"""
+Test script to verify recording and replaying of external calls.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import llm_client, tts
+from app.services.cassette import Cassette, CassetteMissError, MODE_RECORD, MODE_REPLAY, LATENCY_NONE, LATENCY_RECORDED
+from app.services.llm_client import LLMClient, GEMINI_MODEL
+
+CHUNKS = ["from manim import *\n", "class CreateScene(Scene):\n", "    def construct(self):\n        pass\n"]
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Streams the chunks 0.05 seconds apart."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+
+        class Stream:
+            async def __aiter__(self):
+                for chunk in CHUNKS:
+                    await asyncio.sleep(0.05)
+                    yield FakeChunk(chunk)
+
+        return Stream()
+
+async def test_gemini_record_and_replay(directory: Path):
+    """Test that a streamed Gemini call is recorded and replayed without a key."""
+    path = directory / "cassette.db"
+    original = llm_client.get_cassette
+
+    try:
+        # Record a call through a client with a key
+        llm_client.get_cassette = lambda: Cassette(path, MODE_RECORD)
+        model = FakeModel()
+        client = LLMClient("test-key")
+        client._bind_loop()
+        client._models[GEMINI_MODEL] = model
+        recorded = await client.generate("Draw a circle", on_chunk=lambda text: None)
+
+        # Replay it through a client without a key, at the recorded pace
+        replay_cassette = Cassette(path, MODE_REPLAY, LATENCY_RECORDED)
+        llm_client.get_cassette = lambda: replay_cassette
+        client = LLMClient(None)
+        arrivals = []
+        start = time.perf_counter()
+        replayed = await client.generate("Draw a circle", on_chunk=lambda text: arrivals.append((time.perf_counter() - start, text)))
+
+        if replayed != recorded or [text for _, text in arrivals] != CHUNKS:
+            logger.error(f"❌ FAIL: Replayed {replayed!r} instead of {recorded!r}")
+            return False
+        if not (arrivals[0][0] >= 0.03 and arrivals[-1][0] >= 0.12):
+            logger.error(f"❌ FAIL: Chunks were not replayed at their recorded times: {arrivals}")
+            return False
+
+        try:
+            await client.generate("Draw a square")
+            logger.error("❌ FAIL: An unrecorded request was served")
+            return False
+        except CassetteMissError:
+            pass
+
+        logger.info("✅ PASS: Streamed Gemini calls are replayed offline at their recorded pace")
+        return True
+
+    finally:
+        llm_client.get_cassette = original
+
+async def test_tts_record_and_replay(directory: Path):
+    """Test that speech synthesis is recorded and replayed."""
+    path = directory / "cassette.db"
+    calls = []
+
+    def fake_generate(text, voice, model):
+        calls.append(text)
+        return b"ID3 fake audio"
+
+    originals = (tts.get_cassette, tts.generate)
+    tts.generate = fake_generate
+
+    try:
+        tts.get_cassette = lambda: Cassette(path, MODE_RECORD)
+        recorded = await tts.synthesize_speech("Hello", "voice", "model")
+
+        tts.get_cassette = lambda: Cassette(path, MODE_REPLAY, LATENCY_NONE)
+        replayed = await tts.synthesize_speech("Hello", "voice", "model")
+
+        if replayed != recorded or len(calls) != 1:
+            logger.error(f"❌ FAIL: Replayed {replayed!r} after {len(calls)} calls")
+            return False
+
+        logger.info("✅ PASS: Speech synthesis is replayed from the cassette")
+        return True
+
+    finally:
+        (tts.get_cassette, tts.generate) = originals
+
+async def test_repeated_recordings(directory: Path):
+    """Test that repeated recordings of a request are served in turn."""
+    cassette = Cassette(directory / "repeated.db", MODE_RECORD)
+    cassette.record("test", {"prompt": "p"}, "first", 0.1)
+    cassette.record("test", {"prompt": "p"}, "second", 0.2)
+    cassette.mode = MODE_REPLAY
+
+    served = [await cassette.replay("test", {"prompt": "p"}) for _ in range(3)]
+    if served != ["first", "second", "first"] or cassette.stats() != {"test": {"recordings": 2, "requests": 1}}:
+        logger.error(f"❌ FAIL: Served {served}, stats {cassette.stats()}")
+        return False
+
+    logger.info("✅ PASS: Repeated recordings are served in turn")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing the cassette...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Run the tests
+        test1 = await test_gemini_record_and_replay(Path(temp_dir))
+        test2 = await test_tts_record_and_replay(Path(temp_dir))
+        test3 = await test_repeated_recordings(Path(temp_dir))
+
+    # Print summary
+    if test1 and test2 and test3:
+        logger.info("✅ All tests passed! External calls can be recorded and replayed offline.")
+    else:
+        logger.error("❌ Some tests failed. Recording or replaying external calls may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
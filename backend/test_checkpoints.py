@@ -0,0 +1,196 @@
+"""
+Test script to verify that interrupted jobs resume from their pipeline checkpoints.
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+import uuid
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.checkpoints import record_checkpoint, load_valid_checkpoints
+from app.services.job_queue import JobQueue
+from app.routers import generate
+
+EXAMPLE_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: Let's draw a circle.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)
+'''
+
+def create_artifacts(video_id: str) -> Path:
+    """Create the files a run leaves behind after rendering and narration."""
+    video_dir = Path(f"./videos/{video_id}")
+    video_dir.mkdir(parents=True, exist_ok=True)
+
+    code_path = video_dir / f"{video_id}.py"
+    code_path.write_text(EXAMPLE_CODE)
+
+    video_path = video_dir / f"{video_id}.mp4"
+    video_path.write_bytes(b"This is a dummy video file")
+
+    audio_path = video_dir / "segment_000.mp3"
+    audio_path.write_bytes(b"This is a dummy audio file")
+
+    manifest_path = video_dir / "manifest.json"
+    manifest_path.write_text(json.dumps({
+        "video_id": video_id,
+        "segments": [{"index": 0, "text": "Let's draw a circle.", "audio_path": str(audio_path)}]
+    }))
+
+    record_checkpoint(video_id, "generate", {"code_path": str(code_path)})
+    record_checkpoint(video_id, "render", {"video_path": str(video_path)})
+    record_checkpoint(video_id, "narration", {"manifest_path": str(manifest_path)})
+    return video_dir
+
+def test_checkpoint_validation():
+    """Test that checkpoints with missing artifacts are not trusted."""
+    test_video_id = f"test_checkpoints_{uuid.uuid4().hex[:8]}"
+    video_dir = create_artifacts(test_video_id)
+
+    try:
+        checkpoints = load_valid_checkpoints(test_video_id)
+        if set(checkpoints) != {"generate", "render", "narration"}:
+            logger.error(f"❌ FAIL: Expected three valid checkpoints, got {list(checkpoints)}")
+            return False
+        logger.info("✅ PASS: Valid checkpoints are loaded")
+
+        # Remove the rendered video; only the render checkpoint becomes invalid
+        (video_dir / f"{test_video_id}.mp4").unlink()
+        checkpoints = load_valid_checkpoints(test_video_id)
+        if "render" in checkpoints or "generate" not in checkpoints:
+            logger.error(f"❌ FAIL: Render checkpoint should be invalid, got {list(checkpoints)}")
+            return False
+        logger.info("✅ PASS: Checkpoints with missing artifacts are skipped")
+
+        return True
+
+    finally:
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+async def test_resume_skips_completed_stages():
+    """Test that a resumed job only runs the merge stage."""
+    test_video_id = f"test_resume_{uuid.uuid4().hex[:8]}"
+    video_dir = create_artifacts(test_video_id)
+    calls = []
+
+    async def fail_if_called(*args, **kwargs):
+        calls.append("unexpected")
+        raise RuntimeError("Completed stage was run again")
+
+    async def fake_merge(video_path, audio_manifest, output_path):
+        calls.append("merge")
+        Path(output_path).write_bytes(b"This is a dummy merged video file")
+        return Path(output_path)
+
+    originals = (generate.generate_manim_code, generate.execute_manim_code_without_audio,
+                 generate.generate_audio_for_script, generate.merge_audio_segments_with_video)
+    generate.generate_manim_code = fail_if_called
+    generate.execute_manim_code_without_audio = fail_if_called
+    generate.generate_audio_for_script = fail_if_called
+    generate.merge_audio_segments_with_video = fake_merge
+
+    try:
+        result = await generate.generate_video_task(test_video_id, prompt="Draw a circle")
+
+        if result and calls == ["merge"]:
+            logger.info("✅ PASS: Resumed job skipped the completed stages")
+            return True
+
+        logger.error(f"❌ FAIL: Resumed job returned {result} and ran {calls}")
+        return False
+
+    finally:
+        (generate.generate_manim_code, generate.execute_manim_code_without_audio,
+         generate.generate_audio_for_script, generate.merge_audio_segments_with_video) = originals
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+async def test_failed_merge():
+    """Test that a merge without an output video fails the job."""
+    test_video_id = f"test_merge_{uuid.uuid4().hex[:8]}"
+    video_dir = create_artifacts(test_video_id)
+
+    async def failed_merge(video_path, audio_manifest, output_path):
+        return None
+
+    original = generate.merge_audio_segments_with_video
+    generate.merge_audio_segments_with_video = failed_merge
+
+    try:
+        result = await generate.generate_video_task(test_video_id, prompt="Draw a circle")
+        metadata = json.loads((video_dir / "metadata.json").read_text())
+        if result or metadata.get("status") == "completed" or "merge" in load_valid_checkpoints(test_video_id):
+            logger.error(f"❌ FAIL: A merge without output completed the job ({result}, {metadata.get('status')})")
+            return False
+        if not (video_dir / "error.txt").exists():
+            logger.error("❌ FAIL: The merge failure was not recorded")
+            return False
+
+        logger.info("✅ PASS: A merge without output fails the job")
+        return True
+
+    finally:
+        generate.merge_audio_segments_with_video = original
+        shutil.rmtree(video_dir, ignore_errors=True)
+
+async def test_resume_legacy_video():
+    """Test that a video without a job is resumed with its stored request."""
+    test_video_id = f"test_legacy_{uuid.uuid4().hex[:8]}"
+    video_dir = Path(f"./videos/{test_video_id}")
+    video_dir.mkdir(parents=True, exist_ok=True)
+    (video_dir / "metadata.json").write_text(json.dumps({
+        "status": "error", "prompt": "Draw a circle", "topic": "Geometry", "grade_level": "5", "duration_minutes": 1.5
+    }))
+
+    original = generate.get_job_queue
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+        generate.get_job_queue = lambda: queue
+        try:
+            await generate.resume_video(test_video_id)
+            params = queue.get(test_video_id)["params"]
+        finally:
+            generate.get_job_queue = original
+            shutil.rmtree(video_dir, ignore_errors=True)
+
+    if params.get("grade_level") != "5" or params.get("duration_minutes") != 1.5:
+        logger.error(f"❌ FAIL: The resumed job lost its request parameters: {params}")
+        return False
+
+    logger.info("✅ PASS: Videos without a job resume with their grade level and duration")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing pipeline checkpoints...")
+
+    # Run the tests
+    test1 = test_checkpoint_validation()
+    test2 = await test_resume_skips_completed_stages()
+    test3 = await test_failed_merge()
+    test4 = await test_resume_legacy_video()
+
+    # Print summary
+    if test1 and test2 and test3 and test4:
+        logger.info("✅ All tests passed! Interrupted jobs resume from their checkpoints.")
+    else:
+        logger.error("❌ Some tests failed. Interrupted jobs may not resume correctly.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,271 @@
+"""
+Test script to verify that edits patch the code of an earlier video.
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+import uuid
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import code_edit, manim
+from app.services.code_edit import EditApplyError, apply_edit_blocks, parse_edit_blocks, edit_manim_code
+from app.services.llm_client import LLMClient
+from app.routers import generate
+from app.utils.helpers import edit_fingerprint
+
+EXAMPLE_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    def construct(self):
+        # NARRATION: Let's draw a circle.
+        circle = Circle()
+        self.play(Create(circle))
+        self.wait(1)
+        # NARRATION: Now we draw a square.
+        self.play(Create(Square()))
+        self.wait(1)
+'''
+
+SLOWER_EDIT = '''Here are the changes:
+
+<<<<<<< SEARCH
+        self.play(Create(circle))
+        self.wait(1)
+=======
+        self.play(Create(circle), run_time=3)
+        self.wait(3)
+>>>>>>> REPLACE
+'''
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Answers with the given texts in turn and records the prompts."""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.prompts.append(prompt)
+        return FakeResponse(self.answers.pop(0))
+
+def test_apply_blocks():
+    """Test that blocks are applied and bad blocks are rejected."""
+    edited = apply_edit_blocks(EXAMPLE_CODE, parse_edit_blocks(SLOWER_EDIT))
+    if "run_time=3" not in edited or "self.wait(3)" not in edited or "Create(Square())" not in edited:
+        logger.error(f"❌ FAIL: The edit was not applied:\n{edited}")
+        return False
+
+    # Trailing whitespace in the answer does not prevent a match
+    loose = apply_edit_blocks(EXAMPLE_CODE, [("        circle = Circle()   \n", "        circle = Circle(color=RED)\n")])
+    if "Circle(color=RED)" not in loose:
+        logger.error("❌ FAIL: A block with trailing whitespace was not applied")
+        return False
+
+    for blocks in ([("        self.wait(1)\n", "")], [("        self.play(Create(Triangle()))\n", "")]):
+        try:
+            apply_edit_blocks(EXAMPLE_CODE, blocks)
+            logger.error(f"❌ FAIL: An ambiguous or missing block was applied: {blocks}")
+            return False
+        except EditApplyError:
+            pass
+
+    logger.info("✅ PASS: Edit blocks are applied and ambiguous or missing ones are rejected")
+    return True
+
+async def run_edit(answers, fake_generate=None):
+    """Run an edit against a fake model."""
+    model = FakeModel(answers)
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[code_edit.GEMINI_EDIT_MODEL] = model
+
+    originals = (code_edit.get_llm_client, code_edit.GEMINI_API_KEY, code_edit.generate_manim_code)
+    code_edit.get_llm_client = lambda: client
+    code_edit.GEMINI_API_KEY = "test-key"
+    if fake_generate is not None:
+        code_edit.generate_manim_code = fake_generate
+
+    try:
+        edited = await edit_manim_code(EXAMPLE_CODE, "Make the circle slower", "Draw a circle and a square", retry_delay=0.0)
+    finally:
+        (code_edit.get_llm_client, code_edit.GEMINI_API_KEY, code_edit.generate_manim_code) = originals
+    return edited, model
+
+async def test_edit_retries():
+    """Test that an answer that cannot be applied is retried with the problem."""
+    edited, model = await run_edit(["I would make it slower.", SLOWER_EDIT])
+
+    if "run_time=3" not in edited or len(model.prompts) != 2:
+        logger.error(f"❌ FAIL: The edit took {len(model.prompts)} calls and returned:\n{edited}")
+        return False
+    if "could not be used" not in model.prompts[1] or "Make the circle slower" not in model.prompts[0]:
+        logger.error("❌ FAIL: The retry did not explain the problem")
+        return False
+
+    logger.info("✅ PASS: Edits are retried with the reason the answer could not be used")
+    return True
+
+async def test_regenerate_on_failure():
+    """Test that the code is generated again when no edit can be applied."""
+    prompts = []
+
+    async def fake_generate(prompt, topic=None, duration_minutes=3.0, retry_delay=2.0, timeout=120.0, on_section=None):
+        prompts.append(prompt)
+        return EXAMPLE_CODE
+
+    edited, model = await run_edit(["No blocks"] * 3, fake_generate)
+
+    if edited != EXAMPLE_CODE or prompts != ["Draw a circle and a square\n\nMake the circle slower"]:
+        logger.error(f"❌ FAIL: The code was not generated again for the edited request: {prompts}")
+        return False
+
+    logger.info("✅ PASS: Failed edits fall back to generating the code again")
+    return True
+
+def test_partial_movies():
+    """Test that partial movie files are kept and offered to the next render."""
+    source_id = f"test_edit_{uuid.uuid4().hex[:8]}"
+    edited_id = f"test_edit_{uuid.uuid4().hex[:8]}"
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            media_dir = Path(temp_dir) / "source"
+            scene_dir = media_dir / "videos" / source_id / "480p15" / "partial_movie_files" / "CreateScene"
+            scene_dir.mkdir(parents=True)
+            for name in ("111.mp4", "222.mp4"):
+                (scene_dir / name).write_bytes(b"partial movie")
+
+            kept = manim.save_partial_movies(media_dir, source_id)
+            seeded = manim.seed_partial_movies(Path(temp_dir) / "edited", edited_id, source_id)
+            seeded_dir = Path(temp_dir) / "edited" / "videos" / edited_id / "480p15" / "partial_movie_files" / "CreateScene"
+
+            if kept != 2 or seeded != 2 or sorted(p.name for p in seeded_dir.glob("*.mp4")) != ["111.mp4", "222.mp4"]:
+                logger.error(f"❌ FAIL: Kept {kept} and seeded {seeded} partial movie files")
+                return False
+
+        if manim.count_reused_animations("Animation 0 : Using cached data (hash : 111)\nAnimation 1 : Partial movie file written") != 1:
+            logger.error("❌ FAIL: Reused animations were not counted")
+            return False
+
+        logger.info("✅ PASS: Partial movie files are kept and reused by the render of an edit")
+        return True
+
+    finally:
+        shutil.rmtree(manim.VIDEOS_DIR / source_id, ignore_errors=True)
+
+async def test_edit_job():
+    """Test that an edit job patches the earlier code and reuses its render."""
+    source_id = f"test_edit_{uuid.uuid4().hex[:8]}"
+    edited_id = f"test_edit_{uuid.uuid4().hex[:8]}"
+    source_dir = Path(f"./videos/{source_id}")
+    edited_dir = Path(f"./videos/{edited_id}")
+    source_dir.mkdir(parents=True, exist_ok=True)
+    (source_dir / f"{source_id}.py").write_text(EXAMPLE_CODE)
+    calls = {}
+
+    async def fake_edit(manim_code, instruction, prompt, topic=None, duration_minutes=3.0, timeout=120.0, on_section=None):
+        calls["edit"] = (manim_code, instruction, prompt)
+        return apply_edit_blocks(manim_code, parse_edit_blocks(SLOWER_EDIT))
+
+    async def fail_if_called(*args, **kwargs):
+        raise RuntimeError("An edit generated the code from scratch")
+
+    async def fake_render(video_id, manim_code, progress_callback=None, draft=False, reuse_from=None):
+        calls["reuse_from"] = reuse_from
+        video_path = edited_dir / f"{video_id}.mp4"
+        video_path.write_bytes(b"This is a dummy video file")
+        return str(video_path)
+
+    async def fake_tts(script, video_id):
+        return {"video_id": video_id, "segments": []}
+
+    async def fake_merge(video_path, audio_manifest, output_path):
+        Path(output_path).write_bytes(b"This is a dummy merged video file")
+        return Path(output_path)
+
+    originals = (generate.edit_manim_code, generate.generate_manim_code, generate.execute_manim_code_without_audio,
+                 generate.generate_audio_for_script, generate.merge_audio_segments_with_video, generate.VIDEO_CACHE_ENABLED)
+    generate.edit_manim_code = fake_edit
+    generate.generate_manim_code = fail_if_called
+    generate.execute_manim_code_without_audio = fake_render
+    generate.generate_audio_for_script = fake_tts
+    generate.merge_audio_segments_with_video = fake_merge
+    generate.VIDEO_CACHE_ENABLED = False
+
+    try:
+        result = await generate.generate_video_task(
+            edited_id, prompt="Draw a circle and a square", edit_of=source_id, instruction="Make the circle slower"
+        )
+        with open(edited_dir / "metadata.json", "r") as f:
+            metadata = json.load(f)
+
+        if not result or calls.get("edit") != (EXAMPLE_CODE, "Make the circle slower", "Draw a circle and a square"):
+            logger.error(f"❌ FAIL: The edit job returned {result} after {calls}")
+            return False
+        if calls["reuse_from"] != source_id or "run_time=3" not in (edited_dir / f"{edited_id}.py").read_text():
+            logger.error("❌ FAIL: The edited code was not saved or its render did not reuse the earlier one")
+            return False
+        if metadata.get("edit_of") != source_id or metadata.get("prompt") != "Draw a circle and a square\n\nMake the circle slower":
+            logger.error(f"❌ FAIL: The metadata does not describe the edit: {metadata}")
+            return False
+
+        logger.info("✅ PASS: Edit jobs patch the earlier code and reuse its render")
+        return True
+
+    finally:
+        (generate.edit_manim_code, generate.generate_manim_code, generate.execute_manim_code_without_audio,
+         generate.generate_audio_for_script, generate.merge_audio_segments_with_video, generate.VIDEO_CACHE_ENABLED) = originals
+        shutil.rmtree(source_dir, ignore_errors=True)
+        shutil.rmtree(edited_dir, ignore_errors=True)
+
+def test_edit_keys():
+    """Test that resubmitted edits share a key and edits of other videos do not."""
+    key = edit_fingerprint("video_a", "Make the circle slower")
+    if edit_fingerprint("video_a", "  make the CIRCLE   slower ") != key:
+        logger.error("❌ FAIL: The same edit got another key")
+        return False
+    if edit_fingerprint("video_b", "Make the circle slower") == key or not key.startswith("edit:video_a:"):
+        logger.error(f"❌ FAIL: The key {key} does not identify the edited video")
+        return False
+
+    logger.info("✅ PASS: Edits are keyed by the video and the normalized instruction")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing code edits...")
+
+    # Run the tests
+    test1 = test_apply_blocks()
+    test2 = await test_edit_retries()
+    test3 = await test_regenerate_on_failure()
+    test4 = test_partial_movies()
+    test5 = await test_edit_job()
+    test6 = test_edit_keys()
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5 and test6:
+        logger.info("✅ All tests passed! Edits patch the code of the earlier video.")
+    else:
+        logger.error("❌ Some tests failed. Editing videos may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
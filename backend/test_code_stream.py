@@ -0,0 +1,187 @@
+"""
+Test script to verify that streamed Manim code is processed section by section.
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import code_stream, gemini
+from app.services.code_stream import CodeSectionSplitter, NarrationPrefetcher, check_section_syntax
+from app.services.llm_client import LLMClient
+
+EXAMPLE_CODE = '''```python
+from manim import *
+
+class CreateScene(Scene):
+    def construct(self):
+        self.intro()
+        self.shapes()
+
+    # NARRATION: First we introduce the topic.
+    # It is about shapes.
+    def intro(self):
+        self.play(Write(Text("Shapes")))
+        self.wait(1)
+
+    # NARRATION: Then we draw a circle.
+    def shapes(self):
+        def make_circle():
+            return Circle()
+        self.play(Create(make_circle()))
+        self.wait(2)
+```'''
+
+BROKEN_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: This method is broken.
+    def construct(self):
+        self.play(Create(Circle())
+
+    # NARRATION: This one is fine.
+    def outro(self):
+        self.wait(1)
+'''
+
+def chunks(text, size=7):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def test_splitter():
+    """Test that sections are emitted as soon as the next method starts."""
+    splitter = CodeSectionSplitter()
+    emitted = []
+    for i, chunk in enumerate(chunks(EXAMPLE_CODE)):
+        for section in splitter.feed(chunk):
+            emitted.append((i, section))
+    rest = splitter.finish()
+
+    sections = [section for _, section in emitted] + rest
+    if len(sections) != 4 or "```" in "".join(sections):
+        logger.error(f"❌ FAIL: Unexpected sections {sections}")
+        return False
+    if not sections[2].lstrip().startswith("# NARRATION: First") or "make_circle" not in sections[3]:
+        logger.error(f"❌ FAIL: Narration comments or nested functions are in the wrong section: {sections}")
+        return False
+    if any(check_section_syntax(section) for section in sections):
+        logger.error("❌ FAIL: Valid sections were reported as invalid")
+        return False
+    if emitted[2][0] >= len(chunks(EXAMPLE_CODE)) - 1:
+        logger.error("❌ FAIL: The intro section was only emitted at the end of the stream")
+        return False
+
+    logger.info("✅ PASS: Streamed code is split into finished methods")
+    return True
+
+def test_syntax_check():
+    """Test that a method with a syntax error is detected on its own."""
+    splitter = CodeSectionSplitter()
+    sections = splitter.feed(BROKEN_CODE) + splitter.finish()
+    errors = [check_section_syntax(section) for section in sections]
+
+    if errors[0] is not None or errors[1] is None or errors[2] is not None:
+        logger.error(f"❌ FAIL: Unexpected syntax check results {errors}")
+        return False
+
+    logger.info("✅ PASS: Syntax errors are found per method")
+    return True
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeStream:
+    def __init__(self, text):
+        self._chunks = [FakeChunk(chunk) for chunk in chunks(text)]
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+class FakeModel:
+    """Stands in for a streaming Gemini model that answers with the given codes in turn."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        text = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return FakeStream(text)
+
+async def test_streaming_generation():
+    """Test that broken code is retried early and narration is prefetched from valid sections."""
+    model = FakeModel(BROKEN_CODE, EXAMPLE_CODE)
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[gemini.GEMINI_MODEL] = model
+    synthesized = []
+
+    async def fake_verify():
+        return True, "ok"
+
+    async def fake_prefetch(text, voice_id=None):
+        synthesized.append(text)
+        return True
+
+    originals = (gemini.get_llm_client, gemini.GEMINI_API_KEY, code_stream.verify_api_access, code_stream.prefetch_speech)
+    gemini.get_llm_client = lambda: client
+    gemini.GEMINI_API_KEY = "test-key"
+    code_stream.verify_api_access = fake_verify
+    code_stream.prefetch_speech = fake_prefetch
+
+    try:
+        prefetcher = NarrationPrefetcher("test_stream")
+        code = await gemini.generate_manim_code(
+            "Draw shapes", max_retries=2, retry_delay=0.0, model_name=gemini.GEMINI_MODEL,
+            on_section=prefetcher.add_section, use_cache=False
+        )
+        await prefetcher.wait()
+
+        if model.calls != 2 or "make_circle" not in code:
+            logger.error(f"❌ FAIL: Broken code was not retried ({model.calls} calls)")
+            return False
+        expected = {"First we introduce the topic. It is about shapes.", "Then we draw a circle."}
+        if set(synthesized) != expected:
+            logger.error(f"❌ FAIL: Unexpected prefetched narration {synthesized}")
+            return False
+        script = [{"text": text} for text in sorted(expected)]
+        if prefetcher.missing(script):
+            logger.error("❌ FAIL: Prefetched narration is reported as missing")
+            return False
+
+        logger.info("✅ PASS: Broken code is retried early and narration is prefetched")
+        return True
+
+    finally:
+        (gemini.get_llm_client, gemini.GEMINI_API_KEY, code_stream.verify_api_access, code_stream.prefetch_speech) = originals
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing streamed code generation...")
+
+    # Run the tests
+    test1 = test_splitter()
+    test2 = test_syntax_check()
+    test3 = await test_streaming_generation()
+
+    # Print summary
+    if test1 and test2 and test3:
+        logger.info("✅ All tests passed! Streamed code is processed section by section.")
+    else:
+        logger.error("❌ Some tests failed. Streamed code may not be processed incrementally.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
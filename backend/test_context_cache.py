@@ -0,0 +1,221 @@
+"""
+Test script to verify context caching of the static code generation prompt.
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import google.generativeai as genai
+
+from app.services import gemini, llm_client
+from app.services.context_cache import ContextCache, LocalContextBackend, provider_supported
+from app.services.llm_client import LLMClient, GEMINI_MODEL
+from app.services.resilience import Upstream, CircuitOpenError
+
+VALID_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: We draw a circle.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)'''
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Records the prompts it receives."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.prompts.append(prompt)
+
+        class Stream:
+            async def __aiter__(self):
+                yield FakeChunk(VALID_CODE)
+
+        return Stream()
+
+class RecordingBackend(LocalContextBackend):
+    """Local backend that records the prompts sent with cached context."""
+
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.sent = []
+
+    def create(self, model_name, prefix, ttl):
+        if self.fail:
+            raise ValueError("Cached content is too small")
+        return super().create(model_name, prefix, ttl)
+
+    def model(self, base_model, handle):
+        model = super().model(base_model, handle)
+        backend = self
+
+        class Recording:
+            async def generate_content_async(self, prompt, **kwargs):
+                backend.sent.append(prompt)
+                return await model.generate_content_async(prompt, **kwargs)
+
+        return Recording()
+
+def test_prompt_split():
+    """Test that the prefix is the same for requests of a content type."""
+    agent = gemini.ManimEducationalAgent()
+    first_prefix, first_suffix = agent.build_prompt("Algebra", "Solve the equation x + 2 = 5", 1.0)
+    second_prefix, second_suffix = agent.build_prompt("Physics", "Calculate the value of the speed", 3.0)
+
+    if first_prefix != second_prefix or "Solve the equation" in first_prefix or "DURATION: 1.0" not in first_suffix:
+        logger.error("❌ FAIL: The prompt prefix depends on the request")
+        return False
+    if agent.classify_and_generate("Algebra", "Solve the equation x + 2 = 5", 1.0) != first_prefix + first_suffix:
+        logger.error("❌ FAIL: The full prompt is not the prefix followed by the suffix")
+        return False
+
+    logger.info("✅ PASS: The prompt splits into a shared prefix and the request details")
+    return True
+
+async def generate_twice(backend, ttl=3600, client=None):
+    model = FakeModel()
+    client = client or LLMClient("test-key")
+    client._bind_loop()
+    client._models[GEMINI_MODEL] = model
+    context_cache = ContextCache(backend, ttl=ttl, min_chars=100)
+
+    originals = (gemini.get_llm_client, gemini.GEMINI_API_KEY, llm_client.get_context_cache, gemini.TEMPLATES_ENABLED)
+    gemini.get_llm_client = lambda: client
+    gemini.GEMINI_API_KEY = "test-key"
+    llm_client.get_context_cache = lambda: context_cache
+    # The prompts are linear equations, which would otherwise be served from a template
+    gemini.TEMPLATES_ENABLED = False
+
+    try:
+        for prompt in ("Solve the equation x + 2 = 5", "Calculate the value of y in 2y = 8"):
+            await gemini.generate_manim_code(prompt, model_name=GEMINI_MODEL, use_cache=False, retry_delay=0.0)
+    finally:
+        (gemini.get_llm_client, gemini.GEMINI_API_KEY, llm_client.get_context_cache, gemini.TEMPLATES_ENABLED) = originals
+    return model
+
+async def test_cached_context():
+    """Test that the prefix is cached once and calls send only the suffix."""
+    backend = RecordingBackend()
+    model = await generate_twice(backend)
+    prefix, _ = gemini.ManimEducationalAgent().build_prompt(None, "Solve the equation x + 2 = 5", 3.0)
+
+    if backend.created != 1 or len(backend.sent) != 2:
+        logger.error(f"❌ FAIL: {backend.created} contexts created for {len(backend.sent)} calls")
+        return False
+    if any(prefix in sent or "CONTENT:" not in sent for sent in backend.sent):
+        logger.error("❌ FAIL: Calls with cached context sent the prefix")
+        return False
+    if not all(received.startswith(prefix) for received in model.prompts):
+        logger.error("❌ FAIL: The model did not see the cached prefix")
+        return False
+
+    logger.info("✅ PASS: The prefix is cached once and only the request details are sent")
+    return True
+
+async def test_fallback():
+    """Test that the full prompt is sent when the prefix cannot be cached."""
+    backend = RecordingBackend(fail=True)
+    model = await generate_twice(backend)
+
+    if backend.sent or len(model.prompts) != 2 or not all("Manim" in prompt and "CONTENT:" in prompt for prompt in model.prompts):
+        logger.error("❌ FAIL: Full prompts were not sent after the cache failed")
+        return False
+
+    logger.info("✅ PASS: Full prompts are sent when the prefix cannot be cached")
+    return True
+
+async def test_refresh():
+    """Test that refreshed context replaces the model of the old context."""
+    backend = RecordingBackend()
+    client = LLMClient("test-key")
+    # Context that expires within the refresh margin is created again for every call
+    await generate_twice(backend, ttl=1, client=client)
+
+    if backend.created != 2 or len(client._context_models) != 1:
+        logger.error(f"❌ FAIL: {backend.created} contexts created, {len(client._context_models)} models kept")
+        return False
+
+    logger.info("✅ PASS: Refreshed context replaces the model of the old context")
+    return True
+
+async def test_creation_circuit():
+    """Test that creating context counts for the circuit breaker and is rejected while it is open."""
+    upstream = Upstream("test_context", rate=0.0, burst=1)
+    upstream.breaker.failure_threshold = 1
+    client = LLMClient("test-key", upstream=upstream)
+    client._bind_loop()
+    model = FakeModel()
+    client._models[GEMINI_MODEL] = model
+    backend = RecordingBackend(fail=True)
+    context_cache = ContextCache(backend, min_chars=100)
+
+    original = llm_client.get_context_cache
+    llm_client.get_context_cache = lambda: context_cache
+    errors = []
+
+    try:
+        for _ in range(2):
+            try:
+                await client.generate("CONTENT: a circle", model_name=GEMINI_MODEL, cached_prefix="Manim " * 50)
+            except CircuitOpenError as e:
+                errors.append(e)
+            # Without the backoff after the failure, only the open circuit stops the next creation
+            backend.fail = False
+            context_cache._failed_until.clear()
+        if len(errors) != 2 or model.prompts or backend.created:
+            logger.error(f"❌ FAIL: {len(errors)} calls rejected, {len(model.prompts)} sent, {backend.created} contexts created")
+            return False
+
+        logger.info("✅ PASS: Failed context creation opens the circuit and is not retried while it is open")
+        return True
+
+    finally:
+        llm_client.get_context_cache = original
+
+def test_provider_support():
+    """Test that the pinned google-generativeai supports context caching."""
+    if not provider_supported():
+        logger.error(f"❌ FAIL: google-generativeai {genai.__version__} does not support context caching")
+        return False
+
+    logger.info("✅ PASS: The installed google-generativeai supports context caching")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing context caching...")
+
+    # Run the tests
+    test1 = test_prompt_split()
+    test2 = await test_cached_context()
+    test3 = await test_fallback()
+    test4 = await test_refresh()
+    test5 = await test_creation_circuit()
+    test6 = test_provider_support()
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5 and test6:
+        logger.info("✅ All tests passed! The static prompt prefix is sent as cached context.")
+    else:
+        logger.error("❌ Some tests failed. Context caching may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
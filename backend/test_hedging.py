@@ -0,0 +1,156 @@
+"""
+Test script to verify hedged and multi-candidate code generation.
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import gemini, metrics
+from app.services.llm_client import LLMClient
+
+VALID_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: We draw a circle.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)'''
+
+NO_NARRATION_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    def construct(self):
+        self.play(Create(Square()))'''
+
+BROKEN_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    def construct(self):
+        self.play(Create(Circle())'''
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Answers each call with the next (delay, code) pair."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        delay, text = self.responses[self.calls]
+        self.calls += 1
+        model = self
+
+        class Stream:
+            async def __aiter__(self):
+                try:
+                    await asyncio.sleep(delay)
+                except asyncio.CancelledError:
+                    model.cancelled += 1
+                    raise
+                yield FakeChunk(text)
+
+        return Stream()
+
+def make_client(model):
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[gemini.GEMINI_MODEL] = model
+    return client
+
+def test_quantile():
+    """Test the histogram quantile estimate."""
+    histogram = metrics.Histogram("test_quantile_seconds", "Test", buckets=(1.0, 2.0, 4.0))
+    for value in (0.5,) * 8 + (3.0,) * 2:
+        histogram.observe(value)
+    median = histogram.quantile(0.5)
+    p90 = histogram.quantile(0.9)
+
+    if not (0.0 < median <= 1.0) or not (2.0 < p90 <= 4.0):
+        logger.error(f"❌ FAIL: Unexpected quantiles {median} and {p90}")
+        return False
+
+    logger.info("✅ PASS: Quantiles are estimated from the buckets")
+    return True
+
+async def test_hedged_request():
+    """Test that a slow first request is hedged and the faster answer is kept."""
+    model = FakeModel((5.0, BROKEN_CODE), (0.05, VALID_CODE))
+    client = make_client(model)
+    original_delay = gemini.GEMINI_HEDGE_DELAY
+    gemini.GEMINI_HEDGE_DELAY = 0.1
+
+    try:
+        code = await gemini.generate_hedged(client, "prompt", gemini.GEMINI_MODEL, timeout=10.0)
+        await asyncio.sleep(0.05)
+        if code != VALID_CODE or model.calls != 2 or model.cancelled != 1:
+            logger.error(f"❌ FAIL: Hedged request returned {code!r} after {model.calls} calls, {model.cancelled} cancelled")
+            return False
+
+        logger.info("✅ PASS: Slow requests are hedged and the loser is cancelled")
+        return True
+
+    finally:
+        gemini.GEMINI_HEDGE_DELAY = original_delay
+
+async def test_fast_request_not_hedged():
+    """Test that no second request is sent when the first one is fast."""
+    model = FakeModel((0.01, VALID_CODE), (0.01, VALID_CODE))
+    client = make_client(model)
+
+    code = await gemini.generate_hedged(client, "prompt", gemini.GEMINI_MODEL, timeout=10.0)
+    if code != VALID_CODE or model.calls != 1:
+        logger.error(f"❌ FAIL: Fast request was hedged ({model.calls} calls)")
+        return False
+
+    logger.info("✅ PASS: Fast requests are not hedged")
+    return True
+
+async def test_best_candidate():
+    """Test that the candidate passing the most static checks is chosen."""
+    model = FakeModel((0.01, NO_NARRATION_CODE), (0.02, BROKEN_CODE), (0.05, VALID_CODE))
+    client = make_client(model)
+
+    code = await gemini.generate_best_candidate(
+        client, "prompt", gemini.GEMINI_MODEL, timeout=10.0, candidates=3, check_syntax=False
+    )
+    if code != VALID_CODE or model.calls != 3:
+        logger.error(f"❌ FAIL: Picked {code!r} out of {model.calls} candidates")
+        return False
+
+    logger.info("✅ PASS: The best statically valid candidate is picked")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing hedged and multi-candidate generation...")
+
+    # Run the tests
+    test1 = test_quantile()
+    test2 = await test_hedged_request()
+    test3 = await test_fast_request_not_hedged()
+    test4 = await test_best_candidate()
+
+    # Print summary
+    if test1 and test2 and test3 and test4:
+        logger.info("✅ All tests passed! Slow and broken generations are covered by extra requests.")
+    else:
+        logger.error("❌ Some tests failed. Hedging or candidate selection may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,379 @@
+"""
+Test script to verify the durable job queue and the job worker pool.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.job_queue import JobQueue, JobWorkerPool, QueueFullError, RateLimitedError, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from app.utils.helpers import request_fingerprint
+
+def test_queue_persistence():
+    """Test that jobs are claimed in order and survive a restart."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = Path(temp_dir) / "jobs.db"
+        queue = JobQueue(db_path)
+
+        queue.enqueue("job-1", {"prompt": "first"})
+        queue.enqueue("job-2", {"prompt": "second"})
+
+        claimed = queue.claim_next()
+        if claimed["id"] != "job-1" or claimed["state"] != JOB_RUNNING:
+            logger.error(f"❌ FAIL: Expected job-1 to be claimed first, got {claimed}")
+            return False
+        logger.info("✅ PASS: Jobs are claimed in submission order")
+
+        # Simulate a restart with a fresh queue object on the same database
+        queue = JobQueue(db_path)
+        requeued = queue.requeue_running()
+
+        if requeued != ["job-1"] or queue.count(JOB_QUEUED) != 2:
+            logger.error(f"❌ FAIL: Interrupted job was not requeued: {requeued}")
+            return False
+        logger.info("✅ PASS: Interrupted jobs are requeued after a restart")
+
+        return True
+
+def test_request_deduplication():
+    """Test that identical in-flight requests and retried idempotency keys share a job."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+        dedup_key = request_fingerprint("Explain  the Pythagorean theorem", None, None, 1.0)
+
+        first, created = queue.submit("job-1", {"prompt": "first"}, dedup_key=dedup_key)
+        second, created_again = queue.submit(
+            "job-2", {"prompt": "first"},
+            dedup_key=request_fingerprint("explain the pythagorean theorem ", None, None, 1.0)
+        )
+        if not created or created_again or second["id"] != "job-1":
+            logger.error(f"❌ FAIL: Identical in-flight request was not deduplicated: {second}")
+            return False
+        logger.info("✅ PASS: Identical in-flight requests share one job")
+
+        # Once the job finished, the same request starts a new job
+        queue.claim_next()
+        queue.complete("job-1")
+        third, created = queue.submit("job-3", {"prompt": "first"}, dedup_key=dedup_key)
+        if not created or third["id"] != "job-3":
+            logger.error(f"❌ FAIL: Finished job was reused for a new request: {third}")
+            return False
+        logger.info("✅ PASS: Finished jobs are not reused for new requests")
+
+        queue.submit("job-4", {"prompt": "other"}, idempotency_key="retry-key")
+        retried, created = queue.submit("job-5", {"prompt": "changed"}, idempotency_key="retry-key")
+        if created or retried["id"] != "job-4":
+            logger.error(f"❌ FAIL: Retried idempotency key created a new job: {retried}")
+            return False
+        logger.info("✅ PASS: Retried idempotency keys return the original job")
+
+        return True
+
+def test_admission_control():
+    """Test that a full queue rejects new jobs and queued jobs get a position and estimate."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        for i in range(3):
+            queue.submit(f"job-{i}", {"prompt": f"prompt {i}"}, max_depth=3)
+
+        try:
+            queue.submit("job-3", {"prompt": "prompt 3"}, max_depth=3)
+            logger.error("❌ FAIL: Job was accepted by a full queue")
+            return False
+        except QueueFullError:
+            logger.info("✅ PASS: Full queue rejects new jobs")
+
+        queue.claim_next()
+        position = queue.queue_position("job-2")
+        # One job is running and one is ahead, so with one worker job-2 starts after two job durations
+        wait = queue.estimate_wait(position - 1, workers=1)
+        if position != 2 or not (1.9 * 180 < wait <= 2 * 180):
+            logger.error(f"❌ FAIL: Unexpected queue position {position} or wait {wait}")
+            return False
+        logger.info("✅ PASS: Queued jobs get a position and start estimate")
+
+        return True
+
+def test_fair_scheduling():
+    """Test that a client with a large backlog does not starve other clients."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        for i in range(6):
+            queue.submit(f"bulk-{i}", {"prompt": f"course {i}"}, client_id="course-builder", priority="bulk")
+        queue.submit("teacher-0", {"prompt": "lesson"}, client_id="teacher", priority="interactive")
+        queue.submit("teacher-1", {"prompt": "lesson 2"}, client_id="teacher", priority="interactive")
+
+        order = []
+        while True:
+            job = queue.claim_next(client_max_running=0)
+            if job is None:
+                break
+            order.append(job["id"])
+            queue.complete(job["id"])
+
+        if order.index("teacher-1") > 2:
+            logger.error(f"❌ FAIL: Interactive jobs waited behind the bulk backlog: {order}")
+            return False
+        logger.info("✅ PASS: Interactive jobs overtake a bulk backlog")
+
+        for i in range(3):
+            queue.submit(f"capped-{i}", {"prompt": f"capped {i}"}, client_id="capped")
+        claimed = [queue.claim_next(client_max_running=2) for _ in range(3)]
+        if claimed[2] is not None:
+            logger.error("❌ FAIL: Client ran more jobs than its concurrency limit")
+            return False
+        logger.info("✅ PASS: Clients are held to their concurrency limit")
+
+        try:
+            for i in range(3):
+                queue.submit(f"limited-{i}", {"prompt": f"limited {i}"}, client_id="limited", rate_limit=2)
+            logger.error("❌ FAIL: Client exceeded its rate limit")
+            return False
+        except RateLimitedError as e:
+            if not 0 < e.retry_after <= 60:
+                logger.error(f"❌ FAIL: Unexpected Retry-After {e.retry_after}")
+                return False
+            logger.info("✅ PASS: Clients are held to their rate limit")
+
+        return True
+
+def test_requeue_fairness():
+    """Test that requeued jobs queue behind the jobs submitted since they were first queued."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        queue.submit("a-0", {"prompt": "first"}, client_id="a")
+        queue.claim_next(client_max_running=0)
+        queue.submit("a-1", {"prompt": "second"}, client_id="a")
+        queue.submit("b-0", {"prompt": "other"}, client_id="b")
+
+        # The worker running a-0 died, so the job is resumed
+        queue.requeue_running()
+        order = []
+        while True:
+            job = queue.claim_next(client_max_running=0)
+            if job is None:
+                break
+            order.append(job["id"])
+            queue.complete(job["id"])
+        if order.index("a-0") < order.index("a-1") or order.index("a-0") < order.index("b-0"):
+            logger.error(f"❌ FAIL: A resumed job kept its old finish tag: {order}")
+            return False
+
+        queue.submit("a-2", {"prompt": "third"}, client_id="a")
+        queue.requeue("a-0")
+        if queue.claim_next(client_max_running=0)["id"] != "a-2":
+            logger.error("❌ FAIL: A job put back in the queue overtook a newer job of its client")
+            return False
+        logger.info("✅ PASS: Requeued jobs get a finish tag from the current virtual time")
+
+        return True
+
+def test_batch_submission():
+    """Test that batches are admitted as a whole and do not count against the rate limit."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        items = [(f"item-{i}", {"prompt": f"item {i}"}, f"key-{i}") for i in range(3)]
+        items.append(("cached-video", None, None))
+        items.append(("item-3", {"prompt": "item 0"}, "key-0"))
+        results = queue.submit_batch("batch-1", items, max_depth=2, client_id="school", priority="bulk")
+        created = [created for _, created in results]
+        if created != [True, True, True, False, False] or results[4][0]["id"] != "item-0":
+            logger.error(f"❌ FAIL: Unexpected batch results {created}")
+            return False
+        videos = [item["video_id"] for item in queue.get_batch("batch-1")]
+        if videos != ["item-0", "item-1", "item-2", "cached-video", "item-0"]:
+            logger.error(f"❌ FAIL: The batch was recorded as {videos}")
+            return False
+        logger.info("✅ PASS: Batches are queued as a whole and deduplicated")
+
+        # The batch jobs are not counted by later requests of the client
+        queue.submit("single", {"prompt": "single"}, client_id="school", rate_limit=1)
+        logger.info("✅ PASS: Jobs of batches do not count against the rate limit")
+
+        try:
+            queue.submit_batch("batch-2", [("late", {"prompt": "late"}, "late")], max_depth=2, client_id="school", priority="bulk")
+            logger.error("❌ FAIL: A batch was admitted to a full queue")
+            return False
+        except QueueFullError:
+            pass
+
+        # A batch that fails part of the way adds nothing
+        try:
+            queue.submit_batch("batch-3", [("new", {"prompt": "new"}, "new"), ("item-1", {"prompt": "clash"}, "clash")])
+            logger.error("❌ FAIL: A batch with a clashing video ID was accepted")
+            return False
+        except Exception:
+            pass
+        if queue.get("new") is not None or queue.get_batch("batch-3") or queue.get_batch("batch-2"):
+            logger.error("❌ FAIL: A rejected batch left jobs or batch records behind")
+            return False
+        logger.info("✅ PASS: Rejected batches leave nothing behind")
+
+        return True
+
+async def test_worker_pool():
+    """Test that the worker pool runs jobs and records their outcome."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        running = 0
+        peak = 0
+
+        async def handler(job_id, prompt):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return prompt != "broken"
+
+        for i in range(6):
+            queue.enqueue(f"job-{i}", {"prompt": "broken" if i == 0 else "ok"})
+
+        pool = JobWorkerPool(queue, handler, concurrency=2, poll_interval=0.05)
+        pool.start()
+
+        for _ in range(100):
+            if queue.count(JOB_QUEUED) == 0 and queue.count(JOB_RUNNING) == 0:
+                break
+            await asyncio.sleep(0.05)
+        await pool.stop()
+
+        passed = True
+        if queue.get("job-0")["state"] != JOB_FAILED or queue.count(JOB_DONE) != 5:
+            logger.error("❌ FAIL: Job outcomes were not recorded correctly")
+            passed = False
+        else:
+            logger.info("✅ PASS: Worker pool records done and failed jobs")
+
+        if peak > 2:
+            logger.error(f"❌ FAIL: Worker pool ran {peak} jobs at once with a limit of 2")
+            passed = False
+        else:
+            logger.info("✅ PASS: Worker pool respects its concurrency limit")
+
+        return passed
+
+async def test_cancellation():
+    """Test that cancelling a job stops its handler and keeps it from running."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+
+        started = asyncio.Event()
+        stopped = []
+
+        async def handler(job_id, prompt):
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                stopped.append(job_id)
+                raise
+            return True
+
+        queue.enqueue("job-running", {"prompt": "slow"})
+        queue.enqueue("job-queued", {"prompt": "slow"})
+
+        pool = JobWorkerPool(queue, handler, concurrency=1, poll_interval=0.05)
+        pool.start()
+        await asyncio.wait_for(started.wait(), timeout=2.0)
+
+        # Cancel the waiting job first so the worker cannot pick it up
+        queued_state = queue.cancel("job-queued")
+        running_state = queue.cancel("job-running")
+        await pool.cancel("job-running")
+        await asyncio.sleep(0.2)
+        await pool.stop()
+
+        if queued_state != JOB_QUEUED or running_state != JOB_RUNNING:
+            logger.error(f"❌ FAIL: Unexpected states before cancelling: {queued_state}, {running_state}")
+            return False
+
+        if stopped != ["job-running"] or queue.count(JOB_CANCELLED) != 2:
+            logger.error(f"❌ FAIL: Cancelled jobs were not stopped (stopped {stopped})")
+            return False
+
+        if queue.cancel("job-running") != JOB_CANCELLED or queue.cancel("missing") is not None:
+            logger.error("❌ FAIL: Cancelling a finished or unknown job changed its state")
+            return False
+
+        logger.info("✅ PASS: Cancelled jobs are stopped and never run")
+        return True
+
+def test_worker_leases():
+    """Test that jobs of a worker that stops sending heartbeats are taken over."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = Path(temp_dir) / "jobs.db"
+        queue_a = JobQueue(db_path)
+        queue_b = JobQueue(db_path)
+
+        queue_a.enqueue("job-1", {"prompt": "lease"})
+        claimed = queue_a.claim_next(worker_id="host-a:1", lease_duration=0.2)
+        queue_a.heartbeat("host-a:1", ["job-1"], 2, lease_duration=0.2)
+
+        if queue_b.claim_next(worker_id="host-b:1") is not None:
+            logger.error("❌ FAIL: A leased job was claimed by a second worker")
+            return False
+
+        # Worker A stops sending heartbeats
+        time.sleep(0.3)
+        taken_over = queue_b.claim_next(worker_id="host-b:1")
+        if claimed is None or taken_over is None or taken_over["id"] != "job-1":
+            logger.error("❌ FAIL: The job of a dead worker was not taken over")
+            return False
+
+        # The first worker finds out it lost the job and cannot finish it
+        lost = queue_a.heartbeat("host-a:1", ["job-1"], 2)
+        queue_a.complete("job-1", worker_id="host-a:1")
+        if lost != ["job-1"] or queue_b.get("job-1")["state"] != JOB_RUNNING:
+            logger.error("❌ FAIL: A worker that lost its lease changed the job")
+            return False
+
+        queue_b.complete("job-1", worker_id="host-b:1")
+        if queue_b.get("job-1")["state"] != JOB_DONE or queue_b.worker_capacity() != (1, 2):
+            logger.error(f"❌ FAIL: Unexpected final state or worker capacity {queue_b.worker_capacity()}")
+            return False
+
+        logger.info("✅ PASS: Jobs of workers whose lease expired are taken over")
+        return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing job queue...")
+
+    # Run the tests
+    test1 = test_queue_persistence()
+    test2 = test_request_deduplication()
+    test3 = test_admission_control()
+    test4 = test_fair_scheduling()
+    test5 = await test_worker_pool()
+    test6 = await test_cancellation()
+    test7 = test_worker_leases()
+    test8 = test_requeue_fairness()
+    test9 = test_batch_submission()
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5 and test6 and test7 and test8 and test9:
+        logger.info("✅ All tests passed! The job queue works correctly.")
+    else:
+        logger.error("❌ Some tests failed. The job queue may not be working correctly.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+"""
+Test script to verify the persistent Gemini response cache.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import gemini, llm_cache
+from app.services.llm_cache import LLMCache, llm_cache_key, KIND_CODE, KIND_SCRIPT
+from app.services.llm_client import LLMClient
+
+EXAMPLE_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: We draw a circle.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)'''
+
+def test_keys():
+    """Test that keys separate kinds, models and prompts."""
+    keys = {
+        llm_cache_key(KIND_CODE, "model-a", "prompt"),
+        llm_cache_key(KIND_SCRIPT, "model-a", "prompt"),
+        llm_cache_key(KIND_CODE, "model-b", "prompt"),
+        llm_cache_key(KIND_CODE, "model-a", "other prompt"),
+    }
+    if len(keys) != 4 or llm_cache_key(KIND_CODE, "model-a", "prompt") not in keys:
+        logger.error("❌ FAIL: Cache keys collide or are not deterministic")
+        return False
+
+    logger.info("✅ PASS: Cache keys depend on kind, model and prompt")
+    return True
+
+def test_eviction(directory: Path):
+    """Test TTL expiry, LRU eviction over the size limit and invalidation."""
+    cache = LLMCache(db_path=directory / "llm.db", ttl=3600, max_bytes=25)
+    cache.put("a", KIND_CODE, "model", "x" * 10)
+    time.sleep(0.01)
+    cache.put("b", KIND_CODE, "model", "y" * 10)
+    time.sleep(0.01)
+    cache.get("a")
+    cache.put("c", KIND_CODE, "model", "z" * 10)
+
+    if cache.get("b") is not None or cache.get("a") != "x" * 10 or cache.get("c") != "z" * 10:
+        logger.error("❌ FAIL: The least recently used entry was not evicted")
+        return False
+
+    cache.ttl = 0
+    if cache.get("a") is not None:
+        logger.error("❌ FAIL: Expired entry was served")
+        return False
+
+    cache.ttl = 3600
+    cache.put("d", KIND_CODE, "model", "broken")
+    cache.put("e", KIND_CODE, "other-model", "broken")
+    if cache.invalidate_response("broken") != 2 or cache.get("d") is not None:
+        logger.error("❌ FAIL: Entries with a failing response were not invalidated")
+        return False
+
+    logger.info("✅ PASS: Entries expire, are evicted by recency and can be invalidated")
+    return True
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for a Gemini model that streams one piece of code."""
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        text = self.text
+
+        class Stream:
+            async def __aiter__(self):
+                yield FakeResponse(text)
+
+        return Stream()
+
+async def test_generation_cache(directory: Path):
+    """Test that repeated code generation is served from the cache until the code is invalidated."""
+    model = FakeModel(EXAMPLE_CODE)
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[gemini.GEMINI_MODEL] = model
+    cache = LLMCache(db_path=directory / "generation.db")
+
+    originals = (gemini.get_llm_client, gemini.get_llm_cache, gemini.GEMINI_API_KEY)
+    gemini.get_llm_client = lambda: client
+    gemini.get_llm_cache = lambda: cache
+    gemini.GEMINI_API_KEY = "test-key"
+
+    try:
+        first = await gemini.generate_manim_code("Draw a circle", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0)
+        sections = []
+        second = await gemini.generate_manim_code("Draw a circle", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0, on_section=sections.append)
+        if first != second or model.calls != 1 or not sections:
+            logger.error(f"❌ FAIL: Repeated prompt was not served from the cache ({model.calls} calls)")
+            return False
+
+        await gemini.generate_manim_code("Draw a circle", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0, use_cache=False)
+        if model.calls != 2:
+            logger.error("❌ FAIL: use_cache=False still used the cache")
+            return False
+
+        cache.invalidate_response(first)
+        await gemini.generate_manim_code("Draw a circle", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0)
+        if model.calls != 3:
+            logger.error("❌ FAIL: Invalidated code was served from the cache")
+            return False
+
+        logger.info("✅ PASS: Repeated prompts skip Gemini until the code fails to render")
+        return True
+
+    finally:
+        (gemini.get_llm_client, gemini.get_llm_cache, gemini.GEMINI_API_KEY) = originals
+
+class ChangingIndex:
+    """Stands in for an example index that returns new examples on every search."""
+
+    def __init__(self):
+        self.searches = 0
+
+    def exact_matches(self, prompt, topic=None):
+        return []
+
+    def search(self, prompt, topic=None):
+        self.searches += 1
+        return [(1.0, {"prompt": f"Example {self.searches}", "topic": topic, "code": f"# example {self.searches}"})]
+
+async def test_cache_ignores_examples(directory: Path):
+    """Test that the code is served from the cache after the retrieved examples changed."""
+    model = FakeModel(EXAMPLE_CODE)
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[gemini.GEMINI_MODEL] = model
+    cache = LLMCache(db_path=directory / "examples.db")
+    index = ChangingIndex()
+
+    originals = (gemini.get_llm_client, gemini.get_llm_cache, gemini.GEMINI_API_KEY,
+                 gemini.RETRIEVAL_ENABLED, gemini.get_example_index, gemini.select_examples)
+    gemini.get_llm_client = lambda: client
+    gemini.get_llm_cache = lambda: cache
+    gemini.GEMINI_API_KEY = "test-key"
+    gemini.RETRIEVAL_ENABLED = True
+    gemini.get_example_index = lambda: index
+    gemini.select_examples = lambda index, matches: [example for _, example in matches]
+
+    try:
+        await gemini.generate_manim_code("Draw a square", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0)
+        await gemini.generate_manim_code("Draw a square", topic="Shapes", model_name=gemini.GEMINI_MODEL, retry_delay=0.0)
+        if model.calls != 1 or index.searches != 1:
+            logger.error(f"❌ FAIL: Changed examples missed the cache ({model.calls} calls, {index.searches} searches)")
+            return False
+
+        logger.info("✅ PASS: The cache key does not depend on the retrieved examples")
+        return True
+
+    finally:
+        (gemini.get_llm_client, gemini.get_llm_cache, gemini.GEMINI_API_KEY,
+         gemini.RETRIEVAL_ENABLED, gemini.get_example_index, gemini.select_examples) = originals
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing the Gemini response cache...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = Path(temp_dir)
+
+        # Run the tests
+        test1 = test_keys()
+        test2 = test_eviction(directory)
+        test3 = await test_generation_cache(directory)
+        test4 = await test_cache_ignores_examples(directory)
+
+    # Print summary
+    if test1 and test2 and test3 and test4:
+        logger.info("✅ All tests passed! Repeated prompts are served from the cache.")
+    else:
+        logger.error("❌ Some tests failed. Repeated prompts may call Gemini again.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+Test script to verify that the shared Gemini client caps concurrent calls and enforces timeouts.
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.llm_client import LLMClient, LLMTimeoutError
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for a Gemini model and records how many calls run at once."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.running = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            return FakeResponse(f"echo: {prompt}")
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+
+def make_client(model, max_concurrency):
+    """Create a client whose model is replaced by a fake one."""
+    client = LLMClient("test-key", max_concurrency=max_concurrency)
+    client._bind_loop()
+    client._models["fake"] = model
+    return client
+
+async def test_concurrency_cap():
+    """Test that no more calls than the cap run at once."""
+    model = FakeModel(0.1)
+    client = make_client(model, 2)
+
+    results = await asyncio.gather(*(client.generate(f"prompt {i}", model_name="fake") for i in range(6)))
+
+    if results != [f"echo: prompt {i}" for i in range(6)] or model.peak != 2:
+        logger.error(f"❌ FAIL: Got {results} with {model.peak} concurrent calls")
+        return False
+
+    logger.info("✅ PASS: Concurrent calls are capped")
+    return True
+
+async def test_timeout_cancels_call():
+    """Test that a timed out call is cancelled and frees its slot."""
+    model = FakeModel(5.0)
+    client = make_client(model, 1)
+
+    try:
+        await client.generate("slow", model_name="fake", timeout=0.1)
+        logger.error("❌ FAIL: Slow call did not time out")
+        return False
+    except LLMTimeoutError:
+        pass
+
+    if model.cancelled != 1 or model.running != 0:
+        logger.error(f"❌ FAIL: Timed out call was not cancelled ({model.cancelled} cancelled, {model.running} running)")
+        return False
+
+    model.delay = 0.0
+    if await client.generate("fast", model_name="fake", timeout=1.0) != "echo: fast":
+        logger.error("❌ FAIL: Slot was not released after the timeout")
+        return False
+
+    logger.info("✅ PASS: Timeouts cancel the call and release its slot")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing the shared Gemini client...")
+
+    # Run the tests
+    test1 = await test_concurrency_cap()
+    test2 = await test_timeout_cancels_call()
+
+    # Print summary
+    if test1 and test2:
+        logger.info("✅ All tests passed! Gemini calls are capped and time out for real.")
+    else:
+        logger.error("❌ Some tests failed. Gemini calls may pile up or outlive their timeouts.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
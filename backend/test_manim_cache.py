@@ -0,0 +1,98 @@
+"""
+Test script to verify that renders share the Manim Tex and text caches safely.
+"""
+import os
+import sys
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import manim
+
+def test_render_dirs(shared_dir: Path):
+    """Test that each render compiles into its own directories, filled from the shared cache."""
+    with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+        config_path = manim.prepare_render_cache(first)
+        config = config_path.read_text()
+        if str(Path(first).resolve()) not in config or str(shared_dir) in config:
+            logger.error(f"❌ FAIL: The render does not compile into its own directories:\n{config}")
+            return False
+
+        # The first render compiles a formula, the second one starts while it is still writing
+        tex_dir = Path(first).resolve() / "manim_cache" / "Tex"
+        (tex_dir / "abc.tex").write_text("a^2 + b^2 = c^2")
+        (tex_dir / "abc.svg").write_text("<svg/>")
+        manim.prepare_render_cache(second)
+        if any((Path(second) / "manim_cache" / "Tex").iterdir()):
+            logger.error("❌ FAIL: A render saw files of a render that had not finished")
+            return False
+
+        published = manim.publish_render_cache(first)
+        names = sorted(path.name for path in (shared_dir / "Tex").iterdir())
+        if published != 2 or names != ["abc.svg", "abc.tex"]:
+            logger.error(f"❌ FAIL: Published {published} files, the shared cache holds {names}")
+            return False
+
+    with tempfile.TemporaryDirectory() as third:
+        manim.prepare_render_cache(third)
+        if (Path(third) / "manim_cache" / "Tex" / "abc.svg").read_text() != "<svg/>":
+            logger.error("❌ FAIL: A later render did not get the published files")
+            return False
+
+    logger.info("✅ PASS: Renders compile into their own directories and publish finished files")
+    return True
+
+def test_eviction(shared_dir: Path):
+    """Test that the shared cache is trimmed to its size limit, oldest files first."""
+    tex_dir = shared_dir / "Tex"
+    for i, name in enumerate(["old.svg", "middle.svg", "new.svg"]):
+        (tex_dir / name).write_bytes(b"x" * 400 * 1024)
+        os.utime(tex_dir / name, (1000 + i, 1000 + i))
+
+    with tempfile.TemporaryDirectory() as render:
+        manim.prepare_render_cache(render)
+        removed = manim.evict_render_cache(max_mb=1.0)
+        names = sorted(path.name for path in tex_dir.iterdir() if path.name.endswith(".svg") and path.name != "abc.svg")
+        if removed < 1 or "old.svg" in names or "new.svg" not in names:
+            logger.error(f"❌ FAIL: Removed {removed} files, the shared cache holds {names}")
+            return False
+        if not (Path(render) / "manim_cache" / "Tex" / "old.svg").is_file():
+            logger.error("❌ FAIL: A running render lost a file that was evicted from the shared cache")
+            return False
+
+    logger.info("✅ PASS: The shared cache is kept under its size limit")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing the shared Manim caches...")
+
+    original = manim.MANIM_CACHE_DIR
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manim.MANIM_CACHE_DIR = Path(temp_dir)
+        try:
+            # Run the tests
+            test1 = test_render_dirs(Path(temp_dir).resolve())
+            test2 = test_eviction(Path(temp_dir).resolve())
+        finally:
+            manim.MANIM_CACHE_DIR = original
+
+    # Print summary
+    if test1 and test2:
+        logger.info("✅ All tests passed! Renders share the Manim caches safely.")
+    else:
+        logger.error("❌ Some tests failed. The shared Manim caches may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Test script to verify the choice of Gemini model and output budget for code generation.
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import gemini, model_router
+from app.services.model_router import (
+    ModelStats, choose_model, output_token_limit, REASON_SHORT, REASON_CONTENT, REASON_SUCCESS_RATE, REASON_LATENCY
+)
+from app.services.llm_client import LLMClient, LLM_LATENCY, GEMINI_MODEL, GEMINI_FAST_MODEL
+
+VALID_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: We draw a circle.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)'''
+
+def test_content_routing():
+    """Test that short clips and simple content use the fast model."""
+    model_router._stats = ModelStats()
+    decisions = [
+        choose_model("formula_derivation", 0.67),
+        choose_model("visual_demonstration", 3.0),
+        choose_model("formula_derivation", 3.0),
+    ]
+    expected = [(GEMINI_FAST_MODEL, REASON_SHORT), (GEMINI_FAST_MODEL, REASON_CONTENT), (GEMINI_MODEL, REASON_CONTENT)]
+
+    if decisions != expected:
+        logger.error(f"❌ FAIL: Unexpected decisions {decisions}")
+        return False
+
+    logger.info("✅ PASS: Short clips and simple content are routed to the fast model")
+    return True
+
+def test_observed_routing():
+    """Test that a failing model is avoided and a slow fast model is not used."""
+    model_router._stats = ModelStats()
+    for _ in range(10):
+        model_router.record_outcome(GEMINI_MODEL, False)
+        model_router.record_outcome(GEMINI_FAST_MODEL, True)
+    if choose_model("formula_derivation", 3.0) != (GEMINI_FAST_MODEL, REASON_SUCCESS_RATE):
+        logger.error("❌ FAIL: A failing model was still chosen")
+        return False
+
+    model_router._stats = ModelStats()
+    for _ in range(10):
+        LLM_LATENCY.observe(90.0, model=GEMINI_FAST_MODEL)
+        LLM_LATENCY.observe(20.0, model=GEMINI_MODEL)
+    if choose_model("visual_demonstration", 3.0) != (GEMINI_MODEL, REASON_LATENCY):
+        logger.error("❌ FAIL: The fast model was chosen although it is slower")
+        return False
+
+    logger.info("✅ PASS: Observed success rates and latencies change the choice")
+    return True
+
+def test_output_budget():
+    """Test that the output limit grows with the duration and after failed attempts."""
+    short, long = output_token_limit(0.67), output_token_limit(3.0)
+    retried = output_token_limit(0.67, attempt=1)
+
+    if not (short < long <= model_router.MAX_OUTPUT_TOKENS and short < retried):
+        logger.error(f"❌ FAIL: Unexpected limits {short}, {long} and {retried}")
+        return False
+
+    logger.info("✅ PASS: The output budget follows the duration")
+    return True
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Records the generation settings of each call."""
+
+    def __init__(self):
+        self.configs = []
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.configs.append(generation_config)
+
+        class Stream:
+            async def __aiter__(self):
+                yield FakeChunk(VALID_CODE)
+
+        return Stream()
+
+async def test_routed_generation():
+    """Test that code generation uses the routed model and output limit."""
+    model_router._stats = ModelStats()
+    fast, strong = FakeModel(), FakeModel()
+    client = LLMClient("test-key")
+    client._bind_loop()
+    client._models[GEMINI_FAST_MODEL] = fast
+    client._models[GEMINI_MODEL] = strong
+
+    originals = (gemini.get_llm_client, gemini.GEMINI_API_KEY)
+    gemini.get_llm_client = lambda: client
+    gemini.GEMINI_API_KEY = "test-key"
+
+    try:
+        await gemini.generate_manim_code("Draw a circle", duration_minutes=0.67, use_cache=False, retry_delay=0.0)
+        if len(fast.configs) != 1 or strong.configs:
+            logger.error(f"❌ FAIL: A short clip used the wrong model ({len(fast.configs)} fast, {len(strong.configs)} strong calls)")
+            return False
+        if fast.configs[0] != {"max_output_tokens": output_token_limit(0.67)}:
+            logger.error(f"❌ FAIL: Unexpected generation settings {fast.configs[0]}")
+            return False
+
+        logger.info("✅ PASS: Code generation uses the routed model and output budget")
+        return True
+
+    finally:
+        (gemini.get_llm_client, gemini.GEMINI_API_KEY) = originals
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing model routing...")
+
+    # Run the tests
+    test1 = test_content_routing()
+    test2 = test_output_budget()
+    test3 = await test_routed_generation()
+    # Runs last because the latencies it observes stay in the shared histogram
+    test4 = test_observed_routing()
+
+    # Print summary
+    if test1 and test2 and test3 and test4:
+        logger.info("✅ All tests passed! Code generation picks its model and output budget per request.")
+    else:
+        logger.error("❌ Some tests failed. Model routing may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+Test script to verify that progress events reach server-sent event streams.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.job_queue import JobQueue
+from app.services.events import EventBus
+from app.services.manim import estimate_animation_count
+
+async def test_event_fan_out():
+    """Test that one poller delivers events to every subscriber of a video."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+        bus = EventBus(queue, poll_interval=0.05)
+
+        viewers = [bus.subscribe("video-1") for _ in range(3)]
+        other = bus.subscribe("video-2")
+        await asyncio.sleep(0.1)
+
+        queue.submit("video-1", {"prompt": "events"})
+        queue.add_event("video-1", "progress", {"stage": "render", "percent": 50})
+
+        try:
+            for viewer in viewers:
+                first = await asyncio.wait_for(viewer.get(), timeout=2.0)
+                second = await asyncio.wait_for(viewer.get(), timeout=2.0)
+                if first["data"] != {"state": "queued"} or second["data"]["percent"] != 50:
+                    logger.error(f"❌ FAIL: Unexpected events {first} {second}")
+                    return False
+        except asyncio.TimeoutError:
+            logger.error("❌ FAIL: Subscribers did not receive the events")
+            return False
+        finally:
+            await bus.stop()
+
+        if not other.empty():
+            logger.error("❌ FAIL: Events were delivered to subscribers of another video")
+            return False
+
+        logger.info("✅ PASS: Events are fanned out to the subscribers of their video")
+        return True
+
+def test_background_writes():
+    """Test that queued events are written in order, off the caller's thread, before the final state."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue = JobQueue(Path(temp_dir) / "jobs.db")
+        queue.submit("video-1", {"prompt": "events"})
+
+        # A slow database does not hold up the caller
+        add_event = queue.add_event
+        def slow_add_event(*args):
+            time.sleep(0.05)
+            return add_event(*args)
+        queue.add_event = slow_add_event
+
+        start = time.monotonic()
+        for percent in (10, 20, 30):
+            queue.queue_event("video-1", "progress", {"stage": "render", "percent": percent})
+        elapsed = time.monotonic() - start
+        queue.complete("video-1")
+
+        events = queue.events_after(0, "video-1")
+        percents = [event["data"].get("percent") for event in events if event["type"] == "progress"]
+        if elapsed > 0.05 or percents != [10, 20, 30] or events[-1]["data"] != {"state": "done"}:
+            logger.error(f"❌ FAIL: Queuing took {elapsed:.3f} seconds and wrote {[event['data'] for event in events]}")
+            return False
+
+        logger.info("✅ PASS: Events are written in the background, in order, before the final state")
+        return True
+
+def test_animation_count():
+    """Test that render progress is based on the play and wait calls of the scene."""
+    code = '''
+class CreateScene(Scene):
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)
+        self.play(FadeOut(*self.mobjects))
+'''
+    if estimate_animation_count(code) != 3 or estimate_animation_count("") != 1:
+        logger.error(f"❌ FAIL: Unexpected animation count {estimate_animation_count(code)}")
+        return False
+
+    logger.info("✅ PASS: Animations are counted from play and wait calls")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing progress events...")
+
+    # Run the tests
+    test1 = await test_event_fan_out()
+    test2 = test_background_writes()
+    test3 = test_animation_count()
+
+    # Print summary
+    if test1 and test2 and test3:
+        logger.info("✅ All tests passed! Progress events reach their streams.")
+    else:
+        logger.error("❌ Some tests failed. Progress events may not reach their streams.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
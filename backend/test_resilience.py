@@ -0,0 +1,221 @@
+"""
+Test script to verify rate limiting, retry budgets and circuit breaking of external calls.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import resilience
+from app.services.resilience import (
+    TokenBucket, CircuitBreaker, RetryBudget, Upstream, CircuitOpenError,
+    call_with_retries, deadline_scope, allow_retry, CLOSED, HALF_OPEN, OPEN
+)
+from app.services.llm_client import LLMClient
+
+async def test_token_bucket():
+    """Test that calls beyond the burst wait for the rate."""
+    bucket = TokenBucket(rate=20.0, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    elapsed = time.monotonic() - start
+
+    if not 0.08 <= elapsed < 0.5:
+        logger.error(f"❌ FAIL: Four calls with a burst of two took {elapsed:.3f} seconds")
+        return False
+
+    logger.info("✅ PASS: The token bucket limits the call rate")
+    return True
+
+def test_circuit_breaker():
+    """Test that the circuit opens after failures, probes after the timeout and closes on success."""
+    breaker = CircuitBreaker("test_breaker", failure_threshold=2, reset_timeout=0.1)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    if breaker.state != OPEN:
+        logger.error(f"❌ FAIL: Circuit is {breaker.state} after two failures")
+        return False
+    try:
+        breaker.before_call()
+        logger.error("❌ FAIL: An open circuit let a call through")
+        return False
+    except CircuitOpenError:
+        pass
+
+    time.sleep(0.15)
+    breaker.before_call()
+    try:
+        breaker.before_call()
+        logger.error("❌ FAIL: A half open circuit let a second probe through")
+        return False
+    except CircuitOpenError:
+        pass
+    if breaker.state != HALF_OPEN:
+        logger.error(f"❌ FAIL: Circuit is {breaker.state} during the probe")
+        return False
+    breaker.record_success()
+    if breaker.state != CLOSED:
+        logger.error(f"❌ FAIL: Circuit is {breaker.state} after a successful probe")
+        return False
+
+    logger.info("✅ PASS: The circuit opens, probes and closes")
+    return True
+
+def test_retry_budget():
+    """Test that retries are limited to a share of the requests."""
+    budget = RetryBudget(ratio=0.5, minimum=1, window=60.0)
+    for _ in range(4):
+        budget.record_request()
+    allowed = sum(budget.try_spend() for _ in range(10))
+
+    if allowed != 3:
+        logger.error(f"❌ FAIL: {allowed} retries were allowed instead of 3")
+        return False
+
+    logger.info("✅ PASS: The retry budget caps retries at a share of the requests")
+    return True
+
+async def test_call_with_retries():
+    """Test retries of transient errors, fail fast on permanent ones and the deadline."""
+    resilience._upstreams["test_service"] = Upstream("test_service", rate=0.0, burst=1)
+    calls = []
+
+    async def flaky():
+        calls.append("flaky")
+        if len(calls) < 3:
+            raise ConnectionError("503 Service Unavailable")
+        return "audio"
+
+    async def unauthorized():
+        calls.append("unauthorized")
+        raise PermissionError("401 Unauthorized")
+
+    result = await call_with_retries("test_service", flaky, max_attempts=3, base_delay=0.01)
+    if result != "audio" or len(calls) != 3:
+        logger.error(f"❌ FAIL: Transient errors were not retried ({calls})")
+        return False
+
+    calls.clear()
+    try:
+        await call_with_retries("test_service", unauthorized, base_delay=0.01, is_retryable=lambda e: "401" not in str(e))
+    except PermissionError:
+        pass
+    if len(calls) != 1:
+        logger.error(f"❌ FAIL: A permanent error was retried ({calls})")
+        return False
+
+    # A permanent error of the probe of a half open circuit neither closes nor opens it
+    breaker = CircuitBreaker("test_service", failure_threshold=1, reset_timeout=0.05)
+    resilience._upstreams["test_service"].breaker = breaker
+    breaker.before_call()
+    breaker.record_failure()
+    await asyncio.sleep(0.06)
+    try:
+        await call_with_retries("test_service", unauthorized, base_delay=0.01, is_retryable=lambda e: "401" not in str(e))
+    except PermissionError:
+        pass
+    if breaker.state != HALF_OPEN:
+        logger.error(f"❌ FAIL: Circuit is {breaker.state} after a permanent error of the probe")
+        return False
+    async def healthy():
+        return "audio"
+
+    if await call_with_retries("test_service", healthy, base_delay=0.01) != "audio" or breaker.state != CLOSED:
+        logger.error(f"❌ FAIL: The next probe was not let through ({breaker.state})")
+        return False
+
+    with deadline_scope(time.time() + 5.0):
+        if allow_retry("test_service", 1.0):
+            logger.error("❌ FAIL: A retry was allowed with too little time before the deadline")
+            return False
+
+    logger.info("✅ PASS: Transient errors are retried, permanent errors and late retries are not")
+    return True
+
+class FailingModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        raise ConnectionError("503 Service Unavailable")
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class StreamingModel:
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        class Stream:
+            async def __aiter__(self):
+                yield FakeChunk("def broken(:")
+
+        return Stream()
+
+async def test_client_circuit():
+    """Test that Gemini failures open the circuit and callback errors do not."""
+    upstream = Upstream("test_gemini", rate=0.0, burst=1)
+    upstream.breaker.failure_threshold = 2
+    client = LLMClient("test-key", upstream=upstream)
+    client._bind_loop()
+
+    def reject(text):
+        raise SyntaxError("broken")
+
+    client._models["streaming"] = StreamingModel()
+    for _ in range(3):
+        try:
+            await client.generate("prompt", model_name="streaming", on_chunk=reject)
+        except SyntaxError:
+            pass
+    if upstream.breaker.state != CLOSED:
+        logger.error("❌ FAIL: Callback errors opened the circuit")
+        return False
+
+    model = FailingModel()
+    client._models["failing"] = model
+    errors = []
+    for _ in range(4):
+        try:
+            await client.generate("prompt", model_name="failing")
+        except Exception as e:
+            errors.append(type(e).__name__)
+    if model.calls != 2 or errors[-1] != "CircuitOpenError":
+        logger.error(f"❌ FAIL: Gemini was called {model.calls} times with errors {errors}")
+        return False
+
+    logger.info("✅ PASS: Gemini failures open the circuit and later calls fail fast")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing resilience of external calls...")
+
+    # Run the tests
+    test1 = await test_token_bucket()
+    test2 = test_circuit_breaker()
+    test3 = test_retry_budget()
+    test4 = await test_call_with_retries()
+    test5 = await test_client_circuit()
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5:
+        logger.info("✅ All tests passed! External calls are rate limited, budgeted and fail fast.")
+    else:
+        logger.error("❌ Some tests failed. External calls may cause retry storms.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+"""
+Test script to verify local retrieval of successful Manim programs.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import gemini
+from app.services.retrieval import ExampleIndex, find_reusable_code, select_examples
+
+CIRCLE_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: The area of a circle is pi r squared.
+    def construct(self):
+        self.play(Create(Circle()))
+        self.wait(1)'''
+
+PYTHAGORAS_CODE = '''from manim import *
+
+class CreateScene(Scene):
+    # NARRATION: a squared plus b squared equals c squared.
+    def construct(self):
+        self.play(Write(MathTex("a^2 + b^2 = c^2")))
+        self.wait(1)'''
+
+def make_index(directory: Path) -> ExampleIndex:
+    """Create an index with two programs, one of them found by the backfill of completed videos."""
+    videos_dir = directory / "videos"
+    video_dir = videos_dir / "video_circle"
+    video_dir.mkdir(parents=True)
+    (video_dir / "video_circle.py").write_text(CIRCLE_CODE)
+    with open(video_dir / "metadata.json", "w") as f:
+        json.dump({"status": "completed", "prompt": "Explain the area of a circle", "topic": "Geometry"}, f)
+
+    index = ExampleIndex(db_path=directory / "examples.db", videos_dir=videos_dir)
+
+    code_path = directory / "pythagoras.py"
+    code_path.write_text(PYTHAGORAS_CODE)
+    index.add("video_pythagoras", "Prove the Pythagorean theorem", "Geometry", 2.0, code_path)
+    return index
+
+def test_search(index: ExampleIndex):
+    """Test that the most similar prompt ranks first."""
+    matches = index.search("Prove the Pythagorean theorem with squares", "Geometry")
+    if not matches or matches[0][1]["video_id"] != "video_pythagoras":
+        logger.error(f"❌ FAIL: Unexpected matches {matches}")
+        return False
+
+    logger.info("✅ PASS: Similar prompts are found by TF-IDF similarity")
+    return True
+
+def test_reuse(index: ExampleIndex):
+    """Test that only the same request of the same duration reuses a program."""
+    if find_reusable_code(index, "prove the  Pythagorean theorem.", "Geometry", 2.0) != PYTHAGORAS_CODE:
+        logger.error("❌ FAIL: The same request did not reuse the program")
+        return False
+    if find_reusable_code(index, "Prove the Pythagorean theorem", "Geometry", 3.0) is not None:
+        logger.error("❌ FAIL: A program was reused for a different duration")
+        return False
+    similar = "Prove the Pythagorean theorem using a drawing of triangles"
+    if find_reusable_code(index, similar, "Geometry", 2.0) is not None:
+        logger.error("❌ FAIL: A program was reused for a different request")
+        return False
+    if not select_examples(index, index.search(similar, "Geometry")):
+        logger.error("❌ FAIL: A similar request got no examples")
+        return False
+
+    logger.info("✅ PASS: Programs are reused only for the same request")
+    return True
+
+def test_no_reuse_for_same_words(directory: Path):
+    """Test that requests with the same words in another order or with other signs are not reused."""
+    index = ExampleIndex(db_path=directory / "words.db", videos_dir=directory / "none")
+    for name, prompt, code in (("factor", "Factor x^2 + 5x + 6", CIRCLE_CODE),
+                               ("convert", "Convert celsius to fahrenheit", PYTHAGORAS_CODE)):
+        code_path = directory / f"{name}.py"
+        code_path.write_text(code)
+        index.add(f"video_{name}", prompt, None, 2.0, code_path)
+
+    for prompt in ("Factor x^2 - 5x - 6", "Convert fahrenheit to celsius"):
+        if find_reusable_code(index, prompt, None, 2.0) is not None:
+            logger.error(f"❌ FAIL: A program was reused for {prompt!r}")
+            return False
+    if find_reusable_code(index, "factor x^2+5x+6", None, 2.0) != CIRCLE_CODE:
+        logger.error("❌ FAIL: Spacing around operators prevented reuse")
+        return False
+
+    logger.info("✅ PASS: Requests with the same words but other signs or order are not reused")
+    return True
+
+def test_examples_in_prompt(index: ExampleIndex):
+    """Test that examples are added to the code generation prompt."""
+    examples = select_examples(index, index.search("Prove the Pythagorean theorem using triangles", "Geometry"))
+    specialized_prompt = gemini.ManimEducationalAgent().classify_and_generate("Geometry", "Prove the Pythagorean theorem using triangles", 2.0, examples)
+
+    if "REFERENCE EXAMPLES" not in specialized_prompt or "a^2 + b^2 = c^2" not in specialized_prompt:
+        logger.error("❌ FAIL: Examples are missing from the prompt")
+        return False
+
+    logger.info("✅ PASS: Nearest programs are added to the prompt as examples")
+    return True
+
+async def test_generation_reuses_code(index: ExampleIndex):
+    """Test that code generation returns a reused program without calling Gemini."""
+    originals = (gemini.get_example_index, gemini.GEMINI_API_KEY)
+    gemini.get_example_index = lambda: index
+    gemini.GEMINI_API_KEY = ""
+    sections = []
+
+    try:
+        code = await gemini.generate_manim_code(
+            "Prove the Pythagorean theorem", topic="Geometry", duration_minutes=2.0, on_section=sections.append
+        )
+        if code != PYTHAGORAS_CODE or not sections:
+            logger.error(f"❌ FAIL: Code generation returned {code!r}")
+            return False
+
+        logger.info("✅ PASS: Code generation reuses programs of the same request")
+        return True
+
+    finally:
+        (gemini.get_example_index, gemini.GEMINI_API_KEY) = originals
+
+def test_remove(index: ExampleIndex):
+    """Test that a program that failed to render is no longer returned."""
+    index.remove_code(PYTHAGORAS_CODE)
+    matches = index.search("Prove the Pythagorean theorem", "Geometry")
+    if any(example["video_id"] == "video_pythagoras" for _, example in matches):
+        logger.error("❌ FAIL: Removed program is still returned")
+        return False
+
+    logger.info("✅ PASS: Programs that fail to render are removed")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing program retrieval...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = make_index(Path(temp_dir))
+
+        # Run the tests
+        test1 = test_search(index)
+        test2 = test_reuse(index)
+        test3 = test_examples_in_prompt(index)
+        test4 = await test_generation_reuses_code(index)
+        test5 = test_remove(index)
+        test6 = test_no_reuse_for_same_words(Path(temp_dir))
+
+    # Print summary
+    if test1 and test2 and test3 and test4 and test5 and test6:
+        logger.info("✅ All tests passed! Successful programs are reused and used as examples.")
+    else:
+        logger.error("❌ Some tests failed. Program retrieval may not work.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Test script to verify that the supervisor restarts crashed workers and stops them cleanly.
+"""
+import os
+import sys
+import signal
+import socket
+import asyncio
+import subprocess
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import metrics, supervisor
+from app.services.supervisor import WorkerSupervisor, WORKER_RESTARTS
+
+# Worker processes that stand in for app.worker
+CRASHING_WORKER = "import sys; sys.exit(3)"
+RUNNING_WORKER = "import time; time.sleep(60)"
+STUBBORN_WORKER = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print('ready', flush=True); time.sleep(60)"
+
+def fake_spawn(scripts):
+    """Build a replacement for WorkerSupervisor._spawn that runs the scripts in turn."""
+    spawned = []
+
+    async def spawn(slot):
+        script = scripts[min(len(spawned), len(scripts) - 1)]
+        proc = await asyncio.create_subprocess_exec(sys.executable, "-c", script, stdout=asyncio.subprocess.PIPE)
+        spawned.append(proc)
+        return proc
+
+    return spawn, spawned
+
+async def wait_for(condition, timeout: float = 10.0) -> bool:
+    """Wait until condition() is true or the timeout passes."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+async def test_restart():
+    """Test that a worker process that crashes is started again."""
+    pool = WorkerSupervisor(processes=1)
+    pool._spawn, spawned = fake_spawn([CRASHING_WORKER, RUNNING_WORKER])
+    restarts = WORKER_RESTARTS.get()
+
+    pool.start()
+    try:
+        if not await wait_for(lambda: len(spawned) == 2 and pool.alive() == 1):
+            logger.error(f"❌ FAIL: The crashed worker was not restarted ({len(spawned)} spawned, {pool.alive()} alive)")
+            return False
+        if spawned[0].returncode != 3 or WORKER_RESTARTS.get() != restarts + 1:
+            logger.error(f"❌ FAIL: Expected one restart after exit code 3, got {spawned[0].returncode}")
+            return False
+    finally:
+        await pool.stop()
+
+    if pool.alive() != 0 or spawned[1].returncode != -signal.SIGTERM or len(spawned) != 2:
+        logger.error(f"❌ FAIL: The worker did not stop cleanly (exit code {spawned[1].returncode}, {len(spawned)} spawned)")
+        return False
+
+    logger.info("✅ PASS: Crashed workers are restarted and stopped workers are not")
+    return True
+
+async def test_stop_timeout():
+    """Test that a worker process that ignores the stop signal is killed."""
+    pool = WorkerSupervisor(processes=2)
+    pool._spawn, spawned = fake_spawn([STUBBORN_WORKER])
+
+    original = supervisor.WORKER_STOP_TIMEOUT
+    supervisor.WORKER_STOP_TIMEOUT = 0.5
+    pool.start()
+    try:
+        if not await wait_for(lambda: len(spawned) == 2):
+            logger.error("❌ FAIL: The worker processes were not started")
+            return False
+        # Only stop once the workers ignore SIGTERM
+        for proc in spawned:
+            await proc.stdout.readline()
+        await pool.stop()
+    finally:
+        supervisor.WORKER_STOP_TIMEOUT = original
+
+    if any(proc.returncode != -signal.SIGKILL for proc in spawned) or pool.alive() != 0 or pool._tasks:
+        logger.error(f"❌ FAIL: Workers that ignored the stop signal were not killed: {[proc.returncode for proc in spawned]}")
+        return False
+
+    logger.info("✅ PASS: Workers that do not stop in time are killed")
+    return True
+
+def test_stale_snapshots(directory: Path):
+    """Test that only the snapshots of supervisors that exited are removed."""
+    prefix = metrics.snapshot_name(f"{socket.gethostname()}:{supervisor.SUPERVISED_WORKER_TAG}:")
+    # A finished child process has a process ID that is no longer in use
+    dead_pid = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True).stdout.strip()
+    names = {
+        "external": "otherhost_1234",
+        "running": f"{prefix}{os.getpid()}_0_abcd1234",
+        "stale": f"{prefix}{dead_pid}_1_abcd1234"
+    }
+    for name in names.values():
+        metrics.write_snapshot(name, directory)
+
+    removed = supervisor.remove_stale_snapshots(directory)
+    left = sorted(path.stem for path in directory.glob("*.json"))
+    if removed != 1 or left != sorted([names["external"], names["running"]]):
+        logger.error(f"❌ FAIL: Removed {removed} snapshots, left {left}")
+        return False
+
+    logger.info("✅ PASS: Only the snapshots of supervisors that exited are removed")
+    return True
+
+async def main():
+    """Run the tests."""
+    logger.info("Testing the worker supervisor...")
+
+    original = metrics.METRICS_SNAPSHOT_DIR
+    with tempfile.TemporaryDirectory() as temp_dir:
+        metrics.METRICS_SNAPSHOT_DIR = Path(temp_dir) / "metrics"
+        try:
+            # Run the tests
+            test1 = await test_restart()
+            test2 = await test_stop_timeout()
+            test3 = test_stale_snapshots(Path(temp_dir) / "snapshots")
+        finally:
+            metrics.METRICS_SNAPSHOT_DIR = original
+
+    # Print summary
+    if test1 and test2 and test3:
+        logger.info("✅ All tests passed! The supervisor keeps its workers running.")
+    else:
+        logger.error("❌ Some tests failed. The supervisor may not work correctly.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
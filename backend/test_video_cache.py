@@ -0,0 +1,103 @@
+"""
+Test script to verify the completed-video cache.
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the path so we can import from app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.video_cache import VideoCache, cache_key
+from app.utils.helpers import request_fingerprint
+
+def create_video(directory: Path, name: str, size: int) -> Path:
+    """Create a dummy video file of the given size."""
+    path = directory / f"{name}.mp4"
+    path.write_bytes(b"0" * size)
+    return path
+
+def test_cache_lookup():
+    """Test that repeated requests hit the cache and pipeline versions are kept apart."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = VideoCache(Path(temp_dir) / "videos.db")
+        fingerprint = request_fingerprint("Explain photosynthesis", None, None, 3.0)
+        key = cache_key(fingerprint)
+
+        if cache.get(key) is not None:
+            logger.error("❌ FAIL: Empty cache returned an entry")
+            return False
+
+        cache.put(key, "video-1", str(create_video(Path(temp_dir), "video-1", 100)))
+        entry = cache.get(cache_key(request_fingerprint(" explain  Photosynthesis", None, None, 3.0)))
+        if not entry or entry["video_id"] != "video-1":
+            logger.error(f"❌ FAIL: Repeated request missed the cache: {entry}")
+            return False
+        logger.info("✅ PASS: Repeated requests are served from the cache")
+
+        if cache.get(cache_key(fingerprint, pipeline_version="other")) is not None:
+            logger.error("❌ FAIL: Video from another pipeline version was returned")
+            return False
+        logger.info("✅ PASS: Cache keys include the pipeline version")
+
+        return True
+
+def test_cache_eviction():
+    """Test TTL, missing-file and entry-limit eviction."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = Path(temp_dir)
+        cache = VideoCache(directory / "videos.db", ttl=3600, max_entries=2)
+
+        for i in range(3):
+            cache.put(f"key-{i}", f"video-{i}", str(create_video(directory, f"video-{i}", 100)))
+            time.sleep(0.01)
+
+        # The third video goes over the limit, evicting the oldest entry but not its file
+        if cache.get("key-0") is not None or cache.get("key-2") is None:
+            logger.error(f"❌ FAIL: Entry limit did not evict the least recently used video: {cache.stats()}")
+            return False
+        if not (directory / "video-0.mp4").is_file():
+            logger.error("❌ FAIL: Eviction deleted the video file")
+            return False
+        logger.info("✅ PASS: Least recently used entries are evicted over the entry limit")
+
+        (directory / "video-1.mp4").unlink()
+        if cache.get("key-1") is not None:
+            logger.error("❌ FAIL: Entry with a missing video file was returned")
+            return False
+        logger.info("✅ PASS: Entries with missing video files are dropped")
+
+        cache.ttl = 0
+        if cache.get("key-2") is not None:
+            logger.error("❌ FAIL: Expired entry was returned")
+            return False
+        logger.info("✅ PASS: Expired entries are dropped")
+
+        return True
+
+def main():
+    """Run the tests."""
+    logger.info("Testing video cache...")
+
+    # Run the tests
+    test1 = test_cache_lookup()
+    test2 = test_cache_eviction()
+
+    # Print summary
+    if test1 and test2:
+        logger.info("✅ All tests passed! The video cache works correctly.")
+    else:
+        logger.error("❌ Some tests failed. The video cache may not be working correctly.")
+
+if __name__ == "__main__":
+    main()
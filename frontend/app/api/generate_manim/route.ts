@@ -24,14 +24,21 @@ export async function POST(request: NextRequest) {
       );
     }
 
+    // Identify the end user so the backend schedules users fairly
+    const clientId = request.headers.get('x-forwarded-for')?.split(',')[0].trim()
+      || request.headers.get('x-real-ip')
+      || 'web';
+
     // Forward the request to the backend API
     const response = await fetch(`${BACKEND_API_URL}/api/generate`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'X-Client-Id': clientId,
       },
       body: JSON.stringify({
         prompt: topic,
+        priority: 'interactive',
       }),
     });
 
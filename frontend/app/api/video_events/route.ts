@@ -0,0 +1,56 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+// Backend API URL
+const BACKEND_API_URL = process.env.BACKEND_API_URL || 'http://localhost:8000';
+
+export async function GET(request: NextRequest) {
+  try {
+    // Get videoId from the URL
+    const { searchParams } = new URL(request.url);
+    const videoId = searchParams.get('videoId');
+
+    if (!videoId) {
+      return NextResponse.json(
+        { error: 'Video ID is required' },
+        { status: 400 }
+      );
+    }
+
+    // Pass the last received event on so a reconnecting stream resumes where it stopped
+    const headers: Record<string, string> = { 'Accept': 'text/event-stream' };
+    const lastEventId = request.headers.get('last-event-id');
+    if (lastEventId) {
+      headers['Last-Event-ID'] = lastEventId;
+    }
+
+    // Forward the request to the backend API events endpoint
+    const response = await fetch(`${BACKEND_API_URL}/api/video/${videoId}/events`, {
+      method: 'GET',
+      headers,
+      signal: request.signal,
+    });
+
+    if (!response.ok || !response.body) {
+      return NextResponse.json(
+        { error: 'Failed to open progress stream' },
+        { status: response.status }
+      );
+    }
+
+    // Stream the events through without buffering
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+      },
+    });
+
+  } catch (error) {
+    console.error('Error opening progress stream:', error);
+    return NextResponse.json(
+      { error: 'Failed to open progress stream' },
+      { status: 500 }
+    );
+  }
+}
@@ -40,11 +40,23 @@ function VideoPlayerContent() {
     "This demonstrates the core theory in action",
   ]
 
-  // Fetch video status
+  // Fetch video status: follow the progress stream, and fall back to polling
+  // if the stream cannot be opened
   useEffect(() => {
     if (!videoId) return
     
+    let cancelled = false
+    let pollTimer: ReturnType<typeof setTimeout> | null = null
+    
+    const stageLabels: Record<string, string> = {
+      generate: 'Writing the animation code',
+      render: 'Rendering the animation',
+      narration: 'Recording the narration',
+      merge: 'Adding narration to the video',
+    }
+    
     const fetchVideoStatus = async () => {
+      if (cancelled) return
       try {
         const response = await fetch(`/api/fetch_video?videoId=${videoId}`)
         
@@ -57,7 +69,7 @@ function VideoPlayerContent() {
         
         // If video is still processing, poll again in a few seconds
         if (data.status === 'processing') {
-          setTimeout(fetchVideoStatus, 3000)
+          pollTimer = setTimeout(fetchVideoStatus, 3000)
         }
       } catch (error) {
         console.error('Error fetching video status:', error)
@@ -69,7 +81,57 @@ function VideoPlayerContent() {
       }
     }
     
-    fetchVideoStatus()
+    if (typeof EventSource === 'undefined') {
+      fetchVideoStatus()
+      return () => { cancelled = true }
+    }
+    
+    const events = new EventSource(`/api/video_events?videoId=${videoId}`)
+    
+    events.addEventListener('status', (e) => {
+      setVideoStatus(JSON.parse((e as MessageEvent).data))
+    })
+    
+    events.addEventListener('stage', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      if (data.state === 'started' && stageLabels[data.stage]) {
+        setVideoStatus(prev => ({ ...prev, status: 'processing', message: stageLabels[data.stage] }))
+      }
+    })
+    
+    events.addEventListener('progress', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      setVideoStatus(prev => ({ ...prev, status: 'processing', message: `Rendering the animation (${data.percent}%)` }))
+    })
+    
+    events.addEventListener('state', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      if (data.state === 'done') {
+        events.close()
+        setVideoStatus({ status: 'completed', message: 'Video generation completed', video_url: data.video_url })
+      } else if (data.state === 'failed') {
+        events.close()
+        setVideoStatus({ status: 'failed', message: data.error || 'Video generation failed', video_url: null })
+      } else if (data.state === 'cancelled') {
+        events.close()
+        setVideoStatus({ status: 'failed', message: 'Video generation was cancelled', video_url: null })
+      } else if (data.state === 'running') {
+        setVideoStatus(prev => ({ ...prev, status: 'processing', message: 'Video generation in progress' }))
+      }
+    })
+    
+    events.onerror = () => {
+      // The stream ends after the final event or could not be opened; read the
+      // current status once and keep polling if the video is still processing
+      events.close()
+      fetchVideoStatus()
+    }
+    
+    return () => {
+      cancelled = true
+      events.close()
+      if (pollTimer) clearTimeout(pollTimer)
+    }
   }, [videoId])
 
   // Handle video playback